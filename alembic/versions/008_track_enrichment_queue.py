@@ -0,0 +1,44 @@
+"""Add track_enrichment_queue table
+
+Revision ID: 008
+Revises: 007
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "008"
+down_revision: Union[str, None] = "007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "track_enrichment_queue",
+        sa.Column(
+            "track_id",
+            sa.String(255),
+            sa.ForeignKey("dim_all_tracks.track_id"),
+            primary_key=True,
+        ),
+        sa.Column("priority", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("attempts", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("next_attempt_at", sa.DateTime, nullable=False),
+        sa.Column("lease_owner", sa.String(255), nullable=True),
+        sa.Column("lease_expires_at", sa.DateTime, nullable=True),
+        sa.Column("enqueued_at", sa.DateTime, nullable=False),
+    )
+    op.create_index(
+        "ix_enrichment_queue_priority",
+        "track_enrichment_queue",
+        ["priority", "next_attempt_at"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_enrichment_queue_priority", table_name="track_enrichment_queue")
+    op.drop_table("track_enrichment_queue")
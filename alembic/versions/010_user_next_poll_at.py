@@ -0,0 +1,26 @@
+"""Add next_poll_at to dim_all_users for adaptive poll scheduling
+
+Revision ID: 010
+Revises: 009
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "010"
+down_revision: Union[str, None] = "009"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("dim_all_users", sa.Column("next_poll_at", sa.DateTime(), nullable=True))
+    op.create_index("ix_users_next_poll_at", "dim_all_users", ["next_poll_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_users_next_poll_at", table_name="dim_all_users")
+    op.drop_column("dim_all_users", "next_poll_at")
@@ -0,0 +1,26 @@
+"""Add recently-played cursor columns to dim_all_users
+
+Revision ID: 011
+Revises: 010
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "011"
+down_revision: Union[str, None] = "010"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("dim_all_users", sa.Column("last_listen_cursor", sa.String(length=255), nullable=True))
+    op.add_column("dim_all_users", sa.Column("last_listen_at", sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("dim_all_users", "last_listen_at")
+    op.drop_column("dim_all_users", "last_listen_cursor")
@@ -0,0 +1,36 @@
+"""Add award_dirty_groups for incremental award snapshot recomputation
+
+Revision ID: 012
+Revises: 011
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "012"
+down_revision: Union[str, None] = "011"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "award_dirty_groups",
+        sa.Column(
+            "owner_user_id",
+            sa.String(255),
+            sa.ForeignKey("dim_all_users.user_id"),
+            primary_key=True,
+        ),
+        sa.Column("dirty_since", sa.DateTime, nullable=False),
+        sa.Column("marked_at", sa.DateTime, nullable=False),
+    )
+    op.create_index("ix_award_dirty_since", "award_dirty_groups", ["dirty_since"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_award_dirty_since", table_name="award_dirty_groups")
+    op.drop_table("award_dirty_groups")
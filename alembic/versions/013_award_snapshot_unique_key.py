@@ -0,0 +1,41 @@
+"""Unique key on award_snapshots (friend_group_hash, award_id, user_id)
+
+Snapshots were written with ``session.merge`` on a fresh autoincrement id, so
+databases built by create_all (no unique constraint) accumulated a copy of
+every row per run. Duplicates are dropped, keeping the newest id per key,
+before the unique index is created. Mirrors main._INCREMENTAL_UNIQUE_INDEXES.
+
+Revision ID: 013
+Revises: 012
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "013"
+down_revision: Union[str, None] = "012"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        "DELETE FROM award_snapshots WHERE id NOT IN ("
+        "SELECT MAX(id) FROM award_snapshots "
+        "GROUP BY friend_group_hash, award_id, user_id)"
+    )
+    existing = {ix["name"] for ix in sa.inspect(op.get_bind()).get_indexes("award_snapshots")}
+    if "uq_award_group_award_user" not in existing:
+        op.create_index(
+            "uq_award_group_award_user",
+            "award_snapshots",
+            ["friend_group_hash", "award_id", "user_id"],
+            unique=True,
+        )
+
+
+def downgrade() -> None:
+    op.drop_index("uq_award_group_award_user", table_name="award_snapshots")
@@ -0,0 +1,74 @@
+"""Add daily per-user listen rollups for the stats endpoints
+
+Revision ID: 014
+Revises: 013
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "014"
+down_revision: Union[str, None] = "013"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _key_columns():
+    return [
+        sa.Column(
+            "user_id",
+            sa.String(255),
+            sa.ForeignKey("dim_all_users.user_id"),
+            primary_key=True,
+        ),
+        sa.Column("day", sa.Date, primary_key=True),
+    ]
+
+
+def upgrade() -> None:
+    # NULL until rebuild_listen_rollups has built the user's rollups.
+    op.add_column("dim_all_users", sa.Column("rollups_built_at", sa.DateTime(), nullable=True))
+    op.create_table(
+        "listen_day_tracks",
+        *_key_columns(),
+        sa.Column(
+            "track_id",
+            sa.String(255),
+            sa.ForeignKey("dim_all_tracks.track_id"),
+            primary_key=True,
+        ),
+        sa.Column("listen_count", sa.Integer, nullable=False),
+        sa.Column("ms_played", sa.Integer, nullable=False),
+        sa.Column("unplayed_count", sa.Integer, nullable=False),
+    )
+    op.create_index("ix_listen_day_tracks_track", "listen_day_tracks", ["track_id"])
+    op.create_table(
+        "listen_day_artists",
+        *_key_columns(),
+        sa.Column(
+            "artist_id",
+            sa.String(255),
+            sa.ForeignKey("dim_all_artists.artist_id"),
+            primary_key=True,
+        ),
+        sa.Column("listen_count", sa.Integer, nullable=False),
+        sa.Column("duration_ms", sa.Integer, nullable=False),
+    )
+    op.create_table(
+        "listen_day_genres",
+        *_key_columns(),
+        sa.Column("genre", sa.String(255), primary_key=True),
+        sa.Column("listen_count", sa.Integer, nullable=False),
+        sa.Column("duration_ms", sa.Integer, nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("listen_day_genres")
+    op.drop_table("listen_day_artists")
+    op.drop_index("ix_listen_day_tracks_track", table_name="listen_day_tracks")
+    op.drop_table("listen_day_tracks")
+    op.drop_column("dim_all_users", "rollups_built_at")
@@ -0,0 +1,36 @@
+"""Add wrapped_snapshots for materialized per-user Wrapped responses
+
+Revision ID: 015
+Revises: 014
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "015"
+down_revision: Union[str, None] = "014"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "wrapped_snapshots",
+        sa.Column(
+            "user_id",
+            sa.String(255),
+            sa.ForeignKey("dim_all_users.user_id"),
+            primary_key=True,
+        ),
+        sa.Column("year", sa.Integer, primary_key=True),
+        sa.Column("payload", sa.Text, nullable=False),
+        sa.Column("computed_at", sa.DateTime, nullable=False),
+        sa.Column("invalidated_at", sa.DateTime, nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("wrapped_snapshots")
@@ -0,0 +1,27 @@
+"""Add a per-user data version for the response cache
+
+Revision ID: 016
+Revises: 015
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "016"
+down_revision: Union[str, None] = "015"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "dim_all_users",
+        sa.Column("data_version", sa.Integer(), nullable=True, server_default="0"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("dim_all_users", "data_version")
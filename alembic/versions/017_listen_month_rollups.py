@@ -0,0 +1,64 @@
+"""Add global monthly listen rollups for the timeline
+
+Revision ID: 017
+Revises: 016
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "017"
+down_revision: Union[str, None] = "016"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_listen_day_tracks_day", "listen_day_tracks", ["day"])
+    op.create_index("ix_listen_day_artists_day", "listen_day_artists", ["day"])
+    op.create_table(
+        "listen_month_tracks",
+        sa.Column(
+            "track_id",
+            sa.String(255),
+            sa.ForeignKey("dim_all_tracks.track_id"),
+            primary_key=True,
+        ),
+        sa.Column("month", sa.String(7), primary_key=True),
+        sa.Column("listen_count", sa.Integer, nullable=False),
+    )
+    op.create_index("ix_listen_month_tracks_month", "listen_month_tracks", ["month"])
+    op.create_table(
+        "listen_month_artists",
+        sa.Column(
+            "artist_id",
+            sa.String(255),
+            sa.ForeignKey("dim_all_artists.artist_id"),
+            primary_key=True,
+        ),
+        sa.Column("month", sa.String(7), primary_key=True),
+        sa.Column("listen_count", sa.Integer, nullable=False),
+    )
+    op.create_index("ix_listen_month_artists_month", "listen_month_artists", ["month"])
+    op.create_table(
+        "listen_months_dirty",
+        sa.Column("month", sa.String(7), primary_key=True),
+        sa.Column("marked_at", sa.DateTime, nullable=False),
+    )
+    # Monthly rollups are filled as users' daily rollups are rebuilt, so
+    # rebuild everyone once. Global timelines read raw listens until every
+    # user has been rebuilt.
+    op.execute("UPDATE dim_all_users SET rollups_built_at = NULL")
+
+
+def downgrade() -> None:
+    op.drop_table("listen_months_dirty")
+    op.drop_index("ix_listen_month_artists_month", table_name="listen_month_artists")
+    op.drop_table("listen_month_artists")
+    op.drop_index("ix_listen_month_tracks_month", table_name="listen_month_tracks")
+    op.drop_table("listen_month_tracks")
+    op.drop_index("ix_listen_day_artists_day", table_name="listen_day_artists")
+    op.drop_index("ix_listen_day_tracks_day", table_name="listen_day_tracks")
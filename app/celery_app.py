@@ -23,15 +23,36 @@ celery_app.conf.update(
     beat_schedule={
         "poll-recent-listens": {
             "task": "app.tasks.poll_recent_listens",
-            "schedule": settings.poll_interval_seconds,
+            # Each run only polls users whose adaptive next_poll_at is due.
+            "schedule": settings.poll_tick_seconds,
         },
         "backfill-track-metadata": {
             "task": "app.tasks.backfill_track_metadata",
             "schedule": settings.backfill_interval_seconds,
         },
+        "seed-enrichment-queue": {
+            "task": "app.tasks.seed_enrichment_queue",
+            "schedule": 86400,
+        },
         "compute-award-snapshots": {
             "task": "app.tasks.compute_award_snapshots",
-            "schedule": 21600,
+            # Each run only recomputes its share of the dirty friend groups.
+            "schedule": settings.award_snapshot_tick_seconds,
+        },
+        "rebuild-listen-rollups": {
+            "task": "app.tasks.rebuild_listen_rollups",
+            # Each run rebuilds a batch of unbuilt or stale users.
+            "schedule": settings.listen_rollup_tick_seconds,
+        },
+        "refresh-listen-months": {
+            "task": "app.tasks.refresh_listen_months",
+            # Each run re-aggregates a batch of months whose listens changed.
+            "schedule": settings.listen_month_tick_seconds,
+        },
+        "refresh-wrapped-snapshots": {
+            "task": "app.tasks.refresh_wrapped_snapshots",
+            # Invalidated snapshots, and current-year ones from before today.
+            "schedule": settings.wrapped_snapshot_tick_seconds,
         },
         "cleanup-old-records": {
             "task": "app.tasks.cleanup_old_records",
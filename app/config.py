@@ -18,9 +18,47 @@ class Settings(BaseSettings):
     )
     lastfm_api_key: str = ""
     poll_interval_seconds: int = 900
+    poll_tick_seconds: int = 60
+    poll_min_interval_seconds: int = 120
+    poll_max_interval_seconds: int = 21600
     backfill_interval_seconds: int = 120
+    award_snapshot_interval_seconds: int = 21600
+    award_snapshot_tick_seconds: int = 900
+    award_snapshot_max_age_hours: int = 24
+    listen_rollup_tick_seconds: int = 900
+    listen_rollup_rebuild_batch: int = 50
+    listen_rollup_max_age_hours: int = 168
+    listen_month_tick_seconds: int = 900
+    listen_month_refresh_batch: int = 24
+    wrapped_snapshot_tick_seconds: int = 3600
+    wrapped_snapshot_refresh_batch: int = 200
     rate_limit_enabled: bool = True
     sentry_dsn: str = ""
+    dimension_cache_size: int = 50000
+    dimension_cache_redis_enabled: bool = False
+    token_cache_redis_enabled: bool = False
+    response_cache_size: int = 5000
+    response_cache_redis_enabled: bool = False
+    response_cache_version_ttl_seconds: int = 3600
+    artist_metadata_ttl_hours: int = 168
+    artist_refresh_budget: int = 500
+    spotify_http_pool_size: int = 32
+    spotify_http_timeout_seconds: int = 5
+    spotify_http_retries: int = 3
+    spotify_http_backoff_factor: float = 0.3
+    spotify_requests_per_second: float = 25.0
+    spotify_user_requests_per_second: float = 5.0
+    spotify_background_reserve: float = 0.2
+    spotify_interactive_max_wait_seconds: float = 2.0
+    spotify_breaker_threshold: int = 3
+    spotify_breaker_window_seconds: int = 60
+    spotify_breaker_cooldown_seconds: int = 120
+    spotify_governor_redis_enabled: bool = False
+    poll_concurrency: int = 16
+    poll_max_users_per_cycle: int = 5000
+    poll_shards: int = 8
+    poll_user_lock_seconds: int = 300
+    upload_spool_dir: str = "db/uploads"
 
     model_config = {"env_file": ".env", "env_file_encoding": "utf-8"}
 
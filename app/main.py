@@ -63,7 +63,7 @@ def _add_column_if_missing(engine, table, column, col_type):
         logger.info(f"Added column {table}.{column}")
 
 
-def _add_index_if_missing(engine, index_name, table, columns):
+def _add_index_if_missing(engine, index_name, table, columns, unique=False):
     from sqlalchemy import inspect as sa_inspect, text as sa_text
 
     # Validate identifiers to prevent SQL injection.
@@ -75,7 +75,16 @@ def _add_index_if_missing(engine, index_name, table, columns):
     if index_name not in existing:
         cols = ", ".join(columns)
         with engine.begin() as conn:
-            conn.execute(sa_text(f"CREATE INDEX {index_name} ON {table} ({cols})"))
+            if unique:
+                # Keep the newest row per key so the unique index can be built.
+                conn.execute(
+                    sa_text(
+                        f"DELETE FROM {table} WHERE id NOT IN "
+                        f"(SELECT MAX(id) FROM {table} GROUP BY {cols})"
+                    )
+                )
+            kind = "UNIQUE INDEX" if unique else "INDEX"
+            conn.execute(sa_text(f"CREATE {kind} {index_name} ON {table} ({cols})"))
         logger.info(f"Added index {index_name} on {table}({cols})")
 
 
@@ -96,6 +105,12 @@ _INCREMENTAL_COLUMNS = [
     ("dim_all_users", "image_url", "VARCHAR(512)"),
     ("dim_all_users", "is_admin", "BOOLEAN DEFAULT FALSE"),
     ("job_runs", "details", "TEXT"),
+    ("dim_all_artists", "metadata_refreshed_at", "TIMESTAMP"),
+    ("dim_all_users", "next_poll_at", "TIMESTAMP"),
+    ("dim_all_users", "last_listen_cursor", "VARCHAR(255)"),
+    ("dim_all_users", "last_listen_at", "TIMESTAMP"),
+    ("dim_all_users", "rollups_built_at", "TIMESTAMP"),
+    ("dim_all_users", "data_version", "INTEGER DEFAULT 0"),
 ]
 
 # Indexes added to existing tables after the initial schema. Same rationale as
@@ -103,6 +118,16 @@ _INCREMENTAL_COLUMNS = [
 # tables need them backfilled at startup. Mirrored by an Alembic migration.
 _INCREMENTAL_INDEXES = [
     ("ix_listens_user_ts", "dim_all_listens", ["user_id", "ts"]),
+    ("ix_users_next_poll_at", "dim_all_users", ["next_poll_at"]),
+    ("ix_listen_day_tracks_day", "listen_day_tracks", ["day"]),
+    ("ix_listen_day_artists_day", "listen_day_artists", ["day"]),
+]
+
+# Unique indexes backfilled the same way. Tables listed here need an ``id``
+# primary key: duplicate rows are dropped (newest id wins) before the index is
+# built, so only use this for derived data such as cached snapshots.
+_INCREMENTAL_UNIQUE_INDEXES = [
+    ("uq_award_group_award_user", "award_snapshots", ["friend_group_hash", "award_id", "user_id"]),
 ]
 
 
@@ -117,11 +142,31 @@ def _run_schema_migrations():
             _add_index_if_missing(engine, index_name, table, columns)
         except Exception as e:
             logger.warning(f"Index migration skipped ({index_name}): {e}")
+    for index_name, table, columns in _INCREMENTAL_UNIQUE_INDEXES:
+        try:
+            _add_index_if_missing(engine, index_name, table, columns, unique=True)
+        except Exception as e:
+            logger.warning(f"Index migration skipped ({index_name}): {e}")
+    # create_all adds the monthly rollup tables empty; fill them with a full
+    # rebuild, as migration 017 does.
+    try:
+        from app.services.listen_months import reset_unseeded_rollups
+
+        db = SessionLocal()
+        try:
+            if reset_unseeded_rollups(db):
+                logger.info("Monthly listen rollups are empty; queued every user for a rollup rebuild")
+            db.commit()
+        finally:
+            db.close()
+    except Exception as e:
+        logger.warning(f"Monthly rollup seeding skipped: {e}")
 
 
 def _resume_orphaned_jobs():
     try:
         from app.models import JobRun
+        from app.services.upload_spool import delete_spooled_upload, spooled_upload_exists
         from datetime import datetime, timezone
         import json as _json
 
@@ -137,9 +182,18 @@ def _resume_orphaned_jobs():
         for j in orphaned:
             details = _json.loads(j.details) if j.details else {}
             phase = details.get("phase", "")
-            if phase in ("enriching", "analyzing", "inserting"):
+            # Validation and inserts restart from the spooled upload; the worker
+            # only skips phase 1 when it had already finished. Queued jobs are
+            # re-sent too: the spool is what survives the restart, not
+            # necessarily the broker message.
+            spooled = bool(details.get("upload_key")) and spooled_upload_exists(details["upload_key"])
+            if phase in ("enriching", "analyzing", "inserting") or (
+                phase in ("queued", "parsing", "validating") and spooled
+            ):
                 j.status = "pending"
-                details.update({"phase": "resuming", "progress": details.get("progress", 80)})
+                details.update(
+                    {"phase": "resuming", "resumed_from": phase, "progress": details.get("progress", 80)}
+                )
                 j.details = _json.dumps(details)
                 _startup_db.commit()
                 from app.celery_app import celery_app
@@ -162,6 +216,8 @@ def _resume_orphaned_jobs():
                 details.update({"phase": "error", "error": "Server restarted during processing"})
                 j.details = _json.dumps(details)
                 _startup_db.commit()
+                if details.get("upload_key"):
+                    delete_spooled_upload(details["upload_key"])
                 logger.info(f"Marked orphaned upload job {j.id} as failed (no data to resume)")
         _startup_db.close()
     except Exception as e:
@@ -331,11 +387,42 @@ def trigger_backfill(user: User = Depends(get_admin_user), db: Session = Depends
 def trigger_awards(user: User = Depends(get_admin_user), db: Session = Depends(get_db)):
     from app.tasks import compute_award_snapshots
 
-    compute_award_snapshots.delay()
+    compute_award_snapshots.delay(full=True)
     log_action(db, "admin.trigger_awards", user_id=user.user_id)
     return {"status": "triggered", "task": "compute_award_snapshots"}
 
 
+@app.post("/admin/trigger-rollups")
+def trigger_rollups(user: User = Depends(get_admin_user), db: Session = Depends(get_db)):
+    from app.tasks import rebuild_listen_rollups
+
+    rebuild_listen_rollups.delay(full=True)
+    log_action(db, "admin.trigger_rollups", user_id=user.user_id)
+    return {"status": "triggered", "task": "rebuild_listen_rollups"}
+
+
+@app.get("/admin/cache-stats")
+def cache_stats(user: User = Depends(get_admin_user), db: Session = Depends(get_db)):
+    from app.services.dimension_cache import known_dimensions
+    from app.services.response_cache import responses
+    from app.services.token_cache import access_tokens
+
+    log_action(db, "admin.cache_stats", user_id=user.user_id)
+    return {
+        "dimensions": known_dimensions.stats(),
+        "access_tokens": access_tokens.stats(),
+        "responses": responses.stats(),
+    }
+
+
+@app.get("/admin/spotify-budget")
+def spotify_budget(user: User = Depends(get_admin_user), db: Session = Depends(get_db)):
+    from app.services.spotify_governor import governor
+
+    log_action(db, "admin.spotify_budget", user_id=user.user_id)
+    return governor.stats()
+
+
 @app.post("/track-event")
 def track_event(
     event: dict,
@@ -59,6 +59,8 @@ class Artist(Base):
     artist_id: Mapped[str] = mapped_column(String(255), primary_key=True)
     artist_name: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
     image_url: Mapped[Optional[str]] = mapped_column(String(512), nullable=True)
+    # Last time genres/images came from a full Spotify artist object.
+    metadata_refreshed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
 
     tracks: Mapped[List["Track"]] = relationship(
         secondary="track_to_artist", back_populates="artists", viewonly=True
@@ -77,6 +79,25 @@ class TrackArtist(Base):
     )
 
 
+class TrackEnrichmentQueue(Base):
+    __tablename__ = "track_enrichment_queue"
+
+    track_id: Mapped[str] = mapped_column(
+        String(255), ForeignKey("dim_all_tracks.track_id"), primary_key=True
+    )
+    priority: Mapped[int] = mapped_column(Integer, default=0)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime)
+    lease_owner: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    lease_expires_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    enqueued_at: Mapped[datetime] = mapped_column(DateTime)
+
+    __table_args__ = (
+        # Dequeue walks the highest-priority due entries.
+        Index("ix_enrichment_queue_priority", "priority", "next_attempt_at"),
+    )
+
+
 class ArtistGenre(Base):
     __tablename__ = "artist_to_genre"
 
@@ -100,9 +121,26 @@ class User(Base):
     image_url: Mapped[Optional[str]] = mapped_column(String(512), nullable=True)
     created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
     last_poll_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    # Set by app.services.poll_schedule; NULL means due now.
+    next_poll_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    # Recently-played cursor (Unix ms) and newest ingested play; see
+    # app.services.ingestion.advance_listen_cursor.
+    last_listen_cursor: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    last_listen_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
     token_invalidated_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    # When the listen_day_* rollups were last rebuilt from the raw listens; NULL
+    # means they aren't trusted yet and stats read the raw listens instead.
+    rollups_built_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    # Bumped whenever the user's listens, friends or name change; part of the
+    # response cache key (app.services.response_cache).
+    data_version: Mapped[int] = mapped_column(Integer, default=0)
     is_admin: Mapped[bool] = mapped_column(default=False)
 
+    __table_args__ = (
+        # The poller pulls due users straight off this index.
+        Index("ix_users_next_poll_at", "next_poll_at"),
+    )
+
 
 class Listen(Base):
     __tablename__ = "dim_all_listens"
@@ -131,6 +169,119 @@ class Listen(Base):
     )
 
 
+class ListenDayTrack(Base):
+    """A user's listens of one track on one UTC day.
+
+    ``ms_played`` sums the listens that carry it; the other ``unplayed_count``
+    listens count as the track's duration, like ``_get_total_minutes`` does.
+    See app.services.listen_rollups.
+    """
+
+    __tablename__ = "listen_day_tracks"
+
+    user_id: Mapped[str] = mapped_column(
+        String(255), ForeignKey("dim_all_users.user_id"), primary_key=True
+    )
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    track_id: Mapped[str] = mapped_column(
+        String(255), ForeignKey("dim_all_tracks.track_id"), primary_key=True
+    )
+    listen_count: Mapped[int] = mapped_column(Integer)
+    ms_played: Mapped[int] = mapped_column(Integer)
+    unplayed_count: Mapped[int] = mapped_column(Integer)
+
+    __table_args__ = (
+        # Enrichment re-derives the artist/genre days of the tracks it touched.
+        Index("ix_listen_day_tracks_track", "track_id"),
+        # Monthly rollups re-aggregate whole days across users.
+        Index("ix_listen_day_tracks_day", "day"),
+    )
+
+
+class ListenDayArtist(Base):
+    __tablename__ = "listen_day_artists"
+
+    user_id: Mapped[str] = mapped_column(
+        String(255), ForeignKey("dim_all_users.user_id"), primary_key=True
+    )
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    artist_id: Mapped[str] = mapped_column(
+        String(255), ForeignKey("dim_all_artists.artist_id"), primary_key=True
+    )
+    listen_count: Mapped[int] = mapped_column(Integer)
+    duration_ms: Mapped[int] = mapped_column(Integer)
+
+    __table_args__ = (Index("ix_listen_day_artists_day", "day"),)
+
+
+class ListenDayGenre(Base):
+    __tablename__ = "listen_day_genres"
+
+    user_id: Mapped[str] = mapped_column(
+        String(255), ForeignKey("dim_all_users.user_id"), primary_key=True
+    )
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    genre: Mapped[str] = mapped_column(String(255), primary_key=True)
+    listen_count: Mapped[int] = mapped_column(Integer)
+    duration_ms: Mapped[int] = mapped_column(Integer)
+
+
+class ListenMonthTrack(Base):
+    """Every user's listens of one track in one ``'YYYY-MM'`` month.
+
+    Global timeline reads; see app.services.listen_months.
+    """
+
+    __tablename__ = "listen_month_tracks"
+
+    track_id: Mapped[str] = mapped_column(
+        String(255), ForeignKey("dim_all_tracks.track_id"), primary_key=True
+    )
+    month: Mapped[str] = mapped_column(String(7), primary_key=True)
+    listen_count: Mapped[int] = mapped_column(Integer)
+
+    __table_args__ = (Index("ix_listen_month_tracks_month", "month"),)
+
+
+class ListenMonthArtist(Base):
+    __tablename__ = "listen_month_artists"
+
+    artist_id: Mapped[str] = mapped_column(
+        String(255), ForeignKey("dim_all_artists.artist_id"), primary_key=True
+    )
+    month: Mapped[str] = mapped_column(String(7), primary_key=True)
+    listen_count: Mapped[int] = mapped_column(Integer)
+
+    __table_args__ = (Index("ix_listen_month_artists_month", "month"),)
+
+
+class ListenMonthDirty(Base):
+    """A month whose global rollups need re-aggregating."""
+
+    __tablename__ = "listen_months_dirty"
+
+    month: Mapped[str] = mapped_column(String(7), primary_key=True)
+    marked_at: Mapped[datetime] = mapped_column(DateTime)
+
+
+class WrappedSnapshot(Base):
+    """A user's rendered Wrapped for one year.
+
+    Fresh while ``invalidated_at`` is unset or older than ``computed_at``.
+    See app.services.wrapped_snapshots.
+    """
+
+    __tablename__ = "wrapped_snapshots"
+
+    user_id: Mapped[str] = mapped_column(
+        String(255), ForeignKey("dim_all_users.user_id"), primary_key=True
+    )
+    year: Mapped[int] = mapped_column(Integer, primary_key=True)
+    payload: Mapped[str] = mapped_column(Text)
+    computed_at: Mapped[datetime] = mapped_column(DateTime)
+    invalidated_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+
 class Friendship(Base):
     __tablename__ = "friendships"
 
@@ -200,6 +351,33 @@ class AwardSnapshot(Base):
     __table_args__ = (
         Index("ix_award_user_group", "user_id", "friend_group_hash"),
         Index("ix_award_group_award", "friend_group_hash", "award_id"),
+        Index(
+            "uq_award_group_award_user",
+            "friend_group_hash",
+            "award_id",
+            "user_id",
+            unique=True,
+        ),
+    )
+
+
+class AwardDirtyGroup(Base):
+    """A user whose friend group's cached awards need recomputing.
+
+    See app.services.award_groups.
+    """
+
+    __tablename__ = "award_dirty_groups"
+
+    owner_user_id: Mapped[str] = mapped_column(
+        String(255), ForeignKey("dim_all_users.user_id"), primary_key=True
+    )
+    dirty_since: Mapped[datetime] = mapped_column(DateTime)
+    marked_at: Mapped[datetime] = mapped_column(DateTime)
+
+    __table_args__ = (
+        # The award task works through the oldest marks first.
+        Index("ix_award_dirty_since", "dirty_since"),
     )
 
 
@@ -15,7 +15,9 @@ from app.schemas import AuthResponse, AuthUrlResponse, UserResponse
 from app.services.audit import log_action
 from app.services.ingestion import upsert_from_recent_listens
 from app.services.ratelimit import client_ip, enforce_rate_limit
+from app.services.response_cache import bump_data_versions
 from app.services.spotify import SpotifyService, encrypt_token
+from app.services.token_cache import access_tokens
 
 logger = logging.getLogger("gatekeepify.auth")
 
@@ -121,6 +123,9 @@ def callback(
     is_new = False
     user = db.query(User).filter(User.user_id == user_id).first()
     if user:
+        if user.user_name != display_name:
+            # Names are rendered into cached gatekeep responses.
+            bump_data_versions(db, [user_id])
         user.user_name = display_name
         user.email = email
         user.image_url = profile_image
@@ -135,10 +140,13 @@ def callback(
             image_url=profile_image,
             spotify_refresh_token=encrypt_token(refresh_token),
             created_at=datetime.now(timezone.utc),
+            # No listens yet, so the (empty) rollups are already complete.
+            rollups_built_at=datetime.now(timezone.utc),
         )
         db.add(user)
     db.commit()
     db.refresh(user)
+    access_tokens.put(user.user_id, token_info)
 
     log_action(
         db,
@@ -1,7 +1,7 @@
 from typing import Optional
 
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy import select
+from sqlalchemy import or_, select
 from sqlalchemy.orm import Session
 
 from app.database import get_db
@@ -22,13 +22,17 @@ from app.services.awards import (
     AWARD_DEFINITIONS,
     get_friend_group_hash,
 )
+from app.services.response_cache import versioned_cache
 
 router = APIRouter(prefix="/gatekeep/awards", tags=["awards"])
 
 ON_THE_FLY_AWARDS = {"crown", "trendsetter", "obsessive", "basic"}
 CACHED_AWARDS = {"archaeologist", "patient_zero", "completionist", "genre_snob", "time_traveler", "streak", "hypebeast"}
+# Leaderboard rows shown per award on the trophy case.
+LEADERBOARD_SIZE = 5
 
 
+@versioned_cache("awards.on_the_fly", users=lambda group_ids: group_ids)
 def _compute_on_the_fly(db: Session, group_ids: list) -> dict:
     results = {}
     for award_id in ON_THE_FLY_AWARDS:
@@ -38,9 +42,17 @@ def _compute_on_the_fly(db: Session, group_ids: list) -> dict:
     return results
 
 
-def _get_cached(db: Session, group_hash: str) -> dict:
+def _get_cached(db: Session, group_hash: str, user_ids: list) -> dict:
+    """Cached leaderboards for a group: the top ranks plus the rows of ``user_ids``.
+
+    Bounded per award regardless of group size, since the callers only show
+    the leaderboard head and the viewer's (or the compared friend's) entry.
+    """
     rows = db.execute(
-        select(AwardSnapshot).where(AwardSnapshot.friend_group_hash == group_hash)
+        select(AwardSnapshot).where(
+            AwardSnapshot.friend_group_hash == group_hash,
+            or_(AwardSnapshot.rank <= LEADERBOARD_SIZE, AwardSnapshot.user_id.in_(user_ids)),
+        )
     ).scalars().all()
 
     results: dict = {}
@@ -72,7 +84,7 @@ def get_trophies(
     group_hash = get_friend_group_hash(group_ids)
 
     live = _compute_on_the_fly(db, group_ids)
-    cached = _get_cached(db, group_hash)
+    cached = _get_cached(db, group_hash, [user.user_id])
     all_awards = {**cached, **live}
 
     user_names = {
@@ -94,7 +106,7 @@ def get_trophies(
                 stat_value=e.get("stat_value"),
                 stat_detail=e.get("stat_detail"),
             )
-            for e in entries[:5]
+            for e in entries[:LEADERBOARD_SIZE]
         ]
 
         user_entry = next((e for e in entries if e["user_id"] == user.user_id), None)
@@ -141,7 +153,7 @@ def head_to_head(
     group_hash = get_friend_group_hash(group_ids)
 
     live = _compute_on_the_fly(db, group_ids)
-    cached = _get_cached(db, group_hash)
+    cached = _get_cached(db, group_hash, [user.user_id, friend_id])
     all_awards = {**cached, **live}
 
     user_names = {
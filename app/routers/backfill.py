@@ -1,8 +1,10 @@
+import codecs
 import io
 import json
+import re
 import zipfile
 from datetime import datetime, timezone
-from typing import Optional
+from typing import BinaryIO, Callable, Iterator, Optional
 
 from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile
 from sqlalchemy import func, select
@@ -19,12 +21,14 @@ from app.services.audit import log_action
 from app.services.ingestion import upsert_track_metadata
 from app.services.ratelimit import enforce_rate_limit
 from app.services.spotify import SpotifyService, decrypt_token
+from app.services.upload_spool import UploadTooLarge, delete_spooled_upload, spool_path, spool_upload
 
 logger = logging.getLogger("gatekeepify.backfill")
 
 router = APIRouter(prefix="/backfill", tags=["backfill"])
 
 BACKFILL_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+_EXPORT_TS_RE = re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z\Z", re.ASCII)
 FILE_PREFIX = "Streaming_History_Audio"
 FILE_SUFFIX = ".json"
 # Marker files that only appear in the basic "Account data" export (not the
@@ -44,6 +48,14 @@ MIN_PLAY_TIME_MS = 30000
 TRACK_URI_PREFIX = "spotify:track:"
 MAX_UPLOAD_BYTES = 100 * 1024 * 1024  # 100 MB
 MAX_DECOMPRESSED_BYTES = 500 * 1024 * 1024  # 500 MB
+JSON_READ_CHUNK_BYTES = 64 * 1024
+_NUMBER_CHARS = set("0123456789+-.eE")
+# A token cut at the chunk edge fails within this many characters of the end
+# ("-Infinit"); cut strings fail as "Unterminated string" wherever they start.
+_CUT_TOKEN_CHARS = len("-Infinity")
+# Export records validated and inserted per round, bounding worker memory.
+VALIDATION_BATCH_SIZE = 5000
+API_KEY_FETCH_SIZE = 5000
 
 EXPECTED_EXPORT_FIELDS = {
     "ts",
@@ -70,32 +82,148 @@ EXTRA_EXPORT_FIELDS = {
 }
 
 
-def _extract_json_from_zip(content: bytes) -> list[dict]:
-    all_listens = []
-    total_decompressed = 0
-    try:
-        zf = zipfile.ZipFile(io.BytesIO(content))
-    except zipfile.BadZipFile:
-        raise HTTPException(status_code=400, detail="Invalid ZIP file")
+def _open_zip(source) -> zipfile.ZipFile:
+    """Open an export from raw bytes, a path or a binary file object."""
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    return zipfile.ZipFile(source)
+
+
+def _streaming_history_members(zf: zipfile.ZipFile) -> list[str]:
+    """Names of the extended-history audio files, checked against the size cap.
 
+    Only reads the ZIP's central directory, so it is cheap to call before
+    anything is decompressed.
+    """
+    names = []
+    total_decompressed = 0
     for name in zf.namelist():
         basename = name.split("/")[-1]
         if basename.startswith(FILE_PREFIX) and basename.endswith(FILE_SUFFIX):
-            info = zf.getinfo(name)
-            total_decompressed += info.file_size
+            total_decompressed += zf.getinfo(name).file_size
             if total_decompressed > MAX_DECOMPRESSED_BYTES:
                 raise HTTPException(status_code=400, detail="Decompressed data too large (max 500 MB)")
-            with zf.open(name) as f:
+            names.append(name)
+    return names
+
+
+def _iter_json_array(fp: BinaryIO, on_read: Optional[Callable[[int], None]] = None) -> Iterator:
+    """Yield the elements of a top-level JSON array read incrementally from ``fp``.
+
+    Only one read chunk and the element being decoded are held in memory.
+    Yields nothing if the document is not an array; raises
+    ``json.JSONDecodeError`` on malformed input. ``on_read`` is called with
+    the size of every chunk read.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8-sig")()
+    buf, pos, eof = "", 0, False
+
+    def _more():
+        nonlocal buf, pos, eof
+        chunk = fp.read(JSON_READ_CHUNK_BYTES)
+        if on_read:
+            on_read(len(chunk))
+        eof = not chunk
+        buf = buf[pos:] + text.decode(chunk, final=eof)
+        pos = 0
+
+    def _skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            _more()
+
+    _skip_whitespace()
+    if pos >= len(buf) or buf[pos] != "[":
+        return
+    pos += 1
+    _skip_whitespace()
+    if pos < len(buf) and buf[pos] == "]":
+        return
+
+    while True:
+        _skip_whitespace()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError as e:
+                # Only an element cut off by the end of the buffer needs more
+                # input; anything else is malformed, however much follows it.
+                cut = e.msg.startswith("Unterminated string") or e.pos >= len(buf) - _CUT_TOKEN_CHARS
+                if eof or not cut:
+                    raise
+                _more()
+                continue
+            if isinstance(value, (int, float)) and not eof and set(buf[end:]) <= _NUMBER_CHARS:
+                # A number cut at the chunk edge ("-1.5e|10") decodes as its prefix.
+                _more()
+                continue
+            break
+        pos = end
+        yield value
+
+        _skip_whitespace()
+        if pos >= len(buf):
+            raise json.JSONDecodeError("Unterminated array", buf, pos)
+        if buf[pos] == "]":
+            return
+        if buf[pos] != ",":
+            raise json.JSONDecodeError("Expecting ',' delimiter", buf, pos)
+        pos += 1
+
+
+class StreamingHistoryReader:
+    """Iterates an export's listen records one at a time, member by member.
+
+    ``bytes_read``/``bytes_total`` track decompressed bytes for progress
+    reporting. A member that turns out to be malformed is abandoned at the
+    error; records already yielded from it are kept.
+    """
+
+    def __init__(self, source):
+        try:
+            self._zf = _open_zip(source)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail="Invalid ZIP file")
+        try:
+            self._members = _streaming_history_members(self._zf)
+        except HTTPException:
+            self._zf.close()
+            raise
+        self.bytes_total = sum(self._zf.getinfo(name).file_size for name in self._members)
+        self.bytes_read = 0
+
+    def _count(self, n: int) -> None:
+        self.bytes_read += n
+
+    def __iter__(self) -> Iterator:
+        for name in self._members:
+            with self._zf.open(name) as f:
                 try:
-                    data = json.load(f)
-                    if isinstance(data, list):
-                        all_listens.extend(data)
-                except json.JSONDecodeError:
-                    continue
-    return all_listens
+                    yield from _iter_json_array(f, self._count)
+                except json.JSONDecodeError as e:
+                    logger.warning(f"Stopped reading malformed export file {name}: {e}")
+
+    def close(self) -> None:
+        self._zf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
 
-def _is_basic_export(content: bytes) -> bool:
+def _extract_json_from_zip(source) -> list[dict]:
+    with StreamingHistoryReader(source) as reader:
+        return list(reader)
+
+
+def _is_basic_export(source) -> bool:
     """Detect the basic "Account data" export, which we can't ingest.
 
     Returns True if the ZIP contains basic-export streaming files
@@ -103,19 +231,31 @@ def _is_basic_export(content: bytes) -> bool:
     no "Extended streaming history" audio files.
     """
     try:
-        zf = zipfile.ZipFile(io.BytesIO(content))
+        zf = _open_zip(source)
     except zipfile.BadZipFile:
         return False
 
-    for name in zf.namelist():
-        basename = name.split("/")[-1]
-        if basename.startswith(BASIC_EXPORT_PREFIX) and basename.endswith(FILE_SUFFIX):
-            return True
-        if basename in BASIC_EXPORT_MARKERS:
-            return True
+    with zf:
+        for name in zf.namelist():
+            basename = name.split("/")[-1]
+            if basename.startswith(BASIC_EXPORT_PREFIX) and basename.endswith(FILE_SUFFIX):
+                return True
+            if basename in BASIC_EXPORT_MARKERS:
+                return True
     return False
 
 
+def _parse_export_ts(ts_str: str) -> datetime:
+    """Parse an export timestamp (``BACKFILL_DATETIME_FORMAT``).
+
+    The canonical fixed-width form goes through ``fromisoformat``, several
+    times faster than ``strptime``; anything else falls back to ``strptime``.
+    """
+    if _EXPORT_TS_RE.match(ts_str):
+        return datetime.fromisoformat(ts_str[:19])
+    return datetime.strptime(ts_str, BACKFILL_DATETIME_FORMAT)
+
+
 def _validate_and_process_listens(
     raw_listens: list[dict],
     user: User,
@@ -162,6 +302,9 @@ def _validate_and_process_listens(
                 )
 
     user_api_listen_range = _get_api_listen_range(db, user.user_id)
+    passed: list[tuple[datetime, str, int, dict]] = []
+    overlap_lo: Optional[datetime] = None
+    overlap_hi: Optional[datetime] = None
 
     for listen_json in raw_listens:
         if not isinstance(listen_json, dict):
@@ -204,8 +347,8 @@ def _validate_and_process_listens(
             )
             continue
         try:
-            ts = datetime.strptime(ts_str, BACKFILL_DATETIME_FORMAT)
-        except ValueError:
+            ts = _parse_export_ts(ts_str)
+        except (TypeError, ValueError):
             rejection_reasons["invalid_timestamp"] = (
                 rejection_reasons.get("invalid_timestamp", 0) + 1
             )
@@ -220,19 +363,22 @@ def _validate_and_process_listens(
                 )
                 continue
 
-        if user_api_listen_range:
-            api_min, api_max = user_api_listen_range
-            if api_min <= ts <= api_max:
-                existing = db.execute(
-                    select(Listen).where(
-                        Listen.user_id == user.user_id,
-                        Listen.track_id == track_id,
-                        Listen.ts == ts,
-                        Listen.source == ListenSource.api.value,
-                    )
-                ).first()
-                if existing:
-                    continue
+        passed.append((ts, track_id, ms_played, listen_json))
+        if user_api_listen_range and user_api_listen_range[0] <= ts <= user_api_listen_range[1]:
+            overlap_lo = ts if overlap_lo is None else min(overlap_lo, ts)
+            overlap_hi = ts if overlap_hi is None else max(overlap_hi, ts)
+
+    # Listens the poller already recorded are dropped silently. Their keys are
+    # loaded with one range query over the overlap instead of a lookup each.
+    api_keys = (
+        _load_api_listen_keys(db, user.user_id, overlap_lo, overlap_hi)
+        if overlap_lo is not None
+        else set()
+    )
+
+    for ts, track_id, ms_played, listen_json in passed:
+        if (track_id, ts) in api_keys:
+            continue
 
         extra_meta = {
             k: listen_json[k] for k in EXTRA_EXPORT_FIELDS if k in listen_json
@@ -252,6 +398,23 @@ def _validate_and_process_listens(
     return accepted, rejection_reasons
 
 
+def _load_api_listen_keys(
+    db: Session, user_id: str, start: datetime, end: datetime
+) -> set[tuple[str, datetime]]:
+    """``(track_id, ts)`` of the user's API listens between ``start`` and ``end``."""
+    stmt = (
+        select(Listen.track_id, Listen.ts)
+        .where(
+            Listen.user_id == user_id,
+            Listen.source == ListenSource.api.value,
+            Listen.ts >= start,
+            Listen.ts <= end,
+        )
+        .execution_options(yield_per=API_KEY_FETCH_SIZE)
+    )
+    return {(track_id, ts) for track_id, ts in db.execute(stmt)}
+
+
 def _get_api_listen_range(
     db: Session, user_id: str
 ) -> Optional[tuple[datetime, datetime]]:
@@ -294,19 +457,31 @@ def upload_data_export(
     if active_job:
         raise HTTPException(status_code=409, detail="An upload is already being processed")
 
-    content = file.file.read(MAX_UPLOAD_BYTES + 1)
-    if len(content) > MAX_UPLOAD_BYTES:
+    # Stream the upload to the spool and inspect only the ZIP directory here;
+    # the worker parses the listens from disk.
+    try:
+        spooled = spool_upload(file.file, MAX_UPLOAD_BYTES)
+    except UploadTooLarge:
         raise HTTPException(status_code=400, detail="File too large (max 100 MB)")
+    upload_path = spool_path(spooled.key)
 
-    raw_listens = _extract_json_from_zip(content)
-    if not raw_listens:
-        if _is_basic_export(content):
+    try:
+        try:
+            with zipfile.ZipFile(upload_path) as zf:
+                history_files = _streaming_history_members(zf)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail="Invalid ZIP file")
+        if not history_files:
+            if _is_basic_export(upload_path):
+                log_action(db, "backfill.upload", user_id=user.user_id, status="error",
+                           details={"reason": "basic_export_uploaded"})
+                raise HTTPException(status_code=400, detail=BASIC_EXPORT_MESSAGE)
             log_action(db, "backfill.upload", user_id=user.user_id, status="error",
-                       details={"reason": "basic_export_uploaded"})
-            raise HTTPException(status_code=400, detail=BASIC_EXPORT_MESSAGE)
-        log_action(db, "backfill.upload", user_id=user.user_id, status="error",
-                   details={"reason": "no_streaming_history_files"})
-        raise HTTPException(status_code=400, detail="No streaming history files found in the ZIP")
+                       details={"reason": "no_streaming_history_files"})
+            raise HTTPException(status_code=400, detail="No streaming history files found in the ZIP")
+    except HTTPException:
+        delete_spooled_upload(spooled.key)
+        raise
 
     job = JobRun(
         job_name="backfill_upload",
@@ -317,7 +492,8 @@ def upload_data_export(
             "phase": "queued",
             "progress": 0,
             "filename": file.filename,
-            "total_listens": len(raw_listens),
+            "upload_key": spooled.key,
+            "size_bytes": spooled.size_bytes,
         }),
     )
     db.add(job)
@@ -325,10 +501,10 @@ def upload_data_export(
     db.refresh(job)
 
     from app.celery_app import celery_app
-    celery_app.send_task("app.tasks.process_backfill_upload", args=[job.id, user.user_id, raw_listens])
+    celery_app.send_task("app.tasks.process_backfill_upload", args=[job.id, user.user_id])
 
     log_action(db, "backfill.upload_started", user_id=user.user_id,
-               details={"job_id": job.id, "filename": file.filename, "size_bytes": len(content)})
+               details={"job_id": job.id, "filename": file.filename, "size_bytes": spooled.size_bytes})
 
     return {"job_id": job.id, "status": "processing"}
 
@@ -375,6 +551,7 @@ def upload_job_status(
         "accepted": details.get("accepted"),
         "rejected": details.get("rejected"),
         "rejection_reasons": details.get("rejection_reasons"),
+        "rows_per_second": details.get("rows_per_second"),
         "enriched": details.get("enriched"),
         "enrich_total": details.get("enrich_total"),
         "enrich_done": details.get("enrich_done"),
@@ -20,6 +20,7 @@ from app.routers.friends import get_friend_ids
 from app.services.audit import log_action
 from app.services.activity import generate_activity_feed
 from app.services.compatibility import compute_quick_scores_batch, get_user_artists
+from app.services.response_cache import versioned_cache
 
 router = APIRouter(prefix="/discover", tags=["discover"])
 
@@ -40,19 +41,14 @@ def _get_friend_compat_scores(db: Session, user_id: str, friend_ids: list) -> di
     return compute_quick_scores_batch(db, user_id, friend_ids)
 
 
-@router.get("/friends-fresh-finds")
-def friends_fresh_finds(
-    days: int = Query(default=7, le=365),
-    user: UserModel = Depends(get_current_user),
-    db: Session = Depends(get_db),
-):
-    friend_ids = get_friend_ids(db, user.user_id)
-    if not friend_ids:
-        return []
+def _user_and_friends(user_id: str, friend_ids: list, *args) -> list:
+    return [user_id] + friend_ids
 
-    since = datetime.now(timezone.utc) - timedelta(days=days)
-    my_artists = _get_my_artist_ids(db, user.user_id)
-    compat_scores = _get_friend_compat_scores(db, user.user_id, friend_ids)
+
+@versioned_cache("discover.friends_fresh_finds", users=_user_and_friends)
+def _fresh_finds(db: Session, user_id: str, friend_ids: list, since: datetime) -> list:
+    my_artists = _get_my_artist_ids(db, user_id)
+    compat_scores = _get_friend_compat_scores(db, user_id, friend_ids)
 
     # Get per-friend-per-artist recent listens
     stmt = (
@@ -90,15 +86,12 @@ def friends_fresh_finds(
         d["listen_count"] += r.listen_count
         d["relevance_score"] += compat_scores.get(r.user_id, 50) * r.listen_count
 
-    results = sorted(artist_data.values(), key=lambda x: -x["relevance_score"])[:20]
-
-    log_action(db, "discover.friends_fresh_finds", user_id=user.user_id,
-               details={"days": days, "results": len(results)})
-    return results
+    return sorted(artist_data.values(), key=lambda x: -x["relevance_score"])[:20]
 
 
-@router.get("/youre-late-on")
-def youre_late_on(
+@router.get("/friends-fresh-finds")
+def friends_fresh_finds(
+    days: int = Query(default=7, le=365),
     user: UserModel = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
@@ -106,8 +99,19 @@ def youre_late_on(
     if not friend_ids:
         return []
 
-    my_artists = _get_my_artist_ids(db, user.user_id)
-    compat_scores = _get_friend_compat_scores(db, user.user_id, friend_ids)
+    # Whole minutes, so repeated requests share a response cache key.
+    since = datetime.now(timezone.utc).replace(second=0, microsecond=0) - timedelta(days=days)
+    results = _fresh_finds(db, user.user_id, friend_ids, since)
+
+    log_action(db, "discover.friends_fresh_finds", user_id=user.user_id,
+               details={"days": days, "results": len(results)})
+    return results
+
+
+@versioned_cache("discover.youre_late_on", users=_user_and_friends)
+def _late_on(db: Session, user_id: str, friend_ids: list) -> list:
+    my_artists = _get_my_artist_ids(db, user_id)
+    compat_scores = _get_friend_compat_scores(db, user_id, friend_ids)
 
     # Get per-friend-per-artist listens (all time)
     stmt = (
@@ -159,7 +163,7 @@ def youre_late_on(
         for gr in genre_rows:
             genre_map.setdefault(gr.artist_id, []).append(gr.genre)
 
-    results = [
+    return [
         {
             **d,
             "genres": genre_map.get(d["artist_id"], [])[:3],
@@ -168,6 +172,18 @@ def youre_late_on(
         for d in rows_filtered
     ]
 
+
+@router.get("/youre-late-on")
+def youre_late_on(
+    user: UserModel = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    friend_ids = get_friend_ids(db, user.user_id)
+    if not friend_ids:
+        return []
+
+    results = _late_on(db, user.user_id, friend_ids)
+
     log_action(db, "discover.youre_late_on", user_id=user.user_id,
                details={"results": len(results)})
     return results
@@ -14,7 +14,9 @@ from sqlalchemy import func
 
 from app.schemas import FriendResponse, InviteAcceptResponse, InviteResponse
 from app.services.audit import log_action
+from app.services.award_groups import mark_groups_dirty
 from app.services.ratelimit import enforce_rate_limit
+from app.services.response_cache import bump_data_versions
 
 router = APIRouter(prefix="/friends", tags=["friends"])
 
@@ -170,6 +172,8 @@ def accept_invite(
 
     db.add(Friendship(user_id_1=user.user_id, user_id_2=invite.from_user_id, created_at=now))
     db.add(Friendship(user_id_1=invite.from_user_id, user_id_2=user.user_id, created_at=now))
+    mark_groups_dirty(db, [user.user_id, invite.from_user_id])
+    bump_data_versions(db, [user.user_id, invite.from_user_id])
     db.commit()
 
     log_action(
@@ -331,6 +335,8 @@ def accept_friend_request(
     invite.accepted_at = now
     db.add(Friendship(user_id_1=user.user_id, user_id_2=invite.from_user_id, created_at=now))
     db.add(Friendship(user_id_1=invite.from_user_id, user_id_2=user.user_id, created_at=now))
+    mark_groups_dirty(db, [user.user_id, invite.from_user_id])
+    bump_data_versions(db, [user.user_id, invite.from_user_id])
     db.commit()
 
     log_action(db, "friends.request_accepted", user_id=user.user_id, entity_type="user", entity_id=invite.from_user_id)
@@ -21,6 +21,7 @@ from app.models import User as UserModel
 from app.routers.auth import get_current_user
 from app.routers.friends import get_friend_ids
 from app.services.audit import log_action
+from app.services.response_cache import versioned_cache
 from app.schemas import (
     ChallengeResponse,
     GatekeepArtistResponse,
@@ -84,20 +85,12 @@ def _build_gatekeep_entries(
     return entries
 
 
-@router.get("/artist/{artist_id}", response_model=GatekeepArtistResponse)
-def gatekeep_artist(
-    artist_id: str,
-    user: UserModel = Depends(get_current_user),
-    db: Session = Depends(get_db),
-):
-
-    artist = db.query(Artist).filter(Artist.artist_id == artist_id).first()
-    if not artist:
-        raise HTTPException(status_code=404, detail="Artist not found")
+def _group_users(entity_id: str, group_ids: List[str]) -> List[str]:
+    return group_ids
 
-    friend_ids = get_friend_ids(db, user.user_id)
-    group_ids = [user.user_id] + friend_ids
 
+@versioned_cache("gatekeep.artist", users=_group_users)
+def _artist_entries(db: Session, artist_id: str, group_ids: List[str]) -> List[GatekeepEntry]:
     stmt = (
         select(
             Listen.user_id,
@@ -119,8 +112,47 @@ def gatekeep_artist(
         .order_by(func.min(Listen.ts).asc())
     )
     rows = db.execute(stmt).all()
+    return _build_gatekeep_entries(db, rows, "artist", artist_id)
+
+
+@versioned_cache("gatekeep.track", users=_group_users)
+def _track_entries(db: Session, track_id: str, group_ids: List[str]) -> List[GatekeepEntry]:
+    stmt = (
+        select(
+            Listen.user_id,
+            User.user_name,
+            func.min(Listen.ts).label("first_listen"),
+            func.count().label("total_listens"),
+            func.sum(
+                case((Listen.source == ListenSource.api.value, 1), else_=0)
+            ).label("verified_listens"),
+            (func.count() * func.coalesce(Track.duration_ms, 0)).label("total_ms"),
+        )
+        .select_from(Listen)
+        .join(Track, Listen.track_id == Track.track_id)
+        .join(User, Listen.user_id == User.user_id)
+        .where(Listen.track_id == track_id)
+        .where(Listen.user_id.in_(group_ids))
+        .group_by(Listen.user_id, User.user_name)
+        .order_by(func.min(Listen.ts).asc())
+    )
+    rows = db.execute(stmt).all()
+    return _build_gatekeep_entries(db, rows, "track", track_id)
 
-    entries = _build_gatekeep_entries(db, rows, "artist", artist_id)
+
+@router.get("/artist/{artist_id}", response_model=GatekeepArtistResponse)
+def gatekeep_artist(
+    artist_id: str,
+    user: UserModel = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+
+    artist = db.query(Artist).filter(Artist.artist_id == artist_id).first()
+    if not artist:
+        raise HTTPException(status_code=404, detail="Artist not found")
+
+    friend_ids = get_friend_ids(db, user.user_id)
+    entries = _artist_entries(db, artist_id, [user.user_id] + friend_ids)
 
     winner_id = entries[0].user_id if entries else None
     log_action(
@@ -154,30 +186,7 @@ def gatekeep_track(
         raise HTTPException(status_code=404, detail="Track not found")
 
     friend_ids = get_friend_ids(db, user.user_id)
-    group_ids = [user.user_id] + friend_ids
-
-    stmt = (
-        select(
-            Listen.user_id,
-            User.user_name,
-            func.min(Listen.ts).label("first_listen"),
-            func.count().label("total_listens"),
-            func.sum(
-                case((Listen.source == ListenSource.api.value, 1), else_=0)
-            ).label("verified_listens"),
-            (func.count() * func.coalesce(Track.duration_ms, 0)).label("total_ms"),
-        )
-        .select_from(Listen)
-        .join(Track, Listen.track_id == Track.track_id)
-        .join(User, Listen.user_id == User.user_id)
-        .where(Listen.track_id == track_id)
-        .where(Listen.user_id.in_(group_ids))
-        .group_by(Listen.user_id, User.user_name)
-        .order_by(func.min(Listen.ts).asc())
-    )
-    rows = db.execute(stmt).all()
-
-    entries = _build_gatekeep_entries(db, rows, "track", track_id)
+    entries = _track_entries(db, track_id, [user.user_id] + friend_ids)
 
     winner_id = entries[0].user_id if entries else None
     log_action(
@@ -199,19 +208,8 @@ def gatekeep_track(
     )
 
 
-@router.get("/leaderboard", response_model=LeaderboardResponse)
-def leaderboard(
-    user: UserModel = Depends(get_current_user),
-    limit: int = 50,
-    offset: int = 0,
-    db: Session = Depends(get_db),
-):
-    friend_ids = get_friend_ids(db, user.user_id)
-    group_ids = [user.user_id] + friend_ids
-
-    if len(group_ids) < 2:
-        return LeaderboardResponse(entries=[], total_artists_contested=0)
-
+@versioned_cache("gatekeep.leaderboard", users=lambda group_ids, limit, offset: group_ids)
+def _crown_leaderboard(db: Session, group_ids: List[str], limit: int, offset: int) -> LeaderboardResponse:
     artist_user_first = (
         select(
             TrackArtist.artist_id,
@@ -269,19 +267,37 @@ def leaderboard(
         for i, row in enumerate(rows)
     ]
 
+    return LeaderboardResponse(
+        entries=entries,
+        total_artists_contested=contested_count,
+    )
+
+
+@router.get("/leaderboard", response_model=LeaderboardResponse)
+def leaderboard(
+    user: UserModel = Depends(get_current_user),
+    limit: int = 50,
+    offset: int = 0,
+    db: Session = Depends(get_db),
+):
+    friend_ids = get_friend_ids(db, user.user_id)
+    group_ids = [user.user_id] + friend_ids
+
+    if len(group_ids) < 2:
+        return LeaderboardResponse(entries=[], total_artists_contested=0)
+
+    result = _crown_leaderboard(db, group_ids, limit, offset)
+
     log_action(
         db, "gatekeep.leaderboard_viewed",
         user_id=user.user_id,
         details={
-            "total_artists_contested": contested_count,
-            "num_entries": len(entries),
+            "total_artists_contested": result.total_artists_contested,
+            "num_entries": len(result.entries),
         },
     )
 
-    return LeaderboardResponse(
-        entries=entries,
-        total_artists_contested=contested_count,
-    )
+    return result
 
 
 @router.post("/challenge", response_model=ChallengeResponse)
@@ -1,6 +1,8 @@
+from datetime import datetime, timezone
 from typing import List, Optional
 
 from fastapi import APIRouter, Depends, Query
+from spotipy.exceptions import SpotifyException
 from sqlalchemy import case, func, select
 from sqlalchemy.orm import Session
 
@@ -20,9 +22,11 @@ from app.models import User as UserModel
 from app.routers.auth import get_current_user
 from app.schemas import ArtistDetailResponse, ArtistSearchResult, TrackDetailResponse, TrackSearchResult
 from app.services.audit import log_action
-from app.services.ingestion import _get_best_image
+from app.services.dimensions import DimensionWriter, _get_best_image
 from app.services.ratelimit import enforce_rate_limit
-from app.services.spotify import SpotifyService, decrypt_token
+from app.services.spotify import SpotifyService
+from app.services.spotify_governor import DEFAULT_RETRY_AFTER_SECONDS, Priority, request_priority
+from app.services.token_cache import get_access_token
 
 logger = logging.getLogger("gatekeepify.search")
 
@@ -31,6 +35,22 @@ router = APIRouter(prefix="/search", tags=["search"])
 MAX_RESULTS = 20
 
 
+def _is_rate_limited(exc: Exception) -> bool:
+    return isinstance(exc, SpotifyException) and exc.http_status == 429
+
+
+def _spotify_busy(exc: SpotifyException):
+    """503 telling the client when to retry a search Spotify throttled."""
+    from fastapi import HTTPException
+
+    retry_after = (exc.headers or {}).get("Retry-After", DEFAULT_RETRY_AFTER_SECONDS)
+    return HTTPException(
+        status_code=503,
+        detail="Spotify is busy. Please try again shortly.",
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
 def _escape_like(q: str) -> str:
     return q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
 
@@ -303,11 +323,9 @@ def resolve_artist(
 
     try:
         service = SpotifyService()
-        refresh_token = decrypt_token(user_obj.spotify_refresh_token)
-        token_info = service.refresh_access_token(refresh_token)
-        client = service.get_client(token_info["access_token"])
-
-        results = client.search(q=f'artist:"{name}"', type="artist", limit=5)
+        with request_priority(Priority.interactive):
+            client = service.get_client(get_access_token(db, service, user_obj))
+            results = client.search(q=f'artist:"{name}"', type="artist", limit=5)
         artists = results.get("artists", {}).get("items", [])
 
         match = None
@@ -321,14 +339,9 @@ def resolve_artist(
         if not match:
             raise HTTPException(status_code=404, detail="Artist not found on Spotify")
 
-        db.merge(Artist(
-            artist_id=match["id"],
-            artist_name=match.get("name"),
-            image_url=_get_best_image(match.get("images", [])),
-        ))
-        for genre in match.get("genres", []):
-            if genre:
-                db.merge(ArtistGenre(artist_id=match["id"], genre=genre))
+        writer = DimensionWriter(db)
+        writer.add_artist(match, refreshed_at=datetime.now(timezone.utc))
+        writer.flush()
         db.commit()
 
         log_action(db, "search.artist_resolved", user_id=user.user_id,
@@ -340,6 +353,8 @@ def resolve_artist(
     except HTTPException:
         raise
     except Exception as e:
+        if _is_rate_limited(e):
+            raise _spotify_busy(e)
         logger.warning(f"Failed to resolve artist '{name}': {e}")
         raise HTTPException(status_code=404, detail="Could not resolve artist")
 
@@ -357,25 +372,17 @@ def search_spotify_artists(
 
     try:
         service = SpotifyService()
-        refresh_token = decrypt_token(user_obj.spotify_refresh_token)
-        token_info = service.refresh_access_token(refresh_token)
-        client = service.get_client(token_info["access_token"])
-
-        results = client.search(q=q, type="artist", limit=8)
+        with request_priority(Priority.interactive):
+            client = service.get_client(get_access_token(db, service, user_obj))
+            results = client.search(q=q, type="artist", limit=8)
         artists = results.get("artists", {}).get("items", [])
 
+        writer = DimensionWriter(db)
+        refreshed_at = datetime.now(timezone.utc)
         output = []
         for a in artists:
-            if not a or not a.get("id"):
+            if not writer.add_artist(a, refreshed_at=refreshed_at):
                 continue
-            db.merge(Artist(
-                artist_id=a["id"],
-                artist_name=a.get("name"),
-                image_url=_get_best_image(a.get("images", [])),
-            ))
-            for genre in a.get("genres", []):
-                if genre:
-                    db.merge(ArtistGenre(artist_id=a["id"], genre=genre))
             output.append({
                 "artist_id": a["id"],
                 "artist_name": a.get("name"),
@@ -383,11 +390,14 @@ def search_spotify_artists(
                 "genres": a.get("genres", [])[:3],
                 "spotify_followers": a.get("followers", {}).get("total", 0),
             })
+        writer.flush()
         db.commit()
         log_action(db, "search.spotify_artists", user_id=user.user_id,
                    details={"query": q, "results": len(output)})
         return output
 
     except Exception as e:
+        if _is_rate_limited(e):
+            raise _spotify_busy(e)
         logger.warning(f"Spotify artist search failed: {e}")
         return []
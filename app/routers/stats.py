@@ -13,6 +13,8 @@ from app.models import (
     ArtistGenre,
     Friendship,
     Listen,
+    ListenMonthArtist,
+    ListenMonthTrack,
     Track,
     TrackArtist,
     User,
@@ -20,6 +22,11 @@ from app.models import (
 from app.models import User as UserModel
 from app.routers.auth import get_current_user
 from app.services.audit import log_action
+from app.services.listen_months import global_months_ready, month_key
+from app.services.listen_rollups import artist_totals, genre_totals, track_totals
+from app.services.response_cache import versioned_cache
+from app.services.wrapped_engine import Ranked, scan_wrapped
+from app.services.wrapped_snapshots import load_wrapped, store_wrapped
 from app.schemas import (
     TimePeriod,
     TopArtistEntry,
@@ -44,7 +51,8 @@ def _clamp_offset(offset: int) -> int:
 
 
 def _period_to_since(period: TimePeriod) -> Optional[datetime]:
-    now = datetime.now(timezone.utc)
+    # Whole minutes, so repeated requests share a response cache key.
+    now = datetime.now(timezone.utc).replace(second=0, microsecond=0)
     if period == TimePeriod.today:
         return now - timedelta(hours=24)
     elif period == TimePeriod.month:
@@ -63,6 +71,8 @@ def _ms_to_minutes(ms: Optional[int]) -> int:
 def _get_top_tracks(
     db: Session, user_id: str, since: Optional[datetime], limit: int, offset: int = 0, until: Optional[datetime] = None
 ) -> List[TopTrackEntry]:
+    totals = track_totals(db, user_id, since, until)
+    listen_count = func.sum(totals.c.listen_count)
     stmt = (
         select(
             Track.track_id,
@@ -70,12 +80,11 @@ def _get_top_tracks(
             Album.album_name,
             Track.image_url,
             Track.duration_ms,
-            func.count().label("listen_count"),
+            listen_count.label("listen_count"),
         )
-        .select_from(Listen)
-        .join(Track, Listen.track_id == Track.track_id)
+        .select_from(totals)
+        .join(Track, totals.c.track_id == Track.track_id)
         .outerjoin(Album, Track.album_id == Album.album_id)
-        .where(Listen.user_id == user_id)
         .group_by(
             Track.track_id,
             Track.track_name,
@@ -83,14 +92,10 @@ def _get_top_tracks(
             Track.image_url,
             Track.duration_ms,
         )
-        .order_by(func.count().desc())
+        .order_by(listen_count.desc(), Track.track_id)
         .limit(limit)
         .offset(offset)
     )
-    if since:
-        stmt = stmt.where(Listen.ts >= since)
-    if until:
-        stmt = stmt.where(Listen.ts < until)
     rows = db.execute(stmt).all()
     return [
         TopTrackEntry(
@@ -99,49 +104,46 @@ def _get_top_tracks(
             track_name=row.track_name,
             album_name=row.album_name,
             image_url=row.image_url,
-            listen_count=row.listen_count,
-            total_minutes=_ms_to_minutes((row.duration_ms or 0) * row.listen_count),
+            listen_count=int(row.listen_count),
+            total_minutes=_ms_to_minutes((row.duration_ms or 0) * int(row.listen_count)),
         )
         for i, row in enumerate(rows)
     ]
 
 
+def _genres_by_artist(db: Session, artist_ids: List[str]) -> dict[str, list[str]]:
+    genres_by_artist: dict[str, list[str]] = {}
+    if artist_ids:
+        genre_rows = db.execute(
+            select(ArtistGenre.artist_id, ArtistGenre.genre).where(ArtistGenre.artist_id.in_(artist_ids))
+        ).all()
+        for gr in genre_rows:
+            genres_by_artist.setdefault(gr.artist_id, []).append(gr.genre)
+    return genres_by_artist
+
+
 def _get_top_artists(
     db: Session, user_id: str, since: Optional[datetime], limit: int, offset: int = 0, until: Optional[datetime] = None
 ) -> List[TopArtistEntry]:
+    totals = artist_totals(db, user_id, since, until)
+    listen_count = func.sum(totals.c.listen_count)
     stmt = (
         select(
             Artist.artist_id,
             Artist.artist_name,
             Artist.image_url,
-            func.count().label("listen_count"),
-            func.sum(Track.duration_ms).label("total_ms"),
+            listen_count.label("listen_count"),
+            func.sum(totals.c.duration_ms).label("total_ms"),
         )
-        .select_from(Listen)
-        .join(TrackArtist, Listen.track_id == TrackArtist.track_id)
-        .join(Artist, TrackArtist.artist_id == Artist.artist_id)
-        .join(Track, Listen.track_id == Track.track_id)
-        .where(Listen.user_id == user_id)
+        .select_from(totals)
+        .join(Artist, totals.c.artist_id == Artist.artist_id)
         .group_by(Artist.artist_id, Artist.artist_name, Artist.image_url)
-        .order_by(func.count().desc())
+        .order_by(listen_count.desc(), Artist.artist_id)
         .limit(limit)
         .offset(offset)
     )
-    if since:
-        stmt = stmt.where(Listen.ts >= since)
-    if until:
-        stmt = stmt.where(Listen.ts < until)
     rows = db.execute(stmt).all()
-
-    artist_ids = [row.artist_id for row in rows]
-    genres_by_artist: dict[str, list[str]] = {}
-    if artist_ids:
-        genre_rows = db.execute(
-            select(ArtistGenre.artist_id, ArtistGenre.genre).where(ArtistGenre.artist_id.in_(artist_ids))
-        ).all()
-        for gr in genre_rows:
-            genres_by_artist.setdefault(gr.artist_id, []).append(gr.genre)
-
+    genres_by_artist = _genres_by_artist(db, [row.artist_id for row in rows])
     return [
         TopArtistEntry(
             rank=offset + i + 1,
@@ -149,7 +151,7 @@ def _get_top_artists(
             artist_name=row.artist_name,
             image_url=row.image_url,
             genres=genres_by_artist.get(row.artist_id, []),
-            listen_count=row.listen_count,
+            listen_count=int(row.listen_count),
             total_minutes=_ms_to_minutes(row.total_ms),
         )
         for i, row in enumerate(rows)
@@ -159,35 +161,16 @@ def _get_top_artists(
 def _get_top_genres(
     db: Session, user_id: str, since: Optional[datetime], limit: int, offset: int = 0, until: Optional[datetime] = None
 ) -> List[TopGenreEntry]:
-    inner = (
-        select(
-            Listen.ts,
-            Listen.user_id,
-            Listen.track_id,
-            ArtistGenre.genre,
-            Track.duration_ms,
-        )
-        .select_from(Listen)
-        .join(TrackArtist, Listen.track_id == TrackArtist.track_id)
-        .join(ArtistGenre, TrackArtist.artist_id == ArtistGenre.artist_id)
-        .join(Track, Listen.track_id == Track.track_id)
-        .where(Listen.user_id == user_id)
-        .distinct()
-    )
-    if since:
-        inner = inner.where(Listen.ts >= since)
-    if until:
-        inner = inner.where(Listen.ts < until)
-    sub = inner.subquery()
-
+    totals = genre_totals(db, user_id, since, until)
+    listen_count = func.sum(totals.c.listen_count)
     stmt = (
         select(
-            sub.c.genre,
-            func.count().label("listen_count"),
-            func.sum(sub.c.duration_ms).label("total_ms"),
+            totals.c.genre,
+            listen_count.label("listen_count"),
+            func.sum(totals.c.duration_ms).label("total_ms"),
         )
-        .group_by(sub.c.genre)
-        .order_by(func.count().desc())
+        .group_by(totals.c.genre)
+        .order_by(listen_count.desc(), totals.c.genre)
         .limit(limit)
         .offset(offset)
     )
@@ -196,7 +179,7 @@ def _get_top_genres(
         TopGenreEntry(
             rank=offset + i + 1,
             genre=row.genre,
-            listen_count=row.listen_count,
+            listen_count=int(row.listen_count),
             total_minutes=_ms_to_minutes(row.total_ms),
         )
         for i, row in enumerate(rows)
@@ -204,35 +187,19 @@ def _get_top_genres(
 
 
 def _get_total_minutes(db: Session, user_id: str, since: Optional[datetime], until: Optional[datetime] = None) -> int:
-    from sqlalchemy import case
-
-    ms_expr = func.sum(
-        case(
-            (Listen.ms_played.isnot(None), Listen.ms_played),
-            else_=func.coalesce(Track.duration_ms, 0),
-        )
-    )
+    # Listens without ms_played count as the track's full duration.
+    totals = track_totals(db, user_id, since, until)
     stmt = (
-        select(ms_expr)
-        .select_from(Listen)
-        .join(Track, Listen.track_id == Track.track_id)
-        .where(Listen.user_id == user_id)
+        select(
+            func.sum(totals.c.ms_played + totals.c.unplayed_count * func.coalesce(Track.duration_ms, 0))
+        )
+        .select_from(totals)
+        .join(Track, totals.c.track_id == Track.track_id)
     )
-    if since:
-        stmt = stmt.where(Listen.ts >= since)
-    if until:
-        stmt = stmt.where(Listen.ts < until)
     result = db.execute(stmt).scalar()
     return _ms_to_minutes(result)
 
 
-def _get_total_listens(db: Session, user_id: str, since: Optional[datetime]) -> int:
-    stmt = select(func.count()).select_from(Listen).where(Listen.user_id == user_id)
-    if since:
-        stmt = stmt.where(Listen.ts >= since)
-    return db.execute(stmt).scalar() or 0
-
-
 def _resolve_target_user(db: Session, requester: User, target_user_id: Optional[str]) -> str:
     if not target_user_id or target_user_id == requester.user_id:
         return requester.user_id
@@ -255,6 +222,17 @@ def _resolve_target_user(db: Session, requester: User, target_user_id: Optional[
     return target_user_id
 
 
+def _viewed_user(user_id: str, *args, **kwargs) -> List[str]:
+    return [user_id]
+
+
+# The endpoints read through the response cache; Wrapped and other internal
+# callers use the uncached helpers.
+_cached_top_tracks = versioned_cache("stats.top_tracks", users=_viewed_user)(_get_top_tracks)
+_cached_top_artists = versioned_cache("stats.top_artists", users=_viewed_user)(_get_top_artists)
+_cached_top_genres = versioned_cache("stats.top_genres", users=_viewed_user)(_get_top_genres)
+
+
 @router.get("/top-tracks", response_model=List[TopTrackEntry])
 def top_tracks(
     user: UserModel = Depends(get_current_user),
@@ -266,7 +244,7 @@ def top_tracks(
 ):
     uid = _resolve_target_user(db, user, target_user_id)
     since = _period_to_since(period)
-    results = _get_top_tracks(db, uid, since, _clamp_limit(limit), _clamp_offset(offset))
+    results = _cached_top_tracks(db, uid, since, _clamp_limit(limit), _clamp_offset(offset))
     log_action(
         db,
         "stats.top_tracks_viewed",
@@ -287,7 +265,7 @@ def top_artists(
 ):
     uid = _resolve_target_user(db, user, target_user_id)
     since = _period_to_since(period)
-    results = _get_top_artists(db, uid, since, _clamp_limit(limit), _clamp_offset(offset))
+    results = _cached_top_artists(db, uid, since, _clamp_limit(limit), _clamp_offset(offset))
     log_action(
         db,
         "stats.top_artists_viewed",
@@ -308,7 +286,7 @@ def top_genres(
 ):
     uid = _resolve_target_user(db, user, target_user_id)
     since = _period_to_since(period)
-    results = _get_top_genres(db, uid, since, _clamp_limit(limit), _clamp_offset(offset))
+    results = _cached_top_genres(db, uid, since, _clamp_limit(limit), _clamp_offset(offset))
     log_action(
         db,
         "stats.top_genres_viewed",
@@ -318,22 +296,50 @@ def top_genres(
     return results
 
 
-@router.get("/wrapped", response_model=WrappedResponse)
-def wrapped(
-    user: UserModel = Depends(get_current_user),
-    year: Optional[int] = None,
-    db: Session = Depends(get_db),
-):
-    current_year = datetime.now(timezone.utc).year
-    if year:
-        if year < 2000 or year > current_year + 1:
-            from fastapi import HTTPException
+def _wrapped_top_tracks(db: Session, ranked: List[Ranked]) -> List[TopTrackEntry]:
+    rows = {
+        row.track_id: row
+        for row in db.execute(
+            select(Track.track_id, Track.track_name, Album.album_name, Track.image_url)
+            .outerjoin(Album, Track.album_id == Album.album_id)
+            .where(Track.track_id.in_([track_id for track_id, _, _ in ranked]))
+        ).all()
+    }
+    return [
+        TopTrackEntry(
+            rank=i + 1,
+            track_id=track_id,
+            track_name=rows[track_id].track_name,
+            album_name=rows[track_id].album_name,
+            image_url=rows[track_id].image_url,
+            listen_count=count,
+            total_minutes=_ms_to_minutes(duration * count),
+        )
+        for i, (track_id, count, duration) in enumerate(ranked)
+    ]
 
-            raise HTTPException(status_code=400, detail=f"Year must be between 2000 and {current_year + 1}")
-        since = datetime(year, 1, 1, tzinfo=timezone.utc)
-    else:
-        year = current_year
-        since = datetime(year, 1, 1, tzinfo=timezone.utc)
+
+def _wrapped_top_artists(db: Session, ranked: List[Ranked]) -> List[TopArtistEntry]:
+    artist_ids = [artist_id for artist_id, _, _ in ranked]
+    artists = {a.artist_id: a for a in db.query(Artist).filter(Artist.artist_id.in_(artist_ids)).all()}
+    genres_by_artist = _genres_by_artist(db, artist_ids)
+    return [
+        TopArtistEntry(
+            rank=i + 1,
+            artist_id=artist_id,
+            artist_name=artists[artist_id].artist_name,
+            image_url=artists[artist_id].image_url,
+            genres=genres_by_artist.get(artist_id, []),
+            listen_count=count,
+            total_minutes=_ms_to_minutes(ms),
+        )
+        for i, (artist_id, count, ms) in enumerate(ranked)
+    ]
+
+
+def _compute_wrapped(db: Session, user_id: str, year: int) -> WrappedResponse:
+    current_year = datetime.now(timezone.utc).year
+    since = datetime(year, 1, 1, tzinfo=timezone.utc)
 
     # Spotify Wrapped typically covers Jan 1 - Oct 31.
     # For past years, scope to full year. For current year, use Oct 31 cutoff
@@ -350,47 +356,85 @@ def wrapped(
             until = None
             period_label = f"Jan 1 - {now.strftime('%b %d')}, {year}"
 
-    top_tracks = _get_top_tracks(db, user.user_id, since, WRAPPED_LIMIT, until=until)
-    top_artists = _get_top_artists(db, user.user_id, since, WRAPPED_LIMIT, until=until)
-    top_genres = _get_top_genres(db, user.user_id, since, 5, until=until)
-    total_minutes = _get_total_minutes(db, user.user_id, since, until=until)
-    total_listens = _get_total_listens(db, user.user_id, since)
-
-    unique_artists = (
-        db.execute(
-            select(func.count(func.distinct(TrackArtist.artist_id)))
-            .select_from(Listen)
-            .join(TrackArtist, Listen.track_id == TrackArtist.track_id)
-            .where(Listen.user_id == user.user_id, Listen.ts >= since, *([Listen.ts < until] if until else []))
-        ).scalar()
-        or 0
-    )
-
-    unique_tracks = (
-        db.execute(
-            select(func.count(func.distinct(Listen.track_id)))
-            .select_from(Listen)
-            .where(Listen.user_id == user.user_id, Listen.ts >= since, *([Listen.ts < until] if until else []))
-        ).scalar()
-        or 0
-    )
-
-    log_action(db, "stats.wrapped_viewed", user_id=user.user_id, details={"year": year, "total_minutes": total_minutes})
+    scan = scan_wrapped(db, user_id, since, until, WRAPPED_LIMIT)
+    top_genres = [
+        TopGenreEntry(rank=i + 1, genre=genre, listen_count=count, total_minutes=_ms_to_minutes(ms))
+        for i, (genre, count, ms) in enumerate(scan.top_genres)
+    ]
 
     return WrappedResponse(
-        top_artists=top_artists,
-        top_tracks=top_tracks,
+        top_artists=_wrapped_top_artists(db, scan.top_artists),
+        top_tracks=_wrapped_top_tracks(db, scan.top_tracks),
         top_genre=top_genres[0].genre if top_genres else None,
         top_genres=top_genres,
-        total_minutes=total_minutes,
-        total_listens=total_listens,
-        unique_artists=unique_artists,
-        unique_tracks=unique_tracks,
+        total_minutes=_ms_to_minutes(scan.total_ms),
+        total_listens=scan.total_listens,
+        unique_artists=scan.unique_artists,
+        unique_tracks=scan.unique_tracks,
         year=year,
         data_period=period_label,
     )
 
 
+def _get_wrapped(db: Session, user_id: str, year: int) -> WrappedResponse:
+    """The stored snapshot when fresh, otherwise compute and store it."""
+    payload = load_wrapped(db, user_id, year)
+    if payload is not None:
+        return WrappedResponse.model_validate_json(payload)
+    computed_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    result = _compute_wrapped(db, user_id, year)
+    store_wrapped(db, user_id, year, result.model_dump_json(), computed_at)
+    db.commit()
+    return result
+
+
+@router.get("/wrapped", response_model=WrappedResponse)
+def wrapped(
+    user: UserModel = Depends(get_current_user),
+    year: Optional[int] = None,
+    db: Session = Depends(get_db),
+):
+    current_year = datetime.now(timezone.utc).year
+    if year:
+        if year < 2000 or year > current_year + 1:
+            from fastapi import HTTPException
+
+            raise HTTPException(status_code=400, detail=f"Year must be between 2000 and {current_year + 1}")
+    else:
+        year = current_year
+
+    result = _get_wrapped(db, user.user_id, year)
+
+    log_action(
+        db, "stats.wrapped_viewed", user_id=user.user_id, details={"year": year, "total_minutes": result.total_minutes}
+    )
+    return result
+
+
+def _filter_timeline_listens(stmt, artist_id: Optional[str], track_id: Optional[str]):
+    if artist_id:
+        return stmt.join(TrackArtist, Listen.track_id == TrackArtist.track_id).where(TrackArtist.artist_id == artist_id)
+    return stmt.where(Listen.track_id == track_id)
+
+
+def _global_timeline_months(db: Session, artist_id: Optional[str], track_id: Optional[str]) -> list:
+    """``(month, listen_count)`` across all users, from the monthly rollups once they are complete."""
+    if global_months_ready(db):
+        if artist_id:
+            rollup, entity = ListenMonthArtist, ListenMonthArtist.artist_id == artist_id
+        else:
+            rollup, entity = ListenMonthTrack, ListenMonthTrack.track_id == track_id
+        return db.execute(select(rollup.month, rollup.listen_count).where(entity).order_by(rollup.month)).all()
+    month = month_key(db, Listen.ts)
+    return db.execute(
+        _filter_timeline_listens(
+            select(month, func.count()).join(User, Listen.user_id == User.user_id), artist_id, track_id
+        )
+        .group_by(month)
+        .order_by(month)
+    ).all()
+
+
 @router.get("/timeline")
 def timeline(
     artist_id: str = Query(None),
@@ -423,73 +467,73 @@ def timeline(
     else:
         user_ids = [user.user_id]
 
-    stmt = select(
-        Listen.user_id,
-        User.user_name,
-        Listen.ts,
-    ).join(User, Listen.user_id == User.user_id)
-    if user_ids is not None:
-        stmt = stmt.where(Listen.user_id.in_(user_ids))
-    if artist_id:
-        stmt = stmt.join(TrackArtist, Listen.track_id == TrackArtist.track_id).where(TrackArtist.artist_id == artist_id)
-    elif track_id:
-        stmt = stmt.where(Listen.track_id == track_id)
-
-    stmt = stmt.order_by(Listen.ts)
-
-    rows = db.execute(stmt).all()
-
-    from collections import defaultdict
-
+    total_friends_with_data = None
+    all_friend_data = None
     if mode == "global":
-        global_months: dict[str, int] = defaultdict(int)
-        for row in rows:
-            ts = row.ts if isinstance(row.ts, datetime) else datetime.fromisoformat(str(row.ts))
-            global_months[ts.strftime("%Y-%m")] += 1
         data = {
             "_global": {
                 "user_id": "_global",
                 "user_name": "All Users",
-                "months": [{"month": m, "listen_count": c} for m, c in sorted(global_months.items())],
+                "months": [
+                    {"month": m, "listen_count": c} for m, c in _global_timeline_months(db, artist_id, track_id)
+                ],
             }
         }
     else:
-        counts: dict = {}
-        for row in rows:
-            uid = row.user_id
-            if uid not in counts:
-                counts[uid] = {"user_name": row.user_name, "months": defaultdict(int)}
-            ts = row.ts if isinstance(row.ts, datetime) else datetime.fromisoformat(str(row.ts))
-            month_key = ts.strftime("%Y-%m")
-            counts[uid]["months"][month_key] += 1
-
-        data = {}
-        for uid, info in counts.items():
-            total_listens = sum(info["months"].values())
-            data[uid] = {
-                "user_id": uid,
-                "user_name": info["user_name"],
-                "total_listens": total_listens,
-                "months": [{"month": m, "listen_count": c} for m, c in sorted(info["months"].items())],
-            }
+        # In friends mode, cap to current user + top 5 friends by listen count
+        capped = mode == "friends" and not friend_ids
+        total = func.count()
+        first_listen = func.min(Listen.ts)
+        totals_stmt = _filter_timeline_listens(
+            select(Listen.user_id, User.user_name, total.label("total_listens"))
+            .join(User, Listen.user_id == User.user_id)
+            .where(Listen.user_id.in_(user_ids)),
+            artist_id,
+            track_id,
+        ).group_by(Listen.user_id, User.user_name)
+        if capped:
+            totals_stmt = totals_stmt.order_by(total.desc(), first_listen, Listen.user_id)
+        else:
+            totals_stmt = totals_stmt.order_by(first_listen, Listen.user_id)
+        totals = db.execute(totals_stmt).all()
+
+        if capped:
+            friend_totals = [row for row in totals if row.user_id != user.user_id]
+            shown = [row for row in totals if row.user_id == user.user_id] + friend_totals[:5]
+            total_friends_with_data = len(friend_totals)
+            all_friend_data = [
+                {"user_id": row.user_id, "user_name": row.user_name, "total_listens": row.total_listens}
+                for row in friend_totals
+            ]
+        else:
+            shown = totals
+
+        months: dict = {row.user_id: [] for row in shown}
+        if shown:
+            month = month_key(db, Listen.ts)
+            month_rows = db.execute(
+                _filter_timeline_listens(
+                    select(Listen.user_id, month.label("month"), func.count().label("listen_count")).where(
+                        Listen.user_id.in_(list(months))
+                    ),
+                    artist_id,
+                    track_id,
+                )
+                .group_by(Listen.user_id, month)
+                .order_by(Listen.user_id, month)
+            ).all()
+            for row in month_rows:
+                months[row.user_id].append({"month": row.month, "listen_count": row.listen_count})
 
-    # In friends mode, cap to current user + top 5 friends by listen count
-    total_friends_with_data = None
-    all_friend_data = None
-    if mode == "friends" and not friend_ids:
-        current_user_data = data.pop(user.user_id, None)
-        friend_entries = sorted(data.values(), key=lambda x: x.get("total_listens", 0), reverse=True)
-        total_friends_with_data = len(friend_entries)
-        top_friends = friend_entries[:5]
-        all_friend_data = [
-            {"user_id": f["user_id"], "user_name": f["user_name"], "total_listens": f.get("total_listens", 0)}
-            for f in friend_entries
-        ]
-        data = {}
-        if current_user_data:
-            data[user.user_id] = current_user_data
-        for f in top_friends:
-            data[f["user_id"]] = f
+        data = {
+            row.user_id: {
+                "user_id": row.user_id,
+                "user_name": row.user_name,
+                "total_listens": row.total_listens,
+                "months": months[row.user_id],
+            }
+            for row in shown
+        }
 
     log_action(
         db,
@@ -0,0 +1,158 @@
+"""Artist genre/image lookups served from the dimension tables.
+
+``SpotifyService._enrich_with_genres`` needs genres and images for every artist
+on every recently-played page, and used to fetch all of them from Spotify's
+``/artists`` endpoint for every user on every poll. ``ArtistMetadataCache``
+answers from ``dim_all_artists``/``artist_to_genre`` instead, and only sends
+artists to Spotify that are:
+
+- unknown, or stored without a full fetch (``metadata_refreshed_at`` is NULL);
+  these are always fetched, since there is nothing useful to serve, or
+- stale (refreshed more than ``settings.artist_metadata_ttl_hours`` ago), while
+  the per-cycle ``refresh_budget`` lasts. Past the budget, stale artists are
+  served from the database and picked up by a later cycle.
+
+Fetched artists are written back through ``DimensionWriter`` with a fresh
+timestamp. One cache instance is meant to live for one poll or enrichment
+cycle; it also memoises lookups so later users in the cycle skip the query.
+Concurrent poll workers share one cycle through ``for_session``.
+"""
+
+import math
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import Artist, ArtistGenre
+from app.services.dimensions import DimensionWriter
+
+ARTISTS_PER_REQUEST = 50
+
+
+class _CycleState:
+    """Memo, budget and counters shared by every session view of one cycle."""
+
+    def __init__(self, refresh_budget: int) -> None:
+        self.lock = threading.Lock()
+        self.memo: Dict[str, dict] = {}
+        self.refresh_budget = refresh_budget
+        self.requested = 0
+        self.fetched = 0
+        self.api_calls = 0
+        self.api_calls_saved = 0
+
+
+class ArtistMetadataCache:
+    def __init__(
+        self,
+        db: Session,
+        refresh_budget: Optional[int] = None,
+        _state: Optional[_CycleState] = None,
+    ) -> None:
+        self.db = db
+        self._state = _state or _CycleState(
+            settings.artist_refresh_budget if refresh_budget is None else refresh_budget
+        )
+
+    def for_session(self, db: Session) -> "ArtistMetadataCache":
+        """This cycle's cache bound to another session (e.g. a poll worker's)."""
+        return ArtistMetadataCache(db, _state=self._state)
+
+    @property
+    def refresh_budget(self) -> int:
+        return self._state.refresh_budget
+
+    @property
+    def api_calls(self) -> int:
+        return self._state.api_calls
+
+    @property
+    def api_calls_saved(self) -> int:
+        return self._state.api_calls_saved
+
+    def lookup(self, artist_ids: Iterable[str]) -> Tuple[Dict[str, dict], List[str]]:
+        """Split ``artist_ids`` into cached metadata and ids to fetch from Spotify.
+
+        Cached metadata is ``{artist_id: {"genres": [...], "images": [...]}}``.
+        """
+        state = self._state
+        ids = sorted(set(artist_ids))
+        with state.lock:
+            cached = {aid: state.memo[aid] for aid in ids if aid in state.memo}
+        unseen = [aid for aid in ids if aid not in cached]
+        to_fetch: List[str] = []
+        if unseen:
+            stale_before = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(
+                hours=settings.artist_metadata_ttl_hours
+            )
+            rows = {
+                row.artist_id: row
+                for row in self.db.execute(
+                    select(Artist.artist_id, Artist.image_url, Artist.metadata_refreshed_at)
+                    .where(Artist.artist_id.in_(unseen))
+                ).all()
+            }
+            servable: List[str] = []
+            with state.lock:
+                for aid in unseen:
+                    row = rows.get(aid)
+                    if row is None or row.metadata_refreshed_at is None:
+                        to_fetch.append(aid)
+                    elif row.metadata_refreshed_at < stale_before and state.refresh_budget > 0:
+                        state.refresh_budget -= 1
+                        to_fetch.append(aid)
+                    else:
+                        servable.append(aid)
+
+            if servable:
+                genres: Dict[str, List[str]] = {aid: [] for aid in servable}
+                for artist_id, genre in self.db.execute(
+                    select(ArtistGenre.artist_id, ArtistGenre.genre)
+                    .where(ArtistGenre.artist_id.in_(servable))
+                    .order_by(ArtistGenre.artist_id, ArtistGenre.genre)
+                ).all():
+                    genres[artist_id].append(genre)
+                served = {}
+                for aid in servable:
+                    image_url = rows[aid].image_url
+                    served[aid] = {"genres": genres[aid], "images": [{"url": image_url}] if image_url else []}
+                cached.update(served)
+                with state.lock:
+                    state.memo.update(served)
+
+        calls = math.ceil(len(to_fetch) / ARTISTS_PER_REQUEST)
+        with state.lock:
+            state.requested += len(ids)
+            state.fetched += len(to_fetch)
+            state.api_calls += calls
+            state.api_calls_saved += math.ceil(len(ids) / ARTISTS_PER_REQUEST) - calls
+        return cached, to_fetch
+
+    def store(self, artists: List[dict]) -> None:
+        """Write full Spotify artist objects back with a fresh timestamp. Does not commit."""
+        now = datetime.now(timezone.utc)
+        writer = DimensionWriter(self.db)
+        fetched = {}
+        for artist in artists:
+            if writer.add_artist(artist, refreshed_at=now):
+                fetched[artist["id"]] = {
+                    "genres": artist.get("genres", []),
+                    "images": artist.get("images", []),
+                }
+        writer.flush()
+        with self._state.lock:
+            self._state.memo.update(fetched)
+
+    def stats(self) -> dict:
+        state = self._state
+        with state.lock:
+            return {
+                "artists_requested": state.requested,
+                "artists_fetched": state.fetched,
+                "api_calls": state.api_calls,
+                "api_calls_saved": state.api_calls_saved,
+            }
@@ -0,0 +1,224 @@
+"""Dirty tracking for cached award snapshots.
+
+Cached awards are computed per friend group: a user plus their friends, keyed
+by ``get_friend_group_hash``. A group's awards only change when a member gains
+listens or the membership changes, so rather than recomputing every group on
+every run:
+
+- ingestion calls ``mark_listeners_dirty`` for users that gained listens,
+  which marks their own group and each friend's group (they are in both);
+- accepting a friendship calls ``mark_groups_dirty`` for both users, whose
+  groups just changed membership;
+- ``compute_award_snapshots`` runs every ``award_snapshot_tick_seconds`` and
+  recomputes the oldest dirty groups, sized by ``dirty_batch_size`` so the
+  backlog is worked through once per ``award_snapshot_interval_seconds``.
+
+Groups are tracked by owner user id, since a group's hash changes with its
+membership. A repeated mark keeps the first ``dirty_since`` and bumps
+``marked_at``; ``clear_dirty_groups`` only clears marks that didn't move while
+the group was being computed. Streaks and monthly spikes also move with the
+calendar, so ``mark_stale_groups`` re-marks groups whose snapshots are older
+than ``award_snapshot_max_age_hours``.
+
+Snapshots are unique per ``(friend_group_hash, award_id, user_id)``.
+``replace_group_snapshots`` swaps a group's rows for freshly computed ones in
+one delete plus one bulk insert, and ``prune_orphaned_snapshots`` drops rows
+for hashes that no longer belong to any live group (membership changed).
+"""
+
+import math
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Set, Tuple
+
+from sqlalchemy import DateTime, bindparam, delete, func, insert, literal, select, tuple_, union
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import AwardDirtyGroup, AwardSnapshot, Friendship, User
+from app.services.awards import get_friend_group_hash
+from app.services.dimensions import dialect_insert
+
+# Marks (or group hashes) bound per clearing DELETE.
+CLEAR_CHUNK_SIZE = 500
+
+
+def mark_groups_dirty(db: Session, owner_ids: Iterable[str]) -> None:
+    """Mark the groups owned by ``owner_ids`` for recomputation. Does not commit."""
+    owner_ids = sorted(set(owner_ids))
+    if not owner_ids:
+        return
+    now = datetime.now(timezone.utc)
+    table = AwardDirtyGroup.__table__
+    stmt = dialect_insert(db, table).values(
+        [{"owner_user_id": owner, "dirty_since": now, "marked_at": now} for owner in owner_ids]
+    )
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["owner_user_id"],
+            set_={"marked_at": stmt.excluded.marked_at},
+        )
+    )
+
+
+def mark_listeners_dirty(db: Session, user_ids: Iterable[str]) -> None:
+    """Mark every group containing ``user_ids``: their own and their friends'.
+
+    One ``INSERT ... SELECT`` over ``friendships``. Does not commit.
+    """
+    user_ids = sorted(set(user_ids))
+    if not user_ids:
+        return
+    now = literal(datetime.now(timezone.utc), DateTime)
+    owners = union(
+        select(User.user_id, now, now).where(User.user_id.in_(bindparam("listeners", user_ids, expanding=True))),
+        select(Friendship.user_id_2, now, now).where(
+            Friendship.user_id_1.in_(bindparam("friends_of", user_ids, expanding=True))
+        ),
+    )
+    table = AwardDirtyGroup.__table__
+    stmt = dialect_insert(db, table).from_select(["owner_user_id", "dirty_since", "marked_at"], owners)
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["owner_user_id"],
+            set_={"marked_at": stmt.excluded.marked_at},
+        )
+    )
+
+
+def load_friend_graph(db: Session) -> Dict[str, List[str]]:
+    """``{user_id: [friend_id, ...]}`` for every user with friends, in one query."""
+    graph: Dict[str, List[str]] = {}
+    for user_id, friend_id in db.execute(select(Friendship.user_id_1, Friendship.user_id_2)).all():
+        graph.setdefault(user_id, []).append(friend_id)
+    return graph
+
+
+def group_members(owner_id: str, graph: Dict[str, List[str]]) -> List[str]:
+    return sorted(set([owner_id] + graph.get(owner_id, [])))
+
+
+def mark_stale_groups(db: Session, graph: Dict[str, List[str]]) -> int:
+    """Mark groups with no snapshots, or none newer than the max age. Does not commit."""
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(
+        hours=settings.award_snapshot_max_age_hours
+    )
+    latest = dict(
+        db.execute(
+            select(AwardSnapshot.friend_group_hash, func.max(AwardSnapshot.computed_at))
+            .group_by(AwardSnapshot.friend_group_hash)
+        ).all()
+    )
+    stale = []
+    for owner in graph:
+        computed_at = latest.get(get_friend_group_hash(group_members(owner, graph)))
+        if computed_at is None or computed_at.replace(tzinfo=None) < cutoff:
+            stale.append(owner)
+    mark_groups_dirty(db, stale)
+    return len(stale)
+
+
+def dirty_group_count(db: Session) -> int:
+    return db.execute(select(func.count()).select_from(AwardDirtyGroup)).scalar() or 0
+
+
+def dirty_batch_size(pending: int) -> int:
+    """Groups per run so ``pending`` is spread evenly across one interval."""
+    if pending <= 0:
+        return 0
+    runs = max(1, settings.award_snapshot_interval_seconds // max(1, settings.award_snapshot_tick_seconds))
+    return math.ceil(pending / runs)
+
+
+def claim_dirty_groups(db: Session, limit: int) -> List[Tuple[str, datetime]]:
+    """The ``limit`` longest-dirty groups as ``(owner_id, marked_at)``."""
+    if limit <= 0:
+        return []
+    return [
+        (row.owner_user_id, row.marked_at)
+        for row in db.execute(
+            select(AwardDirtyGroup.owner_user_id, AwardDirtyGroup.marked_at)
+            .order_by(AwardDirtyGroup.dirty_since, AwardDirtyGroup.owner_user_id)
+            .limit(limit)
+        ).all()
+    ]
+
+
+def clear_dirty_groups(db: Session, claimed: List[Tuple[str, datetime]]) -> None:
+    """Clear computed marks, keeping any re-marked since they were claimed. Does not commit."""
+    for i in range(0, len(claimed), CLEAR_CHUNK_SIZE):
+        chunk = claimed[i : i + CLEAR_CHUNK_SIZE]
+        db.execute(
+            delete(AwardDirtyGroup)
+            .where(tuple_(AwardDirtyGroup.owner_user_id, AwardDirtyGroup.marked_at).in_(chunk))
+            .execution_options(synchronize_session=False)
+        )
+
+
+def live_group_hashes(graph: Dict[str, List[str]]) -> Set[str]:
+    """Hashes of every group that gets cached awards (two or more members)."""
+    hashes = set()
+    for owner in graph:
+        members = group_members(owner, graph)
+        if len(members) >= 2:
+            hashes.add(get_friend_group_hash(members))
+    return hashes
+
+
+def replace_group_snapshots(
+    db: Session, group_hash: str, results: Dict[str, List[dict]], computed_at: datetime
+) -> int:
+    """Replace the group's snapshots for each award in ``results``.
+
+    Awards missing from ``results`` (say, their computation failed) keep their
+    previous rows. Does not commit; the caller commits once per group.
+    """
+    if not results:
+        return 0
+    rows = []
+    seen = set()
+    for award_id, entries in results.items():
+        for entry in entries:
+            key = (award_id, entry["user_id"])
+            if key in seen:
+                continue
+            seen.add(key)
+            rows.append(
+                {
+                    "user_id": entry["user_id"],
+                    "friend_group_hash": group_hash,
+                    "award_id": award_id,
+                    "rank": entry["rank"],
+                    "stat_value": entry.get("stat_value"),
+                    "stat_detail": entry.get("stat_detail"),
+                    "entity_id": entry.get("entity_id"),
+                    "entity_name": entry.get("entity_name"),
+                    "computed_at": computed_at,
+                }
+            )
+    db.execute(
+        delete(AwardSnapshot)
+        .where(
+            AwardSnapshot.friend_group_hash == group_hash,
+            AwardSnapshot.award_id.in_(sorted(results)),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if rows:
+        db.execute(insert(AwardSnapshot.__table__), rows)
+    return len(rows)
+
+
+def prune_orphaned_snapshots(db: Session, graph: Dict[str, List[str]]) -> int:
+    """Delete snapshots whose group no longer exists. Does not commit.
+
+    Returns the number of orphaned group hashes removed.
+    """
+    stored = set(db.execute(select(AwardSnapshot.friend_group_hash).distinct()).scalars())
+    orphaned = sorted(stored - live_group_hashes(graph))
+    for i in range(0, len(orphaned), CLEAR_CHUNK_SIZE):
+        db.execute(
+            delete(AwardSnapshot)
+            .where(AwardSnapshot.friend_group_hash.in_(orphaned[i : i + CLEAR_CHUNK_SIZE]))
+            .execution_options(synchronize_session=False)
+        )
+    return len(orphaned)
@@ -0,0 +1,159 @@
+"""Process-wide cache of dimension rows already known to be in the database.
+
+Popular albums/artists/genres are re-upserted on nearly every poll even though
+nothing about them changed. ``DimensionWriter`` consults this cache before a
+flush and drops rows whose ``(table, primary key)`` is cached with the same
+content fingerprint, so an unchanged row costs no write at all.
+
+Entries are staged on the session during a flush and only promoted into the
+cache when that session commits (discarded on rollback), so a failed
+transaction can never make the cache claim a row exists.
+
+The in-memory LRU is bounded by ``settings.dimension_cache_size``. Setting
+``DIMENSION_CACHE_REDIS_ENABLED`` adds a shared Redis layer consulted (one
+MGET per flush) on local misses, so the web process and the Celery workers
+warm each other's caches. Redis is best-effort: any failure falls back to the
+local LRU.
+"""
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.config import settings
+
+logger = logging.getLogger("gatekeepify.dimension_cache")
+
+REDIS_KEY_PREFIX = "dimcache:"
+REDIS_TTL_SECONDS = 86400
+_PENDING_INFO_KEY = "dimension_cache_pending"
+
+
+def fingerprint(row: dict) -> str:
+    return hashlib.blake2b(repr(sorted(row.items())).encode(), digest_size=8).hexdigest()
+
+
+class KnownDimensionCache:
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis = None
+        self._redis_checked = False
+        self.hits = 0
+        self.misses = 0
+
+    def _get_redis(self):
+        if not settings.dimension_cache_redis_enabled:
+            return None
+        if not self._redis_checked:
+            self._redis_checked = True
+            try:
+                from redis import Redis
+
+                self._redis = Redis.from_url(settings.redis_url, socket_timeout=1)
+            except Exception as e:
+                logger.warning(f"Dimension cache running without Redis: {e}")
+        return self._redis
+
+    def lookup(self, keys: Iterable[str]) -> Dict[str, str]:
+        """Return ``{key: fingerprint}`` for the keys the cache knows about."""
+        keys = list(keys)
+        found: Dict[str, str] = {}
+        missing: List[str] = []
+        with self._lock:
+            for key in keys:
+                fp = self._entries.get(key)
+                if fp is None:
+                    missing.append(key)
+                else:
+                    self._entries.move_to_end(key)
+                    found[key] = fp
+
+        redis = self._get_redis() if missing else None
+        if redis is not None:
+            try:
+                values = redis.mget([REDIS_KEY_PREFIX + k for k in missing])
+                remote = {k: v.decode() for k, v in zip(missing, values) if v is not None}
+                if remote:
+                    self._store(remote.items())
+                    found.update(remote)
+            except Exception as e:
+                logger.warning(f"Dimension cache Redis lookup failed: {e}")
+        return found
+
+    def record_lookup(self, hits: int, misses: int) -> None:
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def add_many(self, entries: Iterable[Tuple[str, str]]) -> None:
+        entries = list(entries)
+        if not entries:
+            return
+        self._store(entries)
+        redis = self._get_redis()
+        if redis is not None:
+            try:
+                pipe = redis.pipeline(transaction=False)
+                for key, fp in entries:
+                    pipe.set(REDIS_KEY_PREFIX + key, fp, ex=REDIS_TTL_SECONDS)
+                pipe.execute()
+            except Exception as e:
+                logger.warning(f"Dimension cache Redis write failed: {e}")
+
+    def _store(self, entries: Iterable[Tuple[str, str]]) -> None:
+        with self._lock:
+            for key, fp in entries:
+                self._entries[key] = fp
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else None,
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+known_dimensions = KnownDimensionCache(settings.dimension_cache_size)
+
+
+def reset_dimension_cache() -> None:
+    """Test helper: clear all cached dimension keys and counters."""
+    known_dimensions.reset()
+
+
+def stage_for_commit(db: Session, entries: List[Tuple[str, str]]) -> None:
+    """Remember ``entries`` until ``db`` commits (dropped if it rolls back)."""
+    if entries:
+        db.info.setdefault(_PENDING_INFO_KEY, []).extend(entries)
+
+
+@event.listens_for(Session, "after_commit")
+def _promote_pending(session: Session) -> None:
+    entries = session.info.pop(_PENDING_INFO_KEY, None)
+    if entries:
+        known_dimensions.add_many(entries)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session: Session) -> None:
+    session.info.pop(_PENDING_INFO_KEY, None)
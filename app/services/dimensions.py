@@ -0,0 +1,334 @@
+"""Bulk writes for the Spotify dimension tables.
+
+Albums, tracks, artists, ``track_to_artist`` and ``artist_to_genre`` used to be
+written with one ``db.merge`` per row, and every merge issues a hidden SELECT.
+``DimensionWriter`` instead buffers rows built from Spotify payloads (deduped by
+primary key) and ``flush`` writes each table with a multi-row
+``INSERT ... ON CONFLICT``, so a batch costs a handful of statements no matter
+how many rows it touches.
+
+Rows that ``app.services.dimension_cache`` already knows are stored with the
+same content are dropped before the flush, so re-ingesting a popular artist is
+usually free.
+
+Metadata columns listed in ``KEEP_ON_NULL`` are only overwritten when the
+incoming value is non-null. Payloads that omit a field (e.g. artists from a
+recently-played page carry no images) therefore never erase what an earlier
+enrichment stored.
+
+Tracks that gain an artist (typically backfill stubs getting their metadata)
+or change duration, and the tracks of artists that gain a genre, have the
+artist and genre days they were played on re-derived in
+``app.services.listen_rollups``. Tracks whose ``SHOWN`` metadata changes
+(directly, or through their album or artists) invalidate the cached responses
+and Wrapped snapshots of everyone who played them.
+"""
+
+from datetime import date, datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql as pg_dialect
+from sqlalchemy.dialects import sqlite as sqlite_dialect
+from sqlalchemy.orm import Session
+
+from app.models import Album, Artist, ArtistGenre, Track, TrackArtist
+from app.services.dimension_cache import fingerprint, known_dimensions, stage_for_commit
+
+# Rows per INSERT statement. Keeps large flushes (backfill stubs) well under
+# SQLite's bound-parameter limit.
+MAX_ROWS_PER_STATEMENT = 500
+
+KEEP_ON_NULL: Dict[type, Set[str]] = {
+    Album: {"album_name", "release_date", "image_url"},
+    Track: {"track_name", "album_id", "duration_ms", "is_local", "image_url"},
+    Artist: {"artist_name", "image_url", "metadata_refreshed_at"},
+}
+
+# Stored columns that cached responses and Wrapped snapshots show. Changes to
+# anything else (e.g. ``metadata_refreshed_at``) invalidate nothing.
+SHOWN: Dict[type, Tuple[str, ...]] = {
+    Album: ("album_name", "release_date", "image_url"),
+    Track: ("track_name", "album_id", "duration_ms", "image_url"),
+    Artist: ("artist_name", "image_url"),
+}
+
+
+def parse_release_date(date_str: Optional[str]) -> Optional[date]:
+    if not date_str:
+        return None
+    for fmt in ("%Y-%m-%d", "%Y-%m", "%Y"):
+        try:
+            return datetime.strptime(date_str, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _get_best_image(images: list) -> Optional[str]:
+    if not images:
+        return None
+    for img in images:
+        w = img.get("width") or 0
+        if 200 <= w <= 640:
+            return img["url"]
+    return images[0].get("url")
+
+
+def dialect_insert(db: Session, table):
+    """``INSERT`` construct with ``ON CONFLICT`` support for the bound dialect."""
+    if db.get_bind().dialect.name == "postgresql":
+        return pg_dialect.insert(table)
+    return sqlite_dialect.insert(table)
+
+
+def upsert_rows(db: Session, model, rows: List[dict], update: bool = False) -> int:
+    """Multi-row upsert of ``rows`` keyed on ``model``'s primary key.
+
+    With ``update=True`` the supplied non-key columns are overwritten on
+    conflict, except that ``KEEP_ON_NULL`` columns keep their stored value when
+    the new one is NULL. Otherwise conflicting rows are skipped. Returns the
+    summed driver rowcount (inserted rows for ``DO NOTHING``).
+    """
+    if not rows:
+        return 0
+    table = model.__table__
+    pk_cols = [c.name for c in table.primary_key.columns]
+    keep_on_null = KEEP_ON_NULL.get(model, set())
+    update_cols = [c for c in rows[0] if c not in pk_cols] if update else []
+
+    affected = 0
+    for i in range(0, len(rows), MAX_ROWS_PER_STATEMENT):
+        stmt = dialect_insert(db, table).values(rows[i : i + MAX_ROWS_PER_STATEMENT])
+        if update_cols:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=pk_cols,
+                set_={
+                    c: func.coalesce(stmt.excluded[c], table.c[c]) if c in keep_on_null else stmt.excluded[c]
+                    for c in update_cols
+                },
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=pk_cols)
+        affected += db.execute(stmt).rowcount or 0
+    return affected
+
+
+class DimensionWriter:
+    """Collects dimension rows from Spotify payloads and flushes them in bulk.
+
+    ``flush`` does not commit; callers own the transaction.
+    """
+
+    def __init__(self, db: Session) -> None:
+        self.db = db
+        self._albums: Dict[str, dict] = {}
+        self._tracks: Dict[str, dict] = {}
+        self._track_stubs: Dict[str, dict] = {}
+        self._artists: Dict[str, dict] = {}
+        self._track_artists: Set[Tuple[str, str]] = set()
+        self._artist_genres: Set[Tuple[str, str]] = set()
+
+    def add_track(self, track_data: dict) -> bool:
+        """Buffer a full Spotify track object with its album and artists."""
+        if not track_data or not track_data.get("id"):
+            return False
+        album_data = track_data.get("album") or {}
+        album_image = _get_best_image(album_data.get("images", []))
+
+        if album_data.get("id"):
+            self._albums[album_data["id"]] = {
+                "album_id": album_data["id"],
+                "album_name": album_data.get("name"),
+                "release_date": parse_release_date(album_data.get("release_date")),
+                "image_url": album_image,
+            }
+
+        self._tracks[track_data["id"]] = {
+            "track_id": track_data["id"],
+            "track_name": track_data.get("name"),
+            "album_id": album_data.get("id"),
+            "duration_ms": track_data.get("duration_ms"),
+            "is_local": track_data.get("is_local", False),
+            "image_url": album_image,
+        }
+
+        for artist_data in track_data.get("artists", []):
+            if self.add_artist(artist_data):
+                self._track_artists.add((track_data["id"], artist_data["id"]))
+        return True
+
+    def add_artist(self, artist_data: dict, refreshed_at: Optional[datetime] = None) -> bool:
+        """Buffer a Spotify artist object (simplified or full) and its genres.
+
+        Pass ``refreshed_at`` only for full artist objects fetched from Spotify;
+        it stamps the row as fresh for ``app.services.artist_cache``.
+        """
+        if not artist_data or not artist_data.get("id"):
+            return False
+        self._artists[artist_data["id"]] = {
+            "artist_id": artist_data["id"],
+            "artist_name": artist_data.get("name"),
+            "image_url": _get_best_image(artist_data.get("images", [])),
+            "metadata_refreshed_at": refreshed_at,
+        }
+        for genre in artist_data.get("genres", []):
+            if genre:
+                self._artist_genres.add((artist_data["id"], genre))
+        return True
+
+    def add_track_stub(self, track_id: str, track_name: Optional[str]) -> None:
+        """Buffer a placeholder track that is only inserted if it doesn't exist."""
+        self._track_stubs.setdefault(track_id, {"track_id": track_id, "track_name": track_name})
+
+    def flush(self) -> None:
+        db = self.db
+        albums = self._unknown(Album, list(self._albums.values()))
+        tracks = self._unknown(Track, list(self._tracks.values()))
+        stubs = self._unknown(
+            Track,
+            [row for tid, row in self._track_stubs.items() if tid not in self._tracks],
+            stub=True,
+        )
+        artists = self._unknown(Artist, list(self._artists.values()))
+        track_artists = self._unknown(
+            TrackArtist,
+            [{"track_id": t, "artist_id": a} for t, a in sorted(self._track_artists)],
+        )
+        artist_genres = self._unknown(
+            ArtistGenre,
+            [{"artist_id": a, "genre": g} for a, g in sorted(self._artist_genres)],
+        )
+
+        changed_albums = self._changed(Album, albums)
+        changed_tracks = self._changed(Track, tracks)
+        changed_artists = self._changed(Artist, artists)
+
+        upsert_rows(db, Album, albums, update=True)
+        upsert_rows(db, Track, tracks, update=True)
+        upsert_rows(db, Track, stubs)
+        upsert_rows(db, Artist, artists, update=True)
+        linked = self._insert_links(track_artists)
+        genred = self._insert_genres(artist_genres)
+        # Durations are summed into the artist and genre days.
+        retimed = {track_id for track_id, columns in changed_tracks.items() if "duration_ms" in columns}
+        rederive = linked | retimed | self._tracks_of_artists(genred)
+        shown = (
+            set(changed_tracks) | self._tracks_of_albums(set(changed_albums)) | self._tracks_of_artists(set(changed_artists))
+        ) - rederive
+        if rederive or shown:
+            # Imported here: listen_rollups builds its statements with
+            # dialect_insert from this module.
+            from app.services.listen_rollups import invalidate_track_listeners, refresh_track_days
+
+            if rederive:
+                refresh_track_days(db, rederive)
+            if shown:
+                invalidate_track_listeners(db, shown)
+
+        self._albums.clear()
+        self._tracks.clear()
+        self._track_stubs.clear()
+        self._artists.clear()
+        self._track_artists.clear()
+        self._artist_genres.clear()
+
+    def _insert_links(self, rows: List[dict]) -> Set[str]:
+        """Insert ``track_to_artist`` rows; returns the tracks that gained an artist."""
+        table = TrackArtist.__table__
+        linked: Set[str] = set()
+        for i in range(0, len(rows), MAX_ROWS_PER_STATEMENT):
+            stmt = (
+                dialect_insert(self.db, table)
+                .values(rows[i : i + MAX_ROWS_PER_STATEMENT])
+                .on_conflict_do_nothing(index_elements=["track_id", "artist_id"])
+                .returning(table.c.track_id)
+            )
+            linked.update(self.db.execute(stmt).scalars())
+        return linked
+
+    def _insert_genres(self, rows: List[dict]) -> Set[str]:
+        """Insert ``artist_to_genre`` rows; returns the artists that gained a genre."""
+        table = ArtistGenre.__table__
+        genred: Set[str] = set()
+        for i in range(0, len(rows), MAX_ROWS_PER_STATEMENT):
+            stmt = (
+                dialect_insert(self.db, table)
+                .values(rows[i : i + MAX_ROWS_PER_STATEMENT])
+                .on_conflict_do_nothing(index_elements=["artist_id", "genre"])
+                .returning(table.c.artist_id)
+            )
+            genred.update(self.db.execute(stmt).scalars())
+        return genred
+
+    def _tracks_of_artists(self, artist_ids: Set[str]) -> Set[str]:
+        return self._track_ids(TrackArtist.track_id, TrackArtist.artist_id, artist_ids)
+
+    def _tracks_of_albums(self, album_ids: Set[str]) -> Set[str]:
+        return self._track_ids(Track.track_id, Track.album_id, album_ids)
+
+    def _track_ids(self, track_col, key_col, keys: Set[str]) -> Set[str]:
+        ordered = sorted(keys)
+        track_ids: Set[str] = set()
+        for i in range(0, len(ordered), MAX_ROWS_PER_STATEMENT):
+            track_ids.update(
+                self.db.execute(select(track_col).where(key_col.in_(ordered[i : i + MAX_ROWS_PER_STATEMENT]))).scalars()
+            )
+        return track_ids
+
+    def _changed(self, model, rows: List[dict]) -> Dict[str, Set[str]]:
+        """``{key: columns}`` of stored ``rows`` whose ``SHOWN`` columns the upsert will change.
+
+        Read before the upsert. A NULL ``KEEP_ON_NULL`` value changes nothing,
+        and new rows are skipped: nobody has played them yet.
+        """
+        if not rows:
+            return {}
+        table = model.__table__
+        (pk,) = [c.name for c in table.primary_key.columns]
+        columns = [c for c in SHOWN[model] if c in rows[0]]
+        keep_on_null = KEEP_ON_NULL.get(model, set())
+        incoming = {row[pk]: row for row in rows}
+        ordered = sorted(incoming)
+        changed: Dict[str, Set[str]] = {}
+        for i in range(0, len(ordered), MAX_ROWS_PER_STATEMENT):
+            stored_rows = self.db.execute(
+                select(table.c[pk], *(table.c[c] for c in columns)).where(
+                    table.c[pk].in_(ordered[i : i + MAX_ROWS_PER_STATEMENT])
+                )
+            ).all()
+            for stored in stored_rows:
+                row = incoming[stored[0]]
+                diff = {
+                    c
+                    for c, old in zip(columns, stored[1:])
+                    if row[c] != old and not (row[c] is None and c in keep_on_null)
+                }
+                if diff:
+                    changed[stored[0]] = diff
+        return changed
+
+    def _unknown(self, model, rows: List[dict], stub: bool = False) -> List[dict]:
+        """Drop rows the known-dimension cache says are already stored as-is.
+
+        A stub only needs the primary key to exist, so any cached entry covers
+        it. The surviving rows are staged for the cache on commit.
+        """
+        if not rows:
+            return rows
+        table = model.__table__
+        pk_cols = [c.name for c in table.primary_key.columns]
+        keyed = [
+            (f"{table.name}:" + "|".join(str(row[c]) for c in pk_cols), fingerprint(row), row)
+            for row in rows
+        ]
+        known = known_dimensions.lookup(key for key, _, _ in keyed)
+        fresh = [
+            (key, fp, row) for key, fp, row in keyed
+            if key not in known or (not stub and known[key] != fp)
+        ]
+        known_dimensions.record_lookup(hits=len(keyed) - len(fresh), misses=len(fresh))
+        # A stub says nothing about the stored row's content, so it only marks
+        # the key as present; a later full track still differs and is written.
+        stage_for_commit(self.db, [(key, "" if stub else fp) for key, fp, _ in fresh])
+        return [row for _, _, row in fresh]
@@ -0,0 +1,248 @@
+"""Persistent priority queue of tracks that still need Spotify metadata.
+
+Finding enrichment work used to mean a ``GROUP BY`` over all of
+``dim_all_listens`` every two minutes. Instead, ingestion and backfill enqueue
+tracks that arrive without metadata into ``track_enrichment_queue`` (priority =
+listens seen), and enrichment claims the highest-priority due entries with a
+short lease:
+
+- PostgreSQL: ``SELECT ... FOR UPDATE SKIP LOCKED``, so concurrent workers
+  never claim the same rows.
+- SQLite: one atomic ``UPDATE ... WHERE track_id IN (SELECT ... LIMIT n)``
+  stamping a unique lease owner, then reading back what that owner got.
+
+Failed lookups back off exponentially and are dropped after
+``MAX_ENRICH_ATTEMPTS``. A lease that is never completed (worker crash)
+expires and the entry becomes claimable again. ``seed_enrichment_queue`` runs
+the old aggregate on the first enrichment run, to fill the queue with tracks
+that predate it, and then once a day as a safety net for anything that
+bypassed the enqueue paths.
+"""
+
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from app.models import Listen, Track, TrackEnrichmentQueue
+from app.services.dimensions import dialect_insert
+
+MAX_ENRICH_ATTEMPTS = 5
+LEASE_SECONDS = 600
+BACKOFF_BASE_SECONDS = 300
+BACKOFF_MAX_SECONDS = 86400
+
+
+def _due_clause(now: datetime):
+    return (
+        (TrackEnrichmentQueue.next_attempt_at <= now)
+        & or_(
+            TrackEnrichmentQueue.lease_expires_at.is_(None),
+            TrackEnrichmentQueue.lease_expires_at < now,
+        )
+    )
+
+
+def enqueue_tracks(db: Session, priorities: Dict[str, int]) -> None:
+    """Add tracks to the queue, or raise the priority of queued ones.
+
+    Does not commit; callers own the transaction.
+    """
+    if not priorities:
+        return
+    now = datetime.now(timezone.utc)
+    table = TrackEnrichmentQueue.__table__
+    stmt = dialect_insert(db, table).values(
+        [
+            {
+                "track_id": track_id,
+                "priority": count,
+                "attempts": 0,
+                "next_attempt_at": now,
+                "enqueued_at": now,
+            }
+            for track_id, count in sorted(priorities.items())
+        ]
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["track_id"],
+        set_={"priority": table.c.priority + stmt.excluded.priority},
+    )
+    db.execute(stmt)
+
+
+def enqueue_tracks_missing_metadata(db: Session, track_counts: Dict[str, int]) -> int:
+    """Enqueue the subset of ``track_counts`` whose track rows lack metadata."""
+    if not track_counts:
+        return 0
+    missing = db.execute(
+        select(Track.track_id).where(
+            Track.track_id.in_(list(track_counts)),
+            (Track.duration_ms.is_(None)) | (Track.album_id.is_(None)),
+            func.coalesce(Track.enrich_attempts, 0) < MAX_ENRICH_ATTEMPTS,
+        )
+    ).scalars().all()
+    enqueue_tracks(db, {tid: track_counts[tid] for tid in missing})
+    return len(missing)
+
+
+def missing_metadata_counts(db: Session, limit: Optional[int] = None) -> List[Tuple[str, int]]:
+    """``(track_id, listen_count)`` for tracks missing metadata, most-listened first.
+
+    This is the full fact-table aggregation the queue exists to avoid; only the
+    daily reconcile should call it.
+    """
+    stmt = (
+        select(Listen.track_id, func.count().label("cnt"))
+        .join(Track, Listen.track_id == Track.track_id)
+        .where(
+            ((Track.duration_ms.is_(None)) | (Track.album_id.is_(None)))
+            & (func.coalesce(Track.enrich_attempts, 0) < MAX_ENRICH_ATTEMPTS)
+        )
+        .group_by(Listen.track_id)
+        .order_by(func.count().desc())
+    )
+    if limit:
+        stmt = stmt.limit(limit)
+    return [(row.track_id, row.cnt) for row in db.execute(stmt).all()]
+
+
+def seed_enrichment_queue(db: Session) -> int:
+    """Enqueue every track missing metadata that isn't queued yet. Commits."""
+    counts = dict(missing_metadata_counts(db))
+    if counts:
+        queued = set(
+            db.execute(
+                select(TrackEnrichmentQueue.track_id).where(TrackEnrichmentQueue.track_id.in_(list(counts)))
+            ).scalars()
+        )
+        counts = {tid: cnt for tid, cnt in counts.items() if tid not in queued}
+        enqueue_tracks(db, counts)
+    db.commit()
+    return len(counts)
+
+
+def claim_enrichment_batch(db: Session, owner: str, limit: int) -> List[str]:
+    """Lease up to ``limit`` due track ids, highest priority first. Commits."""
+    now = datetime.now(timezone.utc)
+    lease_owner = f"{owner}:{uuid.uuid4().hex[:12]}"
+    lease_values = {
+        "lease_owner": lease_owner,
+        "lease_expires_at": now + timedelta(seconds=LEASE_SECONDS),
+    }
+    candidates = (
+        select(TrackEnrichmentQueue.track_id)
+        .where(_due_clause(now))
+        .order_by(TrackEnrichmentQueue.priority.desc(), TrackEnrichmentQueue.track_id)
+        .limit(limit)
+    )
+
+    if db.get_bind().dialect.name == "postgresql":
+        track_ids = list(db.execute(candidates.with_for_update(skip_locked=True)).scalars())
+        if track_ids:
+            db.execute(
+                update(TrackEnrichmentQueue)
+                .where(TrackEnrichmentQueue.track_id.in_(track_ids))
+                .values(**lease_values)
+            )
+    else:
+        db.execute(
+            update(TrackEnrichmentQueue)
+            .where(TrackEnrichmentQueue.track_id.in_(candidates.scalar_subquery()))
+            .values(**lease_values)
+            .execution_options(synchronize_session=False)
+        )
+        track_ids = list(
+            db.execute(
+                select(TrackEnrichmentQueue.track_id)
+                .where(TrackEnrichmentQueue.lease_owner == lease_owner)
+                .order_by(TrackEnrichmentQueue.priority.desc(), TrackEnrichmentQueue.track_id)
+            ).scalars()
+        )
+    db.commit()
+    return track_ids
+
+
+def complete_enrichment(db: Session, track_ids: Iterable[str]) -> None:
+    """Drop successfully enriched tracks from the queue. Commits."""
+    track_ids = list(track_ids)
+    if track_ids:
+        db.execute(
+            delete(TrackEnrichmentQueue)
+            .where(TrackEnrichmentQueue.track_id.in_(track_ids))
+            .execution_options(synchronize_session=False)
+        )
+    db.commit()
+
+
+def release_enrichment(db: Session, track_ids: Iterable[str]) -> None:
+    """Give leased tracks back without counting an attempt (e.g. rate limited). Commits."""
+    track_ids = list(track_ids)
+    if track_ids:
+        db.execute(
+            update(TrackEnrichmentQueue)
+            .where(TrackEnrichmentQueue.track_id.in_(track_ids))
+            .values(lease_owner=None, lease_expires_at=None)
+            .execution_options(synchronize_session=False)
+        )
+    db.commit()
+
+
+def fail_enrichment(db: Session, track_ids: Iterable[str]) -> None:
+    """Count a failed lookup: back off, or drop after ``MAX_ENRICH_ATTEMPTS``. Commits.
+
+    ``dim_all_tracks.enrich_attempts`` is bumped too, since the backfill status
+    endpoint reports on it.
+    """
+    track_ids = list(track_ids)
+    if not track_ids:
+        db.commit()
+        return
+    now = datetime.now(timezone.utc)
+    db.execute(
+        update(Track)
+        .where(Track.track_id.in_(track_ids))
+        .values(enrich_attempts=func.coalesce(Track.enrich_attempts, 0) + 1)
+        .execution_options(synchronize_session=False)
+    )
+    rows = db.execute(
+        select(TrackEnrichmentQueue.track_id, TrackEnrichmentQueue.attempts)
+        .where(TrackEnrichmentQueue.track_id.in_(track_ids))
+    ).all()
+    exhausted = [r.track_id for r in rows if r.attempts + 1 >= MAX_ENRICH_ATTEMPTS]
+    if exhausted:
+        db.execute(
+            delete(TrackEnrichmentQueue)
+            .where(TrackEnrichmentQueue.track_id.in_(exhausted))
+            .execution_options(synchronize_session=False)
+        )
+    # Entries sharing an attempt count share a backoff: one UPDATE per distinct
+    # count (at most MAX_ENRICH_ATTEMPTS), not per track.
+    by_attempts: Dict[int, List[str]] = {}
+    for row in rows:
+        if row.track_id not in exhausted:
+            by_attempts.setdefault(row.attempts, []).append(row.track_id)
+    for attempts, ids in by_attempts.items():
+        backoff = min(BACKOFF_BASE_SECONDS * 2**attempts, BACKOFF_MAX_SECONDS)
+        db.execute(
+            update(TrackEnrichmentQueue)
+            .where(TrackEnrichmentQueue.track_id.in_(ids))
+            .values(
+                attempts=attempts + 1,
+                next_attempt_at=now + timedelta(seconds=backoff),
+                lease_owner=None,
+                lease_expires_at=None,
+            )
+            .execution_options(synchronize_session=False)
+        )
+    db.commit()
+
+
+def pending_enrichment_count(db: Session) -> int:
+    """Queue entries claimable right now."""
+    now = datetime.now(timezone.utc)
+    return db.execute(
+        select(func.count()).select_from(TrackEnrichmentQueue).where(_due_clause(now))
+    ).scalar() or 0
@@ -1,45 +1,53 @@
-from datetime import date, datetime
-from typing import List, Optional, Set
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set, Tuple
 
-from sqlalchemy import and_, delete, func, or_, select
+from sqlalchemy import delete, func, select
 from sqlalchemy.orm import Session
 
 from app.models import (
     Album,
-    Artist,
-    ArtistGenre,
     JobRun,
     Listen,
     ListenSource,
     Track,
-    TrackArtist,
     User,
 )
+from app.services.award_groups import mark_listeners_dirty
+from app.services.dimensions import DimensionWriter, upsert_rows
+from app.services.enrichment_queue import (
+    MAX_ENRICH_ATTEMPTS,
+    enqueue_tracks,
+    missing_metadata_counts,
+)
+from app.services.listen_rollups import refresh_listen_days, refresh_user_days
 
 CLIENT_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
 
-
-def parse_release_date(date_str: Optional[str]) -> Optional[date]:
-    if not date_str:
-        return None
-    for fmt in ("%Y-%m-%d", "%Y-%m", "%Y"):
-        try:
-            return datetime.strptime(date_str, fmt).date()
-        except ValueError:
-            continue
-    return None
+# Track ids bound per retroactive-validation DELETE.
+VALIDATE_CHUNK_SIZE = 500
 
 
 def upsert_from_recent_listens(
     db: Session, items: List[dict], user_id: str
 ) -> int:
-    inserted = 0
+    """Ingest a recently-played page with a constant number of statements.
+
+    Dimension rows go through ``DimensionWriter`` and the listens get a single
+    multi-row ``INSERT ... ON CONFLICT DO NOTHING``. Tracks whose payload lacks
+    metadata go onto the enrichment queue, and new listens mark the user's
+    award groups dirty and refresh the days they fall on in the listen
+    rollups. Returns the number of listens that were actually new.
+    """
+    writer = DimensionWriter(db)
+    listens: Dict[Tuple[datetime, str], dict] = {}
+    needs_enrichment: Dict[str, int] = {}
+
     for item in items:
         track_data = item.get("track", {})
-        if not track_data.get("id"):
+        if not writer.add_track(track_data):
             continue
-
-        _upsert_track_and_relations(db, track_data)
+        if not track_data.get("duration_ms") or not (track_data.get("album") or {}).get("id"):
+            needs_enrichment[track_data["id"]] = needs_enrichment.get(track_data["id"], 0) + 1
 
         played_at_str = item.get("played_at", "")
         try:
@@ -47,186 +55,126 @@ def upsert_from_recent_listens(
         except ValueError:
             continue
 
-        existing = db.execute(
-            select(Listen).where(
-                Listen.ts == ts,
-                Listen.user_id == user_id,
-                Listen.track_id == track_data["id"],
-            )
-        ).first()
-
-        if not existing:
-            db.add(
-                Listen(
-                    ts=ts,
-                    user_id=user_id,
-                    track_id=track_data["id"],
-                    source=ListenSource.api.value,
-                )
-            )
-            inserted += 1
-
-    db.commit()
-    return inserted
+        listens[(ts, track_data["id"])] = {
+            "ts": ts,
+            "user_id": user_id,
+            "track_id": track_data["id"],
+            "source": ListenSource.api.value,
+        }
 
+    writer.flush()
+    inserted = upsert_rows(db, Listen, list(listens.values()))
+    enqueue_tracks(db, needs_enrichment)
+    if inserted:
+        mark_listeners_dirty(db, [user_id])
+        refresh_user_days(db, user_id, {ts.date() for ts, _ in listens})
 
-def upsert_track_metadata(db: Session, track_items: List[dict]) -> int:
-    updated = 0
-    seen_albums: set = set()
-    seen_artists: set = set()
-    for item in track_items:
-        track_data = item.get("track", {})
-        if not track_data or not track_data.get("id"):
-            continue
-        try:
-            _upsert_track_and_relations(db, track_data, seen_albums, seen_artists)
-            updated += 1
-        except Exception:
-            db.rollback()
     db.commit()
-    return updated
+    return inserted
 
 
-def _get_best_image(images: list) -> Optional[str]:
-    if not images:
+def listen_cursor_ms(db: Session, user: User) -> Optional[int]:
+    """Exclusive ``after`` for the user's next recently-played request, in Unix ms.
+
+    Comes from the cursor ``advance_listen_cursor`` stored on the user row.
+    Users polled before cursors were stored fall back to ``max(ts)`` over their
+    listens once; the result is kept on the row so the aggregate doesn't repeat.
+    """
+    if user.last_listen_cursor and user.last_listen_cursor.isdigit():
+        return int(user.last_listen_cursor)
+    last_ts = user.last_listen_at
+    if last_ts is None:
+        last_ts = db.execute(
+            select(func.max(Listen.ts)).where(Listen.user_id == user.user_id)
+        ).scalar()
+        user.last_listen_at = last_ts
+    if last_ts is None:
         return None
-    for img in images:
-        w = img.get("width") or 0
-        if 200 <= w <= 640:
-            return img["url"]
-    return images[0].get("url")
+    return round(last_ts.replace(tzinfo=timezone.utc).timestamp() * 1000)
 
 
-def _upsert_track_and_relations(
-    db: Session, track_data: dict,
-    seen_albums: set = None, seen_artists: set = None,
-) -> None:
-    if seen_albums is None:
-        seen_albums = set()
-    if seen_artists is None:
-        seen_artists = set()
-
-    album_data = track_data.get("album") or {}
-
-    if album_data.get("id") and album_data["id"] not in seen_albums:
-        seen_albums.add(album_data["id"])
-        db.merge(
-            Album(
-                album_id=album_data["id"],
-                album_name=album_data.get("name"),
-                release_date=parse_release_date(album_data.get("release_date")),
-                image_url=_get_best_image(album_data.get("images", [])),
-            )
-        )
+def advance_listen_cursor(user: User, page: dict) -> None:
+    """Store a recently-played page's cursor and newest play on the user row.
 
-    db.merge(
-        Track(
-            track_id=track_data["id"],
-            track_name=track_data.get("name"),
-            album_id=album_data.get("id"),
-            duration_ms=track_data.get("duration_ms"),
-            is_local=track_data.get("is_local", False),
-            image_url=_get_best_image(
-                album_data.get("images", [])
-            ),
-        )
-    )
-
-    for artist_data in track_data.get("artists", []):
-        if not artist_data.get("id"):
+    Does not commit: set it before ``upsert_from_recent_listens`` so the cursor
+    lands in the same transaction as the listens it covers.
+    """
+    newest = None
+    for item in page.get("items") or []:
+        try:
+            ts = datetime.strptime(item.get("played_at", ""), CLIENT_DATETIME_FORMAT)
+        except ValueError:
             continue
-        if artist_data["id"] not in seen_artists:
-            seen_artists.add(artist_data["id"])
-            db.merge(
-                Artist(
-                    artist_id=artist_data["id"],
-                    artist_name=artist_data.get("name"),
-                    image_url=_get_best_image(artist_data.get("images", [])),
-                )
-            )
+        if newest is None or ts > newest:
+            newest = ts
+    if newest is not None and (user.last_listen_at is None or newest > user.last_listen_at):
+        user.last_listen_at = newest
 
-    db.flush()
+    cursor = (page.get("cursors") or {}).get("after")
+    if cursor:
+        user.last_listen_cursor = str(cursor)
+    elif newest is not None:
+        user.last_listen_cursor = str(round(newest.replace(tzinfo=timezone.utc).timestamp() * 1000))
 
-    for artist_data in track_data.get("artists", []):
-        if not artist_data.get("id"):
-            continue
-        db.merge(
-            TrackArtist(
-                track_id=track_data["id"],
-                artist_id=artist_data["id"],
-            )
-        )
-        for genre in artist_data.get("genres", []):
-            if genre:
-                db.merge(
-                    ArtistGenre(
-                        artist_id=artist_data["id"],
-                        genre=genre,
-                    )
-                )
 
-    db.flush()
+def upsert_track_metadata(db: Session, track_items: List[dict]) -> int:
+    writer = DimensionWriter(db)
+    updated = 0
+    for item in track_items:
+        if writer.add_track(item.get("track")):
+            updated += 1
+    writer.flush()
+    db.commit()
+    return updated
 
 
 def retroactively_validate_export_listens(
     db: Session, track_ids: Set[str]
 ) -> int:
+    """Delete export listens dated before their track's album release.
+
+    The release date lives on ``dim_all_albums``, so rather than building one
+    ``track_id = x AND ts < release`` clause per track, the DELETE joins back
+    through tracks and albums in a correlated ``EXISTS``. Only the candidate
+    track ids are bound, ``VALIDATE_CHUNK_SIZE`` at a time, so the statement
+    stays small however many tracks a backfill enriched. The deleted listens'
+    days are refreshed in the listen rollups.
+    """
     if not track_ids:
         return 0
 
-    stmt = (
-        select(Track.track_id, Album.release_date)
+    released_before = (
+        select(Track.track_id)
         .join(Album, Track.album_id == Album.album_id)
         .where(
-            Track.track_id.in_(list(track_ids)),
+            Track.track_id == Listen.track_id,
             Album.release_date.isnot(None),
+            Listen.ts < Album.release_date,
         )
+        .exists()
     )
-    track_release_dates: dict[str, datetime] = {}
-    for row in db.execute(stmt).all():
-        track_release_dates[row.track_id] = datetime(
-            row.release_date.year, row.release_date.month, row.release_date.day
-        )
-
-    if not track_release_dates:
-        return 0
-
-    # Single bulk DELETE for all backdated export listens across every track,
-    # instead of a per-track SELECT followed by row-by-row deletes (which was
-    # slow when a large upload invalidated many listens).
-    conditions = [
-        and_(Listen.track_id == track_id, Listen.ts < release_dt)
-        for track_id, release_dt in track_release_dates.items()
-    ]
-    result = db.execute(
-        delete(Listen)
-        .where(Listen.source == ListenSource.export.value, or_(*conditions))
-        .execution_options(synchronize_session=False)
-    )
-    removed = result.rowcount or 0
+    ordered = sorted(track_ids)
+    removed = []
+    for i in range(0, len(ordered), VALIDATE_CHUNK_SIZE):
+        removed += db.execute(
+            delete(Listen)
+            .where(
+                Listen.source == ListenSource.export.value,
+                Listen.track_id.in_(ordered[i : i + VALIDATE_CHUNK_SIZE]),
+                released_before,
+            )
+            .returning(Listen.user_id, Listen.ts)
+            .execution_options(synchronize_session=False)
+        ).all()
 
     if removed:
+        refresh_listen_days(db, removed)
         db.commit()
-    return removed
-
-
-MAX_ENRICH_ATTEMPTS = 5
+    return len(removed)
 
 
 def get_tracks_missing_metadata(db: Session, limit: int = 200) -> Set[str]:
-    stmt = (
-        select(Listen.track_id, func.count().label("cnt"))
-        .join(Track, Listen.track_id == Track.track_id)
-        .where(
-            ((Track.duration_ms.is_(None)) | (Track.album_id.is_(None)))
-            & (func.coalesce(Track.enrich_attempts, 0) < MAX_ENRICH_ATTEMPTS)
-        )
-        .group_by(Listen.track_id)
-        .order_by(func.count().desc())
-        .limit(limit)
-    )
-    rows = db.execute(stmt).all()
-    return {row.track_id for row in rows}
+    return {track_id for track_id, _ in missing_metadata_counts(db, limit=limit)}
 
 
 def get_active_users(db: Session) -> List[User]:
@@ -0,0 +1,152 @@
+"""Global monthly listen counts behind ``/stats/timeline?mode=global``.
+
+The global timeline of an artist or track used to load every matching listen
+across all users. ``listen_month_artists`` and ``listen_month_tracks`` hold
+every user's listens per ``'YYYY-MM'`` month instead, re-aggregated from the
+daily per-user rollups (``app.services.listen_rollups``) rather than from the
+raw listens:
+
+- every daily rollup refresh calls ``mark_months_dirty`` (or
+  ``mark_user_months_dirty`` for whole-user rebuilds) for the months it
+  touched;
+- ``refresh_listen_months`` runs every ``listen_month_tick_seconds`` and
+  re-aggregates up to ``listen_month_refresh_batch`` dirty months, so the
+  global view trails ingestion by at most a tick or two.
+
+As with award groups, a repeated mark bumps ``marked_at`` and
+``clear_months`` only clears marks that didn't move while the month was
+being aggregated. Daily rollups are only complete once every user's have been
+built, so ``global_months_ready`` is False until then and the timeline falls
+back to bucketing raw listens.
+
+The monthly rollups are first filled by rebuilding every user once, so global
+mode stays on the raw fallback until that rebuild has finished. Migration 017
+queues it on ``alembic upgrade``; ``reset_unseeded_rollups`` queues it at
+startup for schemas built with ``create_all``, which get the new tables empty
+while users' daily rollups are already trusted.
+
+``month_key`` is the dialect-aware ``'YYYY-MM'`` expression shared by the
+aggregation and the timeline's raw-listen queries.
+"""
+
+from datetime import date, datetime, timezone
+from typing import Iterable, List, Tuple
+
+from sqlalchemy import DateTime, and_, delete, exists, func, literal, or_, select, tuple_, update
+from sqlalchemy.orm import Session
+
+from app.models import (
+    ListenDayArtist,
+    ListenDayTrack,
+    ListenMonthArtist,
+    ListenMonthDirty,
+    ListenMonthTrack,
+    User,
+)
+from app.services.dimensions import dialect_insert
+
+
+def month_key(db: Session, column):
+    """``column`` (a timestamp or date) as a ``'YYYY-MM'`` string, computed in SQL."""
+    if db.get_bind().dialect.name == "postgresql":
+        return func.to_char(func.date_trunc("month", column), "YYYY-MM")
+    return func.strftime("%Y-%m", column)
+
+
+def _month_bounds(month: str) -> Tuple[date, date]:
+    year, mon = int(month[:4]), int(month[5:7])
+    end = date(year + 1, 1, 1) if mon == 12 else date(year, mon + 1, 1)
+    return date(year, mon, 1), end
+
+
+def mark_months_dirty(db: Session, days: Iterable[date]) -> None:
+    """Mark the months of ``days`` for re-aggregation. Does not commit."""
+    months = sorted({f"{day:%Y-%m}" for day in days})
+    if not months:
+        return
+    now = datetime.now(timezone.utc)
+    table = ListenMonthDirty.__table__
+    stmt = dialect_insert(db, table).values([{"month": month, "marked_at": now} for month in months])
+    db.execute(stmt.on_conflict_do_update(index_elements=["month"], set_={"marked_at": stmt.excluded.marked_at}))
+
+
+def mark_user_months_dirty(db: Session, user_id: str) -> None:
+    """Mark every month ``user_id`` has daily rollups in, in one ``INSERT ... SELECT``. Does not commit."""
+    now = literal(datetime.now(timezone.utc), DateTime)
+    table = ListenMonthDirty.__table__
+    stmt = dialect_insert(db, table).from_select(
+        ["month", "marked_at"],
+        select(month_key(db, ListenDayTrack.day), now)
+        .where(ListenDayTrack.user_id == user_id)
+        .distinct(),
+    )
+    db.execute(stmt.on_conflict_do_update(index_elements=["month"], set_={"marked_at": stmt.excluded.marked_at}))
+
+
+def claim_months(db: Session, limit: int) -> List[Tuple[str, datetime]]:
+    """Up to ``limit`` dirty months as ``(month, marked_at)``, oldest month first."""
+    return [
+        (row.month, row.marked_at)
+        for row in db.execute(
+            select(ListenMonthDirty.month, ListenMonthDirty.marked_at).order_by(ListenMonthDirty.month).limit(limit)
+        ).all()
+    ]
+
+
+def clear_months(db: Session, claimed: List[Tuple[str, datetime]]) -> None:
+    """Clear aggregated marks, keeping any re-marked since they were claimed. Does not commit."""
+    if claimed:
+        db.execute(
+            delete(ListenMonthDirty)
+            .where(tuple_(ListenMonthDirty.month, ListenMonthDirty.marked_at).in_(claimed))
+            .execution_options(synchronize_session=False)
+        )
+
+
+def refresh_months(db: Session, months: List[str]) -> None:
+    """Re-aggregate the global monthly rollups of ``months``. Does not commit."""
+    if not months:
+        return
+    for model, day_model, key in (
+        (ListenMonthTrack, ListenDayTrack, "track_id"),
+        (ListenMonthArtist, ListenDayArtist, "artist_id"),
+    ):
+        db.execute(
+            delete(model).where(model.month.in_(months)).execution_options(synchronize_session=False)
+        )
+        in_months = or_(
+            *(and_(day_model.day >= first, day_model.day < end) for first, end in map(_month_bounds, months))
+        )
+        month = month_key(db, day_model.day)
+        entity = getattr(day_model, key)
+        stmt = dialect_insert(db, model.__table__).from_select(
+            [key, "month", "listen_count"],
+            select(entity, month, func.sum(day_model.listen_count)).where(in_months).group_by(entity, month),
+        )
+        # A concurrent refresh of the same month may have inserted the row
+        # after our DELETE; both aggregated committed daily rollups.
+        db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[key, "month"], set_={"listen_count": stmt.excluded.listen_count}
+            )
+        )
+
+
+def _has_rows(db: Session, model) -> bool:
+    return db.execute(select(literal(1)).select_from(model).limit(1)).first() is not None
+
+
+def reset_unseeded_rollups(db: Session) -> bool:
+    """Queue every user for a rollup rebuild if the monthly rollups were never filled. Does not commit.
+
+    Returns whether users were queued.
+    """
+    if _has_rows(db, ListenMonthTrack) or _has_rows(db, ListenMonthDirty) or not _has_rows(db, ListenDayTrack):
+        return False
+    db.execute(update(User).values(rollups_built_at=None).execution_options(synchronize_session=False))
+    return True
+
+
+def global_months_ready(db: Session) -> bool:
+    """Whether every user's daily rollups are built, so the monthly rollups are complete."""
+    return not db.execute(select(exists().where(User.rollups_built_at.is_(None)))).scalar()
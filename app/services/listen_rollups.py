@@ -0,0 +1,460 @@
+"""Daily per-user listen rollups behind the stats endpoints.
+
+``listen_day_tracks`` holds each user's listens per (UTC day, track);
+``listen_day_artists`` and ``listen_day_genres`` are derived from it through
+``track_to_artist`` and ``artist_to_genre``. A day's rollup rows are always
+re-aggregated from the raw listens rather than incremented, so re-ingesting a
+page, filling in ``ms_played`` or deleting listens all converge on the same
+rows:
+
+- ingestion (recently-played pages, backfill insert rounds, retroactive
+  deletes) calls ``refresh_user_days`` for the days it touched;
+- enrichment gives stub tracks their artists and durations, and artist
+  refreshes add genres, so ``DimensionWriter.flush`` calls
+  ``refresh_track_days`` for tracks that gained an artist and for the tracks
+  of artists that gained a genre, re-deriving the artist and genre days they
+  appear on (``invalidate_track_listeners`` covers metadata changes that
+  leave the rollups as they are);
+- ``rebuild_listen_rollups`` rebuilds whole users: ones never built, and ones
+  built more than ``listen_rollup_max_age_hours`` ago as a backstop.
+
+Each of these also invalidates the user's Wrapped snapshots for the years it
+touched (``app.services.wrapped_snapshots``), bumps the user's data
+version, which invalidates their cached responses
+(``app.services.response_cache``), and marks the touched months for the
+global monthly rollups (``app.services.listen_months``).
+
+Stats only trust a user's rollups once ``User.rollups_built_at`` is set. A
+``[since, until)`` window is answered from the whole days it covers plus raw
+listens for the partial days at either end (``split_window``); the
+``*_totals`` builders return both as one ``UNION ALL`` to sum over.
+"""
+
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import Date, and_, case, delete, exists, func, or_, select, true, union, union_all
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import ArtistGenre, Listen, ListenDayArtist, ListenDayGenre, ListenDayTrack, Track, TrackArtist, User
+from app.services.dimensions import dialect_insert
+from app.services.listen_months import mark_months_dirty, mark_user_months_dirty
+from app.services.response_cache import bump_data_versions
+from app.services.wrapped_snapshots import invalidate_wrapped
+
+# Day ranges OR-ed into one refresh statement.
+RANGES_PER_STATEMENT = 100
+# Track ids bound per lookup of the days an enriched track appears on.
+TRACK_CHUNK_SIZE = 500
+
+DayRange = Tuple[date, date]
+
+
+def _naive_utc(dt: Optional[datetime]) -> Optional[datetime]:
+    if dt is not None and dt.tzinfo is not None:
+        return dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def _midnight(day: date) -> datetime:
+    return datetime.combine(day, time.min)
+
+
+def day_ranges(days: Iterable[date]) -> List[DayRange]:
+    """``days`` merged into sorted ``[first, end)`` runs of consecutive days."""
+    ranges: List[List[date]] = []
+    for day in sorted(set(days)):
+        if ranges and ranges[-1][1] == day:
+            ranges[-1][1] = day + timedelta(days=1)
+        else:
+            ranges.append([day, day + timedelta(days=1)])
+    return [(first, end) for first, end in ranges]
+
+
+def _in_days(column, ranges: Optional[List[DayRange]]):
+    if ranges is None:
+        return true()
+    return or_(*(and_(column >= first, column < end) for first, end in ranges))
+
+
+def _in_ts(ranges: Optional[List[DayRange]]):
+    if ranges is None:
+        return true()
+    return or_(*(and_(Listen.ts >= _midnight(first), Listen.ts < _midnight(end)) for first, end in ranges))
+
+
+def _upsert_from(db: Session, model, columns: List[str], source) -> None:
+    table = model.__table__
+    pk_cols = [c.name for c in table.primary_key.columns]
+    stmt = dialect_insert(db, table).from_select(columns, source)
+    # A concurrent refresh of the same day may have inserted the row after
+    # our DELETE; both computed it from committed listens.
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=pk_cols,
+            set_={c: stmt.excluded[c] for c in columns if c not in pk_cols},
+        )
+    )
+
+
+def _refresh(db: Session, user_id: str, ranges: Optional[List[DayRange]], tracks: bool = True) -> None:
+    """Rebuild ``user_id``'s rollups on ``ranges`` (every day when None)."""
+    if tracks:
+        db.execute(
+            delete(ListenDayTrack)
+            .where(ListenDayTrack.user_id == user_id, _in_days(ListenDayTrack.day, ranges))
+            .execution_options(synchronize_session=False)
+        )
+        day = func.date(Listen.ts, type_=Date)
+        _upsert_from(
+            db,
+            ListenDayTrack,
+            ["user_id", "day", "track_id", "listen_count", "ms_played", "unplayed_count"],
+            select(
+                Listen.user_id,
+                day,
+                Listen.track_id,
+                func.count(),
+                func.coalesce(func.sum(Listen.ms_played), 0),
+                func.sum(case((Listen.ms_played.is_(None), 1), else_=0)),
+            )
+            .where(Listen.user_id == user_id, _in_ts(ranges))
+            .group_by(Listen.user_id, day, Listen.track_id),
+        )
+
+    tracks_t = ListenDayTrack
+    for model in (ListenDayArtist, ListenDayGenre):
+        db.execute(
+            delete(model)
+            .where(model.user_id == user_id, _in_days(model.day, ranges))
+            .execution_options(synchronize_session=False)
+        )
+    _upsert_from(
+        db,
+        ListenDayArtist,
+        ["user_id", "day", "artist_id", "listen_count", "duration_ms"],
+        select(
+            tracks_t.user_id,
+            tracks_t.day,
+            TrackArtist.artist_id,
+            func.sum(tracks_t.listen_count),
+            func.coalesce(func.sum(tracks_t.listen_count * Track.duration_ms), 0),
+        )
+        .join(TrackArtist, TrackArtist.track_id == tracks_t.track_id)
+        .join(Track, Track.track_id == tracks_t.track_id)
+        .where(tracks_t.user_id == user_id, _in_days(tracks_t.day, ranges))
+        .group_by(tracks_t.user_id, tracks_t.day, TrackArtist.artist_id),
+    )
+    # A listen counts once per genre even when several of the track's artists
+    # share it, as in the raw top-genres query.
+    track_genres = (
+        select(
+            tracks_t.user_id,
+            tracks_t.day,
+            tracks_t.track_id,
+            ArtistGenre.genre,
+            tracks_t.listen_count,
+            Track.duration_ms,
+        )
+        .join(TrackArtist, TrackArtist.track_id == tracks_t.track_id)
+        .join(ArtistGenre, ArtistGenre.artist_id == TrackArtist.artist_id)
+        .join(Track, Track.track_id == tracks_t.track_id)
+        .where(tracks_t.user_id == user_id, _in_days(tracks_t.day, ranges))
+        .distinct()
+        .subquery()
+    )
+    _upsert_from(
+        db,
+        ListenDayGenre,
+        ["user_id", "day", "genre", "listen_count", "duration_ms"],
+        select(
+            track_genres.c.user_id,
+            track_genres.c.day,
+            track_genres.c.genre,
+            func.sum(track_genres.c.listen_count),
+            func.coalesce(func.sum(track_genres.c.listen_count * track_genres.c.duration_ms), 0),
+        ).group_by(track_genres.c.user_id, track_genres.c.day, track_genres.c.genre),
+    )
+
+
+def refresh_user_days(db: Session, user_id: str, days: Iterable[date]) -> None:
+    """Re-aggregate ``user_id``'s rollups for ``days`` from the raw listens.
+
+    Call after inserting or deleting listens on those days. Does not commit.
+    """
+    days = set(days)
+    ranges = day_ranges(days)
+    for i in range(0, len(ranges), RANGES_PER_STATEMENT):
+        _refresh(db, user_id, ranges[i : i + RANGES_PER_STATEMENT])
+    invalidate_wrapped(db, user_id, {day.year for day in days})
+    bump_data_versions(db, [user_id])
+    mark_months_dirty(db, days)
+
+
+def refresh_listen_days(db: Session, listens: Iterable[Tuple[str, datetime]]) -> None:
+    """``refresh_user_days`` for each user in ``(user_id, ts)`` pairs. Does not commit."""
+    days_by_user: Dict[str, Set[date]] = {}
+    for user_id, ts in listens:
+        days_by_user.setdefault(user_id, set()).add(ts.date())
+    for user_id, days in sorted(days_by_user.items()):
+        refresh_user_days(db, user_id, days)
+
+
+def _track_days(db: Session, track_ids: Iterable[str]) -> Dict[str, Set[date]]:
+    """``{user_id: days}`` on which ``track_ids`` were played.
+
+    Read from the track rollups, plus the raw listens of users whose rollups
+    aren't built yet and may lack older days.
+    """
+    ordered = sorted(set(track_ids))
+    unbuilt = db.execute(select(exists().where(User.rollups_built_at.is_(None)))).scalar()
+    days_by_user: Dict[str, Set[date]] = {}
+    for i in range(0, len(ordered), TRACK_CHUNK_SIZE):
+        chunk = ordered[i : i + TRACK_CHUNK_SIZE]
+        stmt = select(ListenDayTrack.user_id, ListenDayTrack.day).where(ListenDayTrack.track_id.in_(chunk))
+        if unbuilt:
+            day = func.date(Listen.ts, type_=Date)
+            stmt = union(
+                stmt,
+                select(Listen.user_id, day)
+                .join(User, User.user_id == Listen.user_id)
+                .where(Listen.track_id.in_(chunk), User.rollups_built_at.is_(None)),
+            )
+        else:
+            stmt = stmt.distinct()
+        for user_id, day in db.execute(stmt).all():
+            days_by_user.setdefault(user_id, set()).add(day)
+    return days_by_user
+
+
+def refresh_track_days(db: Session, track_ids: Iterable[str]) -> None:
+    """Re-derive the artist and genre rollups of every day ``track_ids`` were played.
+
+    Call after the tracks' artists or durations, or their artists' genres,
+    changed. Does not commit.
+    """
+    days_by_user = _track_days(db, track_ids)
+    for user_id, days in sorted(days_by_user.items()):
+        ranges = day_ranges(days)
+        for j in range(0, len(ranges), RANGES_PER_STATEMENT):
+            _refresh(db, user_id, ranges[j : j + RANGES_PER_STATEMENT], tracks=False)
+        invalidate_wrapped(db, user_id, {day.year for day in days})
+    bump_data_versions(db, days_by_user)
+    mark_months_dirty(db, set().union(*days_by_user.values()))
+
+
+def invalidate_track_listeners(db: Session, track_ids: Iterable[str]) -> None:
+    """Invalidate the cached responses and Wrapped snapshots of everyone who played ``track_ids``.
+
+    Call after metadata the rollups don't hold (names, images, albums)
+    changed. Does not commit.
+    """
+    days_by_user = _track_days(db, track_ids)
+    for user_id, days in sorted(days_by_user.items()):
+        invalidate_wrapped(db, user_id, {day.year for day in days})
+    bump_data_versions(db, days_by_user)
+
+
+def rebuild_user_rollups(db: Session, user_id: str) -> None:
+    """Rebuild all of ``user_id``'s rollups and mark them trusted. Does not commit."""
+    # Months the user had rollups in before and after: either may have changed.
+    mark_user_months_dirty(db, user_id)
+    _refresh(db, user_id, None)
+    mark_user_months_dirty(db, user_id)
+    invalidate_wrapped(db, user_id)
+    bump_data_versions(db, [user_id])
+    db.execute(
+        User.__table__.update()
+        .where(User.user_id == user_id)
+        .values(rollups_built_at=datetime.now(timezone.utc))
+    )
+
+
+def users_due_for_rebuild(db: Session, limit: int) -> List[str]:
+    """Up to ``limit`` users never built or built over ``listen_rollup_max_age_hours`` ago, oldest first."""
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=settings.listen_rollup_max_age_hours)
+    return list(
+        db.execute(
+            select(User.user_id)
+            .where(or_(User.rollups_built_at.is_(None), User.rollups_built_at < cutoff))
+            .order_by(User.rollups_built_at.isnot(None), User.rollups_built_at, User.user_id)
+            .limit(limit)
+        ).scalars()
+    )
+
+
+def rollups_ready(db: Session, user_id: str) -> bool:
+    return db.execute(select(User.rollups_built_at).where(User.user_id == user_id)).scalar() is not None
+
+
+@dataclass(frozen=True)
+class WindowSplit:
+    """A ``[since, until)`` window as rollup days plus raw-listen windows.
+
+    Rollups cover ``[first_day, end_day)`` (None is unbounded) when
+    ``use_rollups``; ``raw`` holds the ``[start, end)`` timestamp windows left
+    over, at most one partial day at either end.
+    """
+
+    use_rollups: bool
+    first_day: Optional[date] = None
+    end_day: Optional[date] = None
+    raw: List[Tuple[Optional[datetime], Optional[datetime]]] = field(default_factory=list)
+
+
+def split_window(since: Optional[datetime], until: Optional[datetime], use_rollups: bool = True) -> WindowSplit:
+    since, until = _naive_utc(since), _naive_utc(until)
+    if not use_rollups:
+        return WindowSplit(use_rollups=False, raw=[(since, until)])
+
+    first_day = end_day = None
+    head = tail = None
+    if since is not None:
+        first_day = since.date()
+        if since != _midnight(first_day):
+            first_day += timedelta(days=1)
+            head = (since, _midnight(first_day))
+    if until is not None:
+        end_day = until.date()
+        if until != _midnight(end_day):
+            tail = (_midnight(end_day), until)
+
+    if first_day is not None and end_day is not None and first_day >= end_day:
+        # No whole day inside the window.
+        return WindowSplit(use_rollups=False, raw=[(since, until)])
+    return WindowSplit(
+        use_rollups=True,
+        first_day=first_day,
+        end_day=end_day,
+        raw=[w for w in (head, tail) if w is not None],
+    )
+
+
+def _in_window(ts_col, start: Optional[datetime], end: Optional[datetime]) -> list:
+    clauses = []
+    if start is not None:
+        clauses.append(ts_col >= start)
+    if end is not None:
+        clauses.append(ts_col < end)
+    return clauses
+
+
+def _rollup_where(model, user_id: str, split: WindowSplit) -> list:
+    return [model.user_id == user_id, *_in_window(model.day, split.first_day, split.end_day)]
+
+
+def _split_for(
+    db: Session, user_id: str, since: Optional[datetime], until: Optional[datetime], use_rollups: Optional[bool]
+) -> WindowSplit:
+    if use_rollups is None:
+        use_rollups = rollups_ready(db, user_id)
+    return split_window(since, until, use_rollups)
+
+
+def track_totals(
+    db: Session, user_id: str, since: Optional[datetime], until: Optional[datetime], use_rollups: Optional[bool] = None
+):
+    """Subquery of ``(track_id, listen_count, ms_played, unplayed_count)`` parts.
+
+    A track may appear once per part; sum them per ``track_id``. Passing
+    ``use_rollups=False`` forces the raw-listen path.
+    """
+    split = _split_for(db, user_id, since, until, use_rollups)
+    parts = []
+    if split.use_rollups:
+        t = ListenDayTrack
+        parts.append(
+            select(
+                t.track_id,
+                func.sum(t.listen_count).label("listen_count"),
+                func.sum(t.ms_played).label("ms_played"),
+                func.sum(t.unplayed_count).label("unplayed_count"),
+            )
+            .where(*_rollup_where(t, user_id, split))
+            .group_by(t.track_id)
+        )
+    for start, end in split.raw:
+        parts.append(
+            select(
+                Listen.track_id,
+                func.count().label("listen_count"),
+                func.coalesce(func.sum(Listen.ms_played), 0).label("ms_played"),
+                func.sum(case((Listen.ms_played.is_(None), 1), else_=0)).label("unplayed_count"),
+            )
+            .where(Listen.user_id == user_id, *_in_window(Listen.ts, start, end))
+            .group_by(Listen.track_id)
+        )
+    return union_all(*parts).subquery() if len(parts) > 1 else parts[0].subquery()
+
+
+def artist_totals(
+    db: Session, user_id: str, since: Optional[datetime], until: Optional[datetime], use_rollups: Optional[bool] = None
+):
+    """Subquery of ``(artist_id, listen_count, duration_ms)`` parts; see ``track_totals``."""
+    split = _split_for(db, user_id, since, until, use_rollups)
+    parts = []
+    if split.use_rollups:
+        a = ListenDayArtist
+        parts.append(
+            select(
+                a.artist_id,
+                func.sum(a.listen_count).label("listen_count"),
+                func.sum(a.duration_ms).label("duration_ms"),
+            )
+            .where(*_rollup_where(a, user_id, split))
+            .group_by(a.artist_id)
+        )
+    for start, end in split.raw:
+        parts.append(
+            select(
+                TrackArtist.artist_id,
+                func.count().label("listen_count"),
+                func.sum(Track.duration_ms).label("duration_ms"),
+            )
+            .select_from(Listen)
+            .join(TrackArtist, Listen.track_id == TrackArtist.track_id)
+            .join(Track, Listen.track_id == Track.track_id)
+            .where(Listen.user_id == user_id, *_in_window(Listen.ts, start, end))
+            .group_by(TrackArtist.artist_id)
+        )
+    return union_all(*parts).subquery() if len(parts) > 1 else parts[0].subquery()
+
+
+def genre_totals(
+    db: Session, user_id: str, since: Optional[datetime], until: Optional[datetime], use_rollups: Optional[bool] = None
+):
+    """Subquery of ``(genre, listen_count, duration_ms)`` parts; see ``track_totals``."""
+    split = _split_for(db, user_id, since, until, use_rollups)
+    parts = []
+    if split.use_rollups:
+        g = ListenDayGenre
+        parts.append(
+            select(
+                g.genre,
+                func.sum(g.listen_count).label("listen_count"),
+                func.sum(g.duration_ms).label("duration_ms"),
+            )
+            .where(*_rollup_where(g, user_id, split))
+            .group_by(g.genre)
+        )
+    for start, end in split.raw:
+        listen_genres = (
+            select(Listen.ts, Listen.track_id, ArtistGenre.genre, Track.duration_ms)
+            .select_from(Listen)
+            .join(TrackArtist, Listen.track_id == TrackArtist.track_id)
+            .join(ArtistGenre, TrackArtist.artist_id == ArtistGenre.artist_id)
+            .join(Track, Listen.track_id == Track.track_id)
+            .where(Listen.user_id == user_id, *_in_window(Listen.ts, start, end))
+            .distinct()
+            .subquery()
+        )
+        parts.append(
+            select(
+                listen_genres.c.genre,
+                func.count().label("listen_count"),
+                func.sum(listen_genres.c.duration_ms).label("duration_ms"),
+            ).group_by(listen_genres.c.genre)
+        )
+    return union_all(*parts).subquery() if len(parts) > 1 else parts[0].subquery()
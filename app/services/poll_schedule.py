@@ -0,0 +1,128 @@
+"""Adaptive per-user poll scheduling.
+
+Spotify's recently-played endpoint only returns the last
+``MAXIMUM_RECENT_TRACKS`` plays, so a fixed poll interval both loses plays for
+heavy listeners and wastes quota on idle users. After every successful poll,
+``schedule_next_poll`` stores a ``next_poll_at`` on the user:
+
+- Users with new plays are polled again before their buffer could fill, based
+  on their play rate over the last hour and the last day (whichever is
+  faster), at ``BUFFER_HEADROOM`` of the buffer. The interval is clamped to
+  ``[poll_min_interval_seconds, poll_interval_seconds]``.
+- A poll that came back with a full page (the buffer may have overflowed
+  since the last poll) is retried at ``poll_min_interval_seconds``.
+- Users with no new plays back off exponentially: each empty poll doubles the
+  previous interval, from ``poll_interval_seconds`` up to
+  ``poll_max_interval_seconds``.
+
+``poll_recent_listens`` runs every ``poll_tick_seconds`` and takes the due
+users straight off ``ix_users_next_poll_at`` (NULL means never scheduled, so
+due now).
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from sqlalchemy import case, func, or_, select
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import Listen, User
+from app.services.spotify import MAXIMUM_RECENT_TRACKS
+
+SHORT_RATE_WINDOW = timedelta(hours=1)
+LONG_RATE_WINDOW = timedelta(hours=24)
+# Poll when the buffer is expected to be this full.
+BUFFER_HEADROOM = 0.5
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _naive(dt: Optional[datetime]) -> Optional[datetime]:
+    return dt.replace(tzinfo=None) if dt is not None and dt.tzinfo else dt
+
+
+def next_poll_interval(
+    db: Session, user: User, new_listens: int, now: datetime, overflowed: bool = False
+) -> timedelta:
+    base = timedelta(seconds=settings.poll_interval_seconds)
+    if overflowed:
+        return timedelta(seconds=settings.poll_min_interval_seconds)
+    if new_listens == 0:
+        last_poll_at, next_poll_at = _naive(user.last_poll_at), _naive(user.next_poll_at)
+        previous = base
+        if last_poll_at and next_poll_at and next_poll_at > last_poll_at:
+            previous = next_poll_at - last_poll_at
+        return min(max(previous * 2, base), timedelta(seconds=settings.poll_max_interval_seconds))
+
+    short_count, long_count = db.execute(
+        select(
+            func.sum(case((Listen.ts >= now - SHORT_RATE_WINDOW, 1), else_=0)),
+            func.count(),
+        ).where(Listen.user_id == user.user_id, Listen.ts >= now - LONG_RATE_WINDOW)
+    ).one()
+    plays_per_second = max(
+        (short_count or 0) / SHORT_RATE_WINDOW.total_seconds(),
+        (long_count or 0) / LONG_RATE_WINDOW.total_seconds(),
+    )
+    if plays_per_second <= 0:
+        return base
+    until_full = timedelta(seconds=MAXIMUM_RECENT_TRACKS * BUFFER_HEADROOM / plays_per_second)
+    return max(min(until_full, base), timedelta(seconds=settings.poll_min_interval_seconds))
+
+
+def schedule_next_poll(
+    db: Session,
+    user: User,
+    new_listens: int,
+    now: Optional[datetime] = None,
+    overflowed: bool = False,
+) -> datetime:
+    """Set ``user.next_poll_at`` from this poll's result. Does not commit.
+
+    Call before updating ``last_poll_at``: the previous interval is what an
+    empty poll doubles.
+    """
+    now = _naive(now) or _utcnow()
+    user.next_poll_at = now + next_poll_interval(db, user, new_listens, now, overflowed)
+    return user.next_poll_at
+
+
+def defer_poll(user: User, now: Optional[datetime] = None) -> None:
+    """Push a failed user back one base interval instead of retrying every tick."""
+    now = _naive(now) or _utcnow()
+    user.next_poll_at = now + timedelta(seconds=settings.poll_interval_seconds)
+
+
+def is_poll_due(user: User, now: Optional[datetime] = None) -> bool:
+    """Whether ``user``'s poll is due; a loaded user may have been polled since."""
+    now = _naive(now) or _utcnow()
+    next_poll_at = _naive(user.next_poll_at)
+    return next_poll_at is None or next_poll_at <= now
+
+
+def _due_filter(now: datetime):
+    return (
+        User.spotify_refresh_token.isnot(None),
+        User.spotify_refresh_token != "",
+        or_(User.next_poll_at.is_(None), User.next_poll_at <= now),
+    )
+
+
+def get_due_users(db: Session, limit: int, now: Optional[datetime] = None) -> List[User]:
+    """Active users whose poll is due, most overdue (or never scheduled) first."""
+    now = _naive(now) or _utcnow()
+    return (
+        db.query(User)
+        .filter(*_due_filter(now))
+        .order_by(User.next_poll_at.asc().nulls_first())
+        .limit(limit)
+        .all()
+    )
+
+
+def count_due_users(db: Session, now: Optional[datetime] = None) -> int:
+    now = _naive(now) or _utcnow()
+    return db.query(func.count(User.user_id)).filter(*_due_filter(now)).scalar() or 0
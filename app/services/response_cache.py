@@ -0,0 +1,248 @@
+"""Versioned cache of read-endpoint computations.
+
+Stats, gatekeep, awards and discover responses only change when a user they
+cover gains or loses listens or friends, or when the tracks, albums, artists
+or genres they played change. Each user therefore carries a monotonically
+increasing ``data_version``:
+
+- every writer of that data calls ``bump_data_versions`` in its transaction
+  (listen rollup refreshes cover ingestion, backfill, retroactive deletes and
+  enrichment; ``DimensionWriter.flush`` covers metadata changes, bumping
+  everyone who played an affected track; the friends router covers new
+  friendships);
+- the bumped versions are mirrored to Redis once the transaction commits,
+  with a compare-and-set so a slow mirror never moves a version backwards;
+  if the mirror fails, the keys are deleted instead;
+- readers take the versions from Redis (one MGET) and fall back to the
+  database for users Redis doesn't know. Version keys expire after
+  ``settings.response_cache_version_ttl_seconds``, so a mirror whose write
+  and delete both failed still heals.
+
+``versioned_cache`` wraps a router helper so its result is cached under
+``(name, arguments, versions of the involved users)``. A bump changes the key,
+so entries are never served stale and need no TTL; superseded entries simply
+age out of the LRU (``settings.response_cache_size`` per process). Versions
+are read before the wrapped helper runs, so a result is never stored under a
+version newer than the data it saw.
+
+Cached results are shared between requests and must be treated as read-only.
+Redis is best-effort: any failure falls back to the database.
+"""
+
+import functools
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Iterable, List, Tuple
+
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import User
+
+logger = logging.getLogger("gatekeepify.response_cache")
+
+REDIS_KEY_PREFIX = "data_version:"
+_PENDING_INFO_KEY = "data_versions_pending"
+# Sets each KEYS[i] to ARGV[i], expiring after the last ARGV seconds, unless
+# it already holds a higher version.
+_SET_IF_GREATER = """
+local ttl = ARGV[#KEYS + 1]
+for i, key in ipairs(KEYS) do
+    local current = tonumber(redis.call('GET', key) or '-1')
+    if tonumber(ARGV[i]) > current then
+        redis.call('SET', key, ARGV[i], 'EX', ttl)
+    end
+end
+return 0
+"""
+_MISSING = object()
+
+
+def _freeze(value) -> Hashable:
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(_freeze(v) for v in value))
+    return value
+
+
+class ResponseCache:
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._entries: "OrderedDict[Hashable, object]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis = None
+        self._redis_checked = False
+        self._set_if_greater = None
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+
+    def _get_redis(self):
+        if not settings.response_cache_redis_enabled:
+            return None
+        if not self._redis_checked:
+            self._redis_checked = True
+            try:
+                from redis import Redis
+
+                self._redis = Redis.from_url(settings.redis_url, socket_timeout=1)
+                self._set_if_greater = self._redis.register_script(_SET_IF_GREATER)
+            except Exception as e:
+                logger.warning(f"Response cache running without Redis: {e}")
+        return self._redis
+
+    def publish_versions(self, versions: Dict[str, int]) -> None:
+        """Mirror committed ``{user_id: version}`` to Redis (no-op without Redis)."""
+        redis = self._get_redis() if versions else None
+        if redis is None:
+            return
+        ordered = sorted(versions.items())
+        keys = [REDIS_KEY_PREFIX + user_id for user_id, _ in ordered]
+        try:
+            self._set_if_greater(
+                keys=keys,
+                args=[version for _, version in ordered] + [settings.response_cache_version_ttl_seconds],
+            )
+        except Exception as e:
+            logger.warning(f"Response cache Redis version write failed: {e}")
+            # A kept key would hold the old version; readers fall back to the
+            # database once it's gone.
+            try:
+                redis.delete(*keys)
+            except Exception as e:
+                logger.warning(f"Response cache Redis version delete failed: {e}")
+
+    def versions(self, db: Session, user_ids: List[str]) -> Dict[str, int]:
+        """Current data version of each of ``user_ids`` (0 for unknown users)."""
+        found: Dict[str, int] = {}
+        missing = user_ids
+        redis = self._get_redis() if user_ids else None
+        if redis is not None:
+            try:
+                values = redis.mget([REDIS_KEY_PREFIX + user_id for user_id in user_ids])
+                found = {u: int(v) for u, v in zip(user_ids, values) if v is not None}
+                missing = [u for u in user_ids if u not in found]
+            except Exception as e:
+                logger.warning(f"Response cache Redis version lookup failed: {e}")
+        if missing:
+            loaded = {
+                user_id: version or 0
+                for user_id, version in db.execute(
+                    select(User.user_id, User.data_version).where(User.user_id.in_(missing))
+                ).all()
+            }
+            if redis is not None:
+                self.publish_versions(loaded)
+            found.update(loaded)
+        return {user_id: found.get(user_id, 0) for user_id in user_ids}
+
+    def get(self, name: str, key: Hashable):
+        with self._lock:
+            value = self._entries.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses[name] = self.misses.get(name, 0) + 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits[name] = self.hits.get(name, 0) + 1
+            return value
+
+    def put(self, key: Hashable, value) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = sum(self.hits.values())
+            misses = sum(self.misses.values())
+            total = hits + misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / total, 4) if total else None,
+                "endpoints": {
+                    name: {"hits": self.hits.get(name, 0), "misses": self.misses.get(name, 0)}
+                    for name in sorted(set(self.hits) | set(self.misses))
+                },
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits.clear()
+            self.misses.clear()
+
+
+responses = ResponseCache(settings.response_cache_size)
+
+
+def reset_response_cache() -> None:
+    """Test helper: clear all cached responses and counters."""
+    responses.reset()
+
+
+def bump_data_versions(db: Session, user_ids: Iterable[str]) -> None:
+    """Invalidate every cached response covering ``user_ids``. Does not commit."""
+    user_ids = sorted(set(user_ids))
+    if not user_ids:
+        return
+    rows = db.execute(
+        update(User)
+        .where(User.user_id.in_(user_ids))
+        .values(data_version=User.data_version + 1)
+        .returning(User.user_id, User.data_version)
+        .execution_options(synchronize_session=False)
+    ).all()
+    pending = db.info.setdefault(_PENDING_INFO_KEY, {})
+    for user_id, version in rows:
+        pending[user_id] = max(version, pending.get(user_id, 0))
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_pending(session: Session) -> None:
+    pending = session.info.pop(_PENDING_INFO_KEY, None)
+    if pending:
+        responses.publish_versions(pending)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session: Session) -> None:
+    session.info.pop(_PENDING_INFO_KEY, None)
+
+
+def versioned_cache(name: str, users: Callable[..., Iterable[str]]):
+    """Cache a ``fn(db, *args, **kwargs)`` helper per argument set and user versions.
+
+    ``users`` receives the helper's arguments (without ``db``) and returns the
+    ids of every user whose data the result depends on. All arguments must
+    be hashable once lists, sets and dicts are frozen into tuples.
+    """
+
+    def decorator(fn: Callable):
+        @functools.wraps(fn)
+        def wrapper(db: Session, *args, **kwargs):
+            user_ids = sorted(set(users(*args, **kwargs)))
+            versions = responses.versions(db, user_ids)
+            key: Tuple = (
+                name,
+                _freeze(args),
+                _freeze(kwargs),
+                tuple((user_id, versions[user_id]) for user_id in user_ids),
+            )
+            value = responses.get(name, key)
+            if value is _MISSING:
+                value = fn(db, *args, **kwargs)
+                responses.put(key, value)
+            return value
+
+        return wrapper
+
+    return decorator
@@ -1,15 +1,116 @@
+import threading
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional, Set, Tuple
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple
 
+import requests
 import spotipy
+import urllib3
 from spotipy.oauth2 import SpotifyOAuth
 
 from app.config import settings
+from app.services.spotify_governor import SpotifyGovernor, governor
+
+if TYPE_CHECKING:
+    from app.services.artist_cache import ArtistMetadataCache
 
 MAXIMUM_RECENT_TRACKS = 50
 MAX_TRACKS_REQUEST = 50
 
 
+def _bearer_token(headers: Optional[dict]) -> Optional[str]:
+    auth = (headers or {}).get("Authorization") or ""
+    return auth[len("Bearer "):] if auth.startswith("Bearer ") else None
+
+
+def _retry_after(response: requests.Response) -> Optional[float]:
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class _SharedSession(requests.Session):
+    """Process-wide HTTP session for every Spotify client.
+
+    Every request first clears ``governor`` (see
+    ``app.services.spotify_governor``), keyed by the request's bearer token.
+    A 429 pauses all Spotify traffic for its ``Retry-After`` and is retried
+    here, up to ``settings.spotify_http_retries`` times, once the governor
+    lets it through again.
+
+    spotipy closes its session when a client or auth manager is garbage
+    collected, which would throw away the pooled keep-alive connections after
+    every request. The pool lives as long as the process, so ``close`` is a
+    no-op.
+    """
+
+    def __init__(self, governor: SpotifyGovernor) -> None:
+        super().__init__()
+        self.governor = governor
+
+    def request(self, method, url, *args, **kwargs):
+        access_token = _bearer_token(kwargs.get("headers"))
+        attempts = max(0, settings.spotify_http_retries) + 1
+        for attempt in range(attempts):
+            self.governor.acquire(access_token)
+            response = super().request(method, url, *args, **kwargs)
+            if response.status_code != 429:
+                return response
+            self.governor.record_throttle(_retry_after(response))
+            if attempt + 1 < attempts:
+                response.close()
+        return response
+
+    def close(self) -> None:
+        pass
+
+
+_http_session: Optional[requests.Session] = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    """Shared ``requests.Session`` with a sized connection pool and retries.
+
+    Sized by ``settings.spotify_http_pool_size``. Server errors are retried
+    like spotipy's defaults (``spotify_http_retries`` attempts with
+    ``spotify_http_backoff_factor`` backoff); 429s are left to the governor.
+    """
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                retry = urllib3.Retry(
+                    total=settings.spotify_http_retries,
+                    connect=None,
+                    read=False,
+                    allowed_methods=frozenset(["GET", "POST", "PUT", "DELETE"]),
+                    status=settings.spotify_http_retries,
+                    status_forcelist=(500, 502, 503, 504),
+                    backoff_factor=settings.spotify_http_backoff_factor,
+                    respect_retry_after_header=False,
+                )
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=4,
+                    pool_maxsize=settings.spotify_http_pool_size,
+                    max_retries=retry,
+                )
+                session = _SharedSession(governor)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _http_session = session
+    return _http_session
+
+
+def reset_http_session() -> None:
+    """Test helper: drop the shared session so the next client builds a new pool."""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is not None:
+            requests.Session.close(_http_session)
+        _http_session = None
+
+
 class SpotifyService:
     def __init__(self) -> None:
         self._oauth = SpotifyOAuth(
@@ -19,6 +120,8 @@ class SpotifyService:
             scope=settings.spotify_scopes,
             cache_handler=spotipy.cache_handler.MemoryCacheHandler(),
             open_browser=False,
+            requests_session=get_http_session(),
+            requests_timeout=settings.spotify_http_timeout_seconds,
         )
 
     def get_auth_url(self) -> str:
@@ -31,7 +134,12 @@ class SpotifyService:
         return self._oauth.refresh_access_token(refresh_token)
 
     def get_client(self, access_token: str) -> spotipy.Spotify:
-        return spotipy.Spotify(auth=access_token, backoff_factor=0.3)
+        """Lightweight client carrying ``access_token``; connections come from the shared pool."""
+        return spotipy.Spotify(
+            auth=access_token,
+            requests_session=get_http_session(),
+            requests_timeout=settings.spotify_http_timeout_seconds,
+        )
 
     def get_current_user(self, access_token: str) -> dict:
         client = self.get_client(access_token)
@@ -41,22 +149,43 @@ class SpotifyService:
         return result
 
     def get_recent_listens(
-        self, access_token: str, after: Optional[datetime] = None
+        self,
+        access_token: str,
+        after: Optional[datetime] = None,
+        artist_cache: Optional["ArtistMetadataCache"] = None,
     ) -> List[dict]:
-        client = self.get_client(access_token)
-        after_ts = None
+        after_ms = None
         if after:
-            after_ts = int(after.replace(tzinfo=timezone.utc).timestamp() * 1000)
+            after_ms = round(after.replace(tzinfo=timezone.utc).timestamp() * 1000)
+        return self.get_recent_listens_page(access_token, after_ms, artist_cache)["items"]
+
+    def get_recent_listens_page(
+        self,
+        access_token: str,
+        after_ms: Optional[int] = None,
+        artist_cache: Optional["ArtistMetadataCache"] = None,
+    ) -> dict:
+        """One recently-played page as ``{"items", "cursors", "next"}``.
+
+        ``after_ms`` is exclusive, in Unix milliseconds, like Spotify's
+        ``cursors.after``.
+        """
+        client = self.get_client(access_token)
         result = client.current_user_recently_played(
-            limit=MAXIMUM_RECENT_TRACKS, after=after_ts
+            limit=MAXIMUM_RECENT_TRACKS, after=after_ms
         )
         if not result or not result.get("items"):
-            return []
+            return {"items": [], "cursors": (result or {}).get("cursors"), "next": None}
         items = result["items"]
-        self._enrich_with_genres(client, items)
-        return items
+        self._enrich_with_genres(client, items, artist_cache)
+        return {"items": items, "cursors": result.get("cursors"), "next": result.get("next")}
 
-    def get_tracks(self, access_token: str, track_ids: List[str]) -> List[dict]:
+    def get_tracks(
+        self,
+        access_token: str,
+        track_ids: List[str],
+        artist_cache: Optional["ArtistMetadataCache"] = None,
+    ) -> List[dict]:
         if not track_ids:
             return []
         client = self.get_client(access_token)
@@ -69,7 +198,7 @@ class SpotifyService:
             result = client.tracks(batch)
             if result and result.get("tracks"):
                 items = [{"track": t} for t in result["tracks"] if t]
-                self._enrich_with_genres(client, items)
+                self._enrich_with_genres(client, items, artist_cache)
                 all_tracks.extend(items)
         return all_tracks
 
@@ -85,8 +214,15 @@ class SpotifyService:
         return result["items"]
 
     def _enrich_with_genres(
-        self, client: spotipy.Spotify, track_items: List[dict]
+        self,
+        client: spotipy.Spotify,
+        track_items: List[dict],
+        artist_cache: Optional["ArtistMetadataCache"] = None,
     ) -> None:
+        """Attach ``genres``/``images`` to every artist on ``track_items``.
+
+        With an ``artist_cache``, artists it can answer for are not fetched.
+        """
         all_artist_ids: Set[str] = set()
         for item in track_items:
             track = item.get("track", {})
@@ -98,6 +234,12 @@ class SpotifyService:
         genre_map: Dict[str, list] = {}
         image_map: Dict[str, list] = {}
         artist_id_list = list(all_artist_ids)
+        if artist_cache is not None:
+            cached, artist_id_list = artist_cache.lookup(all_artist_ids)
+            for artist_id, meta in cached.items():
+                genre_map[artist_id] = meta["genres"]
+                image_map[artist_id] = meta["images"]
+        fetched: List[dict] = []
         for i in range(0, len(artist_id_list), MAX_TRACKS_REQUEST):
             batch = artist_id_list[i : i + MAX_TRACKS_REQUEST]
             artists_result = client.artists(batch)
@@ -106,6 +248,9 @@ class SpotifyService:
                     if a:
                         genre_map[a["id"]] = a.get("genres", [])
                         image_map[a["id"]] = a.get("images", [])
+                        fetched.append(a)
+        if artist_cache is not None and fetched:
+            artist_cache.store(fetched)
         for item in track_items:
             track = item.get("track", {})
             for artist in track.get("artists", []):
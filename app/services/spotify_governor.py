@@ -0,0 +1,396 @@
+"""Rate-limit governor for all Spotify API traffic.
+
+Every request through the shared Spotify HTTP session (polls, enrichment,
+search, OAuth refreshes) asks ``governor.acquire`` first. The governor
+enforces:
+
+- A token bucket for the whole app (``spotify_requests_per_second``) and one
+  per user access token (``spotify_user_requests_per_second``). Background
+  work must leave ``spotify_background_reserve`` of the app bucket untouched,
+  so search keeps headroom while enrichment runs flat out.
+- ``Retry-After`` from any 429: nobody sends until the pause is over.
+- A circuit breaker: ``spotify_breaker_threshold`` 429s within
+  ``spotify_breaker_window_seconds`` open it for
+  ``spotify_breaker_cooldown_seconds``. While it is open, background requests
+  (enrichment, backfill) fail fast with ``SpotifyThrottled``; polls and search
+  still go through, inside the buckets.
+
+Callers declare their priority with ``request_priority``; the default is
+``Priority.poll``. Interactive requests never wait longer than
+``spotify_interactive_max_wait_seconds`` and fail with ``SpotifyThrottled``
+instead of hanging on a pause.
+
+With ``SPOTIFY_GOVERNOR_REDIS_ENABLED`` the buckets, the pause and the breaker
+live in Redis and are shared by the web process and every Celery worker.
+Redis is best-effort: any failure falls back to governing this process alone.
+"""
+
+import hashlib
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Dict, Iterator, Optional, Tuple
+
+from spotipy.exceptions import SpotifyException
+
+from app.config import settings
+
+logger = logging.getLogger("gatekeepify.spotify_governor")
+
+REDIS_KEY_PREFIX = "spotify_governor:"
+DEFAULT_RETRY_AFTER_SECONDS = 5
+# Longest single sleep while waiting, so a breaker opening mid-wait is noticed.
+MAX_SLEEP_SECONDS = 1.0
+
+_ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+if ARGV[4] == '1' then
+  local breaker = tonumber(redis.call('GET', KEYS[4]) or '0')
+  if breaker > now then return {'breaker', tostring(breaker - now)} end
+end
+local pause = tonumber(redis.call('GET', KEYS[3]) or '0')
+if pause > now then return {'retry_after', tostring(pause - now)} end
+
+local function refill(key, rate)
+  if rate <= 0 then return nil, nil end
+  local cap = math.max(rate, 1)
+  local state = redis.call('HMGET', key, 'tokens', 'ts')
+  local tokens = tonumber(state[1]) or cap
+  local ts = tonumber(state[2]) or now
+  return math.min(cap, tokens + math.max(0, now - ts) * rate), cap
+end
+
+local app_rate, user_rate, reserve = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local app_tokens, app_cap = refill(KEYS[1], app_rate)
+local user_tokens = refill(KEYS[2], user_rate)
+local wait = 0
+if app_tokens then
+  local need = 1 + reserve * app_cap
+  if app_tokens < need then wait = (need - app_tokens) / app_rate end
+end
+if user_tokens and user_tokens < 1 then
+  wait = math.max(wait, (1 - user_tokens) / user_rate)
+end
+if wait > 0 then return {'budget', tostring(wait)} end
+if app_tokens then
+  redis.call('HSET', KEYS[1], 'tokens', tostring(app_tokens - 1), 'ts', tostring(now))
+  redis.call('EXPIRE', KEYS[1], 60)
+end
+if user_tokens then
+  redis.call('HSET', KEYS[2], 'tokens', tostring(user_tokens - 1), 'ts', tostring(now))
+  redis.call('EXPIRE', KEYS[2], 60)
+end
+return {'ok', '0'}
+"""
+
+_THROTTLE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local retry_after = tonumber(ARGV[1])
+local pause = tonumber(redis.call('GET', KEYS[1]) or '0')
+if now + retry_after > pause then
+  redis.call('SET', KEYS[1], tostring(now + retry_after), 'EX', math.ceil(retry_after) + 1)
+end
+local strikes = redis.call('INCR', KEYS[2])
+if strikes == 1 then redis.call('EXPIRE', KEYS[2], ARGV[2]) end
+if strikes >= tonumber(ARGV[3]) then
+  redis.call('SET', KEYS[3], tostring(now + tonumber(ARGV[4])), 'EX', ARGV[4])
+  redis.call('DEL', KEYS[2])
+  return 1
+end
+return 0
+"""
+
+
+class Priority(IntEnum):
+    interactive = 0
+    poll = 1
+    background = 2
+
+
+_priority: ContextVar[Priority] = ContextVar("spotify_request_priority", default=Priority.poll)
+
+
+@contextmanager
+def request_priority(priority: Priority) -> Iterator[None]:
+    """Run the enclosed Spotify calls at ``priority``."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class SpotifyThrottled(SpotifyException):
+    """The governor refused to send a request; behaves like a Spotify 429."""
+
+    def __init__(self, retry_after: float, reason: str) -> None:
+        super().__init__(
+            429,
+            -1,
+            f"Spotify request throttled ({reason})",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class RequestBudget:
+    """Token bucket capping requests per second across all threads.
+
+    Holds at most one second's worth of tokens, so bursts stay bounded. A rate
+    of zero or less disables the budget.
+    """
+
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+        self._capacity = max(rate, 1.0)
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, reserve: float = 0.0) -> float:
+        """Seconds until a token is available above ``reserve`` of capacity (0 if now)."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill()
+            need = 1 + reserve * self._capacity
+            return max(0.0, (need - self._tokens) / self.rate)
+
+    def take(self, reserve: float = 0.0) -> float:
+        """Take a token if one is available above ``reserve``; else return the wait."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill()
+            need = 1 + reserve * self._capacity
+            if self._tokens >= need:
+                self._tokens -= 1
+                return 0.0
+            return (need - self._tokens) / self.rate
+
+    def available(self) -> float:
+        if self.rate <= 0:
+            return math.inf
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def acquire(self) -> None:
+        while True:
+            wait = self.take()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+
+def _token_key(access_token: str) -> str:
+    return hashlib.blake2b(access_token.encode(), digest_size=8).hexdigest()
+
+
+class SpotifyGovernor:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._app_budget: Optional[RequestBudget] = None
+        self._user_budgets: Dict[str, RequestBudget] = {}
+        self._paused_until = 0.0
+        self._breaker_until = 0.0
+        self._strikes: list = []
+        self._redis = None
+        self._redis_checked = False
+        self.requests = {p.name: 0 for p in Priority}
+        self.throttled = 0
+        self.rejected = 0
+
+    def _get_redis(self):
+        if not settings.spotify_governor_redis_enabled:
+            return None
+        if not self._redis_checked:
+            self._redis_checked = True
+            try:
+                from redis import Redis
+
+                self._redis = Redis.from_url(settings.redis_url, socket_timeout=1)
+            except Exception as e:
+                logger.warning(f"Spotify governor running without Redis: {e}")
+        return self._redis
+
+    def _app(self) -> RequestBudget:
+        rate = settings.spotify_requests_per_second
+        with self._lock:
+            if self._app_budget is None or self._app_budget.rate != rate:
+                self._app_budget = RequestBudget(rate)
+            return self._app_budget
+
+    def _user(self, key: str) -> RequestBudget:
+        rate = settings.spotify_user_requests_per_second
+        with self._lock:
+            budget = self._user_budgets.get(key)
+            if budget is None or budget.rate != rate:
+                # Tokens expire within the hour; don't let old ones pile up.
+                if len(self._user_budgets) >= 10000:
+                    self._user_budgets.clear()
+                budget = self._user_budgets[key] = RequestBudget(rate)
+            return budget
+
+    def _check_local(self, priority: Priority, user_key: Optional[str]) -> Tuple[str, float]:
+        now = time.time()
+        with self._lock:
+            if priority is Priority.background and self._breaker_until > now:
+                return "breaker", self._breaker_until - now
+            if self._paused_until > now:
+                return "retry_after", self._paused_until - now
+        reserve = settings.spotify_background_reserve if priority is Priority.background else 0.0
+        app = self._app()
+        user = self._user(user_key) if user_key else None
+        # Check both before taking from either, so a refusal costs nothing.
+        wait = max(app.wait_time(reserve), user.wait_time() if user else 0.0)
+        if wait <= 0:
+            wait = app.take(reserve)
+            if wait <= 0 and user is not None:
+                wait = user.take()
+        return ("budget", wait) if wait > 0 else ("ok", 0.0)
+
+    def _check(self, priority: Priority, user_key: Optional[str]) -> Tuple[str, float]:
+        redis = self._get_redis()
+        if redis is not None:
+            try:
+                reason, wait = redis.eval(
+                    _ACQUIRE_SCRIPT,
+                    4,
+                    REDIS_KEY_PREFIX + "bucket:app",
+                    REDIS_KEY_PREFIX + f"bucket:user:{user_key or '-'}",
+                    REDIS_KEY_PREFIX + "paused_until",
+                    REDIS_KEY_PREFIX + "breaker_until",
+                    settings.spotify_requests_per_second,
+                    settings.spotify_user_requests_per_second if user_key else 0,
+                    settings.spotify_background_reserve if priority is Priority.background else 0,
+                    "1" if priority is Priority.background else "0",
+                )
+                return reason.decode(), float(wait)
+            except Exception as e:
+                logger.warning(f"Spotify governor Redis check failed: {e}")
+        return self._check_local(priority, user_key)
+
+    def acquire(self, access_token: Optional[str] = None) -> None:
+        """Block until a request may be sent at the current priority.
+
+        Raises ``SpotifyThrottled`` for background work while the breaker is
+        open, and for interactive work that would wait too long.
+        """
+        priority = _priority.get()
+        user_key = _token_key(access_token) if access_token else None
+        waited = 0.0
+        while True:
+            reason, wait = self._check(priority, user_key)
+            if reason == "ok":
+                with self._lock:
+                    self.requests[priority.name] += 1
+                return
+            too_long = (
+                priority is Priority.interactive
+                and waited + wait > settings.spotify_interactive_max_wait_seconds
+            )
+            if reason == "breaker" or too_long:
+                with self._lock:
+                    self.rejected += 1
+                raise SpotifyThrottled(wait, reason)
+            sleep = min(wait, MAX_SLEEP_SECONDS)
+            time.sleep(sleep)
+            waited += sleep
+
+    def record_throttle(self, retry_after: Optional[float]) -> None:
+        """Pause everyone for a 429's ``Retry-After`` and count it towards the breaker."""
+        retry_after = max(float(DEFAULT_RETRY_AFTER_SECONDS if retry_after is None else retry_after), 0.0)
+        with self._lock:
+            self.throttled += 1
+        redis = self._get_redis()
+        if redis is not None:
+            try:
+                opened = redis.eval(
+                    _THROTTLE_SCRIPT,
+                    3,
+                    REDIS_KEY_PREFIX + "paused_until",
+                    REDIS_KEY_PREFIX + "strikes",
+                    REDIS_KEY_PREFIX + "breaker_until",
+                    retry_after,
+                    settings.spotify_breaker_window_seconds,
+                    settings.spotify_breaker_threshold,
+                    settings.spotify_breaker_cooldown_seconds,
+                )
+                if opened:
+                    logger.warning("Spotify circuit breaker opened; pausing background work")
+                return
+            except Exception as e:
+                logger.warning(f"Spotify governor Redis throttle record failed: {e}")
+
+        now = time.time()
+        with self._lock:
+            self._paused_until = max(self._paused_until, now + retry_after)
+            window_start = now - settings.spotify_breaker_window_seconds
+            self._strikes = [t for t in self._strikes if t > window_start] + [now]
+            if len(self._strikes) >= settings.spotify_breaker_threshold:
+                self._breaker_until = now + settings.spotify_breaker_cooldown_seconds
+                self._strikes = []
+                logger.warning("Spotify circuit breaker opened; pausing background work")
+
+    def stats(self) -> dict:
+        now = time.time()
+        paused_until, breaker_until = self._paused_until, self._breaker_until
+        app_tokens = self._app().available()
+        backend = "local"
+        redis = self._get_redis()
+        if redis is not None:
+            try:
+                tokens, paused, breaker = (
+                    redis.hget(REDIS_KEY_PREFIX + "bucket:app", "tokens"),
+                    redis.get(REDIS_KEY_PREFIX + "paused_until"),
+                    redis.get(REDIS_KEY_PREFIX + "breaker_until"),
+                )
+                app_tokens = float(tokens) if tokens is not None else app_tokens
+                paused_until = float(paused or 0)
+                breaker_until = float(breaker or 0)
+                backend = "redis"
+            except Exception as e:
+                logger.warning(f"Spotify governor Redis stats failed: {e}")
+        with self._lock:
+            return {
+                "backend": backend,
+                "requests_per_second": settings.spotify_requests_per_second,
+                "app_tokens_available": None if math.isinf(app_tokens) else round(app_tokens, 2),
+                "paused_for_seconds": round(max(0.0, paused_until - now), 2),
+                "breaker_open": breaker_until > now,
+                "requests": dict(self.requests),
+                "throttled": self.throttled,
+                "rejected": self.rejected,
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._app_budget = None
+            self._user_budgets.clear()
+            self._paused_until = 0.0
+            self._breaker_until = 0.0
+            self._strikes = []
+            self.requests = {p.name: 0 for p in Priority}
+            self.throttled = 0
+            self.rejected = 0
+
+
+governor = SpotifyGovernor()
+
+
+def reset_spotify_governor() -> None:
+    """Test helper: clear buckets, pauses, the breaker and counters."""
+    governor.reset()
@@ -0,0 +1,197 @@
+"""Cache of Spotify access tokens, keyed by user.
+
+Polling, backfill enrichment and live artist search used to exchange the
+user's refresh token for a fresh access token on every call, an extra OAuth
+round trip per poll and per search keystroke. ``get_access_token`` returns a
+cached token until ``TOKEN_EXPIRY_MARGIN_SECONDS`` before Spotify's
+``expires_in`` and only refreshes once it runs out.
+
+Refreshes are single-flight: a per-user lock in-process, plus a Redis lock
+across processes when ``TOKEN_CACHE_REDIS_ENABLED`` is set. Whoever wins the
+lock refreshes; everyone else re-reads the cache after it. A rotated refresh
+token returned by Spotify is written back to the user row immediately, since
+the old one may stop working.
+
+Redis (when enabled) stores tokens encrypted like the refresh tokens in the
+database and is best-effort: any failure falls back to the in-process cache.
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import User
+from app.services.spotify import SpotifyService, decrypt_token, encrypt_token
+
+logger = logging.getLogger("gatekeepify.token_cache")
+
+REDIS_KEY_PREFIX = "spotify_token:"
+REDIS_LOCK_PREFIX = "lock:spotify_token:"
+REDIS_LOCK_TIMEOUT_SECONDS = 30
+TOKEN_EXPIRY_MARGIN_SECONDS = 120
+DEFAULT_EXPIRES_IN_SECONDS = 3600
+
+
+class AccessTokenCache:
+    def __init__(self) -> None:
+        self._tokens: Dict[str, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+        self._user_locks: Dict[str, threading.Lock] = {}
+        self._redis = None
+        self._redis_checked = False
+        self.hits = 0
+        self.refreshes = 0
+
+    def _get_redis(self):
+        if not settings.token_cache_redis_enabled:
+            return None
+        if not self._redis_checked:
+            self._redis_checked = True
+            try:
+                from redis import Redis
+
+                self._redis = Redis.from_url(settings.redis_url, socket_timeout=1)
+            except Exception as e:
+                logger.warning(f"Token cache running without Redis: {e}")
+        return self._redis
+
+    def get(self, user_id: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            cached = self._tokens.get(user_id)
+            if cached and cached[1] > now:
+                return cached[0]
+
+        redis = self._get_redis()
+        if redis is not None:
+            try:
+                value = redis.get(REDIS_KEY_PREFIX + user_id)
+                ttl = redis.ttl(REDIS_KEY_PREFIX + user_id) if value else None
+                if value and ttl and ttl > 0:
+                    token = decrypt_token(value.decode())
+                    with self._lock:
+                        self._tokens[user_id] = (token, now + ttl)
+                    return token
+            except Exception as e:
+                logger.warning(f"Token cache Redis lookup failed: {e}")
+        return None
+
+    def put(self, user_id: str, token_info: dict) -> None:
+        """Cache ``token_info['access_token']`` for its lifetime minus the safety margin."""
+        expires_in = int(token_info.get("expires_in") or DEFAULT_EXPIRES_IN_SECONDS)
+        ttl = expires_in - TOKEN_EXPIRY_MARGIN_SECONDS
+        if ttl <= 0:
+            return
+        token = token_info["access_token"]
+        with self._lock:
+            self._tokens[user_id] = (token, time.time() + ttl)
+
+        redis = self._get_redis()
+        if redis is not None:
+            try:
+                redis.set(REDIS_KEY_PREFIX + user_id, encrypt_token(token), ex=ttl)
+            except Exception as e:
+                logger.warning(f"Token cache Redis write failed: {e}")
+
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            self._tokens.pop(user_id, None)
+        redis = self._get_redis()
+        if redis is not None:
+            try:
+                redis.delete(REDIS_KEY_PREFIX + user_id)
+            except Exception as e:
+                logger.warning(f"Token cache Redis delete failed: {e}")
+
+    def user_lock(self, user_id: str) -> threading.Lock:
+        with self._lock:
+            return self._user_locks.setdefault(user_id, threading.Lock())
+
+    def distributed_lock(self, user_id: str):
+        """Redis lock serialising refreshes across processes, or None."""
+        redis = self._get_redis()
+        if redis is None:
+            return None
+        try:
+            lock = redis.lock(
+                REDIS_LOCK_PREFIX + user_id,
+                timeout=REDIS_LOCK_TIMEOUT_SECONDS,
+                blocking_timeout=REDIS_LOCK_TIMEOUT_SECONDS,
+            )
+            if lock.acquire():
+                return lock
+        except Exception as e:
+            logger.warning(f"Token refresh lock unavailable for {user_id}: {e}")
+        return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.time()
+            return {
+                "cached_users": sum(1 for _, exp in self._tokens.values() if exp > now),
+                "hits": self.hits,
+                "refreshes": self.refreshes,
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._tokens.clear()
+            self._user_locks.clear()
+            self.hits = 0
+            self.refreshes = 0
+
+
+access_tokens = AccessTokenCache()
+
+
+def reset_token_cache() -> None:
+    """Test helper: drop all cached access tokens and counters."""
+    access_tokens.reset()
+
+
+def get_access_token(
+    db: Session, service: SpotifyService, user: User, force_refresh: bool = False
+) -> str:
+    """Return a usable access token for ``user``, refreshing only when needed.
+
+    ``force_refresh`` skips the cached token, e.g. after Spotify answered 401.
+    Refresh errors propagate unchanged so callers can detect revoked tokens.
+    """
+    user_id = user.user_id
+    if not force_refresh:
+        token = access_tokens.get(user_id)
+        if token:
+            access_tokens.hits += 1
+            return token
+
+    with access_tokens.user_lock(user_id):
+        dist_lock = access_tokens.distributed_lock(user_id)
+        try:
+            if not force_refresh:
+                # Another thread or process may have refreshed while we waited.
+                token = access_tokens.get(user_id)
+                if token:
+                    access_tokens.hits += 1
+                    return token
+
+            refresh_token = decrypt_token(user.spotify_refresh_token)
+            token_info = service.refresh_access_token(refresh_token)
+            access_tokens.refreshes += 1
+
+            new_refresh = token_info.get("refresh_token")
+            if new_refresh and new_refresh != refresh_token:
+                user.spotify_refresh_token = encrypt_token(new_refresh)
+                db.commit()
+
+            access_tokens.put(user_id, token_info)
+            return token_info["access_token"]
+        finally:
+            if dist_lock is not None:
+                try:
+                    dist_lock.release()
+                except Exception:
+                    pass
@@ -0,0 +1,96 @@
+"""Disk spool for backfill uploads.
+
+The web process streams an uploaded export into ``settings.upload_spool_dir``
+and hands the worker a key instead of the parsed listens, so neither the web
+process nor the Celery payload ever holds the export in memory. The directory
+stands in for an object store: files are written once and removed when the
+job finishes.
+
+A key is a random token plus the upload's SHA-256, so two jobs for identical
+files (e.g. a retried upload) each own their spool file and one finishing
+never deletes the other's input.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import secrets
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO
+
+from app.config import settings
+
+logger = logging.getLogger("gatekeepify.upload_spool")
+
+COPY_CHUNK_BYTES = 1024 * 1024
+_KEY_RE = re.compile(r"^[0-9a-f]{32}-[0-9a-f]{64}$")
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class SpooledUpload:
+    key: str
+    sha256: str
+    size_bytes: int
+
+
+def _spool_dir() -> Path:
+    path = Path(settings.upload_spool_dir)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def spool_path(key: str) -> Path:
+    """Path of a spooled upload. Rejects anything that isn't a spool key."""
+    if not _KEY_RE.match(key or ""):
+        raise ValueError(f"Invalid upload key: {key!r}")
+    return _spool_dir() / f"{key}.zip"
+
+
+def spool_upload(source: BinaryIO, max_bytes: int) -> SpooledUpload:
+    """Copy ``source`` to a new spool file in chunks, hashing as it goes.
+
+    Raises ``UploadTooLarge`` (leaving nothing behind) once more than
+    ``max_bytes`` have been read.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_name = tempfile.mkstemp(dir=_spool_dir(), suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := source.read(COPY_CHUNK_BYTES):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+                digest.update(chunk)
+                out.write(chunk)
+        sha256 = digest.hexdigest()
+        key = f"{secrets.token_hex(16)}-{sha256}"
+        os.replace(tmp_name, spool_path(key))
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except FileNotFoundError:
+            pass
+        raise
+    return SpooledUpload(key=key, sha256=sha256, size_bytes=size)
+
+
+def spooled_upload_exists(key: str) -> bool:
+    try:
+        return spool_path(key).is_file()
+    except ValueError:
+        return False
+
+
+def delete_spooled_upload(key: str) -> None:
+    try:
+        spool_path(key).unlink(missing_ok=True)
+    except (ValueError, OSError) as e:
+        logger.warning(f"Could not delete spooled upload {key}: {e}")
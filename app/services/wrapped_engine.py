@@ -0,0 +1,123 @@
+"""Single-pass aggregation behind ``/stats/wrapped``.
+
+Wrapped used to read the same ``(user, year)`` listen range seven times: once
+per top-N list, once each for the minutes and the listen count, and twice more
+for ``COUNT DISTINCT``. ``scan_wrapped`` streams the range's per-track totals
+once (``track_totals``: rollup days plus raw partial days, or the raw listens
+while a user's rollups aren't built) and derives every metric from them:
+
+- track counts, minutes, the listen count and unique tracks directly;
+- artist and genre counts through ``track_to_artist`` and ``artist_to_genre``,
+  looked up for the tracks seen in ``TRACK_CHUNK_SIZE`` chunks;
+- each top-N list with a heap over ``(-listen_count, id)``, the same order as
+  the per-list queries.
+
+A listen counts once per genre even when several of its track's artists share
+it, as in ``genre_totals``.
+"""
+
+import heapq
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models import ArtistGenre, Track, TrackArtist
+from app.services.listen_rollups import TRACK_CHUNK_SIZE, track_totals
+
+# Rows fetched per round trip while streaming the per-track totals.
+STREAM_BATCH_SIZE = 5000
+
+# (id, listen_count, duration_ms)
+Ranked = Tuple[str, int, int]
+
+
+@dataclass
+class WrappedScan:
+    top_tracks: List[Ranked]
+    top_artists: List[Ranked]
+    top_genres: List[Ranked]
+    total_ms: int
+    total_listens: int
+    unique_tracks: int
+    unique_artists: int
+
+
+def _top(totals: Dict[str, List[int]], limit: int) -> List[Ranked]:
+    ranked = heapq.nsmallest(limit, totals.items(), key=lambda item: (-item[1][0], item[0]))
+    return [(key, count, ms) for key, (count, ms) in ranked]
+
+
+def _add(totals: Dict[str, List[int]], key: str, count: int, ms: int) -> None:
+    entry = totals.get(key)
+    if entry is None:
+        totals[key] = [count, ms]
+    else:
+        entry[0] += count
+        entry[1] += ms
+
+
+def _track_links(db: Session, track_ids: List[str]) -> Tuple[Dict[str, Set[str]], Dict[str, Set[str]]]:
+    """``({track_id: artist_ids}, {track_id: genres})`` for ``track_ids``."""
+    artists: Dict[str, Set[str]] = {}
+    genres: Dict[str, Set[str]] = {}
+    for i in range(0, len(track_ids), TRACK_CHUNK_SIZE):
+        rows = db.execute(
+            select(TrackArtist.track_id, TrackArtist.artist_id, ArtistGenre.genre)
+            .outerjoin(ArtistGenre, ArtistGenre.artist_id == TrackArtist.artist_id)
+            .where(TrackArtist.track_id.in_(track_ids[i : i + TRACK_CHUNK_SIZE]))
+        ).all()
+        for track_id, artist_id, genre in rows:
+            artists.setdefault(track_id, set()).add(artist_id)
+            if genre is not None:
+                genres.setdefault(track_id, set()).add(genre)
+    return artists, genres
+
+
+def scan_wrapped(
+    db: Session, user_id: str, since: Optional[datetime], until: Optional[datetime], limit: int
+) -> WrappedScan:
+    """Every Wrapped metric for ``user_id``'s listens in ``[since, until)``.
+
+    ``duration_ms`` in the top-track entries is the track's own duration
+    (0 when unknown); for artists and genres it is the summed duration of
+    their listens.
+    """
+    totals = track_totals(db, user_id, since, until)
+    stmt = select(
+        totals.c.track_id,
+        totals.c.listen_count,
+        totals.c.ms_played,
+        totals.c.unplayed_count,
+        Track.duration_ms,
+    ).join(Track, Track.track_id == totals.c.track_id)
+
+    # track_id -> [listen_count, duration_ms]; a track may come from several parts.
+    tracks: Dict[str, List[int]] = {}
+    total_ms = 0
+    for row in db.execute(stmt, execution_options={"yield_per": STREAM_BATCH_SIZE}):
+        count = int(row.listen_count)
+        duration = row.duration_ms or 0
+        tracks.setdefault(row.track_id, [0, duration])[0] += count
+        total_ms += int(row.ms_played or 0) + int(row.unplayed_count or 0) * duration
+
+    artists_of, genres_of = _track_links(db, sorted(tracks))
+    artists: Dict[str, List[int]] = {}
+    genres: Dict[str, List[int]] = {}
+    for track_id, (count, duration) in tracks.items():
+        for artist_id in artists_of.get(track_id, ()):
+            _add(artists, artist_id, count, count * duration)
+        for genre in genres_of.get(track_id, ()):
+            _add(genres, genre, count, count * duration)
+
+    return WrappedScan(
+        top_tracks=_top(tracks, limit),
+        top_artists=_top(artists, limit),
+        top_genres=_top(genres, limit),
+        total_ms=total_ms,
+        total_listens=sum(count for count, _ in tracks.values()),
+        unique_tracks=len(tracks),
+        unique_artists=len(artists),
+    )
@@ -0,0 +1,101 @@
+"""Materialized ``/stats/wrapped`` responses, one row per user and year.
+
+A past year's Wrapped only changes when that year's listens (or the artists
+and genres of the tracks in it) change, so the rendered response is stored in
+``wrapped_snapshots`` and served from there:
+
+- the endpoint serves a fresh row and computes (then stores) on a miss;
+- every path that refreshes listen rollup days calls ``invalidate_wrapped``
+  for the years those days fall in, which stamps ``invalidated_at``;
+- ``refresh_wrapped_snapshots`` recomputes invalidated rows, current-year
+  rows computed before today, since their period runs up to today, and
+  past-year rows computed before that year ended, which still carry the
+  truncated in-year period.
+
+A row is fresh while ``invalidated_at`` is unset or older than ``computed_at``.
+``computed_at`` is taken before the listens are read, so an invalidation that
+lands while a snapshot is being computed leaves it stale.
+"""
+
+from datetime import datetime, time, timezone
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, extract, or_, select, update
+from sqlalchemy.orm import Session
+
+from app.models import WrappedSnapshot
+from app.services.dimensions import dialect_insert
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _stale_clause(now: datetime):
+    return or_(
+        WrappedSnapshot.invalidated_at >= WrappedSnapshot.computed_at,
+        and_(
+            WrappedSnapshot.year == now.year,
+            WrappedSnapshot.computed_at < datetime.combine(now.date(), time.min),
+        ),
+        # Computed before its year ended, so capped at the in-year period.
+        and_(
+            WrappedSnapshot.year < now.year,
+            extract("year", WrappedSnapshot.computed_at) <= WrappedSnapshot.year,
+        ),
+    )
+
+
+def is_fresh(snapshot: WrappedSnapshot, now: Optional[datetime] = None) -> bool:
+    now = now or _utcnow()
+    if snapshot.invalidated_at is not None and snapshot.invalidated_at >= snapshot.computed_at:
+        return False
+    if snapshot.year == now.year:
+        return snapshot.computed_at.date() >= now.date()
+    return snapshot.computed_at >= datetime(snapshot.year + 1, 1, 1)
+
+
+def load_wrapped(db: Session, user_id: str, year: int) -> Optional[str]:
+    """The stored payload for ``(user_id, year)`` if it is fresh."""
+    snapshot = db.get(WrappedSnapshot, (user_id, year))
+    if snapshot is None or not is_fresh(snapshot):
+        return None
+    return snapshot.payload
+
+
+def store_wrapped(db: Session, user_id: str, year: int, payload: str, computed_at: datetime) -> None:
+    """Upsert a computed payload. ``invalidated_at`` is kept. Does not commit."""
+    table = WrappedSnapshot.__table__
+    stmt = dialect_insert(db, table).values(
+        user_id=user_id, year=year, payload=payload, computed_at=computed_at
+    )
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["user_id", "year"],
+            set_={"payload": stmt.excluded.payload, "computed_at": stmt.excluded.computed_at},
+        )
+    )
+
+
+def invalidate_wrapped(db: Session, user_id: str, years: Optional[Iterable[int]] = None) -> None:
+    """Mark ``user_id``'s snapshots for ``years`` (every year when None) stale. Does not commit."""
+    stmt = update(WrappedSnapshot).where(WrappedSnapshot.user_id == user_id)
+    if years is not None:
+        years = sorted(set(years))
+        if not years:
+            return
+        stmt = stmt.where(WrappedSnapshot.year.in_(years))
+    db.execute(stmt.values(invalidated_at=_utcnow()).execution_options(synchronize_session=False))
+
+
+def stale_snapshots(db: Session, limit: int) -> List[Tuple[str, int]]:
+    """Up to ``limit`` stale ``(user_id, year)`` snapshots, oldest first."""
+    return [
+        (row.user_id, row.year)
+        for row in db.execute(
+            select(WrappedSnapshot.user_id, WrappedSnapshot.year)
+            .where(_stale_clause(_utcnow()))
+            .order_by(WrappedSnapshot.computed_at, WrappedSnapshot.user_id, WrappedSnapshot.year)
+            .limit(limit)
+        ).all()
+    ]
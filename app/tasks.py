@@ -1,25 +1,47 @@
 import logging
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from itertools import islice
 
+from celery import chord
 from spotipy.exceptions import SpotifyException
 from spotipy.oauth2 import SpotifyOauthError
-from sqlalchemy import func, select
+from sqlalchemy import select
 
 from app.celery_app import celery_app
 from app.config import settings
-from app.database import SessionLocal
+from app.database import SessionLocal, engine
 from app.models import Listen, User
-from app.models import Friendship
 from app.models import AuditLog, JobRun
+from app.services.artist_cache import ArtistMetadataCache
+from app.services.dimension_cache import known_dimensions
+from app.services.enrichment_queue import (
+    claim_enrichment_batch,
+    complete_enrichment,
+    fail_enrichment,
+    release_enrichment,
+)
 from app.services.ingestion import (
+    advance_listen_cursor,
     get_active_users,
-    get_tracks_missing_metadata,
+    listen_cursor_ms,
     log_job_run,
     retroactively_validate_export_listens,
     upsert_from_recent_listens,
     upsert_track_metadata,
 )
-from app.services.spotify import SpotifyService, decrypt_token, encrypt_token
+from app.services.poll_schedule import (
+    count_due_users,
+    defer_poll,
+    get_due_users,
+    is_poll_due,
+    schedule_next_poll,
+)
+from app.services.spotify import MAXIMUM_RECENT_TRACKS, SpotifyService
+from app.services.spotify_governor import Priority, request_priority
+from app.services.token_cache import access_tokens, get_access_token
 
 logger = logging.getLogger(__name__)
 
@@ -34,122 +56,271 @@ def _is_token_revoked(exc: Exception) -> bool:
 
 def _deactivate_user(db, user: User, reason: str) -> None:
     user.spotify_refresh_token = None
+    access_tokens.invalidate(user.user_id)
     db.commit()
     logger.warning(
         f"Deactivated user {user.user_id}: {reason}. User must re-authenticate via /auth/login to resume polling."
     )
 
 
-MAX_USERS_PER_CYCLE = 500
-INTER_USER_DELAY = 1.0
+ENRICH_BATCH_SIZE = 200
 
 
-@celery_app.task(name="app.tasks.poll_recent_listens", bind=True)
-def poll_recent_listens(self):
-    import time
+def _poll_concurrency() -> int:
+    # SQLite serialises writers, so concurrent polls there only trade
+    # throughput for "database is locked" errors.
+    if engine.dialect.name == "sqlite":
+        return 1
+    return max(1, settings.poll_concurrency)
 
-    lock_key = "lock:poll_recent_listens"
-    lock = None
+
+def _shard_user_ids(user_ids: list, shards: int) -> list[list[str]]:
+    """Split ``user_ids`` into at most ``shards`` non-empty groups by a stable user hash."""
+    shards = max(1, shards)
+    groups: list[list[str]] = [[] for _ in range(shards)]
+    for user_id in user_ids:
+        groups[zlib.crc32(user_id.encode()) % shards].append(user_id)
+    return [g for g in groups if g]
+
+
+def _poll_lock_client():
+    """Redis client for per-user poll locks, or None if Redis is unreachable."""
     try:
         from redis import Redis
 
-        redis = Redis.from_url(settings.redis_url)
-        lock = redis.lock(lock_key, timeout=settings.poll_interval_seconds - 10)
-        if not lock.acquire(blocking=False):
-            logger.warning("poll_recent_listens skipped: previous cycle still running")
-            return
+        redis = Redis.from_url(settings.redis_url, socket_connect_timeout=1, socket_timeout=1)
+        redis.ping()
+        return redis
     except Exception as e:
-        logger.warning(f"Could not acquire Redis lock, running without lock: {e}")
+        logger.warning(f"Polling without per-user locks, Redis unavailable: {e}")
+        return None
+
+
+def _poll_users(
+    user_ids: list,
+    service: SpotifyService,
+    artist_cache: ArtistMetadataCache,
+    concurrency: int,
+    redis=None,
+) -> dict:
+    """Poll ``user_ids`` with up to ``concurrency`` workers.
+
+    Returns ``{"polled", "errors", "revoked", "skipped", "overflows"}`` counts;
+    a user is skipped when another worker holds their poll lock or already
+    polled them, ``revoked`` counts users deactivated for a revoked token, and
+    ``overflows`` counts polled users whose page came back full. Spotify
+    pacing comes from the shared session's request budget
+    (``settings.spotify_requests_per_second``), not from sleeping between
+    users.
+    """
+
+    def _poll(user_id):
+        return _poll_user_isolated(user_id, service, artist_cache, redis)
+
+    if concurrency <= 1:
+        results = [_poll(uid) for uid in user_ids]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="poll") as pool:
+            results = list(pool.map(_poll, user_ids))
+    return {
+        "polled": results.count("polled") + results.count("overflow"),
+        "errors": results.count("error"),
+        "revoked": results.count("token_revoked"),
+        "skipped": results.count("skipped"),
+        "overflows": results.count("overflow"),
+    }
+
+
+def _poll_user_isolated(
+    user_id: str, service: SpotifyService, artist_cache: ArtistMetadataCache, redis=None
+) -> str:
+    """Poll one user on a session of its own, so a failure never touches other users.
+
+    With ``redis``, a short-lived ``lock:poll_user:<id>`` keeps two shards or
+    overlapping cycles from polling the same user at once. The user is
+    re-checked once the lock is held: a cycle dispatched while an earlier one
+    was still running may hand over a user that run has just polled.
+    """
+    lock = None
+    if redis is not None:
+        try:
+            lock = redis.lock(f"lock:poll_user:{user_id}", timeout=settings.poll_user_lock_seconds)
+            if not lock.acquire(blocking=False):
+                return "skipped"
+        except Exception as e:
+            logger.warning(f"Poll lock unavailable for {user_id}, polling unlocked: {e}")
+            lock = None
 
     db = SessionLocal()
-    started_at = datetime.now(timezone.utc)
     try:
-        service = SpotifyService()
-        all_users = get_active_users(db)
-        total_users = len(all_users)
+        user = db.get(User, user_id)
+        if user is None or not user.spotify_refresh_token or not is_poll_due(user):
+            return "skipped"
+        try:
+            overflowed = _poll_single_user(db, service, user, artist_cache.for_session(db))
+            return "overflow" if overflowed else "polled"
+        except Exception as e:
+            db.rollback()
+            if _is_token_revoked(e):
+                _deactivate_user(db, user, f"token revoked ({e})")
+                status = "token_revoked"
+            else:
+                logger.error(f"Failed to poll user {user_id}: {e}")
+                defer_poll(user)
+                db.commit()
+                status = "error"
+            log_job_run(
+                db,
+                "poll_recent_listens",
+                user_id,
+                datetime.now(timezone.utc),
+                datetime.now(timezone.utc),
+                status,
+            )
+            return status
+    finally:
+        db.close()
+        if lock is not None:
+            try:
+                lock.release()
+            except Exception:
+                pass
+
+
+@celery_app.task(name="app.tasks.poll_recent_listens", bind=True)
+def poll_recent_listens(self):
+    """Start a poll cycle: shard the due users and poll the shards as a Celery group.
 
-        all_users.sort(key=lambda u: u.last_poll_at or datetime.min)
-        batch = all_users[:MAX_USERS_PER_CYCLE]
+    Shards are dispatched as a chord, so ``finish_poll_cycle`` writes the cycle
+    summary once every shard is done. Capacity scales with the number of
+    workers consuming the shards; per-user locks make overlapping cycles safe.
+    """
+    db = SessionLocal()
+    started_at = datetime.now(timezone.utc)
+    try:
+        due_users = count_due_users(db)
+        batch = get_due_users(db, settings.poll_max_users_per_cycle)
 
         logger.info(
-            f"Polling recent listens: {len(batch)}/{total_users} users "
-            f"(oldest poll: {batch[0].last_poll_at if batch else 'N/A'})"
+            f"Polling recent listens: {len(batch)}/{due_users} due users "
+            f"(most overdue: {batch[0].next_poll_at if batch else 'N/A'})"
         )
 
-        polled = 0
-        errors = 0
-        for user in batch:
-            try:
-                _poll_single_user(db, service, user)
-                polled += 1
-            except Exception as e:
-                db.rollback()
-                errors += 1
-                if _is_token_revoked(e):
-                    _deactivate_user(db, user, f"token revoked ({e})")
-                    log_job_run(
-                        db,
-                        "poll_recent_listens",
-                        user.user_id,
-                        datetime.now(timezone.utc),
-                        datetime.now(timezone.utc),
-                        "token_revoked",
-                    )
-                else:
-                    logger.error(f"Failed to poll user {user.user_id}: {e}")
-                    log_job_run(
-                        db,
-                        "poll_recent_listens",
-                        user.user_id,
-                        datetime.now(timezone.utc),
-                        datetime.now(timezone.utc),
-                        "error",
-                    )
+        shards = _shard_user_ids([u.user_id for u in batch], settings.poll_shards)
+        pending = due_users - len(batch)
+        if not shards:
+            finish_poll_cycle([], started_at.isoformat(), pending)
+            return
+        chord(poll_user_shard.s(ids) for ids in shards)(
+            finish_poll_cycle.s(started_at.isoformat(), pending)
+        )
+    except Exception as e:
+        logger.error(f"Poll cycle failed: {e}")
+        log_job_run(db, "poll_recent_listens", None, started_at, datetime.now(timezone.utc), "error")
+    finally:
+        db.close()
 
-            if INTER_USER_DELAY > 0 and len(batch) > 10:
-                time.sleep(INTER_USER_DELAY)
 
-        pending = total_users - len(batch)
-        logger.info(f"Poll cycle complete: {polled} polled, {errors} errors, {pending} pending for next cycle")
+@celery_app.task(name="app.tasks.poll_user_shard")
+def poll_user_shard(user_ids: list) -> dict:
+    """Poll one shard of a cycle. Always returns counts so the chord can finish."""
+    db = SessionLocal()
+    counts = {
+        "polled": 0,
+        "errors": 0,
+        "revoked": 0,
+        "skipped": 0,
+        "overflows": 0,
+        "artist_api_calls": 0,
+        "artist_api_calls_saved": 0,
+    }
+    try:
+        artist_cache = ArtistMetadataCache(db)
+        counts.update(
+            _poll_users(user_ids, SpotifyService(), artist_cache, _poll_concurrency(), _poll_lock_client())
+        )
+        counts["artist_api_calls"] = artist_cache.api_calls
+        counts["artist_api_calls_saved"] = artist_cache.api_calls_saved
+        logger.info(f"Poll shard done ({len(user_ids)} users): {counts}")
+        logger.info(f"Dimension cache: {known_dimensions.stats()}")
+    except Exception as e:
+        logger.error(f"Poll shard failed: {e}")
+        counts["errors"] = len(user_ids) - counts["polled"] - counts["revoked"] - counts["skipped"]
+    finally:
+        db.close()
+    return counts
+
+
+@celery_app.task(name="app.tasks.finish_poll_cycle")
+def finish_poll_cycle(shard_results: list, started_at: str, pending: int = 0) -> None:
+    """Chord callback: write the cycle summary ``JobRun`` from every shard's counts."""
+    totals: dict = {}
+    for result in shard_results:
+        for key, value in (result or {}).items():
+            totals[key] = totals.get(key, 0) + value
+    polled = totals.get("polled", 0)
+    logger.info(
+        f"Poll cycle complete: {polled} polled, {totals.get('errors', 0)} errors, "
+        f"{totals.get('revoked', 0)} revoked, {totals.get('skipped', 0)} skipped (locked or already polled), "
+        f"{pending} pending for next cycle "
+        f"across {len(shard_results)} shards"
+    )
+    if totals.get("overflows"):
+        logger.warning(
+            f"{totals['overflows']} users returned a full recently-played page; "
+            f"plays between polls may have been lost"
+        )
+    logger.info(
+        f"Artist cache: {totals.get('artist_api_calls_saved', 0)} artist API calls saved, "
+        f"{totals.get('artist_api_calls', 0)} made"
+    )
+    db = SessionLocal()
+    try:
         log_job_run(
             db,
             "poll_recent_listens",
             None,
-            started_at,
+            datetime.fromisoformat(started_at),
             datetime.now(timezone.utc),
             "success",
             polled,
         )
-    except Exception as e:
-        logger.error(f"Poll cycle failed: {e}")
-        log_job_run(db, "poll_recent_listens", None, started_at, datetime.now(timezone.utc), "error")
     finally:
         db.close()
-        if lock:
-            try:
-                lock.release()
-            except Exception:
-                pass
-
 
-def _poll_single_user(db, service: SpotifyService, user: User) -> None:
-    started_at = datetime.now(timezone.utc)
 
-    refresh_token = decrypt_token(user.spotify_refresh_token)
-    token_info = service.refresh_access_token(refresh_token)
-    access_token = token_info["access_token"]
+def _poll_single_user(
+    db, service: SpotifyService, user: User, artist_cache: ArtistMetadataCache | None = None
+) -> bool:
+    """Ingest one recently-played page for ``user``.
 
-    new_refresh = token_info.get("refresh_token")
-    if new_refresh and new_refresh != refresh_token:
-        user.spotify_refresh_token = encrypt_token(new_refresh)
+    Returns True if the page may have overflowed: it resumed from a cursor and
+    still came back full, so plays older than the page were probably missed.
+    """
+    started_at = datetime.now(timezone.utc)
 
-    last_ts = db.execute(select(func.max(Listen.ts)).where(Listen.user_id == user.user_id)).scalar()
+    access_token = get_access_token(db, service, user)
+    after_ms = listen_cursor_ms(db, user)
 
-    items = service.get_recent_listens(access_token, after=last_ts)
+    try:
+        page = service.get_recent_listens_page(access_token, after_ms, artist_cache)
+    except SpotifyException as e:
+        # A cached token can be invalidated early (e.g. the user re-authed);
+        # only treat the 401 as a revocation if a fresh token fails too.
+        if e.http_status != 401:
+            raise
+        access_token = get_access_token(db, service, user, force_refresh=True)
+        page = service.get_recent_listens_page(access_token, after_ms, artist_cache)
+    items = page["items"]
+    overflowed = after_ms is not None and len(items) >= MAXIMUM_RECENT_TRACKS
+
+    # upsert_from_recent_listens commits the cursor together with the listens.
+    advance_listen_cursor(user, page)
     count = 0
     if items:
         count = upsert_from_recent_listens(db, items, user.user_id)
 
+    schedule_next_poll(db, user, count, overflowed=overflowed)
     user.last_poll_at = datetime.now(timezone.utc)
     db.commit()
 
@@ -162,145 +333,222 @@ def _poll_single_user(db, service: SpotifyService, user: User) -> None:
         "success",
         count,
     )
+    if overflowed:
+        logger.warning(f"Recently-played page for user {user.user_id} was full; plays may have been missed")
     logger.info(f"Polled {count} new listens for user {user.user_id}")
+    return overflowed
+
+
+def _seed_enrichment_queue(db) -> int:
+    from app.services.enrichment_queue import seed_enrichment_queue as _seed
+
+    started_at = datetime.now(timezone.utc)
+    queued = _seed(db)
+    log_job_run(db, "seed_enrichment_queue", None, started_at, datetime.now(timezone.utc), "success", queued)
+    logger.info(f"Seeded {queued} tracks into the enrichment queue")
+    return queued
+
+
+def _enrichment_queue_seeded(db) -> bool:
+    return (
+        db.query(JobRun.id)
+        .filter(JobRun.job_name == "seed_enrichment_queue", JobRun.status == "success")
+        .first()
+        is not None
+    )
 
 
 @celery_app.task(name="app.tasks.backfill_track_metadata")
 def backfill_track_metadata():
     db = SessionLocal()
     started_at = datetime.now(timezone.utc)
+    # Claimed entries not yet completed, failed or released.
+    unsettled = []
     try:
-        missing = get_tracks_missing_metadata(db)
-        if not missing:
-            return
-
-        service = SpotifyService()
-        users = get_active_users(db)
-        if not users:
-            logger.warning("No active users available to backfill track metadata")
-            return
-
-        access_token = _get_working_access_token(db, service, users)
-        if not access_token:
-            logger.error("All active users have revoked tokens, cannot backfill")
-            return
-
-        items = service.get_tracks(access_token, list(missing))
-        count = 0
-        enriched_ids = set()
-        if items:
-            count = upsert_track_metadata(db, items)
-            enriched_ids = {item["track"]["id"] for item in items if item.get("track", {}).get("id")}
-        failed_ids = missing - enriched_ids
-        if failed_ids:
-            from app.models import Track
-
-            db.execute(
-                Track.__table__.update()
-                .where(Track.__table__.c.track_id.in_(failed_ids))
-                .values(enrich_attempts=func.coalesce(Track.__table__.c.enrich_attempts, 0) + 1)
+        with request_priority(Priority.background):
+            if not _enrichment_queue_seeded(db):
+                # The queue starts out empty; fill it on the first run instead of
+                # waiting up to a day for the reconcile to pick up existing tracks.
+                _seed_enrichment_queue(db)
+            missing = claim_enrichment_batch(db, "backfill_track_metadata", ENRICH_BATCH_SIZE)
+            unsettled = missing
+            if not missing:
+                return
+
+            service = SpotifyService()
+            users = get_active_users(db)
+            if not users:
+                logger.warning("No active users available to backfill track metadata")
+                release_enrichment(db, missing)
+                return
+
+            access_token = _get_working_access_token(db, service, users)
+            if not access_token:
+                logger.error("All active users have revoked tokens, cannot backfill")
+                release_enrichment(db, missing)
+                return
+
+            items = service.get_tracks(access_token, missing, artist_cache=ArtistMetadataCache(db))
+            count = 0
+            enriched_ids = set()
+            if items:
+                count = upsert_track_metadata(db, items)
+                enriched_ids = {item["track"]["id"] for item in items if item.get("track", {}).get("id")}
+            complete_enrichment(db, enriched_ids & set(missing))
+            fail_enrichment(db, set(missing) - enriched_ids)
+            unsettled = []
+
+            removed = retroactively_validate_export_listens(db, set(missing))
+            if removed:
+                logger.info(f"Removed {removed} export listens that predate track release dates")
+
+            log_job_run(
+                db,
+                "backfill_track_metadata",
+                None,
+                started_at,
+                datetime.now(timezone.utc),
+                "success",
+                count,
             )
-            db.commit()
-
-        removed = retroactively_validate_export_listens(db, missing)
-        if removed:
-            logger.info(f"Removed {removed} export listens that predate track release dates")
-
-        log_job_run(
-            db,
-            "backfill_track_metadata",
-            None,
-            started_at,
-            datetime.now(timezone.utc),
-            "success",
-            count,
-        )
-        logger.info(f"Backfilled metadata for {count} tracks")
+            logger.info(f"Backfilled metadata for {count} tracks")
     except Exception as e:
-        logger.error(f"Failed to backfill track metadata: {e}")
         db.rollback()
+        if isinstance(e, SpotifyException) and e.http_status == 429:
+            # Throttled (breaker open or retries used up): hand the batch back
+            # without counting an attempt against the tracks.
+            logger.warning(f"Spotify rate limited, releasing {len(unsettled)} tracks: {e}")
+            release_enrichment(db, unsettled)
+            status = "rate_limited"
+        else:
+            # Count an attempt so a batch that keeps failing backs off and is
+            # eventually dropped instead of sitting leased until it expires.
+            logger.error(f"Failed to backfill track metadata: {e}")
+            fail_enrichment(db, unsettled)
+            status = "error"
         log_job_run(
             db,
             "backfill_track_metadata",
             None,
             started_at,
             datetime.now(timezone.utc),
-            "error",
+            status,
         )
     finally:
         db.close()
 
 
+@celery_app.task(name="app.tasks.seed_enrichment_queue")
+def seed_enrichment_queue():
+    """Daily reconcile: queue any track missing metadata that no enqueue path caught."""
+    db = SessionLocal()
+    started_at = datetime.now(timezone.utc)
+    try:
+        _seed_enrichment_queue(db)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to seed enrichment queue: {e}")
+        log_job_run(db, "seed_enrichment_queue", None, started_at, datetime.now(timezone.utc), "error")
+    finally:
+        db.close()
+
+
 @celery_app.task(name="app.tasks.compute_award_snapshots")
-def compute_award_snapshots():
-    from app.models import AwardSnapshot
+def compute_award_snapshots(full: bool = False):
+    """Recompute cached awards for this run's share of dirty friend groups.
+
+    ``full`` marks and recomputes every group (the admin trigger).
+    """
+    from app.services.award_groups import (
+        claim_dirty_groups,
+        clear_dirty_groups,
+        dirty_batch_size,
+        dirty_group_count,
+        group_members,
+        load_friend_graph,
+        mark_groups_dirty,
+        mark_stale_groups,
+        prune_orphaned_snapshots,
+        replace_group_snapshots,
+    )
     from app.services.awards import (
         ALL_COMPUTE_FUNCTIONS,
         get_friend_group_hash,
     )
 
+    cached_awards = {
+        "archaeologist",
+        "patient_zero",
+        "completionist",
+        "genre_snob",
+        "time_traveler",
+        "streak",
+        "hypebeast",
+    }
+
     db = SessionLocal()
     started_at = datetime.now(timezone.utc)
     try:
-        get_active_users(db)
-        all_users = db.query(User).all()
+        graph = load_friend_graph(db)
+        pruned = prune_orphaned_snapshots(db, graph)
+        if full:
+            mark_groups_dirty(db, list(graph))
+        else:
+            mark_stale_groups(db, graph)
+        db.commit()
+
+        pending = dirty_group_count(db)
+        claimed = claim_dirty_groups(db, pending if full else dirty_batch_size(pending))
         processed_groups = set()
+        failed_groups = set()
+        owner_groups = {}
         total_snapshots = 0
 
-        for u in all_users:
-            friend_ids = [
-                r[0] for r in db.execute(select(Friendship.user_id_2).where(Friendship.user_id_1 == u.user_id)).all()
-            ]
-            if not friend_ids:
+        for owner_id, _ in claimed:
+            group_ids = group_members(owner_id, graph)
+            if len(group_ids) < 2:
                 continue
 
-            group_ids = sorted([u.user_id] + friend_ids)
             group_hash = get_friend_group_hash(group_ids)
+            owner_groups[owner_id] = group_hash
 
             if group_hash in processed_groups:
                 continue
             processed_groups.add(group_hash)
 
-            cached_awards = {
-                "archaeologist",
-                "patient_zero",
-                "completionist",
-                "genre_snob",
-                "time_traveler",
-                "streak",
-                "hypebeast",
-            }
-            for award_id in cached_awards:
+            results = {}
+            for award_id in sorted(cached_awards):
                 fn = ALL_COMPUTE_FUNCTIONS.get(award_id)
                 if not fn:
                     continue
                 try:
-                    results = fn(db, group_ids)
-                    for entry in results:
-                        db.merge(
-                            AwardSnapshot(
-                                user_id=entry["user_id"],
-                                friend_group_hash=group_hash,
-                                award_id=award_id,
-                                rank=entry["rank"],
-                                stat_value=entry.get("stat_value"),
-                                stat_detail=entry.get("stat_detail"),
-                                entity_id=entry.get("entity_id"),
-                                entity_name=entry.get("entity_name"),
-                                computed_at=datetime.now(timezone.utc),
-                            )
-                        )
-                        total_snapshots += 1
+                    results[award_id] = fn(db, group_ids)
                 except Exception as e:
                     logger.warning(f"Failed to compute {award_id}: {e}")
                     db.rollback()
 
-            db.commit()
+            try:
+                total_snapshots += replace_group_snapshots(
+                    db, group_hash, results, datetime.now(timezone.utc)
+                )
+                db.commit()
+            except Exception as e:
+                logger.warning(f"Failed to write award snapshots for group {group_hash}: {e}")
+                db.rollback()
+                failed_groups.add(group_hash)
+
+        # Groups whose write failed stay dirty for the next run.
+        clear_dirty_groups(db, [c for c in claimed if owner_groups.get(c[0]) not in failed_groups])
+        db.commit()
 
         log_job_run(
             db, "compute_award_snapshots", None, started_at, datetime.now(timezone.utc), "success", total_snapshots
         )
-        logger.info(f"Computed {total_snapshots} award snapshots across {len(processed_groups)} groups")
+        logger.info(
+            f"Computed {total_snapshots} award snapshots across {len(processed_groups)} groups "
+            f"({pending - len(claimed)} dirty groups left for later runs, "
+            f"{pruned} orphaned groups pruned)"
+        )
     except Exception as e:
         db.rollback()
         logger.error(f"Failed to compute award snapshots: {e}")
@@ -309,20 +557,127 @@ def compute_award_snapshots():
         db.close()
 
 
+@celery_app.task(name="app.tasks.rebuild_listen_rollups")
+def rebuild_listen_rollups(full: bool = False):
+    """Rebuild the daily listen rollups of a batch of unbuilt or stale users.
+
+    ``full`` rebuilds every user (the admin trigger).
+    """
+    from app.services.listen_rollups import rebuild_user_rollups, users_due_for_rebuild
+
+    db = SessionLocal()
+    started_at = datetime.now(timezone.utc)
+    try:
+        if full:
+            user_ids = list(db.execute(select(User.user_id).order_by(User.user_id)).scalars())
+        else:
+            user_ids = users_due_for_rebuild(db, settings.listen_rollup_rebuild_batch)
+        rebuilt = 0
+        for user_id in user_ids:
+            try:
+                rebuild_user_rollups(db, user_id)
+                db.commit()
+                rebuilt += 1
+            except Exception as e:
+                logger.warning(f"Failed to rebuild listen rollups for {user_id}: {e}")
+                db.rollback()
+        log_job_run(db, "rebuild_listen_rollups", None, started_at, datetime.now(timezone.utc), "success", rebuilt)
+        logger.info(f"Rebuilt listen rollups for {rebuilt}/{len(user_ids)} users")
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to rebuild listen rollups: {e}")
+        log_job_run(db, "rebuild_listen_rollups", None, started_at, datetime.now(timezone.utc), "error")
+    finally:
+        db.close()
+
+
+@celery_app.task(name="app.tasks.refresh_listen_months")
+def refresh_listen_months():
+    """Re-aggregate a batch of dirty months of the global monthly listen rollups."""
+    from app.services.listen_months import claim_months, clear_months, refresh_months
+
+    db = SessionLocal()
+    started_at = datetime.now(timezone.utc)
+    try:
+        claimed = claim_months(db, settings.listen_month_refresh_batch)
+        refresh_months(db, [month for month, _ in claimed])
+        clear_months(db, claimed)
+        db.commit()
+        log_job_run(
+            db, "refresh_listen_months", None, started_at, datetime.now(timezone.utc), "success", len(claimed)
+        )
+        logger.info(f"Refreshed global listen rollups for {len(claimed)} months")
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to refresh global listen rollups: {e}")
+        log_job_run(db, "refresh_listen_months", None, started_at, datetime.now(timezone.utc), "error")
+    finally:
+        db.close()
+
+
+@celery_app.task(name="app.tasks.refresh_wrapped_snapshots")
+def refresh_wrapped_snapshots():
+    """Recompute a batch of stale Wrapped snapshots, oldest first."""
+    from app.routers.stats import _compute_wrapped
+    from app.services.wrapped_snapshots import stale_snapshots, store_wrapped
+
+    db = SessionLocal()
+    started_at = datetime.now(timezone.utc)
+    try:
+        due = stale_snapshots(db, settings.wrapped_snapshot_refresh_batch)
+        refreshed = 0
+        for user_id, year in due:
+            try:
+                computed_at = datetime.now(timezone.utc).replace(tzinfo=None)
+                result = _compute_wrapped(db, user_id, year)
+                store_wrapped(db, user_id, year, result.model_dump_json(), computed_at)
+                db.commit()
+                refreshed += 1
+            except Exception as e:
+                logger.warning(f"Failed to refresh Wrapped {year} for {user_id}: {e}")
+                db.rollback()
+        log_job_run(
+            db, "refresh_wrapped_snapshots", None, started_at, datetime.now(timezone.utc), "success", refreshed
+        )
+        logger.info(f"Refreshed {refreshed}/{len(due)} Wrapped snapshots")
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to refresh Wrapped snapshots: {e}")
+        log_job_run(db, "refresh_wrapped_snapshots", None, started_at, datetime.now(timezone.utc), "error")
+    finally:
+        db.close()
+
+
 @celery_app.task(name="app.tasks.process_backfill_upload", acks_late=True, reject_on_worker_lost=True)
 def process_backfill_upload(job_id: int, user_id: str, raw_listens: list | None = None):
+    """Ingest an uploaded export: validate and insert, enrich, then analyze.
+
+    The listens are parsed from the spooled upload named by the job's
+    ``upload_key``; ``raw_listens`` is only passed by tasks queued before
+    uploads were spooled.
+    """
     import json
-    import time
 
-    from app.models import JobRun, Track
-    from app.routers.backfill import _validate_and_process_listens
+    from fastapi import HTTPException
+
+    from app.models import JobRun
+    from app.routers.backfill import (
+        VALIDATION_BATCH_SIZE,
+        StreamingHistoryReader,
+        _validate_and_process_listens,
+    )
     from app.services.audit import log_action
-    from app.services.ingestion import get_tracks_missing_metadata, retroactively_validate_export_listens
-    from sqlalchemy.dialects import sqlite as sqlite_dialect
-    from sqlalchemy.dialects import postgresql as pg_dialect
+    from app.services.award_groups import mark_listeners_dirty
+    from app.services.dimensions import DimensionWriter
+    from app.services.enrichment_queue import enqueue_tracks_missing_metadata, pending_enrichment_count
+    from app.services.ingestion import retroactively_validate_export_listens
+    from app.services.listen_loader import load_listen_rows
+    from app.services.listen_rollups import refresh_user_days
+    from app.services.upload_spool import delete_spooled_upload, spool_path, spooled_upload_exists
     from spotipy.exceptions import SpotifyException as SpotifyExc
 
     db = SessionLocal()
+    upload_key = None
     try:
         job = db.query(JobRun).filter(JobRun.id == job_id).first()
         if not job:
@@ -341,12 +696,37 @@ def process_backfill_upload(job_id: int, user_id: str, raw_listens: list | None
         if not raw_listens:
             raw_listens = []
         prev_phase = details.get("phase", "")
-        resuming = not raw_listens and prev_phase in ("resuming", "enriching", "analyzing", "inserting")
+        if prev_phase == "resuming":
+            prev_phase = details.get("resumed_from", prev_phase)
+        upload_key = details.get("upload_key")
+
+        # Phase 1 (re)runs from the spooled upload unless it already finished;
+        # its inserts are idempotent, so an interrupted insert phase restarts.
+        export = None
+        if not raw_listens and upload_key and prev_phase not in ("enriching", "analyzing"):
+            if spooled_upload_exists(upload_key):
+                try:
+                    export = StreamingHistoryReader(spool_path(upload_key))
+                except HTTPException as e:
+                    job.status = "error"
+                    job.completed_at = datetime.now(timezone.utc)
+                    _update_job("error", 100, error=e.detail)
+                    delete_spooled_upload(upload_key)
+                    return
+
+        resuming = not raw_listens and export is None and prev_phase in (
+            "resuming",
+            "enriching",
+            "analyzing",
+            "inserting",
+        )
 
-        if not raw_listens and not resuming:
+        if not raw_listens and export is None and not resuming:
             job.status = "error"
             job.completed_at = datetime.now(timezone.utc)
             _update_job("error", 100, error="No listen data found in job")
+            if upload_key:
+                delete_spooled_upload(upload_key)
             return
 
         user_obj = db.query(User).filter(User.user_id == user_id).first()
@@ -361,125 +741,175 @@ def process_backfill_upload(job_id: int, user_id: str, raw_listens: list | None
         total_processed = details.get("total_listens", 0)
         total_accepted = inserted
 
+        def _insert_accepted(batch):
+            writer = DimensionWriter(db)
+            for listen, track_name in batch:
+                writer.add_track_stub(listen.track_id, track_name)
+            writer.flush()
+
+            seen_listens = set()
+            listen_rows = []
+            for listen, track_name in batch:
+                lk = (listen.user_id, listen.track_id, str(listen.ts))
+                if lk in seen_listens:
+                    continue
+                seen_listens.add(lk)
+                listen_rows.append(
+                    {
+                        "ts": listen.ts,
+                        "user_id": listen.user_id,
+                        "track_id": listen.track_id,
+                        "source": listen.source,
+                        "ms_played": listen.ms_played,
+                        "export_metadata": listen.export_metadata,
+                    }
+                )
+            count = load_listen_rows(db, listen_rows)
+            refresh_user_days(db, user_id, {row["ts"].date() for row in listen_rows})
+            batch_track_counts: dict = {}
+            for listen, _ in batch:
+                batch_track_counts[listen.track_id] = batch_track_counts.get(listen.track_id, 0) + 1
+            enqueue_tracks_missing_metadata(db, batch_track_counts)
+            return count
+
         # --- Phase 1: Validate and insert listens ---
+        # Records are consumed in fixed-size rounds straight from the export
+        # stream, so worker memory doesn't grow with the export.
         if not resuming:
-            _update_job("validating", 15, total_listens=len(raw_listens))
-            accepted, rejection_reasons = _validate_and_process_listens(raw_listens, user_obj, db)
-            total_processed = len(raw_listens)
-            total_accepted = len(accepted)
-            _update_job("inserting", 40, total_listens=total_processed, accepted_count=total_accepted)
-
+            _update_job("validating", 15)
+            records = iter(raw_listens) if raw_listens else iter(export)
             inserted = 0
-            batch_size = 500
-            for bi in range(0, len(accepted), batch_size):
-                db.refresh(job)
-                if job.status == "error":
-                    logger.info(f"Backfill job {job_id} was cancelled, stopping")
-                    return
-                batch = accepted[bi : bi + batch_size]
-                seen_tracks = set()
-                for listen, track_name in batch:
-                    if listen.track_id not in seen_tracks:
-                        seen_tracks.add(listen.track_id)
-                        if not db.query(Track).filter(Track.track_id == listen.track_id).first():
-                            db.merge(Track(track_id=listen.track_id, track_name=track_name))
-                db.flush()
-
-                seen_listens = set()
-                listen_rows = []
-                for listen, track_name in batch:
-                    lk = (listen.user_id, listen.track_id, str(listen.ts))
-                    if lk in seen_listens:
-                        continue
-                    seen_listens.add(lk)
-                    listen_rows.append(
-                        {
-                            "ts": listen.ts,
-                            "user_id": listen.user_id,
-                            "track_id": listen.track_id,
-                            "source": listen.source,
-                            "ms_played": listen.ms_played,
-                            "export_metadata": listen.export_metadata,
-                        }
-                    )
-                if listen_rows:
-                    dialect = db.get_bind().dialect.name
-                    tbl = Listen.__table__
-                    if dialect == "postgresql":
-                        stmt = pg_dialect.insert(tbl).values(listen_rows)
+            total_processed = 0
+            total_accepted = 0
+            rejection_reasons = {}
+            phase_started = time.perf_counter()
+            insert_seconds = 0.0
+            try:
+                while chunk := list(islice(records, VALIDATION_BATCH_SIZE)):
+                    db.refresh(job)
+                    if job.status == "error":
+                        logger.info(f"Backfill job {job_id} was cancelled, stopping")
+                        if upload_key:
+                            delete_spooled_upload(upload_key)
+                        return
+                    accepted, chunk_reasons = _validate_and_process_listens(chunk, user_obj, db)
+                    for reason, count in chunk_reasons.items():
+                        rejection_reasons[reason] = rejection_reasons.get(reason, 0) + count
+                    total_processed += len(chunk)
+                    total_accepted += len(accepted)
+                    # One chunk per round: COPY-merged on PostgreSQL, 500-row
+                    # statements elsewhere. Cancellation is checked between rounds.
+                    insert_started = time.perf_counter()
+                    inserted += _insert_accepted(accepted)
+                    db.commit()
+                    insert_seconds += time.perf_counter() - insert_started
+
+                    if export is not None:
+                        done = export.bytes_read / max(export.bytes_total, 1)
                     else:
-                        stmt = sqlite_dialect.insert(tbl).values(listen_rows)
-                    stmt = stmt.on_conflict_do_update(
-                        index_elements=["ts", "user_id", "track_id"],
-                        set_={"ms_played": stmt.excluded.ms_played},
-                        where=tbl.c.ms_played.is_(None),
+                        done = total_processed / len(raw_listens)
+                    # Records read per second for the whole phase, and accepted
+                    # rows written per second of insert time.
+                    _update_job(
+                        "inserting",
+                        15 + int(60 * min(done, 1.0)),
+                        inserted=inserted,
+                        total_listens=total_processed,
+                        accepted_count=total_accepted,
+                        rows_per_second=round(total_processed / max(time.perf_counter() - phase_started, 1e-6)),
+                        insert_rows_per_second=round(total_accepted / max(insert_seconds, 1e-6)),
                     )
-                    result = db.execute(stmt)
-                    inserted += result.rowcount
-                db.commit()
-                progress = 40 + int(35 * (bi + len(batch)) / max(total_accepted, 1))
-                _update_job("inserting", min(progress, 75), inserted=inserted)
+            finally:
+                if export is not None:
+                    export.close()
+
+            if not total_processed:
+                job.status = "error"
+                job.completed_at = datetime.now(timezone.utc)
+                _update_job("error", 100, error="No listen data found in job")
+                if upload_key:
+                    delete_spooled_upload(upload_key)
+                return
+
+            # Everything the later phases need is in the database now.
+            raw_listens = None
+            if upload_key:
+                delete_spooled_upload(upload_key)
+
+        if inserted:
+            mark_listeners_dirty(db, [user_id])
+            db.commit()
 
         # --- Phase 2: Enrich track metadata ---
-        all_unenriched = list(get_tracks_missing_metadata(db, limit=100000))
-        total_to_enrich = len(all_unenriched)
+        total_to_enrich = pending_enrichment_count(db)
         _update_job("enriching", 80, inserted=inserted, enrich_total=total_to_enrich, enrich_done=0)
 
         enriched = 0
         enrich_idx = 0
-        rate_limit_strikes = 0
+        enriched_ids: set = set()
+        lease_owner = f"backfill_upload:{job_id}"
         if total_to_enrich > 0 and user_obj.spotify_refresh_token:
             try:
-                service = SpotifyService()
-                refresh_token = decrypt_token(user_obj.spotify_refresh_token)
-                token_info = service.refresh_access_token(refresh_token)
-                client = service.get_client(token_info["access_token"])
-
-                while enrich_idx < total_to_enrich:
-                    db.refresh(job)
-                    if job.status == "error":
-                        logger.info(f"Backfill job {job_id} cancelled during enrichment")
-                        return
-                    batch = all_unenriched[enrich_idx : enrich_idx + 50]
-                    try:
-                        res = client.tracks(batch)
-                        if res and res.get("tracks"):
-                            items = [{"track": t} for t in res["tracks"] if t]
-                            service._enrich_with_genres(client, items)
-                            enriched += upsert_track_metadata(db, items)
-                        rate_limit_strikes = 0
-                        enrich_idx += 50
-                    except SpotifyExc as e:
-                        if e.http_status == 429:
-                            retry_after = (
-                                int(e.headers.get("Retry-After", 5)) if hasattr(e, "headers") and e.headers else 5
-                            )
-                            rate_limit_strikes += 1
-                            if rate_limit_strikes >= 5:
-                                logger.warning(f"Too many rate limits, stopping at {enriched}/{total_to_enrich}")
-                                break
-                            time.sleep(retry_after)
-                        elif e.http_status in (401, 403):
-                            try:
-                                token_info = service.refresh_access_token(refresh_token)
-                                client = service.get_client(token_info["access_token"])
-                            except Exception:
-                                logger.warning("Token refresh failed, stopping enrichment")
+                with request_priority(Priority.background):
+                    service = SpotifyService()
+                    client = service.get_client(get_access_token(db, service, user_obj))
+                    artist_cache = ArtistMetadataCache(db)
+
+                    while enrich_idx < total_to_enrich:
+                        db.refresh(job)
+                        if job.status == "error":
+                            logger.info(f"Backfill job {job_id} cancelled during enrichment")
+                            return
+                        batch = claim_enrichment_batch(db, lease_owner, 50)
+                        if not batch:
+                            break
+                        try:
+                            res = client.tracks(batch)
+                            got_ids: set = set()
+                            if res and res.get("tracks"):
+                                items = [{"track": t} for t in res["tracks"] if t]
+                                service._enrich_with_genres(client, items, artist_cache)
+                                enriched += upsert_track_metadata(db, items)
+                                got_ids = {item["track"]["id"] for item in items if item["track"].get("id")}
+                            complete_enrichment(db, got_ids & set(batch))
+                            fail_enrichment(db, set(batch) - got_ids)
+                            enriched_ids.update(batch)
+                            enrich_idx += len(batch)
+                        except SpotifyExc as e:
+                            if e.http_status == 429:
+                                # The governor already waited out Retry-After; a 429 here
+                                # means the breaker is open. Leave the rest queued for
+                                # backfill_track_metadata.
+                                release_enrichment(db, batch)
+                                logger.warning(
+                                    f"Spotify rate limited, leaving {total_to_enrich - enrich_idx} tracks queued "
+                                    f"after {enriched}/{total_to_enrich}"
+                                )
                                 break
-                        else:
-                            enrich_idx += 50
-                    except Exception as e:
-                        logger.warning(f"Error during enrichment batch: {e}")
-                        db.rollback()
-                        enrich_idx += 50
-                    progress = 80 + int(15 * min(enrich_idx, total_to_enrich) / total_to_enrich)
-                    _update_job("enriching", min(progress, 95), enrich_total=total_to_enrich, enrich_done=enriched)
+                            elif e.http_status in (401, 403):
+                                release_enrichment(db, batch)
+                                try:
+                                    client = service.get_client(
+                                        get_access_token(db, service, user_obj, force_refresh=True)
+                                    )
+                                except Exception:
+                                    logger.warning("Token refresh failed, stopping enrichment")
+                                    break
+                            else:
+                                fail_enrichment(db, batch)
+                                enrich_idx += len(batch)
+                        except Exception as e:
+                            logger.warning(f"Error during enrichment batch: {e}")
+                            db.rollback()
+                            fail_enrichment(db, batch)
+                            enrich_idx += len(batch)
+                        progress = 80 + int(15 * min(enrich_idx, total_to_enrich) / total_to_enrich)
+                        _update_job("enriching", min(progress, 95), enrich_total=total_to_enrich, enrich_done=enriched)
             except Exception as e:
                 logger.warning(f"Enrichment setup failed: {e}")
 
         # --- Phase 3: Retroactive validation ---
         if enriched > 0:
-            enriched_ids = set(all_unenriched[: min(enrich_idx, total_to_enrich)])
             removed = retroactively_validate_export_listens(db, enriched_ids)
             if removed:
                 logger.info(f"Removed {removed} pre-release listens after enrichment")
@@ -537,6 +967,8 @@ def process_backfill_upload(job_id: int, user_id: str, raw_listens: list | None
                 db.commit()
         except Exception:
             pass
+        if upload_key:
+            delete_spooled_upload(upload_key)
     finally:
         db.close()
 
@@ -544,9 +976,7 @@ def process_backfill_upload(job_id: int, user_id: str, raw_listens: list | None
 def _get_working_access_token(db, service: SpotifyService, users: list) -> str | None:
     for user in users:
         try:
-            refresh_token = decrypt_token(user.spotify_refresh_token)
-            token_info = service.refresh_access_token(refresh_token)
-            return token_info["access_token"]
+            return get_access_token(db, service, user)
         except Exception as e:
             if _is_token_revoked(e):
                 _deactivate_user(db, user, f"token revoked ({e})")
@@ -1,10 +1,11 @@
+from contextlib import contextmanager
 from datetime import datetime, timezone
 
 import pytest
 from fastapi.testclient import TestClient
 from jose import jwt
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy.pool import StaticPool
 
 from app.config import settings
@@ -38,6 +39,49 @@ def _reset_rate_limiter():
     yield
 
 
+@pytest.fixture(autouse=True)
+def _reset_dimension_cache():
+    """Each test gets a fresh DB, so cached dimension keys must not leak across tests."""
+    from app.services.dimension_cache import reset_dimension_cache
+
+    reset_dimension_cache()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def _reset_token_cache():
+    """Cached access tokens are keyed by user id, which tests reuse."""
+    from app.services.token_cache import reset_token_cache
+
+    reset_token_cache()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def _reset_response_cache():
+    """Each test gets a fresh DB whose data versions restart at 0."""
+    from app.services.response_cache import reset_response_cache
+
+    reset_response_cache()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def _reset_spotify_governor():
+    """A 429 pause or open breaker from one test must not throttle the next."""
+    from app.services.spotify_governor import reset_spotify_governor
+
+    reset_spotify_governor()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def _upload_spool_dir(tmp_path, monkeypatch):
+    """Spooled uploads go to a per-test directory instead of db/uploads."""
+    monkeypatch.setattr(settings, "upload_spool_dir", str(tmp_path / "uploads"))
+    yield
+
+
 @pytest.fixture()
 def db():
     Base.metadata.create_all(bind=TEST_ENGINE)
@@ -49,6 +93,31 @@ def db():
         Base.metadata.drop_all(bind=TEST_ENGINE)
 
 
+@pytest.fixture()
+def capture_statements():
+    """Collect the SQL sent through a session's or engine's connection.
+
+    ``with capture_statements(db) as statements:`` fills ``statements`` with
+    every statement executed inside the block (a proxy for round trips).
+    """
+
+    @contextmanager
+    def _capture(target):
+        bind = target.get_bind() if isinstance(target, Session) else target
+        statements = []
+
+        def _on_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(bind, "before_cursor_execute", _on_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(bind, "before_cursor_execute", _on_execute)
+
+    return _capture
+
+
 @pytest.fixture()
 def client(db):
     def _override_get_db():
@@ -74,6 +74,16 @@ class TestAdminTriggerAwards:
         assert resp.json()["task"] == "compute_award_snapshots"
 
 
+class TestAdminTriggerRollups:
+    @patch("app.tasks.rebuild_listen_rollups")
+    def test_triggers_full_rebuild(self, mock_task, client, admin_headers, admin_user):
+        mock_task.delay = MagicMock()
+        resp = client.post("/admin/trigger-rollups", headers=admin_headers)
+        assert resp.status_code == 200
+        assert resp.json()["task"] == "rebuild_listen_rollups"
+        mock_task.delay.assert_called_once_with(full=True)
+
+
 class TestAdminTrustScore:
     def test_returns_trust_data(self, client, admin_headers, admin_user, seeded_db):
         resp = client.get("/admin/trust-score", headers=admin_headers)
@@ -127,3 +137,30 @@ class TestForceLogout:
     def test_requires_auth(self, client):
         resp = client.post("/admin/force-logout-all")
         assert resp.status_code in (401, 403)
+
+
+class TestAdminCacheStats:
+    def test_reports_dimension_cache_stats(self, client, admin_headers, admin_user):
+        resp = client.get("/admin/cache-stats", headers=admin_headers)
+        assert resp.status_code == 200
+        stats = resp.json()["dimensions"]
+        assert {"size", "max_size", "hits", "misses", "hit_rate"} <= set(stats)
+        assert {"cached_users", "hits", "refreshes"} <= set(resp.json()["access_tokens"])
+
+    def test_rejects_non_admin(self, client, auth_headers, test_user):
+        resp = client.get("/admin/cache-stats", headers=auth_headers)
+        assert resp.status_code == 403
+
+
+class TestAdminSpotifyBudget:
+    def test_reports_governor_usage(self, client, admin_headers, admin_user):
+        resp = client.get("/admin/spotify-budget", headers=admin_headers)
+        assert resp.status_code == 200
+        stats = resp.json()
+        assert stats["backend"] == "local"
+        assert stats["breaker_open"] is False
+        assert set(stats["requests"]) == {"interactive", "poll", "background"}
+
+    def test_rejects_non_admin(self, client, auth_headers, test_user):
+        resp = client.get("/admin/spotify-budget", headers=auth_headers)
+        assert resp.status_code == 403
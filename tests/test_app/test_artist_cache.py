@@ -0,0 +1,120 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+
+from app.models import Artist, ArtistGenre
+from app.services.artist_cache import ArtistMetadataCache
+from app.services.spotify import SpotifyService
+
+
+def _service():
+    # _enrich_with_genres never touches OAuth state, so skip SpotifyOAuth setup.
+    return SpotifyService.__new__(SpotifyService)
+
+
+def _now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _full_artist(artist_id, genres=("rock",)):
+    return {
+        "id": artist_id,
+        "name": f"Artist {artist_id}",
+        "genres": list(genres),
+        "images": [{"url": f"https://img/{artist_id}", "width": 300}],
+    }
+
+
+def _client(*artists):
+    client = MagicMock()
+    by_id = {a["id"]: a for a in artists}
+    client.artists.side_effect = lambda ids: {"artists": [by_id.get(i) for i in ids]}
+    return client
+
+
+def _items(*artist_ids):
+    return [{"track": {"id": f"trk_{aid}", "artists": [{"id": aid, "name": aid}]}} for aid in artist_ids]
+
+
+def _stored_artist(db, artist_id, refreshed_at, genres=("jazz",)):
+    db.add(Artist(artist_id=artist_id, artist_name=artist_id, image_url=f"https://img/{artist_id}",
+                  metadata_refreshed_at=refreshed_at))
+    for genre in genres:
+        db.add(ArtistGenre(artist_id=artist_id, genre=genre))
+    db.commit()
+
+
+class TestArtistMetadataCache:
+    def test_fresh_artists_are_served_from_the_database(self, db):
+        _stored_artist(db, "art_1", _now())
+        client = _client()
+        cache = ArtistMetadataCache(db)
+        items = _items("art_1")
+
+        _service()._enrich_with_genres(client, items, cache)
+
+        client.artists.assert_not_called()
+        artist = items[0]["track"]["artists"][0]
+        assert artist["genres"] == ["jazz"]
+        assert artist["images"] == [{"url": "https://img/art_1"}]
+        assert cache.api_calls_saved == 1
+
+    def test_unknown_artists_are_fetched_and_stamped(self, db):
+        client = _client(_full_artist("art_1"))
+        cache = ArtistMetadataCache(db)
+        items = _items("art_1")
+
+        _service()._enrich_with_genres(client, items, cache)
+        db.commit()
+
+        assert client.artists.call_count == 1
+        assert items[0]["track"]["artists"][0]["genres"] == ["rock"]
+        stored = db.get(Artist, "art_1")
+        assert stored.metadata_refreshed_at is not None
+        assert [g.genre for g in db.query(ArtistGenre).all()] == ["rock"]
+
+    def test_artists_without_a_full_fetch_are_always_fetched(self, db):
+        db.add(Artist(artist_id="art_1", artist_name="From a track payload"))
+        db.commit()
+        client = _client(_full_artist("art_1"))
+
+        _service()._enrich_with_genres(client, _items("art_1"), ArtistMetadataCache(db, refresh_budget=0))
+
+        assert client.artists.call_count == 1
+
+    def test_stale_refreshes_respect_the_budget(self, db):
+        stale = _now() - timedelta(days=30)
+        for aid in ("art_1", "art_2", "art_3"):
+            _stored_artist(db, aid, stale)
+        cache = ArtistMetadataCache(db, refresh_budget=2)
+
+        cached, to_fetch = cache.lookup(["art_1", "art_2", "art_3"])
+
+        assert to_fetch == ["art_1", "art_2"]
+        assert set(cached) == {"art_3"}
+        assert cache.refresh_budget == 0
+
+    def test_fetched_artists_are_reused_within_the_cycle(self, db):
+        client = _client(_full_artist("art_1"))
+        cache = ArtistMetadataCache(db)
+        service = _service()
+
+        service._enrich_with_genres(client, _items("art_1"), cache)
+        second = _items("art_1")
+        service._enrich_with_genres(client, second, cache)
+
+        assert client.artists.call_count == 1
+        assert second[0]["track"]["artists"][0]["genres"] == ["rock"]
+        assert cache.stats() == {
+            "artists_requested": 2,
+            "artists_fetched": 1,
+            "api_calls": 1,
+            "api_calls_saved": 1,
+        }
+
+    def test_without_cache_every_artist_is_fetched(self, db):
+        _stored_artist(db, "art_1", _now())
+        client = _client(_full_artist("art_1"))
+
+        _service()._enrich_with_genres(client, _items("art_1"))
+
+        assert client.artists.call_count == 1
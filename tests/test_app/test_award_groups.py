@@ -0,0 +1,257 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+from sqlalchemy import or_
+
+from app.config import settings
+from app.models import AwardDirtyGroup, AwardSnapshot, Friendship, User
+from app.services.award_groups import (
+    claim_dirty_groups,
+    clear_dirty_groups,
+    dirty_batch_size,
+    load_friend_graph,
+    mark_groups_dirty,
+    mark_listeners_dirty,
+    mark_stale_groups,
+    prune_orphaned_snapshots,
+    replace_group_snapshots,
+)
+from app.routers.awards import LEADERBOARD_SIZE, _get_cached
+from app.services.awards import get_friend_group_hash
+from app.services.ingestion import upsert_from_recent_listens
+from app.tasks import compute_award_snapshots
+
+CACHED = ("archaeologist", "patient_zero", "completionist", "genre_snob", "time_traveler", "streak", "hypebeast")
+
+
+def _befriend(db, a, b):
+    now = datetime(2024, 1, 1)
+    db.add(Friendship(user_id_1=a, user_id_2=b, created_at=now))
+    db.add(Friendship(user_id_1=b, user_id_2=a, created_at=now))
+
+
+def _users(db, *user_ids):
+    for user_id in user_ids:
+        db.add(User(user_id=user_id, user_name=user_id))
+    db.commit()
+
+
+def _dirty(db):
+    return {row.owner_user_id for row in db.query(AwardDirtyGroup).all()}
+
+
+class TestMarking:
+    def test_listener_marks_own_and_friends_groups(self, db):
+        _users(db, "a", "b", "c", "d")
+        _befriend(db, "a", "b")
+        _befriend(db, "a", "c")
+        db.commit()
+
+        mark_listeners_dirty(db, ["a"])
+        db.commit()
+        assert _dirty(db) == {"a", "b", "c"}
+
+        mark_listeners_dirty(db, ["d"])
+        db.commit()
+        assert _dirty(db) == {"a", "b", "c", "d"}
+
+    def test_new_listens_mark_groups_in_the_ingest_transaction(self, db):
+        _users(db, "a", "b")
+        _befriend(db, "a", "b")
+        db.commit()
+        item = {
+            "track": {"id": "trk_1", "name": "T", "artists": [{"id": "art_1", "name": "A"}]},
+            "played_at": "2024-06-15T10:00:00.000000Z",
+        }
+
+        upsert_from_recent_listens(db, [item], "a")
+        assert _dirty(db) == {"a", "b"}
+
+        db.query(AwardDirtyGroup).delete()
+        db.commit()
+        upsert_from_recent_listens(db, [item], "a")  # nothing new
+        assert _dirty(db) == set()
+
+    def test_remark_keeps_dirty_since_and_survives_clearing(self, db):
+        _users(db, "a")
+        mark_groups_dirty(db, ["a"])
+        db.commit()
+        claimed = claim_dirty_groups(db, 10)
+        first = db.get(AwardDirtyGroup, "a")
+        dirty_since = first.dirty_since
+
+        mark_groups_dirty(db, ["a"])  # new listens while the group is computed
+        db.commit()
+        db.expire_all()
+        clear_dirty_groups(db, claimed)
+        db.commit()
+
+        remaining = db.get(AwardDirtyGroup, "a")
+        assert remaining is not None
+        assert remaining.dirty_since == dirty_since
+
+        clear_dirty_groups(db, claim_dirty_groups(db, 10))
+        db.commit()
+        assert _dirty(db) == set()
+
+    def test_stale_sweep_only_marks_groups_without_fresh_snapshots(self, db):
+        _users(db, "a", "b", "c", "d")
+        _befriend(db, "a", "b")
+        _befriend(db, "c", "d")
+        db.commit()
+        fresh = get_friend_group_hash(["a", "b"])
+        old = get_friend_group_hash(["c", "d"])
+        now = datetime.now(timezone.utc)
+        db.add(AwardSnapshot(user_id="a", friend_group_hash=fresh, award_id="streak", rank=1, computed_at=now))
+        db.add(
+            AwardSnapshot(
+                user_id="c",
+                friend_group_hash=old,
+                award_id="streak",
+                rank=1,
+                computed_at=now - timedelta(hours=settings.award_snapshot_max_age_hours + 1),
+            )
+        )
+        db.commit()
+
+        assert mark_stale_groups(db, load_friend_graph(db)) == 2
+        db.commit()
+        assert _dirty(db) == {"c", "d"}
+
+    def test_batch_size_spreads_backlog_across_the_interval(self, monkeypatch):
+        monkeypatch.setattr(settings, "award_snapshot_interval_seconds", 21600)
+        monkeypatch.setattr(settings, "award_snapshot_tick_seconds", 900)
+        assert dirty_batch_size(0) == 0
+        assert dirty_batch_size(1) == 1
+        assert dirty_batch_size(240) == 10
+        assert dirty_batch_size(241) == 11
+
+
+class TestIncrementalSnapshots:
+    def _run(self, db, **kwargs):
+        computed = []
+
+        def _stub(db_, group_ids):
+            computed.append(tuple(group_ids))
+            return [{"user_id": group_ids[0], "rank": 1, "stat_value": 1.0}]
+
+        with patch("app.tasks.SessionLocal", return_value=db), patch.dict(
+            "app.services.awards.ALL_COMPUTE_FUNCTIONS", {award_id: _stub for award_id in CACHED}, clear=True
+        ):
+            compute_award_snapshots(**kwargs)
+        return set(computed)
+
+    def test_only_dirty_groups_are_recomputed(self, db, monkeypatch):
+        monkeypatch.setattr(settings, "award_snapshot_tick_seconds", settings.award_snapshot_interval_seconds)
+        ids = [f"u{i:03d}" for i in range(100)]
+        _users(db, *ids)
+        for i in range(0, 100, 2):
+            _befriend(db, ids[i], ids[i + 1])
+        db.commit()
+
+        assert len(self._run(db, full=True)) == 50
+        assert _dirty(db) == set()
+        assert self._run(db) == set()
+
+        mark_listeners_dirty(db, ["u010"])
+        db.commit()
+        assert self._run(db) == {("u010", "u011")}
+        assert _dirty(db) == set()
+
+    def test_friend_graph_is_loaded_once_per_run(self, db, capture_statements):
+        ids = [f"u{i:03d}" for i in range(40)]
+        _users(db, *ids)
+        for i in range(1, 40):
+            _befriend(db, ids[0], ids[i])
+        db.commit()
+
+        with capture_statements(db) as statements:
+            self._run(db, full=True)
+
+        assert sum("from friendships" in sql.lower() for sql in statements) == 1
+
+    def test_staggered_runs_drain_the_backlog_oldest_first(self, db, monkeypatch):
+        monkeypatch.setattr(settings, "award_snapshot_interval_seconds", 3600)
+        monkeypatch.setattr(settings, "award_snapshot_tick_seconds", 900)
+        ids = [f"u{i:03d}" for i in range(16)]
+        _users(db, *ids)
+        for i in range(0, 16, 2):
+            _befriend(db, ids[i], ids[i + 1])
+        db.commit()
+        self._run(db, full=True)
+        for i, owner in enumerate(ids):
+            mark_groups_dirty(db, [owner])
+            db.commit()
+            db.get(AwardDirtyGroup, owner).dirty_since = datetime(2024, 1, 1) + timedelta(minutes=i)
+        db.commit()
+
+        first = self._run(db)
+        assert first == {("u000", "u001"), ("u002", "u003")}
+        assert len(_dirty(db)) == 12
+
+
+class TestSnapshotStorage:
+    def _snapshot_rows(self, db):
+        return db.query(AwardSnapshot).count()
+
+    def test_repeated_runs_replace_rather_than_append(self, db):
+        _users(db, "a", "b")
+        _befriend(db, "a", "b")
+        db.commit()
+
+        def _both(db_, group_ids):
+            return [{"user_id": uid, "rank": i + 1, "stat_value": float(i)} for i, uid in enumerate(group_ids)]
+
+        with patch("app.tasks.SessionLocal", return_value=db), patch.dict(
+            "app.services.awards.ALL_COMPUTE_FUNCTIONS", {award_id: _both for award_id in CACHED}, clear=True
+        ):
+            compute_award_snapshots(full=True)
+            compute_award_snapshots(full=True)
+
+        assert self._snapshot_rows(db) == len(CACHED) * 2
+
+    def test_replace_keeps_awards_missing_from_results(self, db):
+        _users(db, "a", "b")
+        now = datetime(2024, 1, 1)
+        replace_group_snapshots(
+            db, "h", {"streak": [{"user_id": "a", "rank": 1}], "hypebeast": [{"user_id": "b", "rank": 1}]}, now
+        )
+        db.commit()
+
+        written = replace_group_snapshots(
+            db, "h", {"streak": [{"user_id": "b", "rank": 1}, {"user_id": "b", "rank": 2}]}, now
+        )
+        db.commit()
+
+        assert written == 1
+        rows = {(r.award_id, r.user_id) for r in db.query(AwardSnapshot).all()}
+        assert rows == {("streak", "b"), ("hypebeast", "b")}
+
+    def test_orphaned_groups_are_pruned(self, db):
+        _users(db, "a", "b", "c")
+        _befriend(db, "a", "b")
+        db.commit()
+        old = get_friend_group_hash(["a", "b"])
+        replace_group_snapshots(db, old, {"streak": [{"user_id": "a", "rank": 1}]}, datetime(2024, 1, 1))
+        db.commit()
+
+        assert prune_orphaned_snapshots(db, load_friend_graph(db)) == 0
+        _befriend(db, "a", "c")  # a's group is now {a, b, c}; b's stays {a, b}
+        db.commit()
+        assert prune_orphaned_snapshots(db, load_friend_graph(db)) == 0
+
+        db.query(Friendship).filter(or_(Friendship.user_id_1 == "b", Friendship.user_id_2 == "b")).delete()
+        db.commit()
+        assert prune_orphaned_snapshots(db, load_friend_graph(db)) == 1
+        db.commit()
+        assert self._snapshot_rows(db) == 0
+
+    def test_cached_reads_are_bounded_by_leaderboard_size(self, db):
+        ids = [f"u{i:03d}" for i in range(50)]
+        _users(db, *ids)
+        entries = [{"user_id": uid, "rank": i + 1} for i, uid in enumerate(ids)]
+        replace_group_snapshots(db, "h", {"streak": entries}, datetime(2024, 1, 1))
+        db.commit()
+
+        cached = _get_cached(db, "h", ["u040"])
+        assert [e["user_id"] for e in cached["streak"]] == ids[:LEADERBOARD_SIZE] + ["u040"]
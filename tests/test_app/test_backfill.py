@@ -1,15 +1,22 @@
 import io
 import json
+import tracemalloc
 import zipfile
 from unittest.mock import patch, MagicMock
-from datetime import date
 
-from app.models import Album, Listen, ListenSource, Track
+import pytest
+from sqlalchemy import insert
+from datetime import date, datetime, timedelta
+
+from app.models import Album, JobRun, Listen, ListenSource, Track
 from app.routers.backfill import (
+    StreamingHistoryReader,
     _extract_json_from_zip,
+    _iter_json_array,
     _is_basic_export,
     _validate_and_process_listens,
 )
+from app.services.upload_spool import spool_path
 
 
 def _make_zip(files: dict[str, list[dict]]) -> io.BytesIO:
@@ -90,6 +97,57 @@ class TestUploadEndpoint:
         assert "Extended streaming history" in resp.json()["detail"]
 
 
+class TestUploadSpooling:
+    @patch("app.celery_app.celery_app.send_task")
+    def test_upload_is_spooled_and_only_a_reference_is_queued(self, mock_send, client, seeded_db, auth_headers):
+        listens = [_make_listen_json(track_id=f"track_{i}") for i in range(2000)]
+        content = _make_zip_bytes({"Streaming_History_Audio_0.json": listens})
+        resp = client.post(
+            "/backfill/upload",
+            headers=auth_headers,
+            files={"file": ("data.zip", content, "application/zip")},
+        )
+        assert resp.status_code == 200
+
+        job = seeded_db.get(JobRun, resp.json()["job_id"])
+        details = json.loads(job.details)
+        assert spool_path(details["upload_key"]).read_bytes() == content
+        assert details["size_bytes"] == len(content)
+
+        args = mock_send.call_args.kwargs["args"]
+        assert args == [job.id, "test_user_1"]
+        assert len(json.dumps(args)) < 100
+
+    def test_rejected_uploads_leave_nothing_spooled(self, client, seeded_db, auth_headers, tmp_path):
+        basic = _make_zip({"StreamingHistory_music_0.json": [{"msPlayed": 1}]})
+        resp = client.post(
+            "/backfill/upload",
+            headers=auth_headers,
+            files={"file": ("data.zip", basic, "application/zip")},
+        )
+        assert resp.status_code == 400
+
+        resp = client.post(
+            "/backfill/upload",
+            headers=auth_headers,
+            files={"file": ("data.zip", b"not really a zip", "application/zip")},
+        )
+        assert resp.status_code == 400
+        assert list((tmp_path / "uploads").iterdir()) == []
+
+    def test_oversized_upload_is_rejected_while_streaming(self, client, seeded_db, auth_headers, tmp_path):
+        content = _make_zip_bytes({"Streaming_History_Audio_0.json": [_make_listen_json()]})
+        with patch("app.routers.backfill.MAX_UPLOAD_BYTES", len(content) - 1):
+            resp = client.post(
+                "/backfill/upload",
+                headers=auth_headers,
+                files={"file": ("data.zip", content, "application/zip")},
+            )
+        assert resp.status_code == 400
+        assert "too large" in resp.json()["detail"]
+        assert list((tmp_path / "uploads").iterdir()) == []
+
+
 class TestBasicExportDetection:
     def test_detects_basic_streaming_history_file(self):
         content = _make_zip_bytes({
@@ -126,6 +184,11 @@ class TestExtractJson:
         result = _extract_json_from_zip(content)
         assert len(result) == 0
 
+    def test_extracts_from_a_path(self, tmp_path):
+        path = tmp_path / "export.zip"
+        path.write_bytes(_make_zip_bytes({"Streaming_History_Audio_0.json": [_make_listen_json()]}))
+        assert len(_extract_json_from_zip(path)) == 1
+
     def test_handles_nested_paths(self):
         content = _make_zip_bytes({
             "my_spotify_data/Streaming_History_Audio_0.json": [_make_listen_json()],
@@ -134,6 +197,87 @@ class TestExtractJson:
         assert len(result) == 1
 
 
+class TestStreamingParse:
+    @pytest.fixture(autouse=True)
+    def _tiny_chunks(self, monkeypatch):
+        # Force tokens, numbers and multi-byte characters across chunk boundaries.
+        monkeypatch.setattr("app.routers.backfill.JSON_READ_CHUNK_BYTES", 7)
+
+    def _parse(self, raw: bytes):
+        return list(_iter_json_array(io.BytesIO(raw)))
+
+    def test_matches_json_loads(self):
+        data = [
+            {"ts": "2024-06-15T10:30:00Z", "ms_played": 123456, "name": "a, [b] {c} \"d\""},
+            {"name": "Sigur Rós — Hoppípolla 🎵", "skipped": None, "shuffle": True},
+            12345678901234567890,
+            [],
+            {},
+            -1.5e10,
+        ]
+        raw = json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+        assert self._parse(raw) == data
+        assert self._parse(b"\xef\xbb\xbf" + raw) == data
+
+    def test_empty_and_non_array_documents_yield_nothing(self):
+        assert self._parse(b"  [ ]  ") == []
+        assert self._parse(b"") == []
+        assert self._parse(b'{"ts": "2024-06-15T10:30:00Z"}') == []
+
+    def test_malformed_array_raises_after_good_records(self):
+        parsed = []
+        with pytest.raises(json.JSONDecodeError):
+            for record in _iter_json_array(io.BytesIO(b'[{"a": 1}, {"b": 2} {"c": 3}]')):
+                parsed.append(record)
+        assert parsed == [{"a": 1}, {"b": 2}]
+
+        with pytest.raises(json.JSONDecodeError):
+            self._parse(b'[{"a": 1}, {"b": ')
+
+    def test_malformed_element_fails_without_reading_the_rest(self):
+        raw = b'[{"a": 1}, {"b": tru}, ' + b'{"c": 3}, ' * 10000 + b"{}]"
+        read = []
+
+        with pytest.raises(json.JSONDecodeError):
+            list(_iter_json_array(io.BytesIO(raw), on_read=read.append))
+        assert sum(read) < 64
+
+    def test_literals_cut_at_the_chunk_edge_still_parse(self):
+        data = [True, False, None, {"k": "\u00e9"}, float("-inf")]
+        for pad in range(8):
+            raw = b"[" + b" " * pad + json.dumps(data).encode()[1:]
+            assert self._parse(raw) == data
+
+    def test_reader_skips_the_rest_of_a_malformed_member(self):
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w") as zf:
+            zf.writestr("Streaming_History_Audio_0.json", '[{"a": 1}, {"b": ')
+            zf.writestr("Streaming_History_Audio_1.json", json.dumps([{"c": 3}]))
+        with StreamingHistoryReader(buf.getvalue()) as reader:
+            assert list(reader) == [{"a": 1}, {"c": 3}]
+            assert reader.bytes_read == reader.bytes_total
+
+
+class TestStreamingMemory:
+    def test_peak_memory_does_not_grow_with_export_size(self):
+        def peak(n):
+            listens = [_make_listen_json(track_id=f"track_{i}", extra_fields={"platform": "x" * 200}) for i in range(n)]
+            content = _make_zip_bytes({"Streaming_History_Audio_0.json": listens})
+            del listens
+            tracemalloc.start()
+            try:
+                with StreamingHistoryReader(content) as reader:
+                    count = sum(1 for _ in reader)
+                return tracemalloc.get_traced_memory()[1], count
+            finally:
+                tracemalloc.stop()
+
+        small, small_count = peak(2000)
+        large, large_count = peak(16000)
+        assert (small_count, large_count) == (2000, 16000)
+        assert large < small * 2
+
+
 class TestValidateListens:
     def test_accepts_valid_listen(self, seeded_db, test_user):
         listens = [_make_listen_json("new_trk", "New", "2024-01-01T10:00:00Z")]
@@ -167,6 +311,17 @@ class TestValidateListens:
         accepted, reasons = _validate_and_process_listens(listens, test_user, seeded_db)
         assert reasons["invalid_uri_format"] == 1
 
+    def test_timestamps_must_match_the_export_format(self, seeded_db, test_user):
+        listens = [
+            _make_listen_json(ts="2024-06-15T10:30:00Z"),
+            _make_listen_json(ts="2024-W24-6T10:30:00Z"),
+            _make_listen_json(ts="2024-02-30T10:30:00Z"),
+            _make_listen_json(ts=1718447400),
+        ]
+        accepted, reasons = _validate_and_process_listens(listens, test_user, seeded_db)
+        assert [lis.ts for lis, _ in accepted] == [datetime(2024, 6, 15, 10, 30)]
+        assert reasons == {"invalid_timestamp": 3}
+
     def test_rejects_before_release_date(self, seeded_db, test_user):
         album = seeded_db.query(Album).filter(Album.album_id == "album_1").first()
         album.release_date = date(2024, 6, 1)
@@ -202,6 +357,59 @@ class TestValidateListens:
         assert listen.source == ListenSource.export.value
 
 
+class TestApiDuplicates:
+    def _api_listens(self, db, user_id, keys):
+        db.execute(
+            insert(Listen),
+            [
+                {"ts": ts, "user_id": user_id, "track_id": track_id, "source": ListenSource.api.value}
+                for track_id, ts in keys
+            ],
+        )
+        db.commit()
+
+    def test_skips_listens_already_recorded_by_the_api(self, db, test_user):
+        self._api_listens(
+            db,
+            test_user.user_id,
+            [("trk_a", datetime(2024, 6, 1, 10, 0)), ("trk_b", datetime(2024, 6, 2, 10, 0))],
+        )
+        listens = [
+            _make_listen_json("trk_a", ts="2024-06-01T10:00:00Z"),  # duplicate
+            _make_listen_json("trk_b", ts="2024-06-01T10:00:00Z"),  # same ts, other track
+            _make_listen_json("trk_b", ts="2024-06-02T10:00:00Z"),  # duplicate
+            _make_listen_json("trk_c", ts="2024-05-01T10:00:00Z"),  # before the API range
+        ]
+
+        accepted, reasons = _validate_and_process_listens(listens, test_user, db)
+
+        assert [(lis.track_id, lis.ts.day) for lis, _ in accepted] == [("trk_b", 1), ("trk_c", 1)]
+        assert reasons == {}
+
+    def test_large_export_overlapping_api_history_uses_constant_queries(self, db, test_user, capture_statements):
+        # 300k export listens, the last 50k of which the poller already recorded.
+        start = datetime(2020, 1, 1)
+        keys = [(f"trk_{i % 1000}", start + timedelta(minutes=5 * i)) for i in range(300_000)]
+        self._api_listens(db, test_user.user_id, keys[-50_000:])
+        listens = [
+            {
+                "ts": ts.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "ms_played": 60000,
+                "master_metadata_track_name": track_id,
+                "spotify_track_uri": f"spotify:track:{track_id}",
+            }
+            for track_id, ts in keys
+        ]
+
+        db.refresh(test_user)
+        with capture_statements(db) as statements:
+            accepted, _ = _validate_and_process_listens(listens, test_user, db)
+
+        assert len(accepted) == 250_000
+        # Track lookups (2 chunks of 500 ids), the API range, and one key load.
+        assert len(statements) == 4
+
+
 class TestUploadStatus:
     @patch("app.celery_app.celery_app.send_task")
     def test_upload_status_after_upload(self, mock_send, client, seeded_db, auth_headers):
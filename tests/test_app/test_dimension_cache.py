@@ -0,0 +1,95 @@
+from unittest.mock import MagicMock, patch
+
+from app.models import Artist, Track
+from app.services.dimension_cache import KnownDimensionCache, known_dimensions
+from app.services.dimensions import DimensionWriter
+
+
+def _track_payload(track_id="trk_1", name="Track"):
+    return {
+        "id": track_id,
+        "name": name,
+        "album": {"id": "alb_1", "name": "Album", "release_date": "2020-01-01"},
+        "artists": [{"id": "art_1", "name": "Artist", "genres": ["rock"]}],
+        "duration_ms": 200000,
+        "is_local": False,
+    }
+
+def _write(db, *payloads):
+    writer = DimensionWriter(db)
+    for p in payloads:
+        writer.add_track(p)
+    writer.flush()
+    db.commit()
+
+
+class TestKnownDimensionCache:
+    def test_unchanged_rows_skip_the_write(self, db, capture_statements):
+        # Five upserts, a read of the stored album, track and artist to spot
+        # shown changes, the tracks of the artist that gained a genre, and the
+        # unbuilt-user check plus rollup-day lookup for them and the newly
+        # linked track.
+        with capture_statements(db) as first:
+            _write(db, _track_payload())
+        with capture_statements(db) as second:
+            _write(db, _track_payload())
+        assert (len(first), len(second)) == (11, 0)
+        stats = known_dimensions.stats()
+        assert stats["hits"] == 5
+        assert stats["misses"] == 5
+        assert stats["hit_rate"] == 0.5
+
+    def test_changed_content_is_written(self, db, capture_statements):
+        _write(db, _track_payload())
+        # Only the track row differs; album/artist/link rows stay cached. The
+        # stored track is read to spot the rename, whose listeners are then
+        # looked up (unbuilt-user check, days) to invalidate their responses.
+        with capture_statements(db) as statements:
+            _write(db, _track_payload(name="Renamed"))
+        assert len(statements) == 4
+        db.expire_all()
+        assert db.get(Track, "trk_1").track_name == "Renamed"
+
+    def test_rollback_does_not_populate_cache(self, db):
+        writer = DimensionWriter(db)
+        writer.add_track(_track_payload())
+        writer.flush()
+        db.rollback()
+
+        assert known_dimensions.stats()["size"] == 0
+        _write(db, _track_payload())
+        assert db.get(Artist, "art_1") is not None
+
+    def test_stub_skipped_once_track_is_known(self, db, capture_statements):
+        _write(db, _track_payload())
+        writer = DimensionWriter(db)
+        writer.add_track_stub("trk_1", "Export Name")
+        with capture_statements(db) as statements:
+            writer.flush()
+        assert statements == []
+
+    def test_lru_is_bounded(self):
+        cache = KnownDimensionCache(max_size=2)
+        cache.add_many([("a", "1"), ("b", "1")])
+        cache.lookup(["a"])  # touch "a" so "b" is the eviction candidate
+        cache.add_many([("c", "1")])
+        assert set(cache.lookup(["a", "b", "c"])) == {"a", "c"}
+        assert cache.stats()["size"] == 2
+
+    def test_redis_layer_fills_local_misses(self):
+        cache = KnownDimensionCache(max_size=10)
+        fake_redis = MagicMock()
+        fake_redis.mget.return_value = [b"fp1", None]
+        with patch.object(cache, "_get_redis", return_value=fake_redis):
+            assert cache.lookup(["x", "y"]) == {"x": "fp1"}
+        # The remote hit is now cached locally.
+        assert cache.lookup(["x"]) == {"x": "fp1"}
+
+    def test_redis_failure_falls_back_to_local(self):
+        cache = KnownDimensionCache(max_size=10)
+        fake_redis = MagicMock()
+        fake_redis.mget.side_effect = ConnectionError("down")
+        fake_redis.pipeline.side_effect = ConnectionError("down")
+        with patch.object(cache, "_get_redis", return_value=fake_redis):
+            cache.add_many([("x", "fp1")])
+            assert cache.lookup(["x", "y"]) == {"x": "fp1"}
@@ -0,0 +1,139 @@
+from datetime import date
+
+from app.models import Album, Artist, ArtistGenre, Track, TrackArtist
+from app.services import dimensions
+from app.services.dimensions import DimensionWriter, upsert_rows
+
+
+def _track_payload(track_id="trk_1", **overrides):
+    payload = {
+        "id": track_id,
+        "name": "Paranoid Android",
+        "album": {
+            "id": "alb_1",
+            "name": "OK Computer",
+            "release_date": "1997-05-21",
+            "images": [{"url": "https://img/alb_1", "width": 300}],
+        },
+        "artists": [
+            {
+                "id": "art_1",
+                "name": "Radiohead",
+                "genres": ["art rock", ""],
+                "images": [{"url": "https://img/art_1", "width": 300}],
+            }
+        ],
+        "duration_ms": 384000,
+        "is_local": False,
+    }
+    payload.update(overrides)
+    return payload
+
+
+class TestDimensionWriter:
+    def test_writes_all_dimension_tables(self, db):
+        writer = DimensionWriter(db)
+        assert writer.add_track(_track_payload())
+        writer.flush()
+        db.commit()
+
+        album = db.get(Album, "alb_1")
+        assert album.release_date == date(1997, 5, 21)
+        assert album.image_url == "https://img/alb_1"
+        track = db.get(Track, "trk_1")
+        assert track.album_id == "alb_1"
+        assert track.duration_ms == 384000
+        assert db.get(Artist, "art_1").image_url == "https://img/art_1"
+        assert db.query(TrackArtist).count() == 1
+        # Empty genre strings are dropped.
+        assert [g.genre for g in db.query(ArtistGenre).all()] == ["art rock"]
+
+    def test_rejects_payloads_without_id(self, db):
+        writer = DimensionWriter(db)
+        assert not writer.add_track({})
+        assert not writer.add_track(None)
+        assert not writer.add_artist({"name": "No Id"})
+
+    def test_null_values_never_erase_existing_metadata(self, db):
+        writer = DimensionWriter(db)
+        writer.add_track(_track_payload())
+        writer.flush()
+        db.commit()
+
+        # A sparser payload for the same ids: no images, no release date.
+        sparse = _track_payload(duration_ms=None)
+        sparse["album"] = {"id": "alb_1", "name": "OK Computer (Remastered)"}
+        sparse["artists"] = [{"id": "art_1", "name": "Radiohead"}]
+        writer.add_track(sparse)
+        writer.flush()
+        db.commit()
+
+        db.expire_all()
+        album = db.get(Album, "alb_1")
+        assert album.album_name == "OK Computer (Remastered)"
+        assert album.release_date == date(1997, 5, 21)
+        assert album.image_url == "https://img/alb_1"
+        assert db.get(Track, "trk_1").duration_ms == 384000
+        assert db.get(Artist, "art_1").image_url == "https://img/art_1"
+
+    def test_track_stub_does_not_overwrite_existing_track(self, db):
+        db.add(Track(track_id="trk_1", track_name="Canonical Name", duration_ms=1000))
+        db.commit()
+
+        writer = DimensionWriter(db)
+        writer.add_track_stub("trk_1", "Export Name")
+        writer.add_track_stub("trk_2", "New Stub")
+        writer.add_track_stub("trk_2", "Later Duplicate")
+        writer.flush()
+        db.commit()
+
+        db.expire_all()
+        assert db.get(Track, "trk_1").track_name == "Canonical Name"
+        assert db.get(Track, "trk_2").track_name == "New Stub"
+
+    def test_full_track_wins_over_stub_in_same_flush(self, db):
+        writer = DimensionWriter(db)
+        writer.add_track_stub("trk_1", "Stub")
+        writer.add_track(_track_payload())
+        writer.flush()
+        db.commit()
+
+        assert db.get(Track, "trk_1").track_name == "Paranoid Android"
+
+    def test_flush_clears_buffers(self, db):
+        writer = DimensionWriter(db)
+        writer.add_track(_track_payload())
+        writer.flush()
+        db.commit()
+        db.query(TrackArtist).delete()
+        db.commit()
+
+        writer.flush()
+        db.commit()
+        assert db.query(TrackArtist).count() == 0
+
+
+class TestUpsertRows:
+    def test_chunks_large_inserts(self, db, monkeypatch):
+        monkeypatch.setattr(dimensions, "MAX_ROWS_PER_STATEMENT", 3)
+        rows = [{"artist_id": f"art_{i}", "artist_name": f"Artist {i}", "image_url": None} for i in range(10)]
+
+        assert upsert_rows(db, Artist, rows) == 10
+        db.commit()
+        assert db.query(Artist).count() == 10
+
+    def test_do_nothing_counts_only_new_rows(self, db):
+        db.add(Artist(artist_id="art_1", artist_name="Existing"))
+        db.commit()
+        rows = [
+            {"artist_id": "art_1", "artist_name": "Changed", "image_url": None},
+            {"artist_id": "art_2", "artist_name": "New", "image_url": None},
+        ]
+
+        assert upsert_rows(db, Artist, rows) == 1
+        db.commit()
+        db.expire_all()
+        assert db.get(Artist, "art_1").artist_name == "Existing"
+
+    def test_empty_rows_is_noop(self, db):
+        assert upsert_rows(db, Artist, []) == 0
@@ -0,0 +1,146 @@
+from datetime import datetime, timedelta, timezone
+
+from app.models import Album, Listen, Track, TrackEnrichmentQueue, User
+from app.services import enrichment_queue
+from app.services.enrichment_queue import (
+    MAX_ENRICH_ATTEMPTS,
+    claim_enrichment_batch,
+    complete_enrichment,
+    enqueue_tracks,
+    enqueue_tracks_missing_metadata,
+    fail_enrichment,
+    pending_enrichment_count,
+    release_enrichment,
+    seed_enrichment_queue,
+)
+from app.services.ingestion import upsert_from_recent_listens
+
+
+def _add_tracks(db, *track_ids):
+    for tid in track_ids:
+        db.add(Track(track_id=tid, track_name=tid))
+    db.commit()
+
+
+class TestEnqueue:
+    def test_enqueue_accumulates_priority(self, db):
+        _add_tracks(db, "trk_1")
+        enqueue_tracks(db, {"trk_1": 2})
+        enqueue_tracks(db, {"trk_1": 3})
+        db.commit()
+
+        entry = db.get(TrackEnrichmentQueue, "trk_1")
+        assert entry.priority == 5
+        assert entry.attempts == 0
+
+    def test_only_tracks_missing_metadata_are_enqueued(self, db):
+        db.add(Album(album_id="alb_1", album_name="Album"))
+        db.add(Track(track_id="trk_full", album_id="alb_1", duration_ms=1000))
+        db.add(Track(track_id="trk_stub", track_name="Stub"))
+        db.commit()
+
+        assert enqueue_tracks_missing_metadata(db, {"trk_full": 1, "trk_stub": 4}) == 1
+        db.commit()
+        assert [e.track_id for e in db.query(TrackEnrichmentQueue).all()] == ["trk_stub"]
+
+    def test_recent_listens_enqueue_tracks_without_metadata(self, db):
+        db.add(User(user_id="usr_1", user_name="User"))
+        db.commit()
+        items = [
+            {"track": {"id": "trk_full", "album": {"id": "alb_1"}, "duration_ms": 1000}, "played_at": "2024-06-15T10:00:00.000000Z"},
+            {"track": {"id": "trk_bare", "name": "Bare"}, "played_at": "2024-06-15T11:00:00.000000Z"},
+        ]
+        upsert_from_recent_listens(db, items, "usr_1")
+        assert [e.track_id for e in db.query(TrackEnrichmentQueue).all()] == ["trk_bare"]
+
+    def test_seed_picks_up_unqueued_tracks_once(self, db):
+        db.add(User(user_id="usr_1", user_name="User"))
+        _add_tracks(db, "trk_1", "trk_2")
+        db.add(Listen(ts=datetime(2024, 1, 1), user_id="usr_1", track_id="trk_1", source="export"))
+        db.add(Listen(ts=datetime(2024, 1, 2), user_id="usr_1", track_id="trk_1", source="export"))
+        db.add(Listen(ts=datetime(2024, 1, 3), user_id="usr_1", track_id="trk_2", source="export"))
+        db.commit()
+
+        assert seed_enrichment_queue(db) == 2
+        assert db.get(TrackEnrichmentQueue, "trk_1").priority == 2
+        assert seed_enrichment_queue(db) == 0
+
+
+class TestClaim:
+    def test_claims_highest_priority_first(self, db):
+        _add_tracks(db, "trk_a", "trk_b", "trk_c")
+        enqueue_tracks(db, {"trk_a": 1, "trk_b": 9, "trk_c": 5})
+        db.commit()
+
+        assert claim_enrichment_batch(db, "worker", 2) == ["trk_b", "trk_c"]
+
+    def test_leased_entries_are_not_claimed_twice(self, db):
+        _add_tracks(db, "trk_a", "trk_b")
+        enqueue_tracks(db, {"trk_a": 2, "trk_b": 1})
+        db.commit()
+
+        first = claim_enrichment_batch(db, "worker_1", 1)
+        second = claim_enrichment_batch(db, "worker_2", 5)
+        assert first == ["trk_a"]
+        assert second == ["trk_b"]
+        assert claim_enrichment_batch(db, "worker_3", 5) == []
+        assert pending_enrichment_count(db) == 0
+
+    def test_expired_lease_can_be_reclaimed(self, db):
+        _add_tracks(db, "trk_a")
+        enqueue_tracks(db, {"trk_a": 1})
+        db.commit()
+        assert claim_enrichment_batch(db, "crashed_worker", 1) == ["trk_a"]
+
+        entry = db.get(TrackEnrichmentQueue, "trk_a")
+        entry.lease_expires_at = datetime.now(timezone.utc) - timedelta(seconds=1)
+        db.commit()
+        assert claim_enrichment_batch(db, "worker", 1) == ["trk_a"]
+
+    def test_release_makes_entries_claimable_again(self, db):
+        _add_tracks(db, "trk_a")
+        enqueue_tracks(db, {"trk_a": 1})
+        db.commit()
+        claim_enrichment_batch(db, "worker", 1)
+
+        release_enrichment(db, ["trk_a"])
+        assert claim_enrichment_batch(db, "worker", 1) == ["trk_a"]
+
+
+class TestCompleteAndFail:
+    def test_complete_removes_entries(self, db):
+        _add_tracks(db, "trk_a")
+        enqueue_tracks(db, {"trk_a": 1})
+        db.commit()
+
+        complete_enrichment(db, ["trk_a"])
+        assert db.query(TrackEnrichmentQueue).count() == 0
+
+    def test_fail_backs_off_and_counts_attempts(self, db):
+        _add_tracks(db, "trk_a")
+        enqueue_tracks(db, {"trk_a": 1})
+        db.commit()
+        claim_enrichment_batch(db, "worker", 1)
+
+        fail_enrichment(db, ["trk_a"])
+
+        db.expire_all()
+        entry = db.get(TrackEnrichmentQueue, "trk_a")
+        assert entry.attempts == 1
+        assert entry.lease_owner is None
+        assert entry.next_attempt_at > datetime.now(timezone.utc).replace(tzinfo=None)
+        assert db.get(Track, "trk_a").enrich_attempts == 1
+        assert claim_enrichment_batch(db, "worker", 1) == []
+
+    def test_fail_drops_entries_after_max_attempts(self, db, monkeypatch):
+        monkeypatch.setattr(enrichment_queue, "BACKOFF_BASE_SECONDS", 0)
+        _add_tracks(db, "trk_a")
+        enqueue_tracks(db, {"trk_a": 1})
+        db.commit()
+
+        for _ in range(MAX_ENRICH_ATTEMPTS):
+            fail_enrichment(db, ["trk_a"])
+
+        assert db.query(TrackEnrichmentQueue).count() == 0
+        db.expire_all()
+        assert db.get(Track, "trk_a").enrich_attempts == MAX_ENRICH_ATTEMPTS
@@ -1,6 +1,7 @@
 from datetime import date, datetime
 
 import pytest
+from sqlalchemy import insert
 
 from app.models import (
     Album,
@@ -12,12 +13,104 @@ from app.models import (
     TrackArtist,
     User,
 )
+from app.services import ingestion
 from app.services.ingestion import (
     get_tracks_missing_metadata,
     retroactively_validate_export_listens,
+    upsert_from_recent_listens,
 )
 
 
+def _recent_item(track_id, played_at, artist_ids=("art_1",), genres=("rock",)):
+    return {
+        "track": {
+            "id": track_id,
+            "name": f"Track {track_id}",
+            "album": {"id": f"alb_{track_id}", "name": "Album", "release_date": "2020-01-01"},
+            "artists": [{"id": a, "name": f"Artist {a}", "genres": list(genres)} for a in artist_ids],
+            "duration_ms": 200000,
+            "is_local": False,
+        },
+        "played_at": played_at,
+    }
+
+
+class TestUpsertFromRecentListens:
+    def test_inserts_listens_and_dimensions(self, db):
+        db.add(User(user_id="usr_1", user_name="User"))
+        db.commit()
+        items = [
+            _recent_item("trk_1", "2024-06-15T10:00:00.000000Z", artist_ids=("art_1", "art_2")),
+            _recent_item("trk_2", "2024-06-15T11:00:00.000000Z"),
+        ]
+
+        assert upsert_from_recent_listens(db, items, "usr_1") == 2
+        assert db.query(Listen).count() == 2
+        assert db.query(Track).count() == 2
+        assert db.query(Album).count() == 2
+        assert db.query(Artist).count() == 2
+        assert db.query(TrackArtist).count() == 3
+        assert db.query(ArtistGenre).count() == 2
+        assert db.get(Album, "alb_trk_1").release_date == date(2020, 1, 1)
+
+    def test_reingesting_same_page_inserts_nothing(self, db):
+        db.add(User(user_id="usr_1", user_name="User"))
+        db.commit()
+        items = [_recent_item("trk_1", "2024-06-15T10:00:00.000000Z")]
+
+        assert upsert_from_recent_listens(db, items, "usr_1") == 1
+        assert upsert_from_recent_listens(db, items, "usr_1") == 0
+        assert db.query(Listen).count() == 1
+
+    def test_dedupes_within_batch_and_skips_bad_items(self, db):
+        db.add(User(user_id="usr_1", user_name="User"))
+        db.commit()
+        items = [
+            _recent_item("trk_1", "2024-06-15T10:00:00.000000Z"),
+            _recent_item("trk_1", "2024-06-15T10:00:00.000000Z"),
+            _recent_item("trk_2", "not-a-timestamp"),
+            {"track": {}, "played_at": "2024-06-15T12:00:00.000000Z"},
+        ]
+
+        assert upsert_from_recent_listens(db, items, "usr_1") == 1
+        # A bad timestamp still stores the track's metadata, like before.
+        assert db.get(Track, "trk_2") is not None
+
+    def test_overwrites_existing_dimension_values(self, db):
+        db.add(User(user_id="usr_1", user_name="User"))
+        db.add(Track(track_id="trk_1", track_name="Stale", duration_ms=None))
+        db.commit()
+
+        upsert_from_recent_listens(db, [_recent_item("trk_1", "2024-06-15T10:00:00.000000Z")], "usr_1")
+
+        db.expire_all()
+        track = db.get(Track, "trk_1")
+        assert track.track_name == "Track trk_1"
+        assert track.duration_ms == 200000
+
+    def test_statement_count_is_constant_per_batch(self, db, capture_statements):
+        db.add(User(user_id="usr_1", user_name="User"))
+        db.commit()
+        items = [
+            _recent_item(f"trk_{i}", f"2024-06-15T10:{i:02d}:00.000000Z", artist_ids=(f"art_{i}", "art_shared"))
+            for i in range(50)
+        ]
+
+        with capture_statements(db) as statements:
+            assert upsert_from_recent_listens(db, items, "usr_1") == 50
+
+        # One upsert per table (albums, tracks, artists, track_to_artist,
+        # artist_to_genre, listens), a read of the stored albums, tracks and
+        # artists to spot shown changes, the award dirty-group mark, a lookup
+        # of the tracks of artists that gained a genre, the unbuilt-user check
+        # and a lookup of rollup days for those and the newly linked tracks,
+        # a delete plus re-insert per listen rollup table, the Wrapped
+        # invalidation, the data version bump and the dirty-month mark,
+        # regardless of batch size. The previous per-item merge path issued
+        # several hundred statements here.
+        assert len(statements) == 22
+
+
 class TestGetTracksMissingMetadata:
     def test_finds_tracks_with_null_duration(self, db):
         db.add(User(user_id="usr_1", user_name="User"))
@@ -113,3 +206,48 @@ class TestRetroactiveValidation:
         db.commit()
         assert retroactively_validate_export_listens(db, {"trk_x"}) == 0
         assert db.query(Listen).count() == 1
+
+    def test_listens_on_release_day_are_kept(self, db):
+        db.add(User(user_id="usr_1", user_name="User"))
+        db.add(Album(album_id="alb_1", album_name="Album", release_date=date(2020, 1, 1)))
+        db.add(Track(track_id="trk_1", track_name="T1", album_id="alb_1", duration_ms=1000))
+        db.add(Listen(ts=datetime(2019, 12, 31, 23, 59), user_id="usr_1", track_id="trk_1", source="export"))
+        db.add(Listen(ts=datetime(2020, 1, 1), user_id="usr_1", track_id="trk_1", source="export"))
+        db.add(Listen(ts=datetime(2020, 1, 1, 0, 1), user_id="usr_1", track_id="trk_1", source="export"))
+        db.commit()
+
+        assert retroactively_validate_export_listens(db, {"trk_1"}) == 1
+        assert {listen.ts for listen in db.query(Listen).all()} == {datetime(2020, 1, 1), datetime(2020, 1, 1, 0, 1)}
+
+    @pytest.mark.parametrize("n_tracks", [1000, 10000])
+    def test_scales_with_chunked_statements(self, db, n_tracks, capture_statements):
+        # One OR clause per track used to exceed SQLite's expression depth
+        # limit at around a thousand tracks.
+        db.add(User(user_id="usr_1", user_name="User"))
+        db.commit()
+        db.execute(insert(Album), [
+            {"album_id": f"alb_{i}", "album_name": "A", "release_date": date(2020, 1, 1)}
+            for i in range(n_tracks)
+        ])
+        db.execute(insert(Track), [
+            {"track_id": f"trk_{i}", "track_name": "T", "album_id": f"alb_{i}", "duration_ms": 1000}
+            for i in range(n_tracks)
+        ])
+        db.execute(insert(Listen), [
+            {"ts": ts, "user_id": "usr_1", "track_id": f"trk_{i}", "source": "export"}
+            for i in range(n_tracks)
+            for ts in (datetime(2019, 1, 1), datetime(2021, 1, 1))
+        ])
+        db.commit()
+
+        track_ids = {f"trk_{i}" for i in range(n_tracks)}
+        with capture_statements(db) as statements:
+            removed = retroactively_validate_export_listens(db, track_ids)
+
+        assert removed == n_tracks
+        assert db.query(Listen).count() == n_tracks
+        # One DELETE per chunk, then the single affected day is refreshed in
+        # each listen rollup table (a delete plus a re-insert apiece), its
+        # year's Wrapped snapshot is invalidated, the data version bumped and
+        # its month marked for the global rollups.
+        assert len(statements) == -(-n_tracks // ingestion.VALIDATE_CHUNK_SIZE) + 9
@@ -0,0 +1,88 @@
+import csv
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+from sqlalchemy.dialects import postgresql
+
+from app.models import Listen, Track, User
+from app.services.listen_loader import LISTEN_COLUMNS, copy_buffer, load_listen_rows, staged_merge_stmt
+
+
+def _row(track_id, minute, ms_played=60000, export_metadata=None):
+    return {
+        "ts": datetime(2024, 1, 1, 10, minute),
+        "user_id": "u1",
+        "track_id": track_id,
+        "source": "export",
+        "ms_played": ms_played,
+        "export_metadata": export_metadata,
+    }
+
+
+def _pg_session():
+    db = MagicMock()
+    db.get_bind.return_value.dialect = postgresql.dialect()
+    return db
+
+
+class TestFallbackPath:
+    def test_inserts_and_only_fills_missing_ms_played(self, db):
+        db.add(User(user_id="u1", user_name="U"))
+        db.add_all([Track(track_id=t) for t in ("a", "b", "c")])
+        db.add(Listen(ts=datetime(2024, 1, 1, 10, 0), user_id="u1", track_id="a", source="api", ms_played=None))
+        db.add(Listen(ts=datetime(2024, 1, 1, 10, 1), user_id="u1", track_id="b", source="api", ms_played=1234))
+        db.commit()
+
+        loaded = load_listen_rows(db, [_row("a", 0), _row("b", 1), _row("c", 2)])
+        db.commit()
+
+        assert loaded == 2  # "a" backfilled, "c" inserted, "b" untouched
+        stored = {lis.track_id: (lis.source, lis.ms_played) for lis in db.query(Listen).all()}
+        assert stored == {"a": ("api", 60000), "b": ("api", 1234), "c": ("export", 60000)}
+
+    def test_large_loads_are_chunked(self, db):
+        db.add(User(user_id="u1", user_name="U"))
+        db.add_all([Track(track_id=f"t{i}") for i in range(1200)])
+        db.commit()
+        rows = [{**_row(f"t{i}", 0), "ts": datetime(2024, 1, 1) + timedelta(seconds=i)} for i in range(1200)]
+
+        assert load_listen_rows(db, rows) == 1200
+        assert load_listen_rows(db, []) == 0
+
+
+class TestCopyPath:
+    def test_copy_buffer_round_trips_and_writes_nulls_unquoted(self):
+        rows = [
+            _row("a", 0, export_metadata='{"platform": "ios, \\"beta\\"\\nbuild"}'),
+            _row("b", 1, ms_played=None),
+        ]
+        text = copy_buffer(rows).getvalue()
+
+        assert text.splitlines()[-1] == "2024-01-01 10:01:00,u1,b,export,,"
+        parsed = list(csv.reader(copy_buffer(rows)))
+        assert parsed[0][5] == rows[0]["export_metadata"]
+        assert parsed[0][:5] == ["2024-01-01 10:00:00", "u1", "a", "export", "60000"]
+
+    def test_staged_merge_keeps_the_conflict_rule(self):
+        sql = str(staged_merge_stmt(_pg_session()).compile(dialect=postgresql.dialect()))
+
+        assert "INSERT INTO dim_all_listens" in sql
+        assert "SELECT listen_load_stage.ts, listen_load_stage.user_id" in sql
+        assert "ON CONFLICT (ts, user_id, track_id) DO UPDATE SET ms_played = excluded.ms_played" in sql
+        assert "WHERE dim_all_listens.ms_played IS NULL" in sql
+
+    def test_postgres_loads_through_copy_then_one_merge(self):
+        db = _pg_session()
+        cursor = db.connection.return_value.connection.cursor.return_value
+        db.execute.return_value.rowcount = 2
+
+        assert load_listen_rows(db, [_row("a", 0), _row("b", 1)]) == 2
+
+        copy_sql, buf = cursor.copy_expert.call_args.args
+        assert copy_sql == f"COPY listen_load_stage ({', '.join(LISTEN_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+        assert len(buf.getvalue().splitlines()) == 2
+        cursor.close.assert_called_once()
+        executed = [str(call.args[0]) for call in db.execute.call_args_list]
+        assert executed[0].startswith("CREATE TEMPORARY TABLE IF NOT EXISTS listen_load_stage")
+        assert executed[1].startswith("INSERT INTO dim_all_listens")
+        assert executed[2] == "TRUNCATE listen_load_stage"
@@ -0,0 +1,190 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from jose import jwt
+from sqlalchemy import insert
+
+from app.config import settings
+from app.models import Friendship, Listen, ListenMonthArtist, ListenMonthDirty, TrackArtist, User
+from app.services.ingestion import upsert_from_recent_listens
+from app.services.listen_months import clear_months, global_months_ready, month_key, reset_unseeded_rollups
+from app.services.listen_rollups import rebuild_user_rollups
+from app.tasks import refresh_listen_months
+
+FRIENDS = [f"friend_{i}" for i in range(7)]
+
+
+def _auth(user_id):
+    token = jwt.encode(
+        {"sub": user_id, "exp": datetime(2099, 1, 1)},
+        settings.jwt_secret,
+        algorithm=settings.jwt_algorithm,
+    )
+    return {"Authorization": f"Bearer {token}"}
+
+
+def _add_friends(db):
+    """Seven friends with 1..7 listens of artist_1 spread over several months."""
+    for i, friend_id in enumerate(FRIENDS):
+        db.add(User(user_id=friend_id, user_name=f"Friend {i}"))
+        db.add(Friendship(user_id_1="test_user_1", user_id_2=friend_id, created_at=datetime(2024, 1, 1)))
+        db.add(Friendship(user_id_1=friend_id, user_id_2="test_user_1", created_at=datetime(2024, 1, 1)))
+    db.flush()
+    db.execute(
+        insert(Listen),
+        [
+            {
+                "ts": datetime(2023, 11, 1) + timedelta(days=40 * n + i),
+                "user_id": friend_id,
+                "track_id": ("track_1", "track_2", "track_3")[n % 3],
+                "source": "api",
+            }
+            for i, friend_id in enumerate(FRIENDS)
+            for n in range(i + 1)
+        ],
+    )
+    db.commit()
+
+
+def _months_by_user(db, user_ids=None, artist_id="artist_1"):
+    """The per-user month counts the timeline used to build from raw rows."""
+    artist_tracks = {ta.track_id for ta in db.query(TrackArtist).filter(TrackArtist.artist_id == artist_id)}
+    counts = {}
+    for listen in db.query(Listen).order_by(Listen.ts):
+        if listen.track_id in artist_tracks and (user_ids is None or listen.user_id in user_ids):
+            counts.setdefault(listen.user_id, Counter())[listen.ts.strftime("%Y-%m")] += 1
+    return counts
+
+
+def _as_months(counter):
+    return [{"month": m, "listen_count": c} for m, c in sorted(counter.items())]
+
+
+def _timeline(client, **params):
+    resp = client.get("/stats/timeline", params={"artist_id": "artist_1", **params}, headers=_auth("test_user_1"))
+    assert resp.status_code == 200
+    return resp.json()
+
+def _build_all(db):
+    for user in db.query(User).all():
+        rebuild_user_rollups(db, user.user_id)
+    db.commit()
+    with patch("app.tasks.SessionLocal", return_value=db):
+        refresh_listen_months()
+
+
+class TestMonthKey:
+    def test_buckets_timestamps_in_sql(self, db, seeded_db):
+        months = db.query(month_key(db, Listen.ts)).order_by(Listen.ts).all()
+        assert [m for (m,) in months] == ["2024-03", "2024-03", "2024-03", "2024-06", "2024-06", "2024-12"]
+
+
+class TestPersonalAndFriends:
+    def test_personal_months_are_bucketed(self, client, db, seeded_db):
+        data = _timeline(client)
+
+        expected = _months_by_user(db, {"test_user_1"})["test_user_1"]
+        assert data == {
+            "users": [
+                {
+                    "user_id": "test_user_1",
+                    "user_name": "Test User",
+                    "total_listens": sum(expected.values()),
+                    "months": _as_months(expected),
+                }
+            ]
+        }
+
+    def test_friends_mode_returns_only_the_top_five(self, client, db, seeded_db):
+        _add_friends(db)
+
+        data = _timeline(client, mode="friends")
+
+        counts = _months_by_user(db)
+        assert [u["user_id"] for u in data["users"]] == ["test_user_1"] + FRIENDS[::-1][:5]
+        for entry in data["users"]:
+            assert entry["months"] == _as_months(counts[entry["user_id"]])
+        assert data["total_friends_with_data"] == 7
+        assert [f["total_listens"] for f in data["all_friends"]] == [7, 6, 5, 4, 3, 2, 1]
+
+    def test_requested_friends_are_ordered_by_first_listen(self, client, db, seeded_db):
+        _add_friends(db)
+
+        data = _timeline(client, mode="friends", friend_ids="friend_6,friend_0,stranger")
+
+        assert [u["user_id"] for u in data["users"]] == ["friend_0", "friend_6", "test_user_1"]
+        assert "all_friends" not in data
+
+
+class TestGlobalMode:
+    def test_reads_the_monthly_rollups_once_built(self, client, db, seeded_db, capture_statements):
+        _add_friends(db)
+        raw = _timeline(client, mode="global")
+
+        _build_all(db)
+        with capture_statements(db) as statements:
+            built = _timeline(client, mode="global")
+
+        total = sum(_months_by_user(db).values(), Counter())
+        assert built == raw
+        assert raw["users"][0]["months"] == _as_months(total)
+        assert not any("dim_all_listens" in sql for sql in statements)
+        assert db.query(ListenMonthDirty).count() == 0
+
+    def test_unbuilt_users_fall_back_to_raw_listens(self, client, db, seeded_db, capture_statements):
+        _build_all(db)
+        db.add(User(user_id="newcomer", user_name="New"))
+        db.add(Listen(ts=datetime(2024, 3, 2), user_id="newcomer", track_id="track_1", source="api"))
+        db.commit()
+
+        with capture_statements(db) as statements:
+            _timeline(client, mode="global")
+
+        assert sum("dim_all_listens" in sql for sql in statements) == 1
+
+    def test_raw_fallback_skips_listens_of_unknown_users(self, client, db, seeded_db):
+        before = _timeline(client, mode="global")
+        db.add(Listen(ts=datetime(2024, 3, 2), user_id="deleted_user", track_id="track_1", source="api"))
+        db.commit()
+
+        assert _timeline(client, mode="global") == before
+
+    def test_unseeded_monthly_rollups_queue_a_full_rebuild(self, db, seeded_db):
+        # A create_all schema: daily rollups built and trusted, months empty.
+        rebuild_user_rollups(db, "test_user_1")
+        db.query(ListenMonthDirty).delete()
+        db.commit()
+        assert global_months_ready(db)
+
+        assert reset_unseeded_rollups(db)
+        db.commit()
+        assert not global_months_ready(db)
+
+        _build_all(db)
+        assert not reset_unseeded_rollups(db)
+
+    def test_new_listens_reach_the_global_view_on_the_next_refresh(self, client, db, seeded_db):
+        _build_all(db)
+        item = {
+            "track": {"id": "track_3", "name": "Karma Police", "artists": [{"id": "artist_1", "name": "Radiohead"}]},
+            "played_at": "2024-06-20T09:00:00.000000Z",
+        }
+
+        upsert_from_recent_listens(db, [item], "test_user_1")
+        assert [m.month for m in db.query(ListenMonthDirty)] == ["2024-06"]
+        with patch("app.tasks.SessionLocal", return_value=db):
+            refresh_listen_months()
+
+        assert db.get(ListenMonthArtist, ("artist_1", "2024-06")).listen_count == 3
+        assert db.query(ListenMonthDirty).count() == 0
+
+    def test_months_marked_again_during_a_refresh_stay_dirty(self, db, seeded_db):
+        _build_all(db)
+        db.add(ListenMonthDirty(month="2024-03", marked_at=datetime(2024, 7, 1, 12)))
+        db.commit()
+
+        clear_months(db, [("2024-03", datetime(2024, 7, 1, 11))])
+        db.commit()
+
+        assert db.get(ListenMonthDirty, "2024-03") is not None
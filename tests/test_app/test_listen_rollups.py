@@ -0,0 +1,295 @@
+import random
+from datetime import date, datetime, timedelta, timezone
+from unittest.mock import patch
+
+from sqlalchemy import insert
+
+from app.models import (
+    Album,
+    Artist,
+    ArtistGenre,
+    Listen,
+    ListenDayArtist,
+    ListenDayGenre,
+    ListenDayTrack,
+    Track,
+    TrackArtist,
+    User,
+)
+from app.routers.stats import _get_top_artists, _get_top_genres, _get_top_tracks, _get_total_minutes
+from app.services.dimensions import DimensionWriter
+from app.services.ingestion import (
+    retroactively_validate_export_listens,
+    upsert_from_recent_listens,
+    upsert_track_metadata,
+)
+from app.services.listen_rollups import (
+    day_ranges,
+    rebuild_user_rollups,
+    refresh_user_days,
+    split_window,
+    users_due_for_rebuild,
+)
+from app.tasks import rebuild_listen_rollups
+
+START = datetime(2024, 1, 1)
+
+
+def _seed(db, n_listens=3000, seed=7):
+    """A month of listens over tracks that share artists and genres."""
+    rng = random.Random(seed)
+    db.add(User(user_id="u1", user_name="U"))
+    db.add(Album(album_id="alb", album_name="Album"))
+    db.execute(insert(Artist), [{"artist_id": f"ar{i}", "artist_name": f"Artist {i}"} for i in range(8)])
+    db.execute(insert(ArtistGenre), [{"artist_id": f"ar{i}", "genre": f"g{i % 3}"} for i in range(8)])
+    db.execute(
+        insert(Track),
+        [
+            {"track_id": f"t{i}", "track_name": f"T{i}", "album_id": "alb", "duration_ms": None if i % 7 == 0 else 1000 * i}
+            for i in range(40)
+        ],
+    )
+    # Every other track has two artists, often sharing a genre.
+    db.execute(
+        insert(TrackArtist),
+        [{"track_id": f"t{i}", "artist_id": f"ar{i % 8}"} for i in range(40)]
+        + [{"track_id": f"t{i}", "artist_id": f"ar{(i + 3) % 8}"} for i in range(0, 40, 2)],
+    )
+    rows = {}
+    for _ in range(n_listens):
+        ts = START + timedelta(seconds=rng.randrange(31 * 86400))
+        track_id = f"t{int(rng.paretovariate(1.2)) % 40}"
+        rows[(ts, track_id)] = {
+            "ts": ts,
+            "user_id": "u1",
+            "track_id": track_id,
+            "source": "export",
+            "ms_played": rng.choice([None, rng.randrange(1, 300000)]),
+        }
+    db.execute(insert(Listen), list(rows.values()))
+    db.commit()
+
+
+def _set_ready(db, ready):
+    db.get(User, "u1").rollups_built_at = datetime(2024, 2, 1) if ready else None
+    db.commit()
+
+
+def _stats(db, since, until):
+    return (
+        _get_top_tracks(db, "u1", since, 100, until=until),
+        _get_top_artists(db, "u1", since, 100, until=until),
+        _get_top_genres(db, "u1", since, 100, until=until),
+        _get_total_minutes(db, "u1", since, until=until),
+    )
+
+
+def _rollup_rows(db):
+    return {
+        model.__tablename__: sorted(
+            tuple(getattr(row, c.name) for c in model.__table__.columns) for row in db.query(model).all()
+        )
+        for model in (ListenDayTrack, ListenDayArtist, ListenDayGenre)
+    }
+
+
+class TestWindowSplit:
+    def test_day_ranges_merge_consecutive_days(self):
+        days = [date(2024, 1, 3), date(2024, 1, 1), date(2024, 1, 2), date(2024, 1, 5), date(2024, 1, 2)]
+        assert day_ranges(days) == [(date(2024, 1, 1), date(2024, 1, 4)), (date(2024, 1, 5), date(2024, 1, 6))]
+
+    def test_partial_days_at_either_end_stay_raw(self):
+        split = split_window(datetime(2024, 1, 1, 15, tzinfo=timezone.utc), datetime(2024, 1, 5, 6))
+
+        assert (split.first_day, split.end_day) == (date(2024, 1, 2), date(2024, 1, 5))
+        assert split.raw == [
+            (datetime(2024, 1, 1, 15), datetime(2024, 1, 2)),
+            (datetime(2024, 1, 5), datetime(2024, 1, 5, 6)),
+        ]
+
+    def test_aligned_and_open_bounds_need_no_raw_scan(self):
+        split = split_window(datetime(2024, 1, 1, tzinfo=timezone.utc), None)
+        assert split.use_rollups and split.raw == []
+        assert (split.first_day, split.end_day) == (date(2024, 1, 1), None)
+
+    def test_window_without_a_whole_day_is_all_raw(self):
+        since, until = datetime(2024, 1, 1, 15), datetime(2024, 1, 2, 6)
+        split = split_window(since, until)
+        assert not split.use_rollups
+        assert split.raw == [(since, until)]
+
+
+class TestRollupParity:
+    WINDOWS = [
+        (None, None),
+        (datetime(2024, 1, 10, tzinfo=timezone.utc), None),
+        (datetime(2024, 1, 1, tzinfo=timezone.utc), datetime(2024, 1, 20, tzinfo=timezone.utc)),
+        (datetime(2024, 1, 5, 13, 37), datetime(2024, 1, 21, 8, 15)),
+        (datetime(2024, 1, 30, 11, 0), None),
+        (datetime(2024, 1, 7, 3, 0), datetime(2024, 1, 7, 22, 0)),
+    ]
+
+    def test_rollup_reads_match_the_raw_path(self, db):
+        _seed(db)
+        rebuild_user_rollups(db, "u1")
+        db.commit()
+
+        for since, until in self.WINDOWS:
+            _set_ready(db, False)
+            raw = _stats(db, since, until)
+            _set_ready(db, True)
+            assert _stats(db, since, until) == raw, (since, until)
+            assert raw[0] and raw[1] and raw[2] and raw[3]
+
+    def test_whole_day_reads_do_not_touch_raw_listens(self, db, capture_statements):
+        _seed(db, n_listens=200)
+        rebuild_user_rollups(db, "u1")
+        db.commit()
+
+        with capture_statements(db) as statements:
+            _stats(db, datetime(2024, 1, 1, tzinfo=timezone.utc), None)
+
+        assert statements
+        assert not any("dim_all_listens" in sql for sql in statements)
+
+    def test_unbuilt_users_read_the_raw_listens(self, db):
+        _seed(db, n_listens=200)
+        # Ready but never built: the empty rollups would hide every listen.
+        _set_ready(db, True)
+        assert _get_top_tracks(db, "u1", None, 10) == []
+        _set_ready(db, False)
+        assert _get_top_tracks(db, "u1", None, 10)
+
+
+class TestIncrementalMaintenance:
+    def _assert_matches_rebuild(self, db):
+        incremental = _rollup_rows(db)
+        rebuild_user_rollups(db, "u1")
+        db.commit()
+        assert _rollup_rows(db) == incremental
+
+    def test_recently_played_pages_refresh_their_days(self, db):
+        _seed(db, n_listens=500)
+        rebuild_user_rollups(db, "u1")
+        db.commit()
+        items = [
+            {
+                "track": {"id": track_id, "name": "N", "artists": [{"id": "ar_new", "name": "A", "genres": ["g0"]}]},
+                "played_at": played_at,
+            }
+            for track_id, played_at in (
+                ("t3", "2024-01-15T10:00:00.000000Z"),
+                ("t_new", "2024-01-15T23:59:59.000000Z"),
+                ("t_new", "2024-02-02T00:00:00.000000Z"),
+            )
+        ]
+
+        assert upsert_from_recent_listens(db, items, "u1") == 3
+        day = db.get(ListenDayTrack, ("u1", date(2024, 2, 2), "t_new"))
+        assert day.listen_count == 1 and day.unplayed_count == 1
+        self._assert_matches_rebuild(db)
+
+    def test_backfilled_ms_played_replaces_the_duration_estimate(self, db):
+        _seed(db, n_listens=100)
+        db.add(Listen(ts=datetime(2024, 3, 1, 9), user_id="u1", track_id="t1", source="api"))
+        db.commit()
+        rebuild_user_rollups(db, "u1")
+        db.commit()
+
+        db.query(Listen).filter(Listen.ts == datetime(2024, 3, 1, 9)).update({"ms_played": 4242})
+        refresh_user_days(db, "u1", [date(2024, 3, 1)])
+        db.commit()
+
+        day = db.get(ListenDayTrack, ("u1", date(2024, 3, 1), "t1"))
+        assert (day.ms_played, day.unplayed_count) == (4242, 0)
+
+    def test_retroactive_deletes_refresh_their_days(self, db):
+        _seed(db, n_listens=500)
+        db.get(Album, "alb").release_date = date(2024, 1, 20)
+        db.commit()
+        rebuild_user_rollups(db, "u1")
+        db.commit()
+
+        assert retroactively_validate_export_listens(db, {f"t{i}" for i in range(40)}) > 0
+        assert not db.query(ListenDayTrack).filter(ListenDayTrack.day < date(2024, 1, 20)).count()
+        self._assert_matches_rebuild(db)
+
+    def test_enrichment_rederives_artist_and_genre_days(self, db):
+        db.add(User(user_id="u1", user_name="U"))
+        db.add(Track(track_id="stub", track_name="Stub"))
+        db.add(Listen(ts=datetime(2024, 1, 2, 8), user_id="u1", track_id="stub", source="export"))
+        db.commit()
+        rebuild_user_rollups(db, "u1")
+        db.commit()
+        assert db.query(ListenDayArtist).count() == 0
+
+        upsert_track_metadata(
+            db,
+            [
+                {
+                    "track": {
+                        "id": "stub",
+                        "name": "Stub",
+                        "duration_ms": 180000,
+                        "artists": [{"id": "ar_x", "name": "X", "genres": ["shoegaze"]}],
+                    }
+                }
+            ],
+        )
+
+        artist_day = db.get(ListenDayArtist, ("u1", date(2024, 1, 2), "ar_x"))
+        assert (artist_day.listen_count, artist_day.duration_ms) == (1, 180000)
+        assert db.get(ListenDayGenre, ("u1", date(2024, 1, 2), "shoegaze")).listen_count == 1
+
+    def test_new_artist_genres_rederive_genre_days(self, db):
+        _seed(db, n_listens=500)
+        rebuild_user_rollups(db, "u1")
+        db.commit()
+        assert not db.query(ListenDayGenre).filter(ListenDayGenre.genre == "dream pop").count()
+
+        writer = DimensionWriter(db)
+        writer.add_artist({"id": "ar2", "name": "Artist 2", "genres": ["g2", "dream pop"]})
+        writer.flush()
+        db.commit()
+
+        expected = sum(
+            day.listen_count
+            for day in db.query(ListenDayArtist).filter(ListenDayArtist.artist_id == "ar2")
+        )
+        genre_days = db.query(ListenDayGenre).filter(ListenDayGenre.genre == "dream pop").all()
+        assert sum(day.listen_count for day in genre_days) == expected > 0
+        self._assert_matches_rebuild(db)
+
+    def test_duration_changes_rederive_artist_days(self, db):
+        _seed(db, n_listens=500)
+        rebuild_user_rollups(db, "u1")
+        db.commit()
+
+        writer = DimensionWriter(db)
+        writer.add_track({"id": "t1", "name": "T1", "duration_ms": 987654, "album": {"id": "alb", "name": "Album"}})
+        writer.flush()
+        db.commit()
+
+        self._assert_matches_rebuild(db)
+        assert db.get(User, "u1").data_version > 0
+
+
+class TestRebuildTask:
+    def test_rebuilds_unbuilt_then_stale_users(self, db, monkeypatch):
+        from app.config import settings
+
+        monkeypatch.setattr(settings, "listen_rollup_rebuild_batch", 2)
+        fresh = datetime.now(timezone.utc).replace(tzinfo=None)
+        db.add(User(user_id="built", user_name="B", rollups_built_at=fresh))
+        db.add(User(user_id="stale", user_name="S", rollups_built_at=fresh - timedelta(days=30)))
+        db.add(User(user_id="new", user_name="N"))
+        db.add(Track(track_id="t1"))
+        db.add(Listen(ts=datetime(2024, 1, 1), user_id="new", track_id="t1", source="api"))
+        db.commit()
+
+        assert users_due_for_rebuild(db, 10) == ["new", "stale"]
+        with patch("app.tasks.SessionLocal", return_value=db):
+            rebuild_listen_rollups()
+
+        assert db.get(ListenDayTrack, ("new", date(2024, 1, 1), "t1")).listen_count == 1
+        assert users_due_for_rebuild(db, 10) == []
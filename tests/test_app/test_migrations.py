@@ -64,6 +64,23 @@ def test_add_index_if_missing_is_idempotent_and_validates():
         _add_index_if_missing(engine, "ix_ok", "t", ["user_id; DROP TABLE t"])
 
 
+def test_add_unique_index_drops_duplicates_keeping_newest():
+    from app.main import _add_index_if_missing
+
+    engine = sa.create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(sa.text("CREATE TABLE t (id INTEGER PRIMARY KEY, k TEXT, v TEXT)"))
+        conn.execute(sa.text("INSERT INTO t (id, k, v) VALUES (1, 'a', 'old'), (2, 'a', 'new'), (3, 'b', 'x')"))
+
+    _add_index_if_missing(engine, "uq_t_k", "t", ["k"], unique=True)
+
+    with engine.connect() as conn:
+        rows = conn.execute(sa.text("SELECT k, v FROM t ORDER BY k")).all()
+    assert [tuple(r) for r in rows] == [("a", "new"), ("b", "x")]
+    indexes = {ix["name"]: ix for ix in sa.inspect(engine).get_indexes("t")}
+    assert indexes["uq_t_k"]["unique"]
+
+
 def test_alembic_head_matches_model():
     with tempfile.TemporaryDirectory() as d:
         db_path = os.path.join(d, "alembic_check.db")
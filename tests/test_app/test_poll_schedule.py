@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+from sqlalchemy import insert
+
+from app.config import settings
+from app.models import Listen, Track, User
+from app.services.poll_schedule import count_due_users, get_due_users, next_poll_interval, schedule_next_poll
+from app.tasks import _poll_single_user
+
+NOW = datetime(2024, 6, 15, 12, 0, 0)
+
+
+def _user_with_listens(db, minutes_ago):
+    user = User(user_id="usr_1", user_name="User", spotify_refresh_token="tok")
+    db.add(user)
+    db.add(Track(track_id="trk_1", track_name="T"))
+    db.commit()
+    if minutes_ago:
+        db.execute(insert(Listen), [
+            {"ts": NOW - timedelta(minutes=m), "user_id": "usr_1", "track_id": "trk_1", "source": "api"}
+            for m in minutes_ago
+        ])
+        db.commit()
+    return user
+
+
+class TestNextPollInterval:
+    def test_regular_listener_gets_the_base_interval(self, db):
+        user = _user_with_listens(db, range(0, 600, 4))  # ~15 plays/hour
+
+        interval = next_poll_interval(db, user, new_listens=5, now=NOW)
+
+        assert interval == timedelta(seconds=settings.poll_interval_seconds)
+
+    def test_heavy_listener_is_polled_before_the_buffer_fills(self, db):
+        user = _user_with_listens(db, [m / 2 for m in range(120)])  # 120 plays in the last hour
+
+        interval = next_poll_interval(db, user, new_listens=50, now=NOW)
+
+        # 50-item buffer at half capacity: 25 plays at 2 plays/minute.
+        assert interval == timedelta(minutes=12, seconds=30)
+
+    def test_interval_never_drops_below_the_minimum(self, db):
+        user = _user_with_listens(db, [m / 20 for m in range(1000)])
+
+        interval = next_poll_interval(db, user, new_listens=50, now=NOW)
+
+        assert interval == timedelta(seconds=settings.poll_min_interval_seconds)
+
+    def test_idle_users_back_off_exponentially_up_to_the_cap(self, db):
+        user = _user_with_listens(db, [])
+        base = timedelta(seconds=settings.poll_interval_seconds)
+        user.last_poll_at = NOW - base
+        user.next_poll_at = NOW
+
+        intervals = []
+        for _ in range(8):
+            interval = next_poll_interval(db, user, new_listens=0, now=user.next_poll_at)
+            user.last_poll_at, user.next_poll_at = user.next_poll_at, user.next_poll_at + interval
+            intervals.append(interval)
+
+        assert intervals[:3] == [base * 2, base * 4, base * 8]
+        assert intervals[-1] == timedelta(seconds=settings.poll_max_interval_seconds)
+
+    def test_activity_resets_the_backoff(self, db):
+        user = _user_with_listens(db, [1, 2, 3])
+        user.last_poll_at = NOW - timedelta(hours=6)
+        user.next_poll_at = NOW
+
+        assert schedule_next_poll(db, user, new_listens=3, now=NOW) == NOW + timedelta(
+            seconds=settings.poll_interval_seconds
+        )
+
+
+class TestDueUsers:
+    def test_returns_due_active_users_most_overdue_first(self, db):
+        db.add(User(user_id="never", user_name="Never polled", spotify_refresh_token="tok"))
+        db.add(User(user_id="overdue", user_name="Overdue", spotify_refresh_token="tok",
+                    next_poll_at=NOW - timedelta(hours=1)))
+        db.add(User(user_id="just_due", user_name="Just due", spotify_refresh_token="tok",
+                    next_poll_at=NOW - timedelta(minutes=1)))
+        db.add(User(user_id="later", user_name="Later", spotify_refresh_token="tok",
+                    next_poll_at=NOW + timedelta(minutes=5)))
+        db.add(User(user_id="inactive", user_name="No token", spotify_refresh_token=None))
+        db.commit()
+
+        assert [u.user_id for u in get_due_users(db, limit=10, now=NOW)] == ["never", "overdue", "just_due"]
+        assert [u.user_id for u in get_due_users(db, limit=2, now=NOW)] == ["never", "overdue"]
+        assert count_due_users(db, now=NOW) == 3
+
+
+class TestPollSetsSchedule:
+    def test_empty_poll_schedules_a_backed_off_retry(self, db):
+        user = User(user_id="usr_1", user_name="User", spotify_refresh_token="tok")
+        db.add(user)
+        db.commit()
+        service = MagicMock()
+        service.refresh_access_token.return_value = {"access_token": "acc"}
+        service.get_recent_listens_page.return_value = {"items": [], "cursors": None, "next": None}
+
+        _poll_single_user(db, service, user)
+
+        db.expire_all()
+        user = db.get(User, "usr_1")
+        assert user.next_poll_at - user.last_poll_at >= timedelta(seconds=settings.poll_interval_seconds * 2 - 1)
@@ -0,0 +1,199 @@
+from datetime import datetime, timezone
+from unittest.mock import MagicMock, patch
+
+from jose import jwt
+
+from app.config import settings
+from app.models import Artist, User
+from app.services.dimensions import DimensionWriter
+from app.services.ingestion import upsert_from_recent_listens
+from app.services.response_cache import (
+    ResponseCache,
+    bump_data_versions,
+    responses,
+    versioned_cache,
+)
+
+
+def _auth(user_id):
+    token = jwt.encode(
+        {"sub": user_id, "exp": datetime(2099, 1, 1, tzinfo=timezone.utc)},
+        settings.jwt_secret,
+        algorithm=settings.jwt_algorithm,
+    )
+    return {"Authorization": f"Bearer {token}"}
+
+def _top_artists(client, headers):
+    resp = client.get("/stats/top-artists", headers=headers)
+    assert resp.status_code == 200
+    return resp.json()
+
+
+def _recent_item(track_id="track_3", played_at="2024-12-31T23:00:00.000000Z"):
+    return {
+        "track": {"id": track_id, "name": "Karma Police", "artists": [{"id": "artist_1", "name": "Radiohead"}]},
+        "played_at": played_at,
+    }
+
+
+class TestVersionedCache:
+    def test_results_are_cached_per_arguments_and_versions(self, db, test_user):
+        calls = []
+
+        @versioned_cache("test.echo", users=lambda user_id, n: [user_id])
+        def echo(db, user_id, n):
+            calls.append((user_id, n))
+            return [user_id, n]
+
+        assert echo(db, "test_user_1", 1) == ["test_user_1", 1]
+        assert echo(db, "test_user_1", 1) == ["test_user_1", 1]
+        assert echo(db, "test_user_1", 2) == ["test_user_1", 2]
+        assert calls == [("test_user_1", 1), ("test_user_1", 2)]
+
+        bump_data_versions(db, ["test_user_1"])
+        db.commit()
+        echo(db, "test_user_1", 1)
+
+        assert len(calls) == 3
+        assert responses.stats()["endpoints"]["test.echo"] == {"hits": 1, "misses": 3}
+
+    def test_rolled_back_bumps_are_not_published(self, db, test_user):
+        cache = ResponseCache(10)
+        cache._set_if_greater = MagicMock()
+        with patch.object(cache, "_get_redis", return_value=MagicMock()), patch(
+            "app.services.response_cache.responses", cache
+        ):
+            bump_data_versions(db, ["test_user_1"])
+            db.rollback()
+            assert not cache._set_if_greater.called
+
+            bump_data_versions(db, ["test_user_1"])
+            db.commit()
+
+        cache._set_if_greater.assert_called_once_with(keys=["data_version:test_user_1"], args=[1, settings.response_cache_version_ttl_seconds])
+        assert db.get(User, "test_user_1").data_version == 1
+
+    def test_versions_come_from_redis_before_the_database(self, db, test_user):
+        cache = ResponseCache(10)
+        cache._set_if_greater = MagicMock()
+        fake_redis = MagicMock()
+        fake_redis.mget.return_value = [b"7", None]
+        with patch.object(cache, "_get_redis", return_value=fake_redis):
+            assert cache.versions(db, ["cached_user", "test_user_1"]) == {"cached_user": 7, "test_user_1": 0}
+
+        # Only the Redis miss was read from the database, then mirrored back.
+        cache._set_if_greater.assert_called_once_with(keys=["data_version:test_user_1"], args=[0, settings.response_cache_version_ttl_seconds])
+
+    def test_failed_publish_drops_the_stale_redis_version(self, db, test_user):
+        cache = ResponseCache(10)
+        store = {}
+        fake_redis = MagicMock()
+        fake_redis.mget.side_effect = lambda keys: [store.get(key) for key in keys]
+        fake_redis.delete.side_effect = lambda *keys: [store.pop(key, None) for key in keys]
+        cache._set_if_greater = MagicMock(side_effect=lambda keys, args: store.update(zip(keys, args[:-1])))
+        calls = []
+
+        @versioned_cache("test.fresh", users=lambda user_id: [user_id])
+        def fresh(db, user_id):
+            calls.append(user_id)
+            return db.get(User, user_id).data_version
+
+        with patch.object(cache, "_get_redis", return_value=fake_redis), patch(
+            "app.services.response_cache.responses", cache
+        ):
+            assert fresh(db, "test_user_1") == 0
+            assert store == {"data_version:test_user_1": 0}
+
+            cache._set_if_greater.side_effect = ConnectionError("timeout")
+            bump_data_versions(db, ["test_user_1"])
+            db.commit()
+
+            assert store == {}
+            assert fresh(db, "test_user_1") == 1
+        assert len(calls) == 2
+
+    def test_redis_failure_falls_back_to_the_database(self, db, test_user):
+        cache = ResponseCache(10)
+        fake_redis = MagicMock()
+        fake_redis.mget.side_effect = ConnectionError("down")
+        bump_data_versions(db, ["test_user_1"])
+        db.commit()
+        with patch.object(cache, "_get_redis", return_value=fake_redis):
+            assert cache.versions(db, ["test_user_1"]) == {"test_user_1": 1}
+
+
+class TestEndpointInvalidation:
+    def test_repeat_views_skip_the_computation(self, client, db, seeded_db, auth_headers, capture_statements):
+        first = _top_artists(client, auth_headers)
+        with capture_statements(db) as statements:
+            second = _top_artists(client, auth_headers)
+
+        assert second == first
+        assert not any("dim_all_listens" in sql for sql in statements)
+        assert responses.stats()["endpoints"]["stats.top_artists"] == {"hits": 1, "misses": 1}
+
+    def test_new_listens_invalidate_only_their_user(self, client, db, seeded_db, auth_headers):
+        db.add(User(user_id="user_2", user_name="User Two"))
+        db.commit()
+        before = _top_artists(client, auth_headers)
+        _top_artists(client, _auth("user_2"))
+
+        upsert_from_recent_listens(db, [_recent_item()], "test_user_1")
+
+        after = _top_artists(client, auth_headers)
+        _top_artists(client, _auth("user_2"))
+        assert after[0]["listen_count"] == before[0]["listen_count"] + 1
+        assert responses.stats()["endpoints"]["stats.top_artists"] == {"hits": 1, "misses": 3}
+
+    def test_metadata_changes_invalidate_everyone_who_played_them(self, client, db, seeded_db, auth_headers):
+        db.add(User(user_id="user_2", user_name="User Two"))
+        db.commit()
+        before = _top_artists(client, auth_headers)
+        _top_artists(client, _auth("user_2"))
+
+        writer = DimensionWriter(db)
+        writer.add_artist({"id": "artist_1", "name": "Radiohead (Remastered)", "genres": ["art rock"]})
+        writer.flush()
+        db.commit()
+
+        after = _top_artists(client, auth_headers)
+        _top_artists(client, _auth("user_2"))
+        radiohead = next(a for a in after if a["artist_id"] == "artist_1")
+        assert radiohead["artist_name"] == "Radiohead (Remastered)"
+        assert "art rock" in radiohead["genres"]
+        assert after != before
+        # user_2 never played the artist, so only test_user_1 missed again.
+        assert responses.stats()["endpoints"]["stats.top_artists"] == {"hits": 1, "misses": 3}
+
+    def test_unshown_metadata_changes_keep_the_cache(self, db, seeded_db):
+        artist = db.get(Artist, "artist_1")
+        writer = DimensionWriter(db)
+        writer.add_artist(
+            {"id": "artist_1", "name": artist.artist_name, "images": []},
+            refreshed_at=datetime(2024, 7, 1),
+        )
+        writer.flush()
+        db.commit()
+
+        assert db.get(User, "test_user_1").data_version == 0
+
+    def test_new_friendships_invalidate_both_users(self, client, db, seeded_db, auth_headers):
+        db.add(User(user_id="user_2", user_name="User Two"))
+        db.commit()
+
+        code = client.post("/friends/invite", headers=auth_headers).json()["invite_code"]
+        assert client.post(f"/friends/accept/{code}", headers=_auth("user_2")).status_code == 200
+
+        versions = {u.user_id: u.data_version for u in db.query(User).all()}
+        assert versions == {"test_user_1": 1, "user_2": 1}
+
+    def test_cache_stats_reports_response_hits(self, client, db, seeded_db, auth_headers):
+        db.get(User, "test_user_1").is_admin = True
+        db.commit()
+        _top_artists(client, auth_headers)
+        _top_artists(client, auth_headers)
+
+        data = client.get("/admin/cache-stats", headers=auth_headers).json()
+
+        assert data["responses"]["hits"] == 1
+        assert data["responses"]["hit_rate"] == 0.5
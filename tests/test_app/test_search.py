@@ -1,3 +1,10 @@
+from unittest.mock import patch
+
+from app.services.spotify import SpotifyService
+from app.services.spotify_governor import governor
+from app.services.token_cache import access_tokens
+
+
 class TestSearchArtists:
     def test_search_by_name(self, client, seeded_db, auth_headers):
         resp = client.get("/search/artists", params={"q": "Radiohead"}, headers=auth_headers)
@@ -192,3 +199,30 @@ class TestResolveArtist:
         resp = client.get("/search/resolve-artist", params={"name": "radiohead"}, headers=auth_headers)
         assert resp.status_code == 200
         assert resp.json()["resolved"] == "db"
+
+
+class TestSpotifySearchThrottled:
+    def _spotify_user(self, db, test_user):
+        test_user.spotify_refresh_token = "tok"
+        db.commit()
+        access_tokens.put(test_user.user_id, {"access_token": "acc", "expires_in": 3600})
+
+    def test_search_answers_503_instead_of_waiting_out_a_pause(self, client, db, test_user, auth_headers):
+        self._spotify_user(db, test_user)
+        governor.record_throttle(30)
+
+        with patch("app.routers.search.SpotifyService", lambda: SpotifyService.__new__(SpotifyService)):
+            resp = client.get("/search/spotify-artists", params={"q": "radio"}, headers=auth_headers)
+
+        assert resp.status_code == 503
+        assert int(resp.headers["Retry-After"]) >= 29
+        assert governor.stats()["rejected"] == 1
+
+    def test_resolve_answers_503_when_throttled(self, client, db, test_user, auth_headers):
+        self._spotify_user(db, test_user)
+        governor.record_throttle(30)
+
+        with patch("app.routers.search.SpotifyService", lambda: SpotifyService.__new__(SpotifyService)):
+            resp = client.get("/search/resolve-artist", params={"name": "Nobody"}, headers=auth_headers)
+
+        assert resp.status_code == 503
@@ -0,0 +1,251 @@
+import gc
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import spotipy
+
+from app.config import settings
+from app.services import spotify
+from app.services.spotify import SpotifyService, get_http_session, reset_http_session
+from app.services.spotify_governor import (
+    Priority,
+    RequestBudget,
+    SpotifyThrottled,
+    governor,
+    request_priority,
+)
+
+
+class _FakeSpotifyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.auth_headers.append(self.headers.get("Authorization"))
+        if self.server.throttle_next:
+            self.server.throttle_next -= 1
+            self.send_response(429)
+            self.send_header("Retry-After", str(self.server.retry_after))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.dumps({"id": "usr_1"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def fake_spotify(monkeypatch):
+    monkeypatch.setattr(settings, "spotify_requests_per_second", 0)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _FakeSpotifyHandler)
+    server.daemon_threads = True
+    server.connections = 0
+    server.auth_headers = []
+    server.throttle_next = 0
+    server.retry_after = 1
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    reset_http_session()
+    yield server, f"http://127.0.0.1:{server.server_address[1]}/v1/"
+    reset_http_session()
+    server.shutdown()
+    server.server_close()
+
+
+def _run(make_client, prefix, n):
+    started = time.perf_counter()
+    for i in range(n):
+        client = make_client(f"token_{i}")
+        client.prefix = prefix
+        assert client.current_user()["id"] == "usr_1"
+        del client
+    return n / (time.perf_counter() - started)
+
+
+class TestPooledClient:
+    def test_clients_reuse_one_keep_alive_connection(self, fake_spotify):
+        server, prefix = fake_spotify
+        service = SpotifyService.__new__(SpotifyService)
+
+        _run(service.get_client, prefix, 20)
+
+        assert server.connections == 1
+        assert server.auth_headers == [f"Bearer token_{i}" for i in range(20)]
+
+    def test_unpooled_clients_open_a_connection_per_client(self, fake_spotify):
+        # The previous get_client: a fresh spotipy session per client.
+        server, prefix = fake_spotify
+
+        _run(lambda token: spotipy.Spotify(auth=token, backoff_factor=0.3), prefix, 20)
+
+        assert server.connections == 20
+
+    def test_pool_is_sized_from_settings(self, monkeypatch):
+        monkeypatch.setattr(settings, "spotify_http_pool_size", 7)
+        reset_http_session()
+        try:
+            adapter = get_http_session().get_adapter("https://api.spotify.com/v1/")
+            assert adapter._pool_maxsize == 7
+            assert adapter.max_retries.total == settings.spotify_http_retries
+        finally:
+            reset_http_session()
+
+    def test_session_is_shared_and_survives_client_gc(self):
+        reset_http_session()
+        session = get_http_session()
+        client = SpotifyService.__new__(SpotifyService).get_client("tok")
+        assert client._session is session
+        del client
+        gc.collect()
+        assert spotify.get_http_session() is session
+        reset_http_session()
+
+
+class TestRequestBudget:
+    def test_allows_a_one_second_burst_then_throttles(self):
+        budget = RequestBudget(rate=50)
+        started = time.perf_counter()
+        for _ in range(50):
+            budget.acquire()
+        assert time.perf_counter() - started < 0.1
+
+        for _ in range(10):
+            budget.acquire()
+        assert time.perf_counter() - started >= 0.18
+
+    def test_zero_rate_is_unlimited(self):
+        budget = RequestBudget(rate=0)
+        started = time.perf_counter()
+        for _ in range(1000):
+            budget.acquire()
+        assert time.perf_counter() - started < 0.1
+
+    def test_shared_session_draws_from_the_budget(self, fake_spotify, monkeypatch):
+        server, prefix = fake_spotify
+        monkeypatch.setattr(settings, "spotify_requests_per_second", 20)
+        monkeypatch.setattr(settings, "spotify_user_requests_per_second", 0)
+        client = SpotifyService.__new__(SpotifyService).get_client("tok")
+        client.prefix = prefix
+
+        started = time.perf_counter()
+        for _ in range(25):
+            client.current_user()
+        assert time.perf_counter() - started >= 0.2
+
+
+class TestGovernor:
+    def test_retry_after_pauses_every_client(self, fake_spotify, monkeypatch):
+        server, prefix = fake_spotify
+        server.throttle_next = 1
+        service = SpotifyService.__new__(SpotifyService)
+        first, second = service.get_client("tok_a"), service.get_client("tok_b")
+        first.prefix = second.prefix = prefix
+
+        started = time.perf_counter()
+        assert first.current_user()["id"] == "usr_1"
+        assert time.perf_counter() - started >= 0.9
+        stats = governor.stats()
+        assert stats["throttled"] == 1
+        assert stats["paused_for_seconds"] == 0
+
+        # Another client during a pause waits it out instead of sending.
+        governor.record_throttle(0.3)
+        started = time.perf_counter()
+        assert second.current_user()["id"] == "usr_1"
+        assert time.perf_counter() - started >= 0.25
+        assert len(server.auth_headers) == 3
+
+    def test_persistent_429_surfaces_as_spotify_exception(self, fake_spotify, monkeypatch):
+        server, prefix = fake_spotify
+        monkeypatch.setattr(settings, "spotify_http_retries", 1)
+        monkeypatch.setattr(settings, "spotify_breaker_threshold", 10)
+        server.throttle_next = 5
+        server.retry_after = 0
+        client = SpotifyService.__new__(SpotifyService).get_client("tok")
+        client.prefix = prefix
+
+        with pytest.raises(spotipy.SpotifyException) as exc:
+            client.current_user()
+        assert exc.value.http_status == 429
+        assert len(server.auth_headers) == 2
+
+    def test_open_breaker_fails_background_work_fast(self, monkeypatch):
+        monkeypatch.setattr(settings, "spotify_breaker_threshold", 2)
+        governor.record_throttle(0)
+        governor.record_throttle(0)
+
+        with request_priority(Priority.background):
+            with pytest.raises(SpotifyThrottled) as exc:
+                governor.acquire("tok")
+        assert exc.value.http_status == 429
+        assert exc.value.reason == "breaker"
+
+        governor.acquire("tok")
+        with request_priority(Priority.interactive):
+            governor.acquire("tok")
+        stats = governor.stats()
+        assert stats["breaker_open"] is True
+        assert stats["requests"] == {"interactive": 1, "poll": 1, "background": 0}
+        assert stats["rejected"] == 1
+
+    def test_background_leaves_headroom_for_search(self, monkeypatch):
+        monkeypatch.setattr(settings, "spotify_requests_per_second", 10)
+        monkeypatch.setattr(settings, "spotify_background_reserve", 0.2)
+
+        taken = 0
+        with request_priority(Priority.background):
+            while governor._check(Priority.background, None)[0] == "ok":
+                taken += 1
+        assert taken == 8
+
+        started = time.perf_counter()
+        with request_priority(Priority.interactive):
+            governor.acquire()
+            governor.acquire()
+        assert time.perf_counter() - started < 0.05
+
+    def test_each_user_token_has_its_own_bucket(self, monkeypatch):
+        monkeypatch.setattr(settings, "spotify_requests_per_second", 0)
+        monkeypatch.setattr(settings, "spotify_user_requests_per_second", 2)
+
+        assert [governor._check(Priority.poll, "a")[0] for _ in range(3)] == ["ok", "ok", "budget"]
+        assert governor._check(Priority.poll, "b")[0] == "ok"
+
+    def test_interactive_gives_up_instead_of_waiting_out_a_long_pause(self):
+        governor.record_throttle(30)
+
+        started = time.perf_counter()
+        with request_priority(Priority.interactive):
+            with pytest.raises(SpotifyThrottled) as exc:
+                governor.acquire("tok")
+        assert time.perf_counter() - started < 0.1
+        assert int(exc.value.headers["Retry-After"]) >= 29
+
+    def test_redis_failure_falls_back_to_local_state(self, monkeypatch):
+        class _BrokenRedis:
+            def eval(self, *args):
+                raise ConnectionError("down")
+
+            def get(self, key):
+                raise ConnectionError("down")
+
+        monkeypatch.setattr(governor, "_get_redis", lambda: _BrokenRedis())
+        governor.record_throttle(30)
+
+        with request_priority(Priority.interactive):
+            with pytest.raises(SpotifyThrottled):
+                governor.acquire("tok")
+        assert governor.stats()["backend"] == "local"
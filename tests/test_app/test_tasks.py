@@ -1,12 +1,21 @@
-from datetime import datetime
+import io
+import json
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import MagicMock, patch
 
 import pytest
 from spotipy.oauth2 import SpotifyOauthError
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, insert
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 
+from app.celery_app import celery_app
+from app.config import settings
 from app.database import Base
 from app.models import (
     Album,
@@ -17,9 +26,32 @@ from app.models import (
     ListenSource,
     Track,
     TrackArtist,
+    TrackEnrichmentQueue,
     User,
 )
-from app.tasks import _poll_single_user, backfill_track_metadata, poll_recent_listens
+from app.services.artist_cache import ArtistMetadataCache
+from app.services.dimension_cache import reset_dimension_cache
+from app.services.enrichment_queue import seed_enrichment_queue
+from app.services.spotify import MAXIMUM_RECENT_TRACKS, SpotifyService, reset_http_session
+from app.services.spotify_governor import SpotifyThrottled
+from app.services.token_cache import access_tokens
+from app.services.upload_spool import delete_spooled_upload, spool_path, spool_upload, spooled_upload_exists
+from app.tasks import (
+    _poll_single_user,
+    _poll_users,
+    _shard_user_ids,
+    backfill_track_metadata,
+    poll_recent_listens,
+    poll_user_shard,
+    process_backfill_upload,
+)
+
+
+@pytest.fixture(autouse=True)
+def _eager_celery(monkeypatch):
+    """Run chords/groups in-process; there is no broker in tests."""
+    monkeypatch.setattr(celery_app.conf, "task_always_eager", True)
+    monkeypatch.setattr("app.tasks._poll_lock_client", lambda: None)
 
 
 def _make_test_db():
@@ -50,6 +82,10 @@ def _spotify_listen_item(track_id, played_at):
     }
 
 
+def _recent_page(*items, cursor=None):
+    return {"items": list(items), "cursors": {"after": cursor} if cursor else None, "next": None}
+
+
 class TestPollSingleUser:
     def test_polls_and_inserts_listens(self, db):
         user = User(
@@ -65,10 +101,10 @@ class TestPollSingleUser:
             "access_token": "fake_access",
             "refresh_token": "fake_refresh",
         }
-        mock_service.get_recent_listens.return_value = [
+        mock_service.get_recent_listens_page.return_value = _recent_page(
             _spotify_listen_item("t1", "2024-06-15T10:00:00.000000Z"),
             _spotify_listen_item("t2", "2024-06-15T11:00:00.000000Z"),
-        ]
+        )
 
         _poll_single_user(db, mock_service, user)
 
@@ -113,12 +149,12 @@ class TestPollSingleUser:
             "access_token": "fake_access",
             "refresh_token": "fake_refresh",
         }
-        mock_service.get_recent_listens.return_value = []
+        mock_service.get_recent_listens_page.return_value = _recent_page()
 
         _poll_single_user(db, mock_service, user)
 
-        mock_service.get_recent_listens.assert_called_once_with(
-            "fake_access", after=existing_ts
+        mock_service.get_recent_listens_page.assert_called_once_with(
+            "fake_access", int(existing_ts.replace(tzinfo=timezone.utc).timestamp() * 1000), None
         )
 
     def test_updates_refresh_token_if_changed(self, db):
@@ -135,7 +171,7 @@ class TestPollSingleUser:
             "access_token": "fake_access",
             "refresh_token": "new_refresh",
         }
-        mock_service.get_recent_listens.return_value = []
+        mock_service.get_recent_listens_page.return_value = _recent_page()
 
         _poll_single_user(db, mock_service, user)
 
@@ -156,7 +192,7 @@ class TestPollSingleUser:
             "access_token": "fake_access",
             "refresh_token": "fake_refresh",
         }
-        mock_service.get_recent_listens.return_value = []
+        mock_service.get_recent_listens_page.return_value = _recent_page()
 
         _poll_single_user(db, mock_service, user)
 
@@ -166,6 +202,112 @@ class TestPollSingleUser:
         assert job.record_count == 0
 
 
+class TestListenCursor:
+    def _service(self, *pages):
+        service = MagicMock()
+        service.refresh_access_token.return_value = {"access_token": "acc"}
+        service.get_recent_listens_page.side_effect = list(pages)
+        return service
+
+    def test_cursor_is_stored_and_resumed_without_max_scan(self, db, capture_statements):
+        user = User(user_id="usr_1", user_name="Test", spotify_refresh_token="tok")
+        db.add(user)
+        db.commit()
+        service = self._service(
+            _recent_page(
+                _spotify_listen_item("t1", "2024-06-15T10:00:00.000000Z"),
+                _spotify_listen_item("t2", "2024-06-15T11:00:00.000000Z"),
+                cursor="1718449200000",
+            ),
+            _recent_page(),
+        )
+
+        _poll_single_user(db, service, user)
+        db.expire_all()
+        user = db.get(User, "usr_1")
+        assert user.last_listen_cursor == "1718449200000"
+        assert user.last_listen_at == datetime(2024, 6, 15, 11, 0, 0)
+
+        with capture_statements(db) as statements:
+            _poll_single_user(db, service, user)
+
+        assert service.get_recent_listens_page.call_args_list[-1].args[1] == 1718449200000
+        assert not any("max(" in sql.lower() for sql in statements)
+
+    def test_cursor_is_derived_from_newest_play_without_spotify_cursor(self, db):
+        user = User(user_id="usr_1", user_name="Test", spotify_refresh_token="tok")
+        db.add(user)
+        db.commit()
+        service = self._service(_recent_page(_spotify_listen_item("t1", "2024-06-15T11:00:00.000000Z")))
+
+        _poll_single_user(db, service, user)
+
+        assert user.last_listen_cursor == "1718449200000"
+
+    def test_legacy_user_falls_back_to_max_ts_once(self, db, capture_statements):
+        user = User(user_id="usr_1", user_name="Test", spotify_refresh_token="tok")
+        db.add(user)
+        db.add(Track(track_id="old_t", track_name="Old Track"))
+        db.add(Listen(ts=datetime(2024, 3, 15, 10, 0, 0), user_id="usr_1", track_id="old_t",
+                      source=ListenSource.api.value))
+        db.commit()
+        service = self._service(_recent_page(), _recent_page())
+
+        with capture_statements(db) as first:
+            _poll_single_user(db, service, user)
+        with capture_statements(db) as second:
+            _poll_single_user(db, service, user)
+
+        assert sum("max(" in sql.lower() for sql in first) == 1
+        assert not any("max(" in sql.lower() for sql in second)
+        assert user.last_listen_at == datetime(2024, 3, 15, 10, 0, 0)
+
+    def test_full_page_after_cursor_is_an_overflow(self, db):
+        user = User(user_id="usr_1", user_name="Test", spotify_refresh_token="tok",
+                    last_listen_cursor="1718409600000")
+        db.add(user)
+        db.commit()
+        items = [
+            _spotify_listen_item(f"t{i}", f"2024-06-15T{10 + i // 60:02d}:{i % 60:02d}:00.000000Z")
+            for i in range(MAXIMUM_RECENT_TRACKS)
+        ]
+        service = self._service(_recent_page(*items))
+
+        assert _poll_single_user(db, service, user) is True
+        assert user.next_poll_at - user.last_poll_at.replace(tzinfo=None) <= timedelta(
+            seconds=settings.poll_min_interval_seconds + 1
+        )
+
+    def test_full_first_page_is_not_an_overflow(self, db):
+        user = User(user_id="usr_1", user_name="Test", spotify_refresh_token="tok")
+        db.add(user)
+        db.commit()
+        items = [
+            _spotify_listen_item(f"t{i}", f"2024-06-15T10:{i:02d}:00.000000Z")
+            for i in range(MAXIMUM_RECENT_TRACKS)
+        ]
+        service = self._service(_recent_page(*items))
+
+        assert _poll_single_user(db, service, user) is False
+
+    def test_overflows_are_counted_per_shard(self, db):
+        user = User(user_id="usr_1", user_name="Test", spotify_refresh_token="tok",
+                    last_listen_cursor="1718409600000")
+        db.add(user)
+        db.commit()
+        items = [
+            _spotify_listen_item(f"t{i}", f"2024-06-15T10:{i:02d}:00.000000Z")
+            for i in range(MAXIMUM_RECENT_TRACKS)
+        ]
+        service = self._service(_recent_page(*items))
+
+        with patch("app.tasks.SessionLocal", return_value=db), patch("app.tasks.SpotifyService", return_value=service):
+            counts = poll_user_shard(["usr_1"])
+
+        assert counts["polled"] == 1
+        assert counts["overflows"] == 1
+
+
 class TestPollRecentListensTask:
     @patch("app.tasks.SessionLocal")
     @patch("app.tasks.SpotifyService")
@@ -185,13 +327,13 @@ class TestPollRecentListensTask:
             "access_token": "acc",
             "refresh_token": "ref",
         }
-        mock_service.get_recent_listens.return_value = [
+        mock_service.get_recent_listens_page.return_value = _recent_page(
             _spotify_listen_item("t1", "2024-06-15T10:00:00.000000Z"),
-        ]
+        )
 
         poll_recent_listens()
 
-        assert mock_service.get_recent_listens.call_count == 2
+        assert mock_service.get_recent_listens_page.call_count == 2
         assert db.query(Listen).count() == 2
 
         db.close()
@@ -220,9 +362,9 @@ class TestPollRecentListensTask:
             return {"access_token": "acc", "refresh_token": "ref"}
 
         mock_service.refresh_access_token.side_effect = side_effect
-        mock_service.get_recent_listens.return_value = [
+        mock_service.get_recent_listens_page.return_value = _recent_page(
             _spotify_listen_item("t1", "2024-06-15T10:00:00.000000Z"),
-        ]
+        )
 
         poll_recent_listens()
 
@@ -250,6 +392,7 @@ class TestBackfillTrackMetadataTask:
             )
         )
         db.commit()
+        seed_enrichment_queue(db)
 
         MockSessionLocal.return_value = db
         mock_service = MagicMock()
@@ -289,6 +432,92 @@ class TestBackfillTrackMetadataTask:
         db.close()
         Base.metadata.drop_all(bind=engine)
 
+    @patch("app.tasks.SessionLocal")
+    @patch("app.tasks.SpotifyService")
+    def test_throttled_batch_is_released_without_an_attempt(self, MockSpotifyService, MockSessionLocal):
+        Session, engine = _make_test_db()
+        db = Session()
+        db.add(User(user_id="u1", user_name="User 1", spotify_refresh_token="tok1"))
+        db.add(Track(track_id="trk_missing", track_name=None))
+        db.add(Listen(ts=datetime(2024, 1, 1), user_id="u1", track_id="trk_missing", source="export"))
+        db.commit()
+        seed_enrichment_queue(db)
+
+        MockSessionLocal.return_value = db
+        mock_service = MagicMock()
+        MockSpotifyService.return_value = mock_service
+        mock_service.refresh_access_token.return_value = {"access_token": "acc"}
+        mock_service.get_tracks.side_effect = SpotifyThrottled(60, "breaker")
+
+        backfill_track_metadata()
+
+        entry = db.query(TrackEnrichmentQueue).one()
+        assert entry.attempts == 0
+        assert entry.lease_owner is None
+        assert db.query(Track).filter(Track.track_id == "trk_missing").one().enrich_attempts in (None, 0)
+        job = db.query(JobRun).filter(JobRun.job_name == "backfill_track_metadata").one()
+        assert job.status == "rate_limited"
+
+        db.close()
+        Base.metadata.drop_all(bind=engine)
+
+    @patch("app.tasks.SessionLocal")
+    @patch("app.tasks.SpotifyService")
+    def test_failed_batch_counts_an_attempt(self, MockSpotifyService, MockSessionLocal):
+        Session, engine = _make_test_db()
+        db = Session()
+        db.add(User(user_id="u1", user_name="User 1", spotify_refresh_token="tok1"))
+        db.add(Track(track_id="trk_missing", track_name=None))
+        db.add(Listen(ts=datetime(2024, 1, 1), user_id="u1", track_id="trk_missing", source="export"))
+        db.commit()
+        seed_enrichment_queue(db)
+
+        MockSessionLocal.return_value = db
+        mock_service = MagicMock()
+        MockSpotifyService.return_value = mock_service
+        mock_service.refresh_access_token.return_value = {"access_token": "acc"}
+        mock_service.get_tracks.side_effect = RuntimeError("boom")
+
+        backfill_track_metadata()
+
+        entry = db.query(TrackEnrichmentQueue).one()
+        assert entry.attempts == 1
+        assert entry.lease_owner is None
+        job = db.query(JobRun).filter(JobRun.job_name == "backfill_track_metadata").one()
+        assert job.status == "error"
+
+        db.close()
+        Base.metadata.drop_all(bind=engine)
+
+    @patch("app.tasks.SessionLocal")
+    @patch("app.tasks.SpotifyService")
+    def test_first_run_seeds_the_queue(self, MockSpotifyService, MockSessionLocal):
+        Session, engine = _make_test_db()
+        db = Session()
+        db.add(User(user_id="u1", user_name="User 1", spotify_refresh_token="tok1"))
+        db.add(Track(track_id="trk_old", track_name=None))
+        db.add(Listen(ts=datetime(2024, 1, 1), user_id="u1", track_id="trk_old", source="export"))
+        db.commit()
+
+        MockSessionLocal.return_value = db
+        mock_service = MagicMock()
+        MockSpotifyService.return_value = mock_service
+        mock_service.refresh_access_token.return_value = {"access_token": "acc"}
+        mock_service.get_tracks.return_value = []
+
+        backfill_track_metadata()
+
+        mock_service.get_tracks.assert_called_once()
+        assert mock_service.get_tracks.call_args.args[1] == ["trk_old"]
+        seeds = db.query(JobRun).filter(JobRun.job_name == "seed_enrichment_queue").all()
+        assert [(j.status, j.record_count) for j in seeds] == [("success", 1)]
+
+        backfill_track_metadata()
+        assert db.query(JobRun).filter(JobRun.job_name == "seed_enrichment_queue").count() == 1
+
+        db.close()
+        Base.metadata.drop_all(bind=engine)
+
     @patch("app.tasks.SessionLocal")
     @patch("app.tasks.SpotifyService")
     def test_skips_when_no_missing_tracks(self, MockSpotifyService, MockSessionLocal):
@@ -354,18 +583,16 @@ class TestTokenRevocation:
         mock_service = MagicMock()
         MockSpotifyService.return_value = mock_service
 
-        call_count = [0]
-
+        # Shards decide polling order, so fail by token rather than call order.
         def refresh_side_effect(token):
-            call_count[0] += 1
-            if call_count[0] == 1:
+            if token == "revoked":
                 raise SpotifyOauthError("invalid_grant")
             return {"access_token": "acc", "refresh_token": "valid"}
 
         mock_service.refresh_access_token.side_effect = refresh_side_effect
-        mock_service.get_recent_listens.return_value = [
+        mock_service.get_recent_listens_page.return_value = _recent_page(
             _spotify_listen_item("t1", "2024-06-15T10:00:00.000000Z"),
-        ]
+        )
 
         poll_recent_listens()
 
@@ -396,6 +623,7 @@ class TestTokenRevocation:
         db.add(Track(track_id="trk_x", track_name=None))
         db.add(Listen(ts=datetime(2024, 1, 1), user_id="u_good", track_id="trk_x", source="export"))
         db.commit()
+        seed_enrichment_queue(db)
 
         MockSessionLocal.return_value = db
         mock_service = MagicMock()
@@ -431,7 +659,442 @@ class TestTokenRevocation:
         track = db.query(Track).filter(Track.track_id == "trk_x").first()
         assert track.track_name == "Filled In"
 
-        mock_service.get_tracks.assert_called_once_with("good_acc", ["trk_x"])
+        mock_service.get_tracks.assert_called_once()
+        assert mock_service.get_tracks.call_args.args == ("good_acc", ["trk_x"])
+
+        db.close()
+        Base.metadata.drop_all(bind=engine)
+
+
+def _spool_export(listens):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("Streaming_History_Audio_0.json", json.dumps(listens))
+    buf.seek(0)
+    return spool_upload(buf, 10 * 1024 * 1024).key
+
+
+def _export_listen(track_id, ts):
+    return {
+        "ts": ts,
+        "ms_played": 60000,
+        "master_metadata_track_name": f"Track {track_id}",
+        "spotify_track_uri": f"spotify:track:{track_id}",
+    }
+
+
+class TestProcessBackfillUpload:
+    def _job(self, db, **details):
+        job = JobRun(
+            job_name="backfill_upload",
+            user_id="u1",
+            started_at=datetime(2024, 1, 1),
+            status="pending",
+            details=json.dumps(details),
+        )
+        db.add(job)
+        db.commit()
+        return job.id
+
+    def _run(self, db, job_id):
+        with patch("app.tasks.SessionLocal", return_value=db):
+            process_backfill_upload(job_id, "u1")
+        return db.get(JobRun, job_id)
+
+    def test_parses_the_spooled_upload_and_removes_it(self):
+        Session, engine = _make_test_db()
+        db = Session()
+        db.add(User(user_id="u1", user_name="User 1"))
+        db.commit()
+        key = _spool_export([_export_listen(f"trk_{i}", f"2024-01-01T00:{i:02d}:00Z") for i in range(30)])
+        job_id = self._job(db, phase="queued", progress=0, upload_key=key)
+
+        job = self._run(db, job_id)
+
+        assert job.status == "completed"
+        details = json.loads(job.details)
+        assert details["inserted"] == 30
+        assert db.query(Listen).filter(Listen.source == ListenSource.export.value).count() == 30
+        assert not spooled_upload_exists(key)
+        db.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def test_export_is_validated_in_fixed_size_rounds(self, monkeypatch):
+        from app.routers import backfill
+
+        Session, engine = _make_test_db()
+        db = Session()
+        db.add(User(user_id="u1", user_name="User 1"))
+        db.commit()
+        listens = [_export_listen(f"trk_{i}", f"2024-01-01T00:{i:02d}:00Z") for i in range(25)]
+        for listen in listens[::4]:
+            listen["ms_played"] = 1000
+        key = _spool_export(listens)
+        job_id = self._job(db, phase="queued", upload_key=key)
+        monkeypatch.setattr(backfill, "VALIDATION_BATCH_SIZE", 10)
+        sizes = []
+        validate = backfill._validate_and_process_listens
+
+        def _spy(chunk, user, db_):
+            sizes.append(len(chunk))
+            return validate(chunk, user, db_)
+
+        monkeypatch.setattr(backfill, "_validate_and_process_listens", _spy)
+
+        job = self._run(db, job_id)
+
+        assert sizes == [10, 10, 5]
+        details = json.loads(job.details)
+        assert details["inserted"] == 18
+        assert details["rejection_reasons"] == {"too_short": 7}
+        assert details["total_listens"] == 25
+        db.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def test_insert_phase_costs_a_constant_number_of_statements_per_batch(self, capture_statements):
+        def run(listen_count, track_count):
+            reset_dimension_cache()  # each run gets a fresh database
+            Session, engine = _make_test_db()
+            db = Session()
+            db.add(User(user_id="u1", user_name="User 1"))
+            db.commit()
+            start = datetime(2024, 1, 1)
+            key = _spool_export(
+                [
+                    _export_listen(f"trk_{i % track_count}", (start + timedelta(minutes=i)).strftime("%Y-%m-%dT%H:%M:%SZ"))
+                    for i in range(listen_count)
+                ]
+            )
+            job_id = self._job(db, phase="queued", upload_key=key)
+            with capture_statements(engine) as statements:
+                job = self._run(db, job_id)
+            details = json.loads(job.details)
+            db.close()
+            Base.metadata.drop_all(bind=engine)
+            return statements, details
+
+        few_tracks, _ = run(1500, 3)
+        one_batch, _ = run(500, 500)
+        three_batches, details = run(1500, 1500)
+
+        assert details["inserted"] == 1500
+        assert details["rows_per_second"] > 0 and details["insert_rows_per_second"] > 0
+        # 1000 more new tracks cost a handful of statements per 500-row batch...
+        assert len(three_batches) - len(one_batch) <= 2 * 6
+        assert len(three_batches) - len(few_tracks) <= 3 * 3
+        # ...with stubs written by multi-row inserts and never looked up one by one.
+        assert sum(sql.startswith("INSERT INTO dim_all_tracks") for sql in three_batches) == 3
+        assert not any("FROM dim_all_tracks" in sql and "track_id = ?" in sql for sql in three_batches)
+
+    def test_interrupted_insert_phase_restarts_from_the_spool(self):
+        Session, engine = _make_test_db()
+        db = Session()
+        db.add(User(user_id="u1", user_name="User 1"))
+        db.add(Track(track_id="trk_0"))
+        db.add(Listen(ts=datetime(2024, 1, 1, 0, 0), user_id="u1", track_id="trk_0", source="export", ms_played=60000))
+        db.commit()
+        key = _spool_export([_export_listen(f"trk_{i}", f"2024-01-01T00:{i:02d}:00Z") for i in range(10)])
+        job_id = self._job(db, phase="resuming", resumed_from="inserting", inserted=1, upload_key=key)
+
+        job = self._run(db, job_id)
+
+        assert job.status == "completed"
+        assert db.query(Listen).count() == 10
+        assert json.loads(job.details)["inserted"] == 9
+        assert not spooled_upload_exists(key)
+        db.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def test_startup_resumes_spooled_validation_and_fails_jobs_without_a_spool(self):
+        from app.main import _resume_orphaned_jobs
+
+        Session, engine = _make_test_db()
+        db = Session()
+        db.add(User(user_id="u1", user_name="User 1"))
+        db.commit()
+        resumable = _spool_export([_export_listen("trk_1", "2024-01-01T00:00:00Z")])
+        lost = spool_upload(io.BytesIO(b"spool lost before restart"), 1024).key
+        delete_spooled_upload(lost)
+        resumed_id = self._job(db, phase="validating", progress=15, upload_key=resumable)
+        failed_id = self._job(db, phase="parsing", progress=5, upload_key=lost)
+
+        with patch("app.main.SessionLocal", return_value=db), patch.object(celery_app, "send_task") as send:
+            _resume_orphaned_jobs()
+
+        send.assert_called_once_with("app.tasks.process_backfill_upload", args=[resumed_id, "u1"])
+        resumed = json.loads(db.get(JobRun, resumed_id).details)
+        assert resumed["phase"] == "resuming" and resumed["resumed_from"] == "validating"
+        assert spooled_upload_exists(resumable)
+        assert db.get(JobRun, failed_id).status == "error"
+        db.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def test_startup_resends_queued_jobs_and_keeps_their_spool(self):
+        from app.main import _resume_orphaned_jobs
+
+        Session, engine = _make_test_db()
+        db = Session()
+        db.add(User(user_id="u1", user_name="User 1"))
+        db.commit()
+        key = _spool_export([_export_listen(f"trk_{i}", f"2024-01-01T00:{i:02d}:00Z") for i in range(5)])
+        job_id = self._job(db, phase="queued", progress=0, upload_key=key)
+
+        with patch("app.main.SessionLocal", return_value=db), patch.object(celery_app, "send_task") as send:
+            _resume_orphaned_jobs()
+
+        send.assert_called_once_with("app.tasks.process_backfill_upload", args=[job_id, "u1"])
+        assert db.get(JobRun, job_id).status == "pending"
+        assert spooled_upload_exists(key)
+
+        job = self._run(db, job_id)
+        assert job.status == "completed"
+        assert json.loads(job.details)["inserted"] == 5
+        db.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def test_identical_uploads_keep_separate_spool_files(self):
+        Session, engine = _make_test_db()
+        db = Session()
+        db.add(User(user_id="u1", user_name="User 1"))
+        db.commit()
+        listens = [_export_listen("trk_1", "2024-01-01T00:00:00Z")]
+        first, retry = _spool_export(listens), _spool_export(listens)
+        assert first != retry
+
+        job = self._run(db, self._job(db, phase="queued", progress=0, upload_key=first))
+
+        assert job.status == "completed"
+        assert not spooled_upload_exists(first)
+        assert spooled_upload_exists(retry)
+        db.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def test_corrupt_spool_fails_the_job(self):
+        Session, engine = _make_test_db()
+        db = Session()
+        db.add(User(user_id="u1", user_name="User 1"))
+        db.commit()
+        key = spool_upload(io.BytesIO(b"not a zip"), 1024).key
+        job_id = self._job(db, phase="queued", upload_key=key)
+
+        job = self._run(db, job_id)
 
+        assert job.status == "error"
+        assert json.loads(job.details)["error"] == "Invalid ZIP file"
+        assert not spool_path(key).exists()
         db.close()
         Base.metadata.drop_all(bind=engine)
+
+
+class _SlowRecentlyPlayedHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.server.request_count += 1
+        time.sleep(self.server.latency)  # stand-in for Spotify round-trip latency
+        body = b'{"items": []}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _LocalSpotify(SpotifyService):
+    """Real SpotifyService HTTP path, pointed at a local stand-in."""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def get_client(self, access_token):
+        client = super().get_client(access_token)
+        client.prefix = self.prefix
+        return client
+
+    def refresh_access_token(self, refresh_token):
+        raise SpotifyOauthError("invalid_grant")
+
+
+@pytest.fixture()
+def local_spotify(monkeypatch):
+    monkeypatch.setattr(settings, "spotify_requests_per_second", 0)
+    reset_http_session()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _SlowRecentlyPlayedHandler)
+    server.daemon_threads = True
+    server.latency = 0.01
+    server.request_count = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    service = _LocalSpotify(f"http://127.0.0.1:{server.server_address[1]}/v1/")
+    service.server = server
+    yield service
+    server.shutdown()
+    server.server_close()
+    reset_http_session()
+
+
+@pytest.fixture()
+def file_db(tmp_path, monkeypatch):
+    # Workers need real, separate sessions; an in-memory StaticPool can't do that.
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'poll.db'}", connect_args={"check_same_thread": False, "timeout": 30}
+    )
+
+    @event.listens_for(engine, "connect")
+    def _pragmas(dbapi_conn, _):
+        dbapi_conn.execute("PRAGMA journal_mode=WAL")
+        dbapi_conn.execute("PRAGMA synchronous=OFF")
+
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine, autoflush=False)
+    monkeypatch.setattr("app.tasks.SessionLocal", Session)
+    yield Session
+    engine.dispose()
+
+
+def _seed_pollable_users(Session, n_users):
+    db = Session()
+    db.execute(insert(User), [
+        {"user_id": f"u{i}", "user_name": f"User {i}", "spotify_refresh_token": "tok"} for i in range(n_users)
+    ])
+    db.commit()
+    db.close()
+    for i in range(n_users):
+        access_tokens.put(f"u{i}", {"access_token": f"acc_{i}", "expires_in": 3600})
+    return [f"u{i}" for i in range(n_users)]
+
+
+class TestPollFanOut:
+    def test_concurrent_fan_out_outpaces_sequential_polling(self, local_spotify, file_db):
+        user_ids = _seed_pollable_users(file_db, 330)
+        db = file_db()
+
+        started = time.perf_counter()
+        assert _poll_users(user_ids[:30], local_spotify, ArtistMetadataCache(db), 1)["polled"] == 30
+        sequential_rate = 30 / (time.perf_counter() - started)
+
+        started = time.perf_counter()
+        assert _poll_users(user_ids[30:], local_spotify, ArtistMetadataCache(db), 16)["polled"] == 300
+        concurrent_rate = 300 / (time.perf_counter() - started)
+
+        assert concurrent_rate > 2 * sequential_rate
+        assert db.query(User).filter(User.last_poll_at.is_(None)).count() == 0
+        db.close()
+
+    def test_failures_stay_isolated_per_user(self, local_spotify, file_db):
+        user_ids = _seed_pollable_users(file_db, 50)
+        access_tokens.invalidate("u7")  # forces a refresh, which the stand-in rejects
+
+        counts = _poll_users(user_ids, local_spotify, ArtistMetadataCache(file_db()), 8)
+        assert counts == {"polled": 49, "errors": 0, "revoked": 1, "skipped": 0, "overflows": 0}
+
+        db = file_db()
+        assert db.get(User, "u7").spotify_refresh_token is None
+        statuses = {j.user_id: j.status for j in db.query(JobRun).all()}
+        assert statuses["u7"] == "token_revoked"
+        assert sum(1 for s in statuses.values() if s == "success") == 49
+        db.close()
+
+
+class _FakeRedisLock:
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+
+    def acquire(self, blocking=True):
+        with self.store.mutex:
+            if self.name in self.store.held:
+                return False
+            self.store.held.add(self.name)
+            return True
+
+    def release(self):
+        with self.store.mutex:
+            self.store.held.discard(self.name)
+
+
+class _FakeRedis:
+    """Embedded stand-in for the Redis lock API the poller uses."""
+
+    def __init__(self):
+        self.mutex = threading.Lock()
+        self.held = set()
+
+    def lock(self, name, timeout=None):
+        return _FakeRedisLock(self, name)
+
+
+class TestShardedPolling:
+    def test_shards_are_stable_and_disjoint(self):
+        user_ids = [f"u{i}" for i in range(100)]
+
+        shards = _shard_user_ids(user_ids, 8)
+
+        # A user's shard depends only on their id, not on the input order.
+        reordered = _shard_user_ids(list(reversed(user_ids)), 8)
+        assert {frozenset(shard) for shard in shards} == {frozenset(shard) for shard in reordered}
+        assert sorted(uid for shard in shards for uid in shard) == sorted(user_ids)
+        assert len(shards) <= 8
+
+    def test_locked_users_are_skipped_and_locks_released(self, local_spotify, file_db):
+        user_ids = _seed_pollable_users(file_db, 10)
+        redis = _FakeRedis()
+        redis.lock("lock:poll_user:u3").acquire()
+
+        counts = _poll_users(user_ids, local_spotify, ArtistMetadataCache(file_db()), 4, redis)
+
+        assert counts == {"polled": 9, "errors": 0, "revoked": 0, "skipped": 1, "overflows": 0}
+        assert redis.held == {"lock:poll_user:u3"}
+
+    def test_users_polled_by_an_earlier_dispatch_are_skipped(self, local_spotify, file_db):
+        user_ids = _seed_pollable_users(file_db, 10)
+        redis = _FakeRedis()
+        first = _poll_users(user_ids, local_spotify, ArtistMetadataCache(file_db()), 4, redis)
+        requests = local_spotify.server.request_count
+
+        # A later tick dispatched the same users before the first run finished.
+        second = _poll_users(user_ids, local_spotify, ArtistMetadataCache(file_db()), 4, redis)
+
+        assert first["polled"] == 10
+        assert second == {"polled": 0, "errors": 0, "revoked": 0, "skipped": 10, "overflows": 0}
+        assert local_spotify.server.request_count == requests
+
+    def test_summary_job_run_is_written_once_after_all_shards(self, local_spotify, file_db, monkeypatch):
+        _seed_pollable_users(file_db, 40)
+        monkeypatch.setattr(settings, "poll_shards", 4)
+        monkeypatch.setattr("app.tasks.SpotifyService", lambda: local_spotify)
+
+        poll_recent_listens()
+
+        db = file_db()
+        summaries = db.query(JobRun).filter(JobRun.job_name == "poll_recent_listens", JobRun.user_id.is_(None)).all()
+        assert [(j.status, j.record_count) for j in summaries] == [("success", 40)]
+        assert db.query(User).filter(User.last_poll_at.is_(None)).count() == 0
+        db.close()
+
+    def test_throughput_scales_with_workers(self, local_spotify, file_db, monkeypatch):
+        user_ids = _seed_pollable_users(file_db, 80)
+        local_spotify.server.latency = 0.04
+        redis = _FakeRedis()
+        monkeypatch.setattr("app.tasks.SpotifyService", lambda: local_spotify)
+        monkeypatch.setattr("app.tasks._poll_lock_client", lambda: redis)
+        shards = _shard_user_ids(user_ids, 8)
+
+        def run(workers, shard_list):
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(poll_user_shard, shard_list))
+            assert sum(r["polled"] for r in results) == sum(len(s) for s in shard_list)
+            return time.perf_counter() - started
+
+        half = len(shards) // 2
+        one_worker = run(1, shards[:half])
+        four_workers = run(4, shards[half:])
+        per_user_one = one_worker / sum(len(s) for s in shards[:half])
+        per_user_four = four_workers / sum(len(s) for s in shards[half:])
+
+        assert per_user_one / per_user_four > 2.5
+        assert not redis.held
@@ -0,0 +1,133 @@
+import threading
+import time
+from unittest.mock import MagicMock
+
+from spotipy.exceptions import SpotifyException
+
+from app.models import Listen, User
+from app.services import token_cache
+from app.services.token_cache import access_tokens, get_access_token
+from app.tasks import _poll_single_user
+
+
+def _user(db, refresh="fake_refresh"):
+    user = User(user_id="usr_1", user_name="Test", spotify_refresh_token=refresh)
+    db.add(user)
+    db.commit()
+    return user
+
+
+def _service(expires_in=3600, refresh_token="fake_refresh"):
+    service = MagicMock()
+    counter = {"n": 0}
+
+    def refresh(_token):
+        counter["n"] += 1
+        return {"access_token": f"access_{counter['n']}", "refresh_token": refresh_token, "expires_in": expires_in}
+
+    service.refresh_access_token.side_effect = refresh
+    return service
+
+
+class TestGetAccessToken:
+    def test_reuses_cached_token(self, db):
+        user = _user(db)
+        service = _service()
+
+        assert get_access_token(db, service, user) == "access_1"
+        assert get_access_token(db, service, user) == "access_1"
+        assert service.refresh_access_token.call_count == 1
+        assert access_tokens.stats()["hits"] == 1
+
+    def test_refreshes_when_token_is_near_expiry(self, db):
+        user = _user(db)
+        # Expires inside the safety margin, so it is never cached.
+        service = _service(expires_in=token_cache.TOKEN_EXPIRY_MARGIN_SECONDS)
+
+        get_access_token(db, service, user)
+        get_access_token(db, service, user)
+        assert service.refresh_access_token.call_count == 2
+
+    def test_force_refresh_bypasses_cache(self, db):
+        user = _user(db)
+        service = _service()
+
+        get_access_token(db, service, user)
+        assert get_access_token(db, service, user, force_refresh=True) == "access_2"
+        assert get_access_token(db, service, user) == "access_2"
+
+    def test_persists_rotated_refresh_token(self, db):
+        user = _user(db, refresh="old_refresh")
+        service = _service(refresh_token="new_refresh")
+
+        get_access_token(db, service, user)
+
+        db.expire_all()
+        assert db.get(User, "usr_1").spotify_refresh_token == "new_refresh"
+
+    def test_invalidate_forces_refresh(self, db):
+        user = _user(db)
+        service = _service()
+
+        get_access_token(db, service, user)
+        access_tokens.invalidate("usr_1")
+        assert get_access_token(db, service, user) == "access_2"
+
+    def test_concurrent_callers_refresh_once(self, db):
+        user = _user(db)
+        service = _service()
+        original = service.refresh_access_token.side_effect
+
+        def slow_refresh(token):
+            time.sleep(0.05)
+            return original(token)
+
+        service.refresh_access_token.side_effect = slow_refresh
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(get_access_token(db, service, user)))
+            for _ in range(5)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert results == ["access_1"] * 5
+        assert service.refresh_access_token.call_count == 1
+
+    def test_refresh_errors_are_not_cached(self, db):
+        user = _user(db)
+        service = MagicMock()
+        service.refresh_access_token.side_effect = [RuntimeError("boom"), {"access_token": "ok"}]
+
+        try:
+            get_access_token(db, service, user)
+        except RuntimeError:
+            pass
+        assert get_access_token(db, service, user) == "ok"
+
+
+class TestPollUsesCache:
+    def test_second_poll_skips_refresh(self, db):
+        user = _user(db)
+        service = _service()
+        service.get_recent_listens_page.return_value = {"items": [], "cursors": None, "next": None}
+
+        _poll_single_user(db, service, user)
+        _poll_single_user(db, service, user)
+        assert service.refresh_access_token.call_count == 1
+
+    def test_stale_cached_token_is_retried_with_fresh_one(self, db):
+        user = _user(db)
+        service = _service()
+        access_tokens.put("usr_1", {"access_token": "stale", "expires_in": 3600})
+        service.get_recent_listens_page.side_effect = [
+            SpotifyException(401, -1, "expired"),
+            {"items": [], "cursors": None, "next": None},
+        ]
+
+        _poll_single_user(db, service, user)
+
+        assert service.get_recent_listens_page.call_args_list[-1].args[0] == "access_1"
+        assert db.query(Listen).count() == 0
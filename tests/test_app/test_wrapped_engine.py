@@ -0,0 +1,147 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, insert, select
+
+from app.models import Album, Artist, ArtistGenre, Listen, Track, TrackArtist, User
+from app.routers.stats import (
+    WRAPPED_LIMIT,
+    _compute_wrapped,
+    _get_top_artists,
+    _get_top_genres,
+    _get_top_tracks,
+    _get_total_minutes,
+)
+from app.schemas import WrappedResponse
+from app.services.listen_rollups import rebuild_user_rollups
+
+SINCE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+UNTIL = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def _seed(db, n_listens=2000, seed=11):
+    """Listens across 2023-2025 over tracks sharing artists and genres, with ties."""
+    rng = random.Random(seed)
+    db.add(User(user_id="u1", user_name="U"))
+    db.add(Album(album_id="alb", album_name="Album"))
+    db.execute(insert(Artist), [{"artist_id": f"ar{i}", "artist_name": f"Artist {i}"} for i in range(10)])
+    db.execute(
+        insert(ArtistGenre),
+        [{"artist_id": f"ar{i}", "genre": f"g{i % 4}"} for i in range(10)]
+        + [{"artist_id": f"ar{i}", "genre": "shared"} for i in range(0, 10, 3)],
+    )
+    db.execute(
+        insert(Track),
+        [
+            {"track_id": f"t{i}", "track_name": f"T{i}", "album_id": "alb" if i % 2 else None,
+             "duration_ms": None if i % 9 == 0 else 1000 * i}
+            for i in range(60)
+        ],
+    )
+    # t59 never gets an artist: it counts towards tracks and minutes only.
+    db.execute(
+        insert(TrackArtist),
+        [{"track_id": f"t{i}", "artist_id": f"ar{i % 10}"} for i in range(59)]
+        + [{"track_id": f"t{i}", "artist_id": f"ar{(i + 4) % 10}"} for i in range(0, 59, 3)],
+    )
+    start = datetime(2023, 12, 1)
+    rows = {}
+    for _ in range(n_listens):
+        ts = start + timedelta(seconds=rng.randrange(430 * 86400))
+        track_id = f"t{int(rng.paretovariate(1.1)) % 60}"
+        rows[(ts, track_id)] = {
+            "ts": ts,
+            "user_id": "u1",
+            "track_id": track_id,
+            "source": "export",
+            "ms_played": rng.choice([None, rng.randrange(1, 300000)]),
+        }
+    db.execute(insert(Listen), list(rows.values()))
+    db.commit()
+
+
+def _reference(db, user_id, since, until, year, period_label):
+    """Wrapped assembled from the per-metric queries the engine replaced."""
+    in_range = [Listen.user_id == user_id, Listen.ts >= since, Listen.ts < until]
+    top_genres = _get_top_genres(db, user_id, since, WRAPPED_LIMIT, until=until)
+    return WrappedResponse(
+        top_artists=_get_top_artists(db, user_id, since, WRAPPED_LIMIT, until=until),
+        top_tracks=_get_top_tracks(db, user_id, since, WRAPPED_LIMIT, until=until),
+        top_genre=top_genres[0].genre if top_genres else None,
+        top_genres=top_genres,
+        total_minutes=_get_total_minutes(db, user_id, since, until=until),
+        total_listens=db.execute(select(func.count()).select_from(Listen).where(*in_range)).scalar(),
+        unique_artists=db.execute(
+            select(func.count(func.distinct(TrackArtist.artist_id)))
+            .select_from(Listen)
+            .join(TrackArtist, Listen.track_id == TrackArtist.track_id)
+            .where(*in_range)
+        ).scalar(),
+        unique_tracks=db.execute(select(func.count(func.distinct(Listen.track_id))).where(*in_range)).scalar(),
+        year=year,
+        data_period=period_label,
+    )
+
+def _set_ready(db, ready):
+    db.get(User, "u1").rollups_built_at = datetime(2025, 3, 1) if ready else None
+    db.commit()
+
+
+class TestWrappedEngine:
+    def test_matches_the_per_metric_queries_byte_for_byte(self, db):
+        _seed(db)
+        rebuild_user_rollups(db, "u1")
+        db.commit()
+        expected = _reference(db, "u1", SINCE, UNTIL, 2024, "Jan 1 - Dec 31, 2024").model_dump_json()
+
+        for ready in (False, True):
+            _set_ready(db, ready)
+            assert _compute_wrapped(db, "u1", 2024).model_dump_json() == expected, ready
+
+    def test_total_listens_stop_at_the_end_of_the_year(self, db):
+        _seed(db, n_listens=300)
+        before = db.query(Listen).filter(Listen.ts >= datetime(2024, 1, 1), Listen.ts < datetime(2025, 1, 1)).count()
+        after = db.query(Listen).filter(Listen.ts >= datetime(2025, 1, 1)).count()
+        assert before and after
+
+        assert _compute_wrapped(db, "u1", 2024).total_listens == before
+
+    def test_reads_the_listen_range_once(self, db, capture_statements):
+        _seed(db, n_listens=3000)
+
+        with capture_statements(db) as raw:
+            _compute_wrapped(db, "u1", 2024)
+        assert sum("dim_all_listens" in sql for sql in raw) == 1
+
+        rebuild_user_rollups(db, "u1")
+        db.commit()
+        with capture_statements(db) as rollup:
+            _compute_wrapped(db, "u1", 2024)
+        assert not any("dim_all_listens" in sql for sql in rollup)
+        # Rollup readiness, the stream, track links, then the top tracks, the
+        # top artists and their genres. The per-metric path issued seven reads
+        # of the listen range alone.
+        assert len(raw) == len(rollup) == 6
+
+    def test_statement_count_does_not_grow_with_listens(self, db, capture_statements):
+        _seed(db, n_listens=200)
+        with capture_statements(db) as small:
+            _compute_wrapped(db, "u1", 2024)
+        db.query(Listen).delete()
+        db.commit()
+        rows = [
+            {"ts": datetime(2024, 1, 1) + timedelta(minutes=i), "user_id": "u1", "track_id": f"t{i % 60}",
+             "source": "api", "ms_played": None}
+            for i in range(20000)
+        ]
+        db.execute(insert(Listen), rows)
+        db.commit()
+
+        with capture_statements(db) as large:
+            result = _compute_wrapped(db, "u1", 2024)
+
+        assert result.total_listens == 20000
+        assert len(large) == len(small)
+        # Every track now has 333 or 334 listens: ties resolve by id as in SQL.
+        expected = _reference(db, "u1", SINCE, UNTIL, 2024, "Jan 1 - Dec 31, 2024")
+        assert result.model_dump_json() == expected.model_dump_json()
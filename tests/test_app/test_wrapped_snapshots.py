@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+from app.models import WrappedSnapshot
+from app.services.ingestion import upsert_from_recent_listens
+from app.services.wrapped_snapshots import (
+    invalidate_wrapped,
+    is_fresh,
+    load_wrapped,
+    stale_snapshots,
+    store_wrapped,
+)
+from app.tasks import refresh_wrapped_snapshots
+
+
+def _view(client, headers, year=2024):
+    resp = client.get("/stats/wrapped", params={"year": year}, headers=headers)
+    assert resp.status_code == 200
+    return resp.json()
+
+def _now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class TestWrappedEndpoint:
+    def test_repeat_views_are_served_from_the_snapshot(self, client, db, seeded_db, auth_headers, capture_statements):
+        first = _view(client, auth_headers)
+        assert db.get(WrappedSnapshot, ("test_user_1", 2024)) is not None
+
+        with capture_statements(db) as statements:
+            second = _view(client, auth_headers)
+
+        assert second == first
+        assert not any("dim_all_listens" in sql for sql in statements)
+
+    def test_new_listens_only_invalidate_their_year(self, client, db, seeded_db, auth_headers):
+        before = _view(client, auth_headers)
+        _view(client, auth_headers, year=2023)
+        item = {
+            "track": {"id": "track_3", "name": "Karma Police", "artists": [{"id": "artist_1", "name": "Radiohead"}]},
+            "played_at": "2024-12-31T23:00:00.000000Z",
+        }
+
+        upsert_from_recent_listens(db, [item], "test_user_1")
+
+        assert load_wrapped(db, "test_user_1", 2023) is not None
+        assert load_wrapped(db, "test_user_1", 2024) is None
+        after = _view(client, auth_headers)
+        assert after["total_listens"] == before["total_listens"] + 1
+
+
+class TestFreshness:
+    def test_invalidation_during_a_computation_leaves_it_stale(self, db, test_user):
+        computed_at = _now() - timedelta(seconds=5)
+        invalidate_wrapped(db, "test_user_1", [2020])  # nothing stored yet: no-op
+        db.commit()
+        store_wrapped(db, "test_user_1", 2020, "{}", computed_at - timedelta(seconds=1))
+        db.commit()
+        assert load_wrapped(db, "test_user_1", 2020) == "{}"
+
+        invalidate_wrapped(db, "test_user_1", [2020])
+        db.commit()
+        store_wrapped(db, "test_user_1", 2020, '{"late": true}', computed_at)
+        db.commit()
+
+        assert load_wrapped(db, "test_user_1", 2020) is None
+        assert stale_snapshots(db, 10) == [("test_user_1", 2020)]
+
+    def test_current_year_snapshots_expire_daily(self):
+        now = datetime(2026, 10, 17, 9, 0)
+        yesterday = WrappedSnapshot(user_id="u", year=2026, payload="{}", computed_at=now - timedelta(hours=10))
+        past_year = WrappedSnapshot(user_id="u", year=2025, payload="{}", computed_at=now - timedelta(days=200))
+
+        assert not is_fresh(yesterday, now)
+        assert is_fresh(past_year, now)
+
+    def test_snapshots_computed_during_their_year_expire_once_it_ends(self, db, test_user):
+        # Computed in November, so capped at "Jan 1 - Oct 31".
+        store_wrapped(db, "test_user_1", 2024, "{}", datetime(2024, 11, 20))
+        store_wrapped(db, "test_user_1", 2023, "{}", datetime(2024, 1, 1))
+        db.commit()
+
+        snapshot = db.get(WrappedSnapshot, ("test_user_1", 2024))
+        assert is_fresh(snapshot, datetime(2024, 11, 20, 9, 0))
+        assert not is_fresh(snapshot, datetime(2025, 1, 2))
+        assert load_wrapped(db, "test_user_1", 2024) is None
+        assert load_wrapped(db, "test_user_1", 2023) == "{}"
+        assert stale_snapshots(db, 10) == [("test_user_1", 2024)]
+
+
+class TestRefreshTask:
+    def test_recomputes_stale_snapshots(self, db, seeded_db):
+        year = datetime.now(timezone.utc).year
+        store_wrapped(db, "test_user_1", 2024, "{}", _now() - timedelta(days=1))
+        store_wrapped(db, "test_user_1", year, "{}", _now() - timedelta(days=1))
+        invalidate_wrapped(db, "test_user_1", [2024])
+        db.commit()
+
+        assert sorted(stale_snapshots(db, 10)) == sorted([("test_user_1", 2024), ("test_user_1", year)])
+        with patch("app.tasks.SessionLocal", return_value=db):
+            refresh_wrapped_snapshots()
+
+        assert stale_snapshots(db, 10) == []
+        assert '"year":2024' in load_wrapped(db, "test_user_1", 2024)